@@ -1,5 +1,141 @@
-from pydantic import BaseModel
+from typing import Any, Literal
+from pydantic import BaseModel, Field, field_validator
+from services.sampling import PRESETS, SamplingSpec, sampling_factory
+from services.sse import CoalescePolicy
+
+
+class StreamOptions(BaseModel):
+    coalesce_bytes: int = Field(default=0, ge=0, le=65536)
+    flush_interval_ms: float = Field(default=0.0, ge=0.0, le=1000.0)
+
+    def to_policy(self) -> CoalescePolicy:
+        return CoalescePolicy(
+            max_bytes=self.coalesce_bytes,
+            flush_interval_ms=self.flush_interval_ms
+        )
+
+
+class SamplingOptions(BaseModel):
+    """Overrides on top of a named preset; unset fields keep the preset's"""
+    preset: str | None = None
+    # Clamped to SAMPLING_MAX_TOKENS_CAP
+    max_tokens: int | None = Field(default=None, ge=1)
+    temperature: float | None = Field(default=None, ge=0.0, le=2.0)
+    top_p: float | None = Field(default=None, gt=0.0, le=1.0)
+    top_k: int | None = Field(default=None, ge=-1)
+    repetition_penalty: float | None = Field(default=None, gt=0.0, le=2.0)
+    presence_penalty: float | None = Field(default=None, ge=-2.0, le=2.0)
+    frequency_penalty: float | None = Field(default=None, ge=-2.0, le=2.0)
+    seed: int | None = None
+    stop: str | list[str] | None = None
+
+    @field_validator("preset")
+    @classmethod
+    def _known_preset(cls, value: str | None) -> str | None:
+        if value is not None and value not in PRESETS:
+            raise ValueError(f"expected one of {sorted(PRESETS)}")
+        return value
+
+    def to_spec(self) -> SamplingSpec:
+        """Raises ValueError when the stop list is over the server limits"""
+        return sampling_factory.resolve(
+            **self.model_dump(exclude_none=True)
+        )
 
 
 class ChatRequest(BaseModel):
     question: str
+    stream_options: StreamOptions | None = None
+    sampling: SamplingOptions | None = None
+    # Set to False to skip the response cache for this request
+    cache: bool = True
+
+
+class SessionChatRequest(BaseModel):
+    # Only the new question; earlier turns are kept server-side
+    question: str = Field(min_length=1)
+    stream_options: StreamOptions | None = None
+    sampling: SamplingOptions | None = None
+
+
+class BatchCreate(BaseModel):
+    # Server-side JSONL, relative to BATCH_INPUT_DIR or absolute inside it
+    path: str
+    # Prompts in flight for this job (capped by BATCH_MAX_CONCURRENCY)
+    concurrency: int | None = Field(default=None, ge=1)
+    sampling: SamplingOptions | None = None
+
+
+class IngestCreate(BaseModel):
+    # Subdirectory (or key prefix) of INGEST_SOURCE; all of it by default
+    prefix: str | None = None
+    # Re-index documents even if unchanged
+    force: bool = False
+
+
+###############################################################################
+#
+#                     OpenAI-compatible request bodies
+#
+###############################################################################
+class OpenAIStreamOptions(BaseModel):
+    include_usage: bool = False
+
+
+class _OpenAISampling(BaseModel):
+    # Accepted for compatibility; the served model is always used
+    model: str | None = None
+    max_tokens: int | None = Field(default=None, ge=1)
+    temperature: float | None = Field(default=None, ge=0.0, le=2.0)
+    top_p: float | None = Field(default=None, gt=0.0, le=1.0)
+    n: int = Field(default=1, ge=1)
+    stop: str | list[str] | None = None
+    seed: int | None = None
+    presence_penalty: float | None = Field(default=None, ge=-2.0, le=2.0)
+    frequency_penalty: float | None = Field(default=None, ge=-2.0, le=2.0)
+    stream: bool = False
+    stream_options: OpenAIStreamOptions | None = None
+    user: str | None = None
+    # vLLM extensions
+    top_k: int | None = Field(default=None, ge=-1)
+    repetition_penalty: float | None = Field(default=None, gt=0.0, le=2.0)
+
+    def to_spec(self, max_tokens: int | None = None) -> SamplingSpec:
+        """Raises ValueError for stop lists or `n` over the server limits"""
+        return sampling_factory.resolve(
+            max_tokens=max_tokens or self.max_tokens,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            top_k=self.top_k,
+            repetition_penalty=self.repetition_penalty,
+            presence_penalty=self.presence_penalty,
+            frequency_penalty=self.frequency_penalty,
+            seed=self.seed,
+            stop=self.stop,
+            n=self.n
+        )
+
+
+class ChatMessage(BaseModel):
+    role: Literal["system", "user", "assistant", "tool", "developer"]
+    # Plain text, or a list of {"type": "text", "text": ...} parts
+    content: str | list[dict[str, Any]] | None = None
+
+    def text(self) -> str:
+        if isinstance(self.content, list):
+            return "".join(
+                part.get("text", "") for part in self.content
+                if part.get("type") == "text"
+            )
+        return self.content or ""
+
+
+class ChatCompletionRequest(_OpenAISampling):
+    messages: list[ChatMessage] = Field(min_length=1)
+    # Newer name for max_tokens
+    max_completion_tokens: int | None = Field(default=None, ge=1)
+
+
+class CompletionRequest(_OpenAISampling):
+    # Text, a list of texts, or one prompt as token IDs
+    prompt: str | list[str] | list[int] = Field(min_length=1)
@@ -0,0 +1,473 @@
+import asyncio
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncGenerator
+from uuid import uuid4
+from fastapi import APIRouter, Depends, status
+from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
+from api.v1.models import ChatCompletionRequest, CompletionRequest
+from api.v1.responses import DisconnectAwareStreamingResponse
+from api.v1.routes import (
+    SSE_HEADERS,
+    get_admission,
+    get_engine_manager,
+    get_tenant,
+)
+from services.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    AdmissionTicket,
+    admitted_stream,
+)
+from services.engine import LLMEngine
+from services.engine_manager import EngineManager, EngineUnavailable
+from services.prompting import BuiltPrompt, get_prompt_builder
+from services.sampling import SamplingSpec
+from services.sse import OPENAI_DONE_FRAME, encode_data
+from services.tenants import Tenant
+from services.tokenizer import PromptTooLong
+from services.vllm_service import MODEL_PATH, vLLMService
+
+if TYPE_CHECKING:
+    from vllm.outputs import RequestOutput
+
+router = APIRouter()
+
+MODEL_NAME = Path(MODEL_PATH).name
+# Prompts per /v1/completions request
+MAX_PROMPTS = 16
+
+
+###############################################################################
+#
+#                  OpenAI-style errors and admission
+#
+###############################################################################
+def openai_error(
+    status_code: int,
+    message: str,
+    error_type: str,
+    retry_after: int | None = None,
+    code: str | None = None
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {
+            "message": message,
+            "type": error_type,
+            "param": None,
+            "code": code,
+        }},
+        headers=(
+            {"Retry-After": str(retry_after)}
+            if retry_after is not None else None
+        )
+    )
+
+
+def _context_error(e: PromptTooLong) -> JSONResponse:
+    return openai_error(
+        status.HTTP_400_BAD_REQUEST, str(e), "invalid_request_error",
+        code="context_length_exceeded"
+    )
+
+
+async def _fit_prompts(
+    prompts: list[str | dict[str, list[int]]],
+    sampling: SamplingSpec
+) -> tuple[list[str | dict[str, list[int]]], SamplingSpec, int | None]:
+    """
+    Text prompts tokenized on the tokenizer pool and every prompt fitted
+    to max_model_len, with the smallest max_tokens any of them needs.
+    Also returns their total length, None if some stay text (no
+    tokenizer). Raises PromptTooLong.
+    """
+    tokens = get_prompt_builder(MODEL_PATH).tokens
+    encoded = iter(await asyncio.gather(*(
+        tokens.encode_async(p) for p in prompts if isinstance(p, str)
+    )))
+    fitted: list[str | dict[str, list[int]]] = []
+    total: int | None = 0
+    max_tokens = sampling.max_tokens
+    for prompt in prompts:
+        if isinstance(prompt, str):
+            built = BuiltPrompt(prompt, next(encoded), 0)
+        else:
+            built = BuiltPrompt("", prompt["prompt_token_ids"], 0)
+        built, spec = vLLMService.fit_prompt(built, sampling)
+        fitted.append(built.engine_prompt)
+        max_tokens = min(max_tokens, spec.max_tokens)
+        total = total + built.num_tokens \
+            if total is not None and built.num_tokens is not None else None
+    if max_tokens != sampling.max_tokens:
+        sampling = replace(sampling, max_tokens=max_tokens)
+    return fitted, sampling, total
+
+
+async def _admit(
+    engine_manager: EngineManager,
+    admission: AdmissionController,
+    cost: int,
+    tenant: Tenant
+) -> tuple[AdmissionTicket, LLMEngine] | JSONResponse:
+    try:
+        ticket = await admission.acquire(cost, tenant=tenant)
+    except AdmissionRejected as e:
+        if e.retry_after is None:
+            return openai_error(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                e.reason, "invalid_request_error"
+            )
+        return openai_error(
+            status.HTTP_429_TOO_MANY_REQUESTS,
+            e.reason, "rate_limit_error", e.retry_after
+        )
+    try:
+        return ticket, await engine_manager.get()
+    except EngineUnavailable as e:
+        ticket.refund()
+        return openai_error(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            f"Model unavailable ({e.state.value}), please retry later.",
+            "server_error", e.retry_after
+        )
+
+
+###############################################################################
+#
+#                  Engine outputs -> choices and usage
+#
+###############################################################################
+@dataclass
+class _Choice:
+    text: list[str] = field(default_factory=list)
+    tokens: int = 0
+    finish_reason: str | None = None
+    started: bool = False
+
+
+@dataclass
+class _Run:
+    """Per-response state; choice `p * n + i` is output i of prompt p"""
+    n: int
+    choices: dict[int, _Choice] = field(default_factory=dict)
+    prompts_seen: set[int] = field(default_factory=set)
+    prompt_tokens: int = 0
+
+    def usage(self) -> dict[str, int]:
+        completion = sum(c.tokens for c in self.choices.values())
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": completion,
+            "total_tokens": self.prompt_tokens + completion,
+        }
+
+
+async def _outputs(
+    engine: LLMEngine,
+    prompts: list[str | dict[str, list[int]]],
+    sampling: SamplingSpec,
+    priority: int
+) -> AsyncGenerator[tuple[int, "RequestOutput"], None]:
+    """(prompt index, delta output) for every prompt, interleaved"""
+    if len(prompts) == 1:
+        stream = vLLMService.stream_outputs(
+            engine, prompts[0], None, sampling, priority
+        )
+        async with aclosing(stream):
+            async for output in stream:
+                yield 0, output
+        return
+
+    queue: asyncio.Queue[tuple[int, RequestOutput | BaseException | None]] \
+        = asyncio.Queue()
+
+    async def pump(index: int, prompt: str | dict[str, list[int]]) -> None:
+        stream = vLLMService.stream_outputs(
+            engine, prompt, None, sampling, priority
+        )
+        try:
+            async with aclosing(stream):
+                async for output in stream:
+                    queue.put_nowait((index, output))
+            queue.put_nowait((index, None))
+        except Exception as e:
+            queue.put_nowait((index, e))
+
+    tasks = [
+        asyncio.create_task(pump(i, prompt))
+        for i, prompt in enumerate(prompts)
+    ]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            index, item = await queue.get()
+            if item is None:
+                remaining -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield index, item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _apply(
+    run: _Run,
+    prompt_index: int,
+    output: "RequestOutput"
+) -> list[tuple[int, _Choice, str]]:
+    """Fold one delta into `run`; return (index, choice, new text)"""
+    if prompt_index not in run.prompts_seen:
+        # Counted once per prompt, from the engine's own tokenization
+        run.prompts_seen.add(prompt_index)
+        run.prompt_tokens += len(output.prompt_token_ids or ())
+    changed = []
+    for completion in output.outputs:
+        index = prompt_index * run.n + completion.index
+        choice = run.choices.get(index)
+        if choice is None:
+            choice = run.choices[index] = _Choice()
+        choice.tokens += len(completion.token_ids)
+        choice.text.append(completion.text)
+        if completion.finish_reason is not None:
+            choice.finish_reason = completion.finish_reason
+        changed.append((index, choice, completion.text))
+    return changed
+
+
+###############################################################################
+#
+#                          Response bodies
+#
+###############################################################################
+async def _respond(
+    engine_manager: EngineManager,
+    ticket: AdmissionTicket,
+    engine: LLMEngine,
+    prompts: list[str | dict[str, list[int]]],
+    sampling: SamplingSpec,
+    chat: bool,
+    stream: bool,
+    include_usage: bool
+) -> DisconnectAwareStreamingResponse | JSONResponse:
+    response_id = f"{'chatcmpl' if chat else 'cmpl'}-{uuid4().hex}"
+    created = int(time.time())
+    run = _Run(n=sampling.n)
+
+    if not stream:
+        try:
+            outputs = _outputs(engine, prompts, sampling, ticket.priority)
+            async with aclosing(outputs):
+                async for prompt_index, output in outputs:
+                    _apply(run, prompt_index, output)
+        except Exception as e:
+            engine_manager.report_error(e)
+            return openai_error(
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
+                f"{type(e).__name__}: {e}", "server_error"
+            )
+        finally:
+            ticket.release()
+        engine_manager.report_success()
+        choices = []
+        for index in sorted(run.choices):
+            choice = run.choices[index]
+            text = "".join(choice.text)
+            choices.append({
+                "index": index,
+                **(
+                    {"message": {"role": "assistant", "content": text}}
+                    if chat else {"text": text, "logprobs": None}
+                ),
+                "finish_reason": choice.finish_reason,
+            })
+        return JSONResponse({
+            "id": response_id,
+            "object": "chat.completion" if chat else "text_completion",
+            "created": created,
+            "model": MODEL_NAME,
+            "choices": choices,
+            "usage": run.usage(),
+        })
+
+    chunk_object = "chat.completion.chunk" if chat else "text_completion"
+
+    def chunk(index: int, text: str, choice: _Choice) -> bytes:
+        if chat:
+            delta: dict[str, str] = {}
+            if not choice.started:
+                delta["role"] = "assistant"
+            if text:
+                delta["content"] = text
+            body = {"index": index, "delta": delta}
+        else:
+            body = {"index": index, "text": text, "logprobs": None}
+        choice.started = True
+        body["finish_reason"] = choice.finish_reason
+        return encode_data({
+            "id": response_id,
+            "object": chunk_object,
+            "created": created,
+            "model": MODEL_NAME,
+            "choices": [body],
+        })
+
+    async def frames() -> AsyncGenerator[bytes, None]:
+        outputs = _outputs(engine, prompts, sampling, ticket.priority)
+        async with aclosing(outputs):
+            async for prompt_index, output in outputs:
+                for index, choice, text in _apply(run, prompt_index, output):
+                    if text or choice.finish_reason or not choice.started:
+                        yield chunk(index, text, choice)
+        if include_usage:
+            yield encode_data({
+                "id": response_id,
+                "object": chunk_object,
+                "created": created,
+                "model": MODEL_NAME,
+                "choices": [],
+                "usage": run.usage(),
+            })
+        yield OPENAI_DONE_FRAME
+
+    return DisconnectAwareStreamingResponse(
+        admitted_stream(ticket, engine_manager.track(frames())),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=BackgroundTask(ticket.release)
+    )
+
+
+###############################################################################
+#
+#                               API Endpoints
+#
+###############################################################################
+@router.get("/models")
+async def list_models() -> dict:
+    return {
+        "object": "list",
+        "data": [{
+            "id": MODEL_NAME,
+            "object": "model",
+            "created": 0,
+            "owned_by": "local",
+        }],
+    }
+
+
+@router.post("/chat/completions", response_model=None)
+async def chat_completions(
+    request: ChatCompletionRequest,
+    engine_manager: EngineManager = Depends(
+        get_engine_manager
+    ),
+    admission: AdmissionController = Depends(
+        get_admission
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
+    )
+) -> DisconnectAwareStreamingResponse | JSONResponse:
+    try:
+        sampling = request.to_spec(request.max_completion_tokens)
+    except ValueError as e:
+        return openai_error(
+            status.HTTP_400_BAD_REQUEST, str(e), "invalid_request_error"
+        )
+    messages = [
+        {"role": m.role, "content": m.text()} for m in request.messages
+    ]
+    try:
+        built, sampling = vLLMService.fit_prompt(
+            await get_prompt_builder(MODEL_PATH).render_messages_async(
+                messages
+            ),
+            sampling
+        )
+    except PromptTooLong as e:
+        return _context_error(e)
+    admitted = await _admit(
+        engine_manager, admission, admission.estimate_tokens(
+            "".join(m["content"] for m in messages),
+            sampling.max_tokens * sampling.n,
+            built.num_tokens
+        ),
+        tenant
+    )
+    if isinstance(admitted, JSONResponse):
+        return admitted
+    ticket, engine = admitted
+    return await _respond(
+        engine_manager, ticket, engine, [built.engine_prompt], sampling,
+        chat=True,
+        stream=request.stream,
+        include_usage=bool(
+            request.stream_options and request.stream_options.include_usage
+        )
+    )
+
+
+@router.post("/completions", response_model=None)
+async def completions(
+    request: CompletionRequest,
+    engine_manager: EngineManager = Depends(
+        get_engine_manager
+    ),
+    admission: AdmissionController = Depends(
+        get_admission
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
+    )
+) -> DisconnectAwareStreamingResponse | JSONResponse:
+    prompts: list[str | dict[str, list[int]]]
+    if isinstance(request.prompt, str):
+        prompts = [request.prompt]
+    elif isinstance(request.prompt[0], int):
+        prompts = [{"prompt_token_ids": list(request.prompt)}]
+    else:
+        prompts = list(request.prompt)
+    if len(prompts) > MAX_PROMPTS:
+        return openai_error(
+            status.HTTP_400_BAD_REQUEST,
+            f"At most {MAX_PROMPTS} prompts per request",
+            "invalid_request_error"
+        )
+    try:
+        sampling = request.to_spec()
+    except ValueError as e:
+        return openai_error(
+            status.HTTP_400_BAD_REQUEST, str(e), "invalid_request_error"
+        )
+    try:
+        prompts, sampling, prompt_tokens = await _fit_prompts(
+            prompts, sampling
+        )
+    except PromptTooLong as e:
+        return _context_error(e)
+    admitted = await _admit(
+        engine_manager, admission, admission.estimate_tokens(
+            "".join(p for p in prompts if isinstance(p, str)),
+            sampling.max_tokens * sampling.n * len(prompts),
+            prompt_tokens
+        ),
+        tenant
+    )
+    if isinstance(admitted, JSONResponse):
+        return admitted
+    ticket, engine = admitted
+    return await _respond(
+        engine_manager, ticket, engine, prompts, sampling,
+        chat=False,
+        stream=request.stream,
+        include_usage=bool(
+            request.stream_options and request.stream_options.include_usage
+        )
+    )
@@ -0,0 +1,43 @@
+from functools import partial
+from typing import Awaitable, Callable
+
+import anyio
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class DisconnectAwareStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always races the body against http.disconnect.
+
+    Starlette only does this for ASGI spec < 2.4; newer servers notice a
+    dropped client on the next failed write and leave the body iterator
+    to the garbage collector. Cancelling the body task instead runs the
+    generator's cleanup right away, which is where the engine request is
+    aborted.
+    """
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        try:
+            async with anyio.create_task_group() as task_group:
+
+                async def wrap(func: Callable[[], Awaitable[None]]) -> None:
+                    await func()
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(
+                    wrap, partial(self.stream_response, send)
+                )
+                await wrap(partial(self.listen_for_disconnect, receive))
+        except BaseExceptionGroup as eg:
+            if len(eg.exceptions) == 1:
+                raise eg.exceptions[0] from None
+            raise
+
+        if self.background is not None:
+            await self.background()
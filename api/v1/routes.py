@@ -1,21 +1,150 @@
-from fastapi import APIRouter, Request, Depends
-from fastapi.responses import StreamingResponse
-from vllm.engine.async_llm_engine import AsyncLLMEngine
-from api.v1.models import ChatRequest
-from services.vllm_service import vLLMService
+import asyncio
+from typing import AsyncGenerator
+from pydantic import ValidationError
+from fastapi import APIRouter, Request, Depends, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from api.v1.models import (
+    BatchCreate,
+    ChatRequest,
+    IngestCreate,
+    SamplingOptions,
+    SessionChatRequest,
+)
+from api.v1.responses import DisconnectAwareStreamingResponse
+from services.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    admitted_stream,
+)
+from services.batch import BatchError, BatchManager
+from services.engine_manager import EngineManager, EngineUnavailable
+from services.ingestion import IngestError, IngestionManager
+from services.response_cache import ResponseCache
+from services.retrieval import Retriever
+from services.semantic_cache import SemanticCache
+from services.sessions import SessionStore
+from services.tenants import Tenant
+from services.tokenizer import PromptTooLong
+from services.vllm_service import (
+    DEFAULT_SAMPLING,
+    PreparedPrompt,
+    vLLMService,
+)
 
 router = APIRouter()
 
+SSE_HEADERS: dict[str, str] = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    # "Access-Control-Allow-Origin": "*",  # For CORS if needed
+}
+
 
 ###############################################################################
 #
 #                     Dependency Injection for FastAPI
 #
 ###############################################################################
-def get_vllm_engine(
+def get_engine_manager(
+    request: Request
+) -> EngineManager:
+    return request.app.state.engine_manager
+
+
+def get_admission(
     request: Request
-) -> AsyncLLMEngine:
-    return request.app.state.vllm_engine
+) -> AdmissionController:
+    return request.app.state.admission
+
+
+def get_response_cache(
+    request: Request
+) -> ResponseCache | None:
+    return request.app.state.response_cache
+
+
+def get_semantic_cache(
+    request: Request
+) -> SemanticCache | None:
+    return request.app.state.semantic_cache
+
+
+def get_retriever(
+    request: Request
+) -> Retriever | None:
+    return request.app.state.retriever
+
+
+def get_batch_manager(
+    request: Request
+) -> BatchManager:
+    return request.app.state.batch
+
+
+def get_ingestion(
+    request: Request
+) -> IngestionManager | None:
+    return request.app.state.ingestion
+
+
+def get_sessions(
+    request: Request
+) -> SessionStore | None:
+    return request.app.state.sessions
+
+
+def get_tenant(
+    request: Request
+) -> Tenant:
+    return request.app.state.tenants.resolve(request.headers)
+
+
+def admission_error_response(e: AdmissionRejected) -> JSONResponse:
+    """429 with Retry-After, or 413 when the request can never fit"""
+    if e.retry_after is None:
+        return JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={"error": e.reason}
+        )
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"error": e.reason, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+def prompt_too_long_response(e: PromptTooLong) -> JSONResponse:
+    """413: the prompt and max_tokens can never fit the model's context"""
+    return JSONResponse(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        content={
+            "error": str(e),
+            "prompt_tokens": e.prompt_tokens,
+            "max_tokens": e.max_tokens,
+            "max_model_len": e.max_model_len
+        }
+    )
+
+
+def sampling_error_response(e: ValueError) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={"error": str(e)}
+    )
+
+
+def engine_error_response(e: EngineUnavailable) -> JSONResponse:
+    """503 with Retry-After while the engine is loading or failed"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "error": "Model unavailable, please retry later.",
+            "state": e.state.value,
+            "retry_after": e.retry_after
+        },
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
 
 ###############################################################################
@@ -23,23 +152,481 @@ def get_vllm_engine(
 #                               API Endpoints
 #
 ###############################################################################
-@router.post("/ask")
+@router.post("/ask", response_model=None)
 async def ask(
     request: ChatRequest,
-    vllm_engine: AsyncLLMEngine = Depends(
-        get_vllm_engine
+    engine_manager: EngineManager = Depends(
+        get_engine_manager
+    ),
+    admission: AdmissionController = Depends(
+        get_admission
+    ),
+    response_cache: ResponseCache | None = Depends(
+        get_response_cache
+    ),
+    semantic_cache: SemanticCache | None = Depends(
+        get_semantic_cache
+    ),
+    retriever: Retriever | None = Depends(
+        get_retriever
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
     )
-) -> StreamingResponse:
+) -> DisconnectAwareStreamingResponse | JSONResponse:
     question = request.question.strip()
-    return StreamingResponse(
-        vLLMService.generate_answer(
-            llm_engine=vllm_engine,
-            prompt=question
+    cache = response_cache if request.cache else None
+    coalesce = (
+        request.stream_options.to_policy()
+        if request.stream_options else None
+    )
+    try:
+        sampling = (
+            request.sampling.to_spec()
+            if request.sampling else DEFAULT_SAMPLING
+        )
+    except ValueError as e:
+        return sampling_error_response(e)
+    prepared: PreparedPrompt | None = None
+    try:
+        if retriever is not None:
+            # The retrieved documents are part of the cache key
+            prepared = await vLLMService.prepare_prompt(
+                question, sampling, retriever
+            )
+        cached = cache.take(
+            prepared.key if prepared
+            else vLLMService.cache_key(question, sampling)
+        ) if cache is not None else None
+        if cached is not None:
+            # Cached answers never reach the engine, so skip admission
+            return DisconnectAwareStreamingResponse(
+                vLLMService.generate_answer(
+                    llm_engine=None,
+                    prompt=question,
+                    coalesce=coalesce,
+                    sampling=sampling,
+                    prepared=prepared,
+                    cached=cached
+                ),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+        if prepared is None:
+            prepared = await vLLMService.prepare_prompt(question, sampling)
+    except PromptTooLong as e:
+        return prompt_too_long_response(e)
+    try:
+        ticket = await admission.acquire(
+            admission.estimate_tokens(
+                prepared.built.text,
+                prepared.sampling.max_tokens,
+                prepared.built.num_tokens
+            ),
+            tenant=tenant
+        )
+    except AdmissionRejected as e:
+        return admission_error_response(e)
+    try:
+        vllm_engine = await engine_manager.get()
+    except EngineUnavailable as e:
+        ticket.refund()
+        return engine_error_response(e)
+    stream = vLLMService.generate_answer(
+        llm_engine=vllm_engine,
+        prompt=question,
+        coalesce=coalesce,
+        cache=cache,
+        semantic_cache=semantic_cache if request.cache else None,
+        priority=ticket.priority,
+        prepared=prepared
+    )
+    return DisconnectAwareStreamingResponse(
+        admitted_stream(ticket, engine_manager.track(stream)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=BackgroundTask(ticket.release)
+    )
+
+
+@router.get("/cache/stats")
+async def cache_stats(
+    response_cache: ResponseCache | None = Depends(
+        get_response_cache
+    ),
+    semantic_cache: SemanticCache | None = Depends(
+        get_semantic_cache
+    )
+) -> dict:
+    return {
+        "exact": (
+            {"enabled": True, **response_cache.stats.snapshot()}
+            if response_cache is not None else {"enabled": False}
         ),
+        "semantic": (
+            {"enabled": True, **semantic_cache.stats.snapshot()}
+            if semantic_cache is not None else {"enabled": False}
+        ),
+    }
+
+
+@router.get("/tenants")
+async def tenant_stats(
+    request: Request,
+    admission: AdmissionController = Depends(
+        get_admission
+    )
+) -> dict:
+    """Per-tenant queue, latency and rate-limit counters"""
+    return {
+        **request.app.state.tenants.snapshot(),
+        "tenants": admission.tenant_snapshots(),
+    }
+
+
+###############################################################################
+#
+#                      Multi-turn chat sessions
+#
+###############################################################################
+def _sessions_disabled() -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"error": "Sessions are disabled (SESSIONS_ENABLED=0)"}
+    )
+
+
+def _session_not_found(session_id: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={"error": f"Unknown or expired session: {session_id}"}
+    )
+
+
+@router.post(
+    "/sessions",
+    status_code=status.HTTP_201_CREATED,
+    response_model=None
+)
+async def create_session(
+    sessions: SessionStore | None = Depends(
+        get_sessions
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
+    )
+) -> dict | JSONResponse:
+    if sessions is None:
+        return _sessions_disabled()
+    session = await sessions.create(tenant.name)
+    return session.snapshot()
+
+
+@router.get("/sessions/{session_id}", response_model=None)
+async def get_session(
+    session_id: str,
+    sessions: SessionStore | None = Depends(
+        get_sessions
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
+    )
+) -> dict | JSONResponse:
+    """History with each turn's prompt, cached and prefilled tokens"""
+    if sessions is None:
+        return _sessions_disabled()
+    session = await sessions.get(session_id, tenant.name)
+    if session is None:
+        return _session_not_found(session_id)
+    return session.snapshot()
+
+
+@router.delete("/sessions/{session_id}", response_model=None)
+async def delete_session(
+    session_id: str,
+    sessions: SessionStore | None = Depends(
+        get_sessions
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
+    )
+) -> dict | JSONResponse:
+    if sessions is None:
+        return _sessions_disabled()
+    if not await sessions.delete(session_id, tenant.name):
+        return _session_not_found(session_id)
+    return {"deleted": session_id}
+
+
+@router.post("/sessions/{session_id}/chat", response_model=None)
+async def session_chat(
+    session_id: str,
+    request: SessionChatRequest,
+    engine_manager: EngineManager = Depends(
+        get_engine_manager
+    ),
+    admission: AdmissionController = Depends(
+        get_admission
+    ),
+    sessions: SessionStore | None = Depends(
+        get_sessions
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
+    )
+) -> DisconnectAwareStreamingResponse | JSONResponse:
+    """
+    Answer `question` in the session's context. Streams answer_part
+    frames, then a `session` event reporting the turn's prompt tokens and
+    how many of them the prefix cache served.
+    """
+    if sessions is None:
+        return _sessions_disabled()
+    session = await sessions.get(session_id, tenant.name)
+    if session is None:
+        return _session_not_found(session_id)
+    if session.lock.locked():
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"error": "A turn of this session is still running"}
+        )
+    question = request.question.strip()
+    coalesce = (
+        request.stream_options.to_policy()
+        if request.stream_options else None
+    )
+    try:
+        sampling = (
+            request.sampling.to_spec()
+            if request.sampling else DEFAULT_SAMPLING
+        )
+    except ValueError as e:
+        return sampling_error_response(e)
+    try:
+        ticket = await admission.acquire(
+            sessions.estimate_cost(session, question, sampling.max_tokens),
+            tenant=tenant
+        )
+    except AdmissionRejected as e:
+        return admission_error_response(e)
+    try:
+        vllm_engine = await engine_manager.get()
+    except EngineUnavailable as e:
+        ticket.refund()
+        return engine_error_response(e)
+    stream = vLLMService.session_answer(
+        llm_engine=vllm_engine,
+        store=sessions,
+        session=session,
+        question=question,
+        coalesce=coalesce,
+        sampling=sampling,
+        priority=ticket.priority
+    )
+    return DisconnectAwareStreamingResponse(
+        admitted_stream(ticket, engine_manager.track(stream)),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            # "Access-Control-Allow-Origin": "*",  # For CORS if needed
-        }
+        headers=SSE_HEADERS,
+        background=BackgroundTask(ticket.release)
+    )
+
+
+###############################################################################
+#
+#                           Batch (offline) jobs
+#
+###############################################################################
+def _job_not_found(job_id: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={"error": f"Unknown batch job: {job_id}"}
+    )
+
+
+@router.post(
+    "/batch",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=None
+)
+async def create_batch(
+    request: Request,
+    batches: BatchManager = Depends(
+        get_batch_manager
+    ),
+    tenant: Tenant = Depends(
+        get_tenant
+    )
+) -> dict | JSONResponse:
+    """
+    Start a job from a multipart `file` upload (optional `concurrency`
+    and JSON `sampling` fields) or a JSON body naming a server-side file:
+    {"path": ..., "concurrency": ..., "sampling": {...}}.
+    """
+    try:
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise BatchError("multipart body needs a 'file' part")
+            concurrency = form.get("concurrency")
+            sampling = form.get("sampling")
+            job = await batches.submit_upload(
+                upload.file,
+                int(concurrency) if concurrency else None,
+                SamplingOptions.model_validate_json(sampling).model_dump(
+                    exclude_none=True
+                ) if isinstance(sampling, str) else None,
+                tenant.name
+            )
+        else:
+            body = BatchCreate.model_validate(await request.json())
+            job = await batches.submit_path(
+                body.path,
+                body.concurrency,
+                body.sampling.model_dump(exclude_none=True)
+                if body.sampling else None,
+                tenant.name
+            )
+    except ValidationError as e:
+        return JSONResponse(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            content={"error": e.errors(include_url=False)}
+        )
+    except (BatchError, ValueError) as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"error": str(e)}
+        )
+    return job.snapshot()
+
+
+@router.get("/batch")
+async def list_batches(
+    batches: BatchManager = Depends(
+        get_batch_manager
+    )
+) -> dict:
+    return {
+        "jobs": [job.snapshot() for job in batches.list_jobs()],
+        "counts": batches.snapshot(),
+    }
+
+
+@router.get("/batch/{job_id}", response_model=None)
+async def get_batch(
+    job_id: str,
+    batches: BatchManager = Depends(
+        get_batch_manager
+    )
+) -> dict | JSONResponse:
+    job = batches.get(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    return job.snapshot()
+
+
+@router.get("/batch/{job_id}/results", response_model=None)
+async def get_batch_results(
+    job_id: str,
+    offset: int = 0,
+    batches: BatchManager = Depends(
+        get_batch_manager
+    )
+) -> StreamingResponse | JSONResponse:
+    """
+    Output JSONL from byte `offset` up to what is written so far.
+
+    Poll with the returned X-Next-Offset to tail a running job.
+    """
+    if batches.get(job_id) is None:
+        return _job_not_found(job_id)
+    path = batches.output_path(job_id)
+    end = path.stat().st_size if path.exists() else 0
+    start = min(max(offset, 0), end)
+
+    async def read() -> AsyncGenerator[bytes, None]:
+        with path.open("rb") as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(remaining, 65536))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(
+        read() if end > start else iter(()),
+        media_type="application/x-ndjson",
+        headers={"X-Next-Offset": str(end)}
+    )
+
+
+@router.post("/batch/{job_id}/cancel", response_model=None)
+async def cancel_batch(
+    job_id: str,
+    batches: BatchManager = Depends(
+        get_batch_manager
+    )
+) -> dict | JSONResponse:
+    job = await batches.cancel(job_id)
+    if job is None:
+        return _job_not_found(job_id)
+    return job.snapshot()
+
+
+###############################################################################
+#
+#                     Document ingestion into the RAG index
+#
+###############################################################################
+def _ingestion_disabled() -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"error": "Ingestion is disabled (INGEST_ENABLED=0)"}
+    )
+
+
+@router.post(
+    "/ingest",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=None
+)
+async def start_ingest(
+    body: IngestCreate,
+    ingestion: IngestionManager | None = Depends(
+        get_ingestion
+    )
+) -> dict | JSONResponse:
+    """
+    Index INGEST_SOURCE (or `prefix` inside it) in the background;
+    unchanged documents are skipped unless `force` is set.
+    """
+    if ingestion is None:
+        return _ingestion_disabled()
+    if ingestion.running:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"error": "An ingestion run is already in progress"}
+        )
+    try:
+        stats = ingestion.start(body.prefix, body.force)
+    except IngestError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"error": str(e)}
+        )
+    return stats.snapshot()
+
+
+@router.get("/ingest", response_model=None)
+async def get_ingest(
+    ingestion: IngestionManager | None = Depends(
+        get_ingestion
     )
+) -> dict | JSONResponse:
+    """Progress of the current run (pages/s, chunks/s), or the last one"""
+    if ingestion is None:
+        return _ingestion_disabled()
+    return ingestion.snapshot()
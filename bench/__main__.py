@@ -0,0 +1,212 @@
+"""
+Load generator for the SSE endpoints.
+
+    python -m bench --base-url http://127.0.0.1:8080 --concurrency 32
+    python -m bench --spawn-synthetic --rate 20 --num-requests 500
+    python -m bench --cold-start 3
+    python -m bench --spawn-synthetic --compare-speculative ngram
+    python -m bench --compare-profiles default,throughput --rate 20
+    python -m bench --spawn-synthetic --scale-workers 1,2,4 --concurrency 64
+    python -m bench --spawn-synthetic --compare-tracing --concurrency 32
+    python -m bench --tokenizer /models/Qwen2-7B --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from bench.coldstart import measure_cold_start
+from bench.loadgen import DEFAULT_PROMPTS, ENDPOINTS, run_benchmark
+from bench.server import spawn_server
+from bench.compare import compare_servers
+from bench.tokenizer import measure_tokenizer
+from bench.workers import scale_workers
+
+
+def load_prompts(path: str | None) -> list[str]:
+    """Read prompts from a .txt (one per line) or .jsonl file"""
+    if path is None:
+        return list(DEFAULT_PROMPTS)
+    prompts: list[str] = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        if path.endswith(".jsonl"):
+            record = json.loads(line)
+            line = record.get("prompt") or record.get("question", "")
+        prompts.append(line)
+    return prompts
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="bench", description=__doc__)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--base-url", default="http://127.0.0.1:8080")
+    target.add_argument(
+        "--spawn-synthetic", action="store_true",
+        help="start a local server with ENGINE_BACKEND=synthetic"
+    )
+    parser.add_argument(
+        "--endpoint", default="ask,generate",
+        help=f"comma separated subset of {sorted(ENDPOINTS)}"
+    )
+    parser.add_argument("--num-requests", type=int, default=100)
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument(
+        "--concurrency", type=int, default=8,
+        help="closed-loop: number of requests kept in flight"
+    )
+    load.add_argument(
+        "--rate", type=float, default=None,
+        help="open-loop: Poisson arrival rate in requests/s"
+    )
+    parser.add_argument("--prompts", default=None)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--slo-ttft", type=float, default=None)
+    parser.add_argument("--slo-itl", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--preset", default=None,
+        help="sampling preset sent with every request (e.g. precise)"
+    )
+    parser.add_argument(
+        "--cache-hits", action="store_true",
+        help="let the server's response cache answer repeated prompts; "
+             "by default every request asks to bypass it"
+    )
+    parser.add_argument(
+        "--cold-start", type=int, default=0, metavar="RUNS",
+        help="instead of load, spawn the server RUNS times and time startup"
+    )
+    parser.add_argument(
+        "--compare-speculative", default=None, metavar="METHOD",
+        choices=("ngram", "draft"),
+        help="spawn the server with speculative decoding off, then on, "
+             "and compare output tokens/s"
+    )
+    parser.add_argument(
+        "--compare-profiles", default=None, metavar="A,B,...",
+        help="spawn the server once per ENGINE_PROFILE and compare "
+             "output tokens/s against the first"
+    )
+    parser.add_argument(
+        "--scale-workers", default=None, metavar="N,M,...",
+        help="spawn an engine process shared by N API workers for each "
+             "count (plus an in-process baseline) and report throughput "
+             "and event-loop CPU headroom"
+    )
+    parser.add_argument(
+        "--compare-tracing", action="store_true",
+        help="spawn the server with tracing off, then tracing every "
+             "request, and compare throughput and latency"
+    )
+    parser.add_argument(
+        "--tokenizer", default=None, metavar="MODEL_PATH",
+        help="instead of load, time prompt tokenization in process with "
+             "this model's tokenizer: on the loop, in a thread, on the "
+             "tokenizer pool with and without segment caching"
+    )
+    parser.add_argument(
+        "--tokenizer-threads", type=int, default=4,
+        help="tokenizer pool size for --tokenizer"
+    )
+    parser.add_argument("--output", default=None, help="write JSON here")
+    return parser
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    base_env = (
+        {"ENGINE_BACKEND": "synthetic"} if args.spawn_synthetic else {}
+    )
+    if args.cold_start:
+        return {
+            "cold_start": await measure_cold_start(base_env, args.cold_start)
+        }
+    prompts = load_prompts(args.prompts)
+    if args.tokenizer:
+        return {"tokenizer": await measure_tokenizer(
+            args.tokenizer, prompts, args.num_requests, args.concurrency,
+            threads=args.tokenizer_threads
+        )}
+    endpoints = [e.strip() for e in args.endpoint.split(",") if e.strip()]
+
+    async def run_all(base_url: str) -> dict[str, Any]:
+        report: dict[str, Any] = {"base_url": base_url, "results": {}}
+        for endpoint in endpoints:
+            report["results"][endpoint] = await run_benchmark(
+                base_url=base_url,
+                endpoint=endpoint,
+                prompts=prompts,
+                num_requests=args.num_requests,
+                concurrency=None if args.rate else args.concurrency,
+                rate=args.rate,
+                timeout=args.timeout,
+                slo_ttft=args.slo_ttft,
+                slo_itl=args.slo_itl,
+                extra_payload={
+                    "cache": args.cache_hits,
+                    **({"sampling": {"preset": args.preset}}
+                       if args.preset else {}),
+                },
+                seed=args.seed,
+            )
+        return report
+
+    if args.compare_speculative:
+        return {"compare": await compare_servers({
+            "off": {**base_env, "SPECULATIVE_METHOD": "off"},
+            args.compare_speculative: {
+                **base_env, "SPECULATIVE_METHOD": args.compare_speculative
+            },
+        }, run_all)}
+    if args.compare_profiles:
+        return {"compare": await compare_servers({
+            profile.strip(): {**base_env, "ENGINE_PROFILE": profile.strip()}
+            for profile in args.compare_profiles.split(",")
+            if profile.strip()
+        }, run_all)}
+    if args.compare_tracing:
+        trace_path = Path(tempfile.mkdtemp(prefix="bench-traces-"))
+        return {"compare": await compare_servers({
+            "off": {**base_env, "TRACING_ENABLED": "0"},
+            "traced": {
+                **base_env,
+                "TRACING_ENABLED": "1",
+                "TRACE_SAMPLE_RATE": "1.0",
+                "TRACE_EXPORT_PATH": str(trace_path / "traces.jsonl"),
+            },
+        }, run_all)}
+    if args.scale_workers:
+        return {"compare": await scale_workers(
+            [int(n) for n in args.scale_workers.split(",") if n.strip()],
+            run_all, base_env
+        )}
+    if args.spawn_synthetic:
+        async with spawn_server(base_env) as base_url:
+            return await run_all(base_url)
+    return await run_all(args.base_url)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    results = report.get("results", {})
+    if "compare" in report:
+        results = {
+            f"{label}/{endpoint}": result
+            for label, run in report["compare"]["runs"].items()
+            for endpoint, result in run["results"].items()
+        }
+    failed = any(r["num_ok"] == 0 for r in results.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
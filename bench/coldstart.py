@@ -0,0 +1,39 @@
+import time
+from typing import Any
+
+import aiohttp
+
+from bench.loadgen import percentile
+from bench.server import spawn_server
+
+
+async def measure_cold_start(
+    env: dict[str, str],
+    runs: int,
+    ready_timeout: float = 1800.0
+) -> dict[str, Any]:
+    """
+    Start the server `runs` times and time spawn-to-ready.
+
+    The server's own /startup report is attached to every run, so a
+    regression can be pinned to a phase (compile cache, build, warmup).
+    """
+    samples: list[dict[str, Any]] = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        async with spawn_server(env, ready_timeout=ready_timeout) as base_url:
+            ready_s = time.perf_counter() - started
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{base_url}/startup") as response:
+                    report = await response.json()
+        samples.append({"spawn_to_ready_s": ready_s, "startup": report})
+    ready = [s["spawn_to_ready_s"] for s in samples]
+    return {
+        "runs": runs,
+        "spawn_to_ready_s": {
+            "first": ready[0] if ready else None,
+            "p50": percentile(ready, 50),
+            "max": max(ready, default=None),
+        },
+        "samples": samples,
+    }
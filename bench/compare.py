@@ -0,0 +1,70 @@
+import time
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+from bench.server import spawn_server
+
+
+async def scrape_metrics(base_url: str) -> dict[str, float]:
+    """Unlabeled samples from the server's /metrics"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/metrics") as response:
+            text = await response.text()
+    samples: dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#") or "{" in line:
+            continue
+        name, _, value = line.partition(" ")
+        try:
+            samples[name] = float(value)
+        except ValueError:
+            continue
+    return samples
+
+
+async def compare_servers(
+    variants: dict[str, dict[str, str]],
+    run_load: Callable[[str], Awaitable[dict[str, Any]]]
+) -> dict[str, Any]:
+    """
+    Spawn the server once per variant (extra env), run the same load on
+    each and compare generated tokens per second against the first.
+
+    Tokens come from the server's output-token histogram, so the number
+    is exact whatever the SSE framing.
+    """
+    runs: dict[str, dict[str, Any]] = {}
+    for label, env in variants.items():
+        async with spawn_server(env) as base_url:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{base_url}/config") as response:
+                    config = await response.json()
+            before = await scrape_metrics(base_url)
+            started = time.perf_counter()
+            report = await run_load(base_url)
+            wall_time = time.perf_counter() - started
+            after = await scrape_metrics(base_url)
+        tokens = after.get("chatbot_output_tokens_sum", 0.0) \
+            - before.get("chatbot_output_tokens_sum", 0.0)
+        runs[label] = {
+            "env": env,
+            "output_tokens": tokens,
+            "output_tokens_per_s": tokens / wall_time if wall_time else 0.0,
+            "spec_decode": {
+                name.removeprefix("chatbot_spec_decode_"): value
+                for name, value in after.items()
+                if name.startswith("chatbot_spec_decode_")
+            },
+            "engine_config": config,
+            **report,
+        }
+    baseline = next(iter(runs.values()))["output_tokens_per_s"]
+    return {
+        "baseline": next(iter(runs)),
+        "speedup": {
+            label: run["output_tokens_per_s"] / baseline if baseline else None
+            for label, run in runs.items()
+        },
+        "runs": runs,
+    }
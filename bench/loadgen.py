@@ -0,0 +1,280 @@
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator
+
+import aiohttp
+
+from bench.compare import scrape_metrics
+
+
+# endpoint name -> (path, JSON field carrying the prompt)
+ENDPOINTS: dict[str, tuple[str, str]] = {
+    "ask": ("/api/v1/ask", "question"),
+    "generate": ("/api/v1/generate", "prompt"),
+}
+
+DEFAULT_PROMPTS: tuple[str, ...] = (
+    "Thủ đô của Việt Nam là gì?",
+    "Hãy giải thích ngắn gọn về trí tuệ nhân tạo.",
+    "Làm thế nào để đăng ký tài khoản mới?",
+    "Chính sách hoàn tiền của công ty như thế nào?",
+    "Tóm tắt nội dung chính của tài liệu hướng dẫn sử dụng.",
+    "What are the opening hours of the support center?",
+)
+
+
+###############################################################################
+#
+#                          Per-request measurement
+#
+###############################################################################
+@dataclass
+class RequestResult:
+    ok: bool
+    start: float
+    e2e: float
+    ttft: float | None = None
+    itls: list[float] = field(default_factory=list)
+    num_parts: int = 0
+    num_chars: int = 0
+    status: int | None = None
+    error: str | None = None
+
+
+async def iter_sse_events(
+    content: aiohttp.StreamReader
+) -> AsyncIterator[dict[str, Any]]:
+    """Yield decoded `data:` payloads; the final frame may lack a blank line"""
+    buffer = b""
+    async for chunk in content.iter_any():
+        buffer += chunk
+        while b"\n\n" in buffer:
+            frame, buffer = buffer.split(b"\n\n", 1)
+            event = _decode_frame(frame)
+            if event is not None:
+                yield event
+    event = _decode_frame(buffer)
+    if event is not None:
+        yield event
+
+
+def _decode_frame(frame: bytes) -> dict[str, Any] | None:
+    data = b"".join(
+        line[5:].lstrip() for line in frame.split(b"\n")
+        if line.startswith(b"data:")
+    )
+    return json.loads(data) if data else None
+
+
+async def run_request(
+    session: aiohttp.ClientSession,
+    url: str,
+    payload: dict[str, Any],
+) -> RequestResult:
+    start = time.perf_counter()
+    result = RequestResult(ok=False, start=start, e2e=0.0)
+    last = start
+    try:
+        async with session.post(url, json=payload) as response:
+            result.status = response.status
+            if response.status != 200:
+                result.error = f"HTTP {response.status}"
+                return result
+            async for event in iter_sse_events(response.content):
+                now = time.perf_counter()
+                kind = event.get("type")
+                if kind == "answer_part":
+                    if result.ttft is None:
+                        result.ttft = now - start
+                    else:
+                        result.itls.append(now - last)
+                    last = now
+                    result.num_parts += 1
+                    result.num_chars += len(event.get("data", ""))
+                elif kind == "done":
+                    result.ok = True
+                elif kind == "error":
+                    result.error = str(event.get("data", "stream error"))
+            if not result.ok and result.error is None:
+                result.error = "stream ended without done event"
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        result.error = f"{type(e).__name__}: {e}"
+    finally:
+        result.e2e = time.perf_counter() - start
+    return result
+
+
+###############################################################################
+#
+#                         Arrival processes
+#
+###############################################################################
+async def run_closed_loop(
+    session: aiohttp.ClientSession,
+    url: str,
+    payloads: list[dict[str, Any]],
+    concurrency: int,
+) -> list[RequestResult]:
+    """Keep `concurrency` requests in flight until all payloads are sent"""
+    queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+    for payload in payloads:
+        queue.put_nowait(payload)
+    results: list[RequestResult] = []
+
+    async def worker() -> None:
+        while not queue.empty():
+            payload = queue.get_nowait()
+            results.append(await run_request(session, url, payload))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(
+    session: aiohttp.ClientSession,
+    url: str,
+    payloads: list[dict[str, Any]],
+    rate: float,
+    seed: int = 0,
+) -> list[RequestResult]:
+    """Poisson arrivals at `rate` req/s regardless of completions"""
+    rng = random.Random(seed)
+    tasks: list[asyncio.Task[RequestResult]] = []
+    for payload in payloads:
+        tasks.append(asyncio.create_task(run_request(session, url, payload)))
+        await asyncio.sleep(rng.expovariate(rate))
+    return list(await asyncio.gather(*tasks))
+
+
+###############################################################################
+#
+#                              Reporting
+#
+###############################################################################
+def percentile(values: list[float], q: float) -> float | None:
+    """Linear-interpolated percentile of `values` (q in [0, 100])"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _dist(values: list[float]) -> dict[str, float | None]:
+    return {
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def summarize(
+    results: list[RequestResult],
+    wall_time: float,
+    slo_ttft: float | None = None,
+    slo_itl: float | None = None,
+) -> dict[str, Any]:
+    """
+    Aggregate results into the JSON report (latencies in seconds). Parts
+    are SSE `answer_part` frames, which carry one token or (coalesced)
+    several, so they are not a token rate; run_benchmark adds that.
+    """
+    ok = [r for r in results if r.ok]
+    itls = [itl for r in ok for itl in r.itls]
+
+    def meets_slo(r: RequestResult) -> bool:
+        if slo_ttft is not None and (r.ttft is None or r.ttft > slo_ttft):
+            return False
+        if slo_itl is not None and r.itls:
+            return sum(r.itls) / len(r.itls) <= slo_itl
+        return True
+
+    good = [r for r in ok if meets_slo(r)]
+    total_parts = sum(r.num_parts for r in ok)
+    errors: dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            key = r.error or "unknown"
+            errors[key] = errors.get(key, 0) + 1
+    return {
+        "num_requests": len(results),
+        "num_ok": len(ok),
+        "error_rate": 1 - len(ok) / len(results) if results else 0.0,
+        "errors": errors,
+        "wall_time_s": wall_time,
+        "request_throughput": len(ok) / wall_time if wall_time else 0.0,
+        "goodput": len(good) / wall_time if wall_time else 0.0,
+        "output_parts_per_s": total_parts / wall_time if wall_time else 0.0,
+        "output_chars_per_s": (
+            sum(r.num_chars for r in ok) / wall_time if wall_time else 0.0
+        ),
+        "ttft_s": _dist([r.ttft for r in ok if r.ttft is not None]),
+        "itl_s": _dist(itls),
+        "e2e_s": _dist([r.e2e for r in ok]),
+        "slo": {"ttft_s": slo_ttft, "itl_s": slo_itl},
+    }
+
+
+async def output_tokens(base_url: str) -> float | None:
+    """The server's generated-token total, None if /metrics is missing"""
+    try:
+        samples = await scrape_metrics(base_url)
+    except aiohttp.ClientError:
+        return None
+    return samples.get("chatbot_output_tokens_sum")
+
+
+async def run_benchmark(
+    base_url: str,
+    endpoint: str,
+    prompts: list[str],
+    num_requests: int,
+    concurrency: int | None = None,
+    rate: float | None = None,
+    timeout: float = 600.0,
+    slo_ttft: float | None = None,
+    slo_itl: float | None = None,
+    extra_payload: dict[str, Any] | None = None,
+    seed: int = 0,
+) -> dict[str, Any]:
+    """Run one endpoint with closed-loop `concurrency` or open-loop `rate`"""
+    path, field_name = ENDPOINTS[endpoint]
+    url = base_url.rstrip("/") + path
+    payloads = [
+        {field_name: prompts[i % len(prompts)], **(extra_payload or {})}
+        for i in range(num_requests)
+    ]
+    tokens_before = await output_tokens(base_url)
+    connector = aiohttp.TCPConnector(limit=0)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as session:
+        started = time.perf_counter()
+        if rate is not None:
+            results = await run_open_loop(session, url, payloads, rate, seed)
+        else:
+            results = await run_closed_loop(
+                session, url, payloads, concurrency or 1
+            )
+        wall_time = time.perf_counter() - started
+    report = summarize(results, wall_time, slo_ttft, slo_itl)
+    tokens_after = await output_tokens(base_url)
+    # Counted by the server, so exact whatever the SSE framing; includes
+    # anything else it served meanwhile
+    report["output_tokens_per_s"] = None
+    if tokens_before is not None and tokens_after is not None and wall_time:
+        report["output_tokens_per_s"] = \
+            (tokens_after - tokens_before) / wall_time
+    report["endpoint"] = path
+    report["mode"] = (
+        {"type": "open", "rate": rate} if rate is not None
+        else {"type": "closed", "concurrency": concurrency or 1}
+    )
+    return report
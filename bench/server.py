@@ -0,0 +1,150 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import IO, AsyncIterator
+
+import aiohttp
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(base_url: str, timeout: float) -> None:
+    """Poll /ready until the engine reports ready or `timeout` expires"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/ready") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{base_url} not ready after {timeout}s")
+
+
+def child_log(name: str) -> IO[bytes]:
+    """
+    File for a child's stdout and stderr; our own stdout carries only the
+    JSON report
+    """
+    log = tempfile.NamedTemporaryFile(
+        prefix=f"bench-{name}-", suffix=".log", delete=False
+    )
+    print(f"📝 [Bench] {name} output: {log.name}", file=sys.stderr)
+    return log
+
+
+@asynccontextmanager
+async def spawn_app(
+    env: dict[str, str] | None = None,
+    port: int | None = None,
+    ready_timeout: float = 600.0,
+    workers: int = 1,
+) -> AsyncIterator[tuple[str, subprocess.Popen]]:
+    """Run `uvicorn main:app` in a subprocess; yield its URL and process"""
+    port = port or free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log = child_log("server")
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--log-level", "warning", "--workers", str(workers),
+        ],
+        cwd=REPO_ROOT,
+        env={**os.environ, **(env or {})},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    try:
+        await wait_ready(base_url, ready_timeout)
+        yield base_url, process
+    finally:
+        stop_process(process)
+        log.close()
+
+
+@asynccontextmanager
+async def spawn_server(
+    env: dict[str, str] | None = None,
+    port: int | None = None,
+    ready_timeout: float = 600.0,
+) -> AsyncIterator[str]:
+    """Run `uvicorn main:app` in a subprocess and yield its base URL"""
+    async with spawn_app(env, port, ready_timeout) as (base_url, _):
+        yield base_url
+
+
+@asynccontextmanager
+async def spawn_engine_process(
+    env: dict[str, str] | None = None
+) -> AsyncIterator[subprocess.Popen]:
+    """Run the shared engine process (`python -m services.ipc`)"""
+    log = child_log("engine")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "services.ipc"],
+        cwd=REPO_ROOT,
+        env={**os.environ, **(env or {})},
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    try:
+        yield process
+    finally:
+        stop_process(process)
+        log.close()
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+###############################################################################
+#                      Process CPU time (Linux /proc)
+###############################################################################
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def child_pids(pid: int) -> list[int]:
+    """
+    Direct children of `pid`, e.g. uvicorn's worker processes, leaving
+    out multiprocessing's resource tracker
+    """
+    children: list[int] = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+            cmdline = (stat.parent / "cmdline").read_bytes()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid and b"resource_tracker" not in cmdline:
+            children.append(int(stat.parent.name))
+    return children
+
+
+def cpu_seconds(pid: int) -> float | None:
+    """User + system CPU time of `pid`; None if it is gone or not Linux"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1]
+    except OSError:
+        return None
+    utime, stime = fields.split()[11:13]
+    return (int(utime) + int(stime)) / _CLOCK_TICKS
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from bench.loadgen import percentile
+from services.prompting import PromptBuilder, load_tokenizer
+from services.tokenizer import TokenizerConfig, TokenizerService
+
+# A RAG-like request: a question plus a few documents out of a corpus
+# small enough that documents recur, as popular ones do in production
+CORPUS_SIZE = 32
+DOCUMENTS_PER_PROMPT = 4
+DOCUMENT_WORDS = 200
+
+
+@dataclass
+class _Document:
+    id: str
+    text: str
+
+
+def _corpus() -> list[_Document]:
+    words = (
+        "hướng dẫn sử dụng tài khoản chính sách hoàn tiền khách hàng "
+        "support center opening hours policy refund account"
+    ).split()
+    return [
+        _Document(
+            id=f"doc-{i}",
+            text=" ".join(
+                words[(i * 7 + j) % len(words)] for j in range(DOCUMENT_WORDS)
+            )
+        )
+        for i in range(CORPUS_SIZE)
+    ]
+
+
+async def _sample_lag(lags: list[float], stop: asyncio.Event) -> None:
+    interval = 0.001
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(time.perf_counter() - started - interval, 0.0))
+
+
+async def _drive(
+    render: Callable[[str, list[_Document]], Awaitable[Any]],
+    prompts: list[str],
+    num_requests: int,
+    concurrency: int
+) -> dict[str, Any]:
+    """`num_requests` renders, `concurrency` at a time"""
+    corpus = _corpus()
+    latencies: list[float] = []
+    lags: list[float] = []
+    indices = iter(range(num_requests))
+
+    async def worker() -> None:
+        for i in indices:
+            documents = [
+                corpus[(i + k) % CORPUS_SIZE]
+                for k in range(DOCUMENTS_PER_PROMPT)
+            ]
+            # Unique questions, like real traffic: only documents repeat
+            question = f"{prompts[i % len(prompts)]} ({i})"
+            started = time.perf_counter()
+            await render(question, documents)
+            latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_lag(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_time = time.perf_counter() - started
+    stop.set()
+    await sampler
+    return {
+        "requests_per_s": num_requests / wall_time,
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": max(latencies) * 1000,
+        },
+        "loop_lag_ms": {
+            "p99": (percentile(lags, 99) or 0.0) * 1000,
+            "max": max(lags, default=0.0) * 1000,
+        },
+    }
+
+
+async def measure_tokenizer(
+    model_path: str,
+    prompts: list[str],
+    num_requests: int,
+    concurrency: int,
+    threads: int = 4
+) -> dict[str, Any]:
+    """
+    Prompt rendering (chat template and tokenization) with the model's
+    tokenizer, in process:
+
+        inline        render() on the event loop
+        to_thread     asyncio.to_thread, the shared default executor
+        pool          the TokenizerService pool, segment IDs cached
+        pool_uncached the same pool, every segment tokenized again
+
+    Latency is per request under `concurrency`; loop lag is what every
+    other coroutine on the loop would have waited meanwhile.
+    """
+    tokenizer = load_tokenizer(model_path)
+    if tokenizer is None:
+        raise RuntimeError(
+            f"No tokenizer loadable from {model_path} (is transformers "
+            f"installed and the model downloaded?)"
+        )
+
+    def builder(cache_size: int) -> PromptBuilder:
+        return PromptBuilder(tokenizer, tokens=TokenizerService(
+            tokenizer, TokenizerConfig(threads=threads, cache_size=cache_size)
+        ))
+
+    cached = builder(TokenizerConfig.cache_size)
+    uncached = builder(0)
+
+    async def inline(question: str, documents: list[_Document]) -> Any:
+        return cached.render(question, documents)
+
+    async def to_thread(question: str, documents: list[_Document]) -> Any:
+        return await asyncio.to_thread(cached.render, question, documents)
+
+    modes: dict[str, Callable[[str, list[_Document]], Awaitable[Any]]] = {
+        "inline": inline,
+        "to_thread": to_thread,
+        "pool": cached.render_async,
+        "pool_uncached": uncached.render_async,
+    }
+    # Warm the segment cache and the pools so no mode pays for that
+    await _drive(cached.render_async, prompts, CORPUS_SIZE, concurrency)
+    results: dict[str, Any] = {}
+    try:
+        for name, render in modes.items():
+            results[name] = await _drive(
+                render, prompts, num_requests, concurrency
+            )
+    finally:
+        cached.tokens.shutdown()
+        uncached.tokens.shutdown()
+    results["pool"]["tokenizer"] = cached.tokens.stats.snapshot()
+    return {
+        "model": model_path,
+        "concurrency": concurrency,
+        "threads": threads,
+        "num_requests": num_requests,
+        "modes": results,
+    }
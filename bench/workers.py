@@ -0,0 +1,101 @@
+import os
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from typing import Any, Awaitable, Callable
+
+from bench.server import (
+    child_pids,
+    cpu_seconds,
+    spawn_app,
+    spawn_engine_process,
+)
+
+
+def _busy(
+    before: dict[int, float | None],
+    after: dict[int, float | None],
+    wall_time: float
+) -> list[float]:
+    """Fraction of the run each process spent on a CPU"""
+    return [
+        (after[pid] - before[pid]) / wall_time
+        for pid in before
+        if before[pid] is not None and after.get(pid) is not None
+    ]
+
+
+async def scale_workers(
+    counts: list[int],
+    run_load: Callable[[str], Awaitable[dict[str, Any]]],
+    base_env: dict[str, str] | None = None
+) -> dict[str, Any]:
+    """
+    Run the same load against one in-process server, then against an
+    engine process shared by N API workers for each N in `counts`.
+
+    Each API worker is one event loop; `busy` is the CPU time it used over
+    the run's wall time, and headroom is what the busiest worker had
+    left. When that nears zero the loop, not the engine, is the limit,
+    and more workers should lift throughput until the engine process is.
+    """
+    runs: dict[str, dict[str, Any]] = {}
+    variants: list[tuple[str, int]] = [("inproc", 0)]
+    variants += [(f"workers={n}", n) for n in counts]
+    for label, workers in variants:
+        env = dict(base_env or {})
+        async with AsyncExitStack() as stack:
+            engine_pid: int | None = None
+            if workers:
+                socket_path = os.path.join(
+                    tempfile.mkdtemp(prefix="bench-ipc-"), "engine.sock"
+                )
+                engine = await stack.enter_async_context(
+                    spawn_engine_process({
+                        **env, "ENGINE_IPC_SOCKET": socket_path
+                    })
+                )
+                engine_pid = engine.pid
+                env.update(
+                    ENGINE_BACKEND="ipc",
+                    ENGINE_IPC_SOCKET=socket_path,
+                    API_WORKERS=str(workers),
+                )
+            base_url, server = await stack.enter_async_context(
+                spawn_app(env, workers=max(workers, 1))
+            )
+            # uvicorn --workers 1 serves from the parent process itself
+            api_pids = child_pids(server.pid) if workers > 1 \
+                else [server.pid]
+            pids = api_pids + ([engine_pid] if engine_pid else [])
+            before = {pid: cpu_seconds(pid) for pid in pids}
+            started = time.perf_counter()
+            report = await run_load(base_url)
+            wall_time = time.perf_counter() - started
+            after = {pid: cpu_seconds(pid) for pid in pids}
+        api_busy = _busy(
+            {pid: before[pid] for pid in api_pids}, after, wall_time
+        )
+        engine_busy = _busy(
+            {engine_pid: before[engine_pid]}, after, wall_time
+        ) if engine_pid else []
+        runs[label] = {
+            "api_workers": max(workers, 1),
+            "ipc": bool(workers),
+            "wall_time_s": wall_time,
+            "api_cpu_busy": api_busy,
+            "api_cpu_headroom": 1 - max(api_busy) if api_busy else None,
+            "engine_cpu_busy": engine_busy[0] if engine_busy else None,
+            **report,
+        }
+    return {
+        "baseline": "inproc",
+        "throughput": {
+            label: {
+                endpoint: result["request_throughput"]
+                for endpoint, result in run["results"].items()
+            }
+            for label, run in runs.items()
+        },
+        "runs": runs,
+    }
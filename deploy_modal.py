@@ -1,6 +1,5 @@
 import modal
 import os
-import shutil
 
 
 # --- 1. TẠO VOLUMES TỰ ĐỘNG NẾU CHƯA TỒN TẠI ---
@@ -81,9 +80,11 @@ app = modal.App(name="my-vllm-fastapi-app")
 
 
 # --- 4. HÀM UPLOAD ---
-upload_image = modal.Image.debian_slim().add_local_dir(
-    local_model_dir_path, 
-    remote_path="/local_models_ro"
+upload_image = (
+    modal.Image.debian_slim()
+    .add_local_dir(local_model_dir_path, remote_path="/local_models_ro")
+    # services/model_sync.py is stdlib-only
+    .add_local_python_source("services")
 )
 
 @app.function(
@@ -92,29 +93,69 @@ upload_image = modal.Image.debian_slim().add_local_dir(
     timeout=1800,
 )
 def upload_local_models():
+    from services.model_sync import ModelSyncError, sync
+
     src_path = "/local_models_ro"
     dest_path = "/models_dir"
-    
-    check_file_name = "language_model/GRPO-Vi-Qwen2-7B-RAG-W4A16/config.json"
-    check_file_on_volume = os.path.join(dest_path, check_file_name)
-    
-    if os.path.exists(check_file_on_volume):
-        print(f"File {check_file_on_volume} đã tồn tại. Bỏ qua upload.")
-        return
 
-    print(f"Đang copy models từ '{src_path}' sang '{dest_path}'...")
+    # Only chunks whose hash changed are written; a rerun after a timeout
+    # resumes from the journal the periodic commits saved on the volume
+    print(f"Đang đồng bộ models từ '{src_path}' sang '{dest_path}'...")
 
     try:
-        shutil.copytree(src_path, dest_path, dirs_exist_ok=True)
-    except Exception as e:
+        stats = sync(
+            src_path,
+            dest_path,
+            workers=int(os.getenv("MODEL_SYNC_WORKERS", "16")),
+            checkpoint=models_volume.commit,
+        )
+    except ModelSyncError as e:
         print(f"Lỗi: {e}")
+        models_volume.commit()
         return
 
+    print(
+        f"{stats.chunks_written}/{stats.chunks} chunk đã ghi, "
+        f"{stats.files_unchanged}/{stats.files} file không đổi, "
+        f"{stats.bytes_written / 1e9:.2f} GB trong {stats.seconds:.1f}s"
+    )
     print("Đang commit volume...")
     models_volume.commit()
     print("✅ Upload thành công!")
 
 
+# --- 4b. PRE-POPULATE COMPILE CACHES ---
+@app.function(
+    image=app_image,
+    volumes={
+        "/models_dir": models_volume,
+        TORCH_CACHE_PATH: torch_cache_vol,
+        TRITON_CACHE_PATH: triton_cache_vol,
+        VLLM_COMPILE_CACHE_PATH: vllm_compile_cache_vol,
+    },
+    gpu="A10G",
+    timeout=3600,
+)
+def warm_compile_cache():
+    """
+    Boot once with the serving image and warmup profile so cold starts
+    find valid keyed caches (only useful with VLLM_EAGER=0).
+    """
+    import asyncio
+    import json
+    import sys
+    sys.path.insert(0, "/app")
+    from services.startup import startup_report
+    from services.vllm_service import vLLMService
+
+    asyncio.run(vLLMService.init_resource())
+    print(json.dumps(startup_report.snapshot(), indent=2))
+    torch_cache_vol.commit()
+    triton_cache_vol.commit()
+    vllm_compile_cache_vol.commit()
+    print("✅ Compile caches committed!")
+
+
 # --- 5. WEB ENDPOINT ---
 @app.function(
     image=app_image,
@@ -52,16 +52,61 @@
 # def health_check():
 #     return {"": 204} if not ready else {"status": "healthy"}
 
+import os
 import signal
+from dataclasses import asdict
+from pydantic import ValidationError
 from fastapi import FastAPI, status, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.background import BackgroundTask
+from api.v1 import openai as openai_routes
 from api.v1 import routes as v1_routes
+from api.v1.models import SamplingOptions, StreamOptions
+from api.v1.responses import DisconnectAwareStreamingResponse
 from contextlib import asynccontextmanager
-from services.vllm_service import vLLMService
-from vllm.engine.async_llm_engine import AsyncLLMEngine
+from services import metrics, tracing
+from services.admission import (
+    AdmissionConfig,
+    AdmissionController,
+    AdmissionRejected,
+    admitted_stream,
+)
+from services.batch import BatchManager
+from services.ingestion import IngestionManager
+from services.tenants import TenantConfig, TenantRegistry
+from services.cancellation import abort_stats
+from services.engine import LLMEngine, get_engine_backend
+from services.engine_manager import (
+    EngineManager,
+    EngineManagerConfig,
+    EngineUnavailable,
+)
+from services.response_cache import ResponseCache
+from services.profiling import CPUProfiler, LoopLagMonitor, ProfilerBusy
+from services.prompting import get_prompt_builder, prefix_cache_stats
+from services.retrieval import Retriever
+from services.router import EngineRouter, build_engine_factory
+from services.sampling import sampling_factory
+from services.semantic_cache import SemanticCache
+from services.sessions import SessionStore
+from services.speculative import spec_decode_snapshot
+from services.startup import startup_report
+from services.tokenizer import PromptTooLong
+from services.vllm_service import (
+    DEFAULT_MAX_TOKENS,
+    DEFAULT_SAMPLING,
+    ENGINE_CONFIG,
+    MODEL_PATH,
+    SPECULATIVE_CONFIG,
+    PreparedPrompt,
+    vLLMService,
+)
 
-ready: bool = False
-engine: AsyncLLMEngine | None = None
+# With ROUTER_REPLICAS set the "engine" is a router over several replicas
+engine_manager = EngineManager(
+    build_engine_factory(vLLMService.init_resource),
+    EngineManagerConfig.from_env()
+)
 
 
 ###############################################################################
@@ -69,26 +114,29 @@ engine: AsyncLLMEngine | None = None
 ###############################################################################
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global ready, engine
-    print("🚀 Application starting up (lazy vLLM loading)...")
-    ready = False
-
-    if engine is None:  # ✅ chỉ preload 1 lần
-        try:
-            from services.vllm_service import vLLMService
-            print("⚙️ Preloading vLLM engine...")
-            engine = await vLLMService.init_resource()
-            app.state.vllm_engine = engine
-            ready = True
-            print("✅ vLLM engine ready!")
-        except Exception as e:
-            print(f"❌ Failed to preload engine: {e}")
-    else:
-        print("♻️ Engine already initialized, skipping preload...")
-
+    print("🚀 Application starting up (background vLLM loading)...")
+    # Load in the background so /live, /ready and /health answer meanwhile
+    engine_manager.start()
+    app.state.batch.start()
+    if app.state.tracer is not None:
+        app.state.tracer.start()
+    if app.state.loop_lag is not None:
+        app.state.loop_lag.start()
     yield
     print("🛑 Application shutting down...")
-
+    if app.state.loop_lag is not None:
+        await app.state.loop_lag.shutdown()
+    # Running batch jobs stay `running` on disk and resume on next start
+    await app.state.batch.shutdown()
+    if app.state.ingestion is not None:
+        await app.state.ingestion.shutdown()
+    if app.state.retriever is not None:
+        await app.state.retriever.close()
+    await engine_manager.shutdown()
+    get_prompt_builder(MODEL_PATH).tokens.shutdown()
+    if app.state.tracer is not None:
+        # Last, so the traces of requests drained above are exported too
+        await app.state.tracer.shutdown()
 
 
 ###############################################################################
@@ -99,74 +147,355 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan
 )
+app.state.engine_manager = engine_manager
+app.state.admission = AdmissionController(AdmissionConfig.from_env())
+app.state.tenants = TenantRegistry(TenantConfig.from_env())
+app.state.response_cache = ResponseCache.from_env()
+app.state.semantic_cache = SemanticCache.from_env()
+app.state.retriever = Retriever.from_env(
+    DEFAULT_MAX_TOKENS, get_prompt_builder(MODEL_PATH),
+    ENGINE_CONFIG.settings.max_model_len
+)
+if app.state.semantic_cache is not None and app.state.retriever is not None:
+    print("⚠️ [Cache] RAG answers bypass the semantic cache: it is keyed "
+          "on the question alone")
+app.state.batch = BatchManager.from_env(
+    engine_manager, app.state.admission, get_prompt_builder(MODEL_PATH),
+    app.state.tenants
+)
+# Writes to the collection the retriever reads, through the same client
+app.state.ingestion = IngestionManager.from_env(
+    app.state.retriever.store if app.state.retriever is not None else None
+)
+app.state.sessions = SessionStore.from_env(
+    get_prompt_builder(MODEL_PATH), ENGINE_CONFIG.settings.max_model_len
+)
+app.state.tracer = tracing.Tracer.from_env()
+app.state.loop_lag = LoopLagMonitor.from_env()
+app.state.profiler = CPUProfiler.from_env()
+if app.state.tracer is not None:
+    app.add_middleware(tracing.TracingMiddleware, tracer=app.state.tracer)
 
 # Include versioned routers
 app.include_router(v1_routes.router, prefix="/api/v1")
+# OpenAI-compatible; clients use base_url=<host>/v1
+app.include_router(openai_routes.router, prefix="/v1")
+
+
+###############################################################################
+#                      Metrics exposed on /metrics
+###############################################################################
+metrics.REGISTRY.register(metrics.Gauge(
+    "engine_ready",
+    "1 once the engine is loaded and warmed up",
+    callback=lambda: float(engine_manager.ready)
+))
+metrics.REGISTRY.register(metrics.Gauge(
+    "engine_loads",
+    "Engine (re)initializations completed",
+    callback=lambda: engine_manager.loads
+))
+metrics.REGISTRY.register(metrics.Gauge(
+    "engine_boot_seconds",
+    "Duration of the last engine boot, from init to warmed up",
+    callback=lambda: startup_report.boot_seconds
+))
+metrics.REGISTRY.register(metrics.Gauge(
+    "requests_in_flight",
+    "Requests holding an admission ticket",
+    callback=lambda: app.state.admission.inflight
+))
+metrics.REGISTRY.register(metrics.Gauge(
+    "request_queue_depth",
+    "Requests waiting for admission",
+    callback=lambda: app.state.admission.queue_depth
+))
+metrics.REGISTRY.add_collector(
+    metrics.engine_collector(lambda: engine_manager.engine)
+)
+metrics.REGISTRY.add_collector(
+    metrics.stats_collector("aborts", abort_stats.snapshot)
+)
+metrics.REGISTRY.add_collector(
+    metrics.stats_collector("prefix_cache", prefix_cache_stats.snapshot)
+)
+metrics.REGISTRY.add_collector(
+    metrics.stats_collector("batch_jobs", app.state.batch.snapshot)
+)
+metrics.REGISTRY.add_collector(
+    metrics.stats_collector("sampling", sampling_factory.snapshot)
+)
+metrics.REGISTRY.add_collector(metrics.stats_collector(
+    "tokenizer", get_prompt_builder(MODEL_PATH).tokens.stats.snapshot
+))
+metrics.REGISTRY.add_collector(metrics.stats_collector(
+    "spec_decode",
+    lambda: spec_decode_snapshot(SPECULATIVE_CONFIG, engine_manager.engine)
+))
+metrics.REGISTRY.add_collector(metrics.labeled_collector(
+    "tenant", "tenant", app.state.admission.tenant_snapshots
+))
+metrics.REGISTRY.add_collector(metrics.labeled_collector(
+    "replica", "replica",
+    lambda: router.snapshot()["replicas"] if (router := get_router()) else {}
+))
+if app.state.response_cache is not None:
+    metrics.REGISTRY.add_collector(metrics.stats_collector(
+        "response_cache", app.state.response_cache.stats.snapshot
+    ))
+if app.state.semantic_cache is not None:
+    metrics.REGISTRY.add_collector(metrics.stats_collector(
+        "semantic_cache", app.state.semantic_cache.stats.snapshot
+    ))
+if app.state.retriever is not None:
+    metrics.REGISTRY.add_collector(metrics.stats_collector(
+        "rag_embed_cache", app.state.retriever.embedder.snapshot
+    ))
+if app.state.ingestion is not None:
+    metrics.REGISTRY.add_collector(metrics.stats_collector(
+        "ingest",
+        lambda: (last := app.state.ingestion.last) and last.snapshot() or {}
+    ))
+if app.state.sessions is not None:
+    metrics.REGISTRY.add_collector(metrics.stats_collector(
+        "sessions", app.state.sessions.stats.snapshot
+    ))
+if app.state.tracer is not None:
+    metrics.REGISTRY.add_collector(metrics.stats_collector(
+        "tracing", app.state.tracer.stats.snapshot
+    ))
+if app.state.loop_lag is not None:
+    metrics.REGISTRY.add_collector(metrics.stats_collector(
+        "event_loop_lag", app.state.loop_lag.snapshot
+    ))
+if os.getenv("METRICS_INCLUDE_VLLM", "1") == "1":
+    metrics.REGISTRY.add_collector(metrics.vllm_collector)
 
 
 ###############################################################################
 #                      Dynamic model loader (auto-reconnect)
 ###############################################################################
-async def get_engine(app: FastAPI) -> AsyncLLMEngine:
+async def get_engine(app: FastAPI) -> LLMEngine:
     """
-    Return active vLLM engine. Auto-init or reconnect if needed.
+    Return active vLLM engine, joining the one in-progress (re)load if any.
     """
-    global ready, engine
+    return await app.state.engine_manager.get()
 
-    if engine is None:
-        print("⚙️ (Re)initializing vLLM engine...")
-        try:
-            engine = await vLLMService.init_resource()
-            app.state.vllm_engine = engine
-            ready = True
-            print("✅ vLLM engine ready!")
-        except Exception as e:
-            print(f"❌ [Init Error] Failed to start vLLM engine: {e}")
-            ready = False
-            raise
 
-    return engine
+def get_router() -> EngineRouter | None:
+    engine = engine_manager.engine
+    return engine if isinstance(engine, EngineRouter) else None
+
+
+def load_snapshot() -> dict[str, float]:
+    """Load signals a router in front of this instance polls via /health"""
+    admission: AdmissionController = app.state.admission
+    return {
+        "inflight": admission.inflight,
+        "queue_depth": admission.queue_depth,
+        **metrics.read_engine_stats(engine_manager.engine),
+    }
 
 
 ###############################################################################
 #                           Health Check Endpoints
 ###############################################################################
+def loop_lag_snapshot() -> dict[str, float] | None:
+    monitor: LoopLagMonitor | None = app.state.loop_lag
+    return monitor.snapshot() if monitor is not None else None
+
+
 @app.get("/")
 async def root():
     return {
         "name": "AI Chatbot API",
         "version": "1.0.0",
-        "status": "running" if ready else "starting"
+        "status": "running" if engine_manager.ready else "starting",
+        "engine": engine_manager.state.value
     }
 
 
 @app.get("/health")
 async def health():
-    if not ready:
+    admission: AdmissionController = app.state.admission
+    if not engine_manager.ready:
         return JSONResponse(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             content={
                 "status": "unavailable",
                 "ready": False,
-                "message": "vLLM engine is still loading"
+                "message": f"vLLM engine is {engine_manager.state.value}",
+                "engine": engine_manager.snapshot(),
+                "admission": admission.snapshot(),
+                "aborts": abort_stats.snapshot(),
+                "prefix_cache": prefix_cache_stats.snapshot(),
+                "loop_lag": loop_lag_snapshot(),
+                "load": load_snapshot()
             }
         )
     return {
-        "status": "healthy",
+        "status": engine_manager.state.value,
         "ready": True,
         "service": "vllm",
-        "model": "GRPO-Vi-Qwen2-7B-RAG-W4A16"
+        "model": "GRPO-Vi-Qwen2-7B-RAG-W4A16",
+        "engine": engine_manager.snapshot(),
+        "admission": admission.snapshot(),
+        "aborts": abort_stats.snapshot(),
+        "prefix_cache": prefix_cache_stats.snapshot(),
+        "tokenizer": get_prompt_builder(MODEL_PATH).tokens.stats.snapshot(),
+        "speculative": spec_decode_snapshot(
+            SPECULATIVE_CONFIG, engine_manager.engine
+        ),
+        "loop_lag": loop_lag_snapshot(),
+        "load": load_snapshot()
     }
 
 
 @app.get("/ready")
 async def readiness():
-    if not ready:
+    if not engine_manager.ready:
         return JSONResponse(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            content={"ready": False}
+            content={"ready": False, "state": engine_manager.state.value}
+        )
+    return {"ready": True, "state": engine_manager.state.value}
+
+
+@app.get("/startup")
+async def startup():
+    return {
+        "engine": engine_manager.state.value,
+        **startup_report.snapshot()
+    }
+
+
+@app.get("/config")
+async def engine_config():
+    """Resolved engine settings, their sources and the AsyncEngineArgs"""
+    return {
+        "backend": get_engine_backend(),
+        **ENGINE_CONFIG.snapshot(),
+        "speculative": (
+            asdict(SPECULATIVE_CONFIG) if SPECULATIVE_CONFIG else None
+        ),
+        "engine_args": ENGINE_CONFIG.engine_args(
+            os.getenv("VLLM_TORCH_COMPILE_DIR"),
+            SPECULATIVE_CONFIG.engine_config() if SPECULATIVE_CONFIG else None
+        ),
+    }
+
+
+###############################################################################
+#                    Replica routing (ROUTER_REPLICAS)
+###############################################################################
+def _no_router() -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={"error": "Routing is not enabled (ROUTER_REPLICAS)"}
+    )
+
+
+@app.get("/replicas")
+async def replicas():
+    router = get_router()
+    if router is None:
+        return _no_router()
+    return router.snapshot()
+
+
+@app.post("/replicas/{name}/drain")
+async def drain_replica(name: str):
+    router = get_router()
+    if router is None:
+        return _no_router()
+    replica = router.drain(name)
+    if replica is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": f"Unknown replica: {name}"}
+        )
+    return replica.snapshot()
+
+
+@app.post("/replicas/{name}/resume")
+async def resume_replica(name: str):
+    router = get_router()
+    if router is None:
+        return _no_router()
+    replica = router.resume(name)
+    if replica is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": f"Unknown replica: {name}"}
+        )
+    return replica.snapshot()
+
+
+@app.post("/admin/profile")
+async def profile(
+    seconds: float = 5.0,
+    sort: str = "cumulative",
+    limit: int = 50,
+    format: str = "text"
+):
+    """
+    cProfile the event loop for `seconds`; `format=pstats` returns the raw
+    dump for snakeviz or `python -m pstats`
+    """
+    profiler: CPUProfiler | None = app.state.profiler
+    if profiler is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": "Profiling is not enabled (PROFILE_ENABLED)"}
+        )
+    if sort not in CPUProfiler.SORT_KEYS or format not in ("text", "pstats"):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={
+                "error": f"sort must be one of {CPUProfiler.SORT_KEYS}, "
+                         "format text or pstats"
+            }
+        )
+    try:
+        stats = await profiler.capture(seconds)
+    except ProfilerBusy as e:
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"error": str(e)}
         )
-    return {"ready": True}
+    if format == "pstats":
+        return Response(
+            CPUProfiler.dump(stats),
+            media_type="application/octet-stream",
+            headers={
+                "Content-Disposition": 'attachment; filename="api.prof"'
+            }
+        )
+    return PlainTextResponse(CPUProfiler.render(stats, sort, limit))
+
+
+@app.get("/admin/traces")
+async def recent_traces(limit: int = 20):
+    """The last finished traces, as one OTLP-JSON export request"""
+    tracer: tracing.Tracer | None = app.state.tracer
+    if tracer is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"error": "Tracing is not enabled (TRACING_ENABLED)"}
+        )
+    traces = list(tracer.recent)[-limit:] if limit > 0 else []
+    return {
+        "stats": tracer.stats.snapshot(),
+        **tracer.export_request(traces)
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(
+        metrics.render_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.get("/live")
@@ -176,10 +505,10 @@ async def liveness():
 
 @app.get("/ping")
 async def ping():
-    if not ready:
+    if not engine_manager.ready:
         return JSONResponse(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            content={"status": "starting"}
+            content={"status": engine_manager.state.value}
         )
     return {"status": "healthy"}
 
@@ -190,31 +519,96 @@ async def ping():
 @app.post("/api/v1/generate")
 async def generate(request: Request):
     """
-    Generate endpoint with auto-reconnect logic for vLLM engine.
-    """
-    global engine, ready
-    data = await request.json()
-    prompt = data.get("prompt", "")
+    Generate endpoint; engine failures trigger one shared re-init.
 
-    try:
-        llm_engine = await get_engine(app)
-        stream = vLLMService.generate_answer(llm_engine, prompt)
-        return StreamingResponse(stream, media_type="text/event-stream")
-
-    except Exception as e:
-        print(f"⚠️ [Engine error] {e} — retrying re-init ...")
-        # Reconnect logic nếu engine bị mất do scale-down
+    The prompt reaches the engine as sent, without the system prompt or
+    chat template /api/v1/ask adds (unless RAG puts documents around it).
+    """
+    with tracing.span("parse"):
+        data = await request.json()
+        prompt = data.get("prompt", "")
         try:
-            engine = await vLLMService.init_resource()
-            ready = True
-            print("🔁 vLLM engine restarted successfully!")
-            stream = vLLMService.generate_answer(engine, prompt)
-            return StreamingResponse(stream, media_type="text/event-stream")
-        except Exception as e2:
-            print(f"💥 [Critical] Could not recover engine: {e2}")
-            ready = False
+            stream_options = data.get("stream_options")
+            coalesce = (
+                StreamOptions.model_validate(stream_options).to_policy()
+                if stream_options else None
+            )
+            sampling_options = data.get("sampling")
+            sampling = (
+                SamplingOptions.model_validate(sampling_options).to_spec()
+                if sampling_options else DEFAULT_SAMPLING
+            )
+        except ValidationError as e:
             return JSONResponse(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                content={"error": "Model unavailable, please retry later."}
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                content={"error": e.errors(include_url=False)}
             )
+        except ValueError as e:
+            return v1_routes.sampling_error_response(e)
+
+    use_cache = bool(data.get("cache", True))
+    cache: ResponseCache | None = (
+        app.state.response_cache if use_cache else None
+    )
+    semantic_cache: SemanticCache | None = (
+        app.state.semantic_cache if use_cache else None
+    )
+    retriever: Retriever | None = app.state.retriever
+    prepared: PreparedPrompt | None = None
+    try:
+        if retriever is not None:
+            # The retrieved documents are part of the cache key
+            prepared = await vLLMService.prepare_prompt(
+                prompt, sampling, retriever, raw=True
+            )
+        cached = cache.take(
+            prepared.key if prepared
+            else vLLMService.cache_key(prompt, sampling, raw=True)
+        ) if cache is not None else None
+        if cached is not None:
+            # Cached answers never reach the engine, so skip admission
+            stream = vLLMService.generate_answer(
+                None, prompt, coalesce,
+                sampling=sampling,
+                prepared=prepared,
+                cached=cached
+            )
+            return DisconnectAwareStreamingResponse(
+                stream, media_type="text/event-stream"
+            )
+        if prepared is None:
+            prepared = await vLLMService.prepare_prompt(
+                prompt, sampling, raw=True
+            )
+    except PromptTooLong as e:
+        return v1_routes.prompt_too_long_response(e)
 
+    admission: AdmissionController = app.state.admission
+    try:
+        ticket = await admission.acquire(
+            admission.estimate_tokens(
+                prepared.built.text,
+                prepared.sampling.max_tokens,
+                prepared.built.num_tokens
+            ),
+            tenant=app.state.tenants.resolve(request.headers)
+        )
+    except AdmissionRejected as e:
+        return v1_routes.admission_error_response(e)
+
+    try:
+        llm_engine = await get_engine(app)
+    except EngineUnavailable as e:
+        print(f"⚠️ [Engine {e.state.value}] rejecting request")
+        ticket.refund()
+        return v1_routes.engine_error_response(e)
+    stream = vLLMService.generate_answer(
+        llm_engine, prompt, coalesce, cache, semantic_cache,
+        priority=ticket.priority,
+        prepared=prepared
+    )
+    return DisconnectAwareStreamingResponse(
+        admitted_stream(ticket, engine_manager.track(stream)),
+        media_type="text/event-stream",
+        background=BackgroundTask(ticket.release)
+    )
@@ -0,0 +1,467 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterator
+
+from services import metrics, tracing
+
+if TYPE_CHECKING:
+    from services.tenants import Tenant
+
+
+###############################################################################
+#
+#                 Admission control in front of the engine
+#
+###############################################################################
+# Lower values are admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+DEFAULT_TENANT = "default"
+
+
+def api_workers() -> int:
+    """API worker processes sharing one engine process (API_WORKERS)"""
+    return max(1, int(os.getenv("API_WORKERS", "1")))
+
+
+def worker_share(total: float) -> float:
+    """
+    This worker's part of a limit configured for the whole server: each
+    worker admits on its own, and the load balancer spreads requests
+    about evenly.
+    """
+    return total / api_workers()
+
+
+class AdmissionRejected(Exception):
+    """Request was not admitted; `retry_after` is None if retrying is futile"""
+
+    def __init__(self, reason: str, retry_after: int | None) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class AdmissionConfig:
+    max_inflight: int = 64
+    max_queue: int = 256
+    queue_timeout_s: float = 30.0
+    # Upper bound on estimated prompt + output tokens in flight (0 = off)
+    token_budget: int = 0
+    chars_per_token: float = 3.0
+    # In-flight slots batch work may hold, so interactive traffic always
+    # finds room (0 = max_inflight // 2)
+    batch_max_inflight: int = 0
+    # Per-tenant state kept for fairness and metrics; idle tenants past
+    # this are forgotten first
+    max_tenants: int = 1024
+
+    @classmethod
+    def from_env(cls) -> "AdmissionConfig":
+        """Server-wide limits, split across API_WORKERS"""
+        def share(value: int) -> int:
+            return math.ceil(worker_share(value))
+
+        return cls(
+            max_inflight=share(int(
+                os.getenv("ADMISSION_MAX_INFLIGHT", cls.max_inflight)
+            )),
+            max_queue=share(
+                int(os.getenv("ADMISSION_MAX_QUEUE", cls.max_queue))
+            ),
+            queue_timeout_s=float(
+                os.getenv("ADMISSION_QUEUE_TIMEOUT_S", cls.queue_timeout_s)
+            ),
+            token_budget=share(int(
+                os.getenv("ADMISSION_TOKEN_BUDGET", cls.token_budget)
+            )),
+            chars_per_token=float(
+                os.getenv("ADMISSION_CHARS_PER_TOKEN", cls.chars_per_token)
+            ),
+            batch_max_inflight=share(int(
+                os.getenv(
+                    "ADMISSION_BATCH_MAX_INFLIGHT", cls.batch_max_inflight
+                )
+            )),
+            max_tenants=int(
+                os.getenv("ADMISSION_MAX_TENANTS", cls.max_tenants)
+            ),
+        )
+
+
+@dataclass
+class AdmissionTicket:
+    controller: "AdmissionController"
+    cost: int
+    priority: int = PRIORITY_INTERACTIVE
+    tenant: str = DEFAULT_TENANT
+    admitted_at: float = field(default_factory=time.monotonic)
+    released: bool = False
+    # Tokens taken from the tenant's bucket for this request
+    charged: int = 0
+
+    def release(self) -> None:
+        """Idempotent; safe to call from both the stream and a callback"""
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def refund(self) -> None:
+        """Release a ticket whose request never ran, returning its tokens"""
+        if not self.released:
+            self.controller._refund(self)
+            self.release()
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    # Virtual start time: start-time fair queuing across tenants
+    start: float
+    seq: int
+    cost: int = field(compare=False)
+    tenant: str = field(compare=False)
+    future: asyncio.Future[AdmissionTicket] = field(compare=False)
+
+
+def _p95(samples: deque[float]) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+@dataclass
+class _TenantState:
+    # Finish tag of the tenant's latest request (start-time fair queuing)
+    last_finish: float = 0.0
+    tokens: float = 0.0
+    refilled_at: float = 0.0
+    inflight: int = 0
+    queued: int = 0
+    admitted: int = 0
+    rejected: int = 0
+    rate_limited: int = 0
+    tokens_admitted: int = 0
+    # Recent queue waits and admission-to-release times
+    queue_s: deque[float] = field(default_factory=lambda: deque(maxlen=512))
+    hold_s: deque[float] = field(default_factory=lambda: deque(maxlen=512))
+
+    def snapshot(self) -> dict[str, int | float]:
+        return {
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+            "tokens_admitted": self.tokens_admitted,
+            "queue_wait_p95_s": round(_p95(self.queue_s), 4),
+            "latency_p95_s": round(_p95(self.hold_s), 4),
+        }
+
+
+class AdmissionController:
+    """
+    Bounded in-flight count and token budget with a priority wait queue.
+
+    Requests over capacity wait up to `queue_timeout_s`; within a
+    priority, tenants share the queue in proportion to their weight
+    (start-time fair queuing on estimated tokens), FIFO for any one
+    tenant. Once the queue is full, or a tenant's token bucket is empty,
+    requests are rejected immediately so callers can return 429. Batch
+    work is capped at `batch_max_inflight` slots and only counts against
+    its own queue.
+    """
+
+    def __init__(self, config: AdmissionConfig | None = None) -> None:
+        self.config = config or AdmissionConfig()
+        self.inflight = 0
+        self.inflight_tokens = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.batch_inflight = 0
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+        # Virtual time per priority: start tag of the latest admission
+        self._vtime: dict[int, float] = {}
+        self._tenants: OrderedDict[str, _TenantState] = OrderedDict()
+        # EWMA of how long a ticket is held, used for Retry-After
+        self._hold_s = 1.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def estimate_tokens(
+        self,
+        prompt: str,
+        max_tokens: int,
+        prompt_tokens: int | None = None
+    ) -> int:
+        """Cost of a request: the exact prompt length when it is known"""
+        if prompt_tokens is None:
+            prompt_tokens = math.ceil(
+                len(prompt) / self.config.chars_per_token
+            )
+        return prompt_tokens + max_tokens
+
+    @property
+    def batch_max_inflight(self) -> int:
+        return self.config.batch_max_inflight \
+            or max(self.config.max_inflight // 2, 1)
+
+    def _fits(self, cost: int, priority: int) -> bool:
+        cfg = self.config
+        if self.inflight >= cfg.max_inflight:
+            return False
+        if priority > PRIORITY_INTERACTIVE and \
+                self.batch_inflight >= self.batch_max_inflight:
+            return False
+        if cfg.token_budget and self.inflight and \
+                self.inflight_tokens + cost > cfg.token_budget:
+            return False
+        return True
+
+    def _grant(
+        self,
+        cost: int,
+        priority: int,
+        tenant: str,
+        start: float
+    ) -> AdmissionTicket:
+        self.inflight += 1
+        self.inflight_tokens += cost
+        if priority > PRIORITY_INTERACTIVE:
+            self.batch_inflight += 1
+        self._vtime[priority] = max(self._vtime.get(priority, 0.0), start)
+        state = self._tenant(tenant)
+        state.inflight += 1
+        state.admitted += 1
+        state.tokens_admitted += cost
+        return AdmissionTicket(
+            controller=self, cost=cost, priority=priority, tenant=tenant
+        )
+
+    def _tenant(self, name: str) -> _TenantState:
+        state = self._tenants.get(name)
+        if state is not None:
+            self._tenants.move_to_end(name)
+            return state
+        state = self._tenants[name] = _TenantState()
+        if len(self._tenants) > self.config.max_tenants:
+            for old, candidate in list(self._tenants.items()):
+                if not candidate.inflight and not candidate.queued:
+                    del self._tenants[old]
+                    break
+        return state
+
+    def _take_tokens(
+        self,
+        state: _TenantState,
+        tenant: "Tenant | None",
+        cost: int
+    ) -> None:
+        """Charge `cost` to the tenant's token bucket or raise"""
+        if tenant is None or tenant.token_rate <= 0:
+            return
+        burst = tenant.token_burst or tenant.token_rate * 10
+        now = time.monotonic()
+        state.tokens = min(
+            burst,
+            state.tokens + (now - state.refilled_at) * tenant.token_rate
+        )
+        state.refilled_at = now
+        if cost > burst:
+            state.rejected += 1
+            metrics.ADMISSION_REJECTED.labels("rate_limited").inc()
+            raise AdmissionRejected(
+                f"request exceeds tenant burst of {int(burst)} tokens", None
+            )
+        if state.tokens < cost:
+            state.rate_limited += 1
+            metrics.ADMISSION_REJECTED.labels("rate_limited").inc()
+            raise AdmissionRejected(
+                "tenant token rate exceeded",
+                math.ceil((cost - state.tokens) / tenant.token_rate)
+            )
+        state.tokens -= cost
+
+    def retry_after(self) -> int:
+        waves = (self.queue_depth + 1) / max(self.config.max_inflight, 1)
+        return max(1, math.ceil(waves * self._hold_s))
+
+    async def acquire(
+        self,
+        cost: int,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: float | None = -1.0,
+        tenant: "Tenant | None" = None
+    ) -> AdmissionTicket:
+        """
+        Wait for capacity or raise AdmissionRejected.
+
+        `timeout` defaults to `queue_timeout_s`; None waits indefinitely.
+        With `tenant`, its priority class is the best `priority` can be,
+        and `cost` is charged to its token bucket.
+        """
+        with tracing.span(
+            "admission",
+            cost=cost,
+            tenant=tenant.name if tenant is not None else DEFAULT_TENANT
+        ) as span:
+            ticket = await self._acquire(cost, priority, timeout, tenant)
+            span.set(priority=ticket.priority)
+            return ticket
+
+    async def _acquire(
+        self,
+        cost: int,
+        priority: int,
+        timeout: float | None,
+        tenant: "Tenant | None"
+    ) -> AdmissionTicket:
+        name = DEFAULT_TENANT
+        weight = 1.0
+        if tenant is not None:
+            name = tenant.name
+            weight = max(tenant.weight, 1e-3)
+            priority = max(priority, tenant.priority)
+        state = self._tenant(name)
+        self._take_tokens(state, tenant, cost)
+        charged = cost if tenant is not None and tenant.token_rate > 0 else 0
+        start = max(self._vtime.get(priority, 0.0), state.last_finish)
+        ahead = [w for w in self._waiters if w.priority <= priority]
+        if not ahead and self._fits(cost, priority):
+            state.last_finish = start + cost / weight
+            metrics.REQUEST_QUEUE_SECONDS.observe(0.0)
+            state.queue_s.append(0.0)
+            ticket = self._grant(cost, priority, name, start)
+            ticket.charged = charged
+            return ticket
+        queued = sum(1 for w in self._waiters if w.priority == priority)
+        if queued >= self.config.max_queue:
+            self.rejected += 1
+            state.rejected += 1
+            state.tokens += charged
+            metrics.ADMISSION_REJECTED.labels("queue_full").inc()
+            raise AdmissionRejected("queue full", self.retry_after())
+
+        state.last_finish = start + cost / weight
+        waiter = _Waiter(
+            priority=priority,
+            start=start,
+            seq=next(self._seq),
+            cost=cost,
+            tenant=name,
+            future=asyncio.get_running_loop().create_future()
+        )
+        heapq.heappush(self._waiters, waiter)
+        state.queued += 1
+        enqueued = time.monotonic()
+        if timeout is not None and timeout < 0:
+            timeout = self.config.queue_timeout_s
+        try:
+            ticket = await asyncio.wait_for(
+                asyncio.shield(waiter.future), timeout
+            )
+            waited = time.monotonic() - enqueued
+            metrics.REQUEST_QUEUE_SECONDS.observe(waited)
+            state.queue_s.append(waited)
+            ticket.charged = charged
+            return ticket
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted in the same tick we timed out or were cancelled
+                waiter.future.result().release()
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            # Nothing was generated; give the tokens back
+            state.tokens += charged
+            if isinstance(e, asyncio.TimeoutError):
+                state.rejected += 1
+                self.timed_out += 1
+                metrics.ADMISSION_REJECTED.labels("queue_timeout").inc()
+                raise AdmissionRejected(
+                    "queue timeout", self.retry_after()
+                ) from None
+            raise
+
+    def _remove(self, waiter: _Waiter) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        self._tenant(waiter.tenant).queued -= 1
+        heapq.heapify(self._waiters)
+        # The removed waiter may have been blocking smaller ones behind it
+        self._wake()
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        self.inflight -= 1
+        self.inflight_tokens -= ticket.cost
+        if ticket.priority > PRIORITY_INTERACTIVE:
+            self.batch_inflight -= 1
+        held = time.monotonic() - ticket.admitted_at
+        self._hold_s += 0.1 * (held - self._hold_s)
+        state = self._tenants.get(ticket.tenant)
+        if state is not None:
+            state.inflight -= 1
+            state.hold_s.append(held)
+        self._wake()
+
+    def _refund(self, ticket: AdmissionTicket) -> None:
+        state = self._tenants.get(ticket.tenant)
+        if state is not None:
+            state.tokens += ticket.charged
+
+    def _wake(self) -> None:
+        while self._waiters:
+            waiter = self._waiters[0]
+            if not self._fits(waiter.cost, waiter.priority):
+                break
+            heapq.heappop(self._waiters)
+            self._tenant(waiter.tenant).queued -= 1
+            if not waiter.future.done():
+                waiter.future.set_result(self._grant(
+                    waiter.cost, waiter.priority, waiter.tenant, waiter.start
+                ))
+
+    def snapshot(self) -> dict[str, int | float]:
+        return {
+            "inflight": self.inflight,
+            "inflight_tokens": self.inflight_tokens,
+            "batch_inflight": self.batch_inflight,
+            "queue_depth": self.queue_depth,
+            "max_inflight": self.config.max_inflight,
+            "max_queue": self.config.max_queue,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "tenants": len(self._tenants),
+        }
+
+    def tenant_snapshots(self) -> dict[str, dict[str, int | float]]:
+        return {
+            name: state.snapshot() for name, state in self._tenants.items()
+        }
+
+
+async def admitted_stream(
+    ticket: AdmissionTicket,
+    stream: AsyncGenerator[bytes, None]
+) -> AsyncIterator[bytes]:
+    """Hold `ticket` for the lifetime of the streamed response"""
+    try:
+        async with aclosing(stream):
+            async for chunk in stream:
+                yield chunk
+    finally:
+        ticket.release()
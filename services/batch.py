@@ -0,0 +1,666 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any, BinaryIO, TextIO
+from uuid import uuid4
+
+from services.admission import (
+    DEFAULT_TENANT,
+    PRIORITY_BATCH,
+    AdmissionController,
+    AdmissionRejected,
+    api_workers,
+)
+from services.engine_manager import EngineManager, EngineUnavailable
+from services.prompting import PromptBuilder
+from services.sampling import SamplingSpec, sampling_factory
+from services.tenants import Tenant, TenantRegistry
+from services.vllm_service import Completion, vLLMService
+
+
+###############################################################################
+#
+#                 Offline batch generation with resumable jobs
+#
+# A job is a directory under BATCH_DIR: job.json (status and counters),
+# the input JSONL and output.jsonl. Results are appended one line per
+# prompt as they finish (completion order, each carrying its input
+# `index`), so the output is usable while the job runs. After a crash or
+# restart the output file is the source of truth: prompts already in it
+# are skipped and the rest are resubmitted. Batch prompts go through
+# admission at PRIORITY_BATCH, so interactive requests are admitted first
+# and batch work never holds more than its share of in-flight slots.
+#
+# With several API workers (API_WORKERS) the one holding BATCH_DIR's
+# leader lock runs every job. The others write new jobs (and cancel
+# markers) into the job directory for the leader to pick up, and answer
+# reads from job.json, which lags the leader by at most a few seconds.
+#
+###############################################################################
+JOB_FILE = "job.json"
+INPUT_FILE = "input.jsonl"
+OUTPUT_FILE = "output.jsonl"
+CANCEL_FILE = "cancel"
+LEADER_FILE = ".leader"
+_WATCH_INTERVAL_S = 1.0
+_READ_HINT = 1 << 20
+_SAVE_INTERVAL_S = 2.0
+
+
+class BatchStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class BatchError(ValueError):
+    """Invalid batch submission (bad path, oversized upload, ...)"""
+
+
+@dataclass
+class BatchConfig:
+    root: str = "/tmp/batch_jobs"
+    # Server-side inputs must live under here ("" = <root>/inputs)
+    input_dir: str = ""
+    concurrency: int = 8
+    max_concurrency: int = 64
+    # Jobs generating at the same time; the rest wait as `queued`
+    max_running_jobs: int = 1
+    max_upload_bytes: int = 256 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "BatchConfig":
+        return cls(
+            root=os.getenv("BATCH_DIR", cls.root),
+            input_dir=os.getenv("BATCH_INPUT_DIR", cls.input_dir),
+            concurrency=int(os.getenv("BATCH_CONCURRENCY", cls.concurrency)),
+            max_concurrency=int(
+                os.getenv("BATCH_MAX_CONCURRENCY", cls.max_concurrency)
+            ),
+            max_running_jobs=int(
+                os.getenv("BATCH_MAX_RUNNING_JOBS", cls.max_running_jobs)
+            ),
+            max_upload_bytes=int(
+                os.getenv("BATCH_MAX_UPLOAD_BYTES", cls.max_upload_bytes)
+            ),
+        )
+
+
+@dataclass
+class BatchJob:
+    id: str
+    input_path: str
+    concurrency: int
+    # Sampling overrides (services.sampling), resolved when the job runs
+    sampling: dict[str, Any] | None = None
+    # Submitting tenant: its weight and token rate apply to the job
+    tenant: str = DEFAULT_TENANT
+    status: BatchStatus = BatchStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    total: int | None = None
+    completed: int = 0
+    failed: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    # Time spent running, summed over resumes
+    run_seconds: float = 0.0
+    resumes: int = 0
+    error: str | None = None
+    _running_since: float | None = field(default=None, repr=False)
+
+    @property
+    def done(self) -> int:
+        return self.completed + self.failed
+
+    @property
+    def elapsed_s(self) -> float:
+        if self._running_since is None:
+            return self.run_seconds
+        return self.run_seconds + time.monotonic() - self._running_since
+
+    def snapshot(self) -> dict[str, Any]:
+        elapsed = self.elapsed_s
+        data = {
+            k: v for k, v in asdict(self).items() if not k.startswith("_")
+        }
+        data["status"] = self.status.value
+        data["run_seconds"] = round(elapsed, 3)
+        data["progress"] = (
+            self.done / self.total if self.total else None
+        )
+        data["requests_per_s"] = self.done / elapsed if elapsed else 0.0
+        data["output_tokens_per_s"] = (
+            self.output_tokens / elapsed if elapsed else 0.0
+        )
+        remaining = (self.total or 0) - self.done
+        data["eta_s"] = (
+            remaining / data["requests_per_s"]
+            if self.status is BatchStatus.RUNNING and data["requests_per_s"]
+            else None
+        )
+        return data
+
+    @classmethod
+    def load(cls, path: Path) -> "BatchJob":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        for key in ("progress", "requests_per_s", "output_tokens_per_s",
+                    "eta_s"):
+            data.pop(key, None)
+        data["status"] = BatchStatus(data["status"])
+        return cls(**data)
+
+
+def parse_line(line: str) -> tuple[str | None, str]:
+    """(id, prompt) from a JSONL line: an object or a bare JSON string"""
+    record = json.loads(line)
+    if isinstance(record, str):
+        return None, record
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object or string")
+    prompt = record.get("prompt", record.get("question"))
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("missing 'prompt'")
+    item_id = record.get("id")
+    return (None if item_id is None else str(item_id)), prompt.strip()
+
+
+def _count_lines(path: Path) -> int:
+    with path.open("r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def _recover_output(path: Path) -> tuple[set[int], dict[str, int]]:
+    """
+    Indices already answered in `path`, plus counters rebuilt from it.
+
+    A torn last line (crash mid-write) is cut off so appends stay valid.
+    """
+    done: set[int] = set()
+    counts = {"completed": 0, "failed": 0, "prompt_tokens": 0,
+              "output_tokens": 0}
+    if not path.exists():
+        return done, counts
+    with path.open("r+b") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        done.add(record["index"])
+        if "error" in record:
+            counts["failed"] += 1
+        else:
+            counts["completed"] += 1
+            counts["prompt_tokens"] += record.get("prompt_tokens", 0)
+            counts["output_tokens"] += record.get("output_tokens", 0)
+    return done, counts
+
+
+class BatchManager:
+    """
+    Accepts, runs, persists and resumes batch jobs.
+
+    Each job keeps at most `concurrency` prompts in flight; up to
+    `max_running_jobs` jobs run at once.
+    """
+
+    def __init__(
+        self,
+        engine_manager: EngineManager,
+        admission: AdmissionController,
+        builder: PromptBuilder,
+        config: BatchConfig | None = None,
+        tenants: TenantRegistry | None = None
+    ) -> None:
+        self.engine_manager = engine_manager
+        self.admission = admission
+        self.builder = builder
+        self.config = config or BatchConfig()
+        self.tenants = tenants or TenantRegistry()
+        self.root = Path(self.config.root)
+        self.input_dir = Path(
+            self.config.input_dir or self.root / "inputs"
+        ).resolve()
+        self.jobs: dict[str, BatchJob] = {}
+        self._tasks: dict[str, asyncio.Task[None]] = {}
+        self._slots = asyncio.Semaphore(self.config.max_running_jobs)
+        self._saved_at: dict[str, float] = {}
+        # Runs jobs; False in API workers that hand them to the leader
+        self.leader = True
+        self._leader_lock: TextIO | None = None
+        self._watch_task: asyncio.Task[None] | None = None
+
+    @classmethod
+    def from_env(
+        cls,
+        engine_manager: EngineManager,
+        admission: AdmissionController,
+        builder: PromptBuilder,
+        tenants: TenantRegistry | None = None
+    ) -> "BatchManager":
+        return cls(
+            engine_manager, admission, builder, BatchConfig.from_env(),
+            tenants
+        )
+
+    def _dir(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def _save(self, job: BatchJob) -> None:
+        """Atomic write of job.json"""
+        path = self._dir(job.id) / JOB_FILE
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps(job.snapshot(), ensure_ascii=False),
+            encoding="utf-8"
+        )
+        os.replace(tmp, path)
+        self._saved_at[job.id] = time.monotonic()
+
+    def _concurrency(self, requested: int | None) -> int:
+        value = requested or self.config.concurrency
+        return max(1, min(value, self.config.max_concurrency))
+
+    def output_path(self, job_id: str) -> Path:
+        return self._dir(job_id) / OUTPUT_FILE
+
+    ###########################################################################
+    #                             Lifecycle
+    ###########################################################################
+    def start(self) -> None:
+        """Load every job on disk; the leader resumes the unfinished ones"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.leader = self._lead()
+        for path in sorted(self.root.glob(f"*/{JOB_FILE}")):
+            job = self._read(path)
+            if job is None:
+                continue
+            self.jobs[job.id] = job
+            if not self.leader:
+                continue
+            if job.status in (BatchStatus.QUEUED, BatchStatus.RUNNING):
+                if job.status is BatchStatus.RUNNING:
+                    job.resumes += 1
+                job.status = BatchStatus.QUEUED
+                print(f"🔁 [Batch] resuming job {job.id}")
+                self._launch(job)
+        if self.leader and api_workers() > 1:
+            self._watch_task = asyncio.get_running_loop().create_task(
+                self._watch()
+            )
+
+    def _lead(self) -> bool:
+        """Take the leader lock; it is released when this process exits"""
+        if api_workers() == 1:
+            return True
+        lock = (self.root / LEADER_FILE).open("w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self._leader_lock = lock
+        print(f"👑 [Batch] worker {os.getpid()} runs batch jobs")
+        return True
+
+    @staticmethod
+    def _read(path: Path) -> BatchJob | None:
+        try:
+            return BatchJob.load(path)
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"⚠️ [Batch] skipping unreadable {path}: {e}")
+            return None
+
+    async def _watch(self) -> None:
+        """Leader: run jobs other workers queued, honour their cancels"""
+        while True:
+            await asyncio.sleep(_WATCH_INTERVAL_S)
+            for path in self.root.glob(f"*/{JOB_FILE}"):
+                if path.parent.name in self.jobs:
+                    continue
+                job = self._read(path)
+                if job is not None and job.status is BatchStatus.QUEUED:
+                    self.jobs[job.id] = job
+                    self._launch(job)
+            for marker in self.root.glob(f"*/{CANCEL_FILE}"):
+                marker.unlink(missing_ok=True)
+                await self.cancel(marker.parent.name)
+
+    def get(self, job_id: str) -> BatchJob | None:
+        """The job, re-read from disk in workers that do not run it"""
+        if not self.leader and job_id.isalnum():
+            path = self._dir(job_id) / JOB_FILE
+            job = self._read(path) if path.is_file() else None
+            if job is not None:
+                self.jobs[job_id] = job
+            return job
+        return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list[BatchJob]:
+        if not self.leader:
+            self.jobs = {
+                job.id: job
+                for path in sorted(self.root.glob(f"*/{JOB_FILE}"))
+                if (job := self._read(path)) is not None
+            }
+        return list(self.jobs.values())
+
+    async def shutdown(self) -> None:
+        """
+        Stop running jobs without marking them finished, so the next start
+        resumes them exactly like after a crash.
+        """
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _launch(self, job: BatchJob) -> None:
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+
+    ###########################################################################
+    #                             Submission
+    ###########################################################################
+    def resolve_input(self, path: str) -> Path:
+        """A server-side input file; must be inside `input_dir`"""
+        resolved = Path(path)
+        if not resolved.is_absolute():
+            resolved = self.input_dir / resolved
+        resolved = resolved.resolve()
+        if not resolved.is_relative_to(self.input_dir):
+            raise BatchError(f"input must be under {self.input_dir}")
+        if not resolved.is_file():
+            raise BatchError(f"input not found: {path}")
+        return resolved
+
+    def _new_job(
+        self,
+        job_id: str,
+        input_path: Path,
+        concurrency: int | None,
+        sampling: dict[str, Any] | None,
+        tenant: str
+    ) -> BatchJob:
+        if sampling:
+            # Fail the submission, not the job, on bad overrides
+            sampling_factory.resolve(**sampling)
+        return BatchJob(
+            id=job_id,
+            input_path=str(input_path),
+            concurrency=self._concurrency(concurrency),
+            sampling=sampling or None,
+            tenant=tenant
+        )
+
+    async def submit_path(
+        self,
+        path: str,
+        concurrency: int | None = None,
+        sampling: dict[str, Any] | None = None,
+        tenant: str = DEFAULT_TENANT
+    ) -> BatchJob:
+        job = self._new_job(
+            uuid4().hex, self.resolve_input(path), concurrency, sampling,
+            tenant
+        )
+        self._dir(job.id).mkdir(parents=True)
+        return self._enqueue(job)
+
+    async def submit_upload(
+        self,
+        upload: BinaryIO,
+        concurrency: int | None = None,
+        sampling: dict[str, Any] | None = None,
+        tenant: str = DEFAULT_TENANT
+    ) -> BatchJob:
+        """Copy an uploaded JSONL into the job directory, then enqueue"""
+        job_id = uuid4().hex
+        if sampling:
+            sampling_factory.resolve(**sampling)
+        job_dir = self._dir(job_id)
+        job_dir.mkdir(parents=True)
+        input_path = job_dir / INPUT_FILE
+        limit = self.config.max_upload_bytes
+
+        def copy() -> None:
+            written = 0
+            with input_path.open("wb") as out:
+                while chunk := upload.read(_READ_HINT):
+                    written += len(chunk)
+                    if written > limit:
+                        raise BatchError(f"upload exceeds {limit} bytes")
+                    out.write(chunk)
+
+        try:
+            await asyncio.to_thread(copy)
+        except BatchError:
+            input_path.unlink(missing_ok=True)
+            job_dir.rmdir()
+            raise
+        return self._enqueue(
+            self._new_job(job_id, input_path, concurrency, sampling, tenant)
+        )
+
+    def _enqueue(self, job: BatchJob) -> BatchJob:
+        self.jobs[job.id] = job
+        self._save(job)
+        if self.leader:
+            self._launch(job)
+        print(f"📦 [Batch] job {job.id} queued ({job.input_path})")
+        return job
+
+    async def cancel(self, job_id: str) -> BatchJob | None:
+        if not self.leader:
+            job = self.get(job_id)
+            if job is not None and \
+                    job.status in (BatchStatus.QUEUED, BatchStatus.RUNNING):
+                # The leader cancels it within _WATCH_INTERVAL_S
+                (self._dir(job_id) / CANCEL_FILE).touch()
+            return job
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if job.status in (BatchStatus.QUEUED, BatchStatus.RUNNING):
+            self._finish(job, BatchStatus.CANCELLED)
+        return job
+
+    def snapshot(self) -> dict[str, int]:
+        counts = {s.value: 0 for s in BatchStatus}
+        for job in self.jobs.values():
+            counts[job.status.value] += 1
+        return counts
+
+    ###########################################################################
+    #                              Execution
+    ###########################################################################
+    def _finish(self, job: BatchJob, status: BatchStatus) -> None:
+        if job._running_since is not None:
+            job.run_seconds = job.elapsed_s
+            job._running_since = None
+        job.status = status
+        job.finished_at = time.time()
+        self._save(job)
+
+    async def _run(self, job: BatchJob) -> None:
+        try:
+            async with self._slots:
+                await self._execute(job)
+        except asyncio.CancelledError:
+            # Shutdown or cancel(): leave RUNNING on disk so it resumes
+            if job._running_since is not None:
+                job.run_seconds = job.elapsed_s
+                job._running_since = None
+            self._save(job)
+            raise
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            print(f"❌ [Batch] job {job.id} failed: {job.error}")
+            self._finish(job, BatchStatus.FAILED)
+
+    async def _execute(self, job: BatchJob) -> None:
+        input_path = Path(job.input_path)
+        output_path = self.output_path(job.id)
+        sampling = sampling_factory.resolve(**(job.sampling or {}))
+        done, counts = await asyncio.to_thread(_recover_output, output_path)
+        for key, value in counts.items():
+            setattr(job, key, value)
+        if job.total is None:
+            job.total = await asyncio.to_thread(_count_lines, input_path)
+        job.status = BatchStatus.RUNNING
+        job.started_at = job.started_at or time.time()
+        job._running_since = time.monotonic()
+        self._save(job)
+
+        window = asyncio.Semaphore(job.concurrency)
+        inflight: set[asyncio.Task[None]] = set()
+        index = 0
+        try:
+            with input_path.open("r", encoding="utf-8") as src, \
+                    output_path.open("a", encoding="utf-8") as out:
+                while lines := await asyncio.to_thread(
+                    src.readlines, _READ_HINT
+                ):
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        index += 1
+                        if index - 1 in done:
+                            continue
+                        await window.acquire()
+                        task = asyncio.create_task(
+                            self._run_item(
+                                job, index - 1, line, sampling, out, window
+                            )
+                        )
+                        inflight.add(task)
+                        task.add_done_callback(inflight.discard)
+                await asyncio.gather(*inflight)
+        except BaseException:
+            for task in inflight:
+                task.cancel()
+            await asyncio.gather(*inflight, return_exceptions=True)
+            raise
+        self._finish(job, BatchStatus.COMPLETED)
+        print(f"✅ [Batch] job {job.id} completed: {job.completed} ok, "
+              f"{job.failed} failed in {job.run_seconds:.1f}s")
+
+    async def _run_item(
+        self,
+        job: BatchJob,
+        index: int,
+        line: str,
+        sampling: SamplingSpec,
+        out: TextIO,
+        window: asyncio.Semaphore
+    ) -> None:
+        try:
+            record: dict[str, Any] = {"index": index}
+            started = time.perf_counter()
+            try:
+                record["id"], prompt = parse_line(line)
+                completion = await self._generate(
+                    prompt, sampling, self.tenants.get(job.tenant)
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                job.failed += 1
+            else:
+                record.update(
+                    output=completion.text,
+                    prompt_tokens=completion.prompt_tokens,
+                    output_tokens=completion.output_tokens,
+                    finish_reason=completion.finish_reason
+                )
+                job.completed += 1
+                job.prompt_tokens += completion.prompt_tokens
+                job.output_tokens += completion.output_tokens
+            record["latency_s"] = round(time.perf_counter() - started, 4)
+            # One write() per line, flushed, so readers never see half of one
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if time.monotonic() - self._saved_at.get(job.id, 0.0) \
+                    > _SAVE_INTERVAL_S:
+                self._save(job)
+        finally:
+            window.release()
+
+    async def _generate(
+        self,
+        prompt: str,
+        sampling: SamplingSpec,
+        tenant: Tenant
+    ) -> Completion:
+        """
+        One prompt at batch priority, waiting out engine reloads and the
+        tenant's rate limit. A prompt too long for the model fails its
+        line (PromptTooLong) without waiting for admission.
+
+        The engine is fetched only once admitted: the wait for a slot can
+        outlast a restart, and a handle taken before it would be shut down.
+        """
+        built, sampling = vLLMService.fit_prompt(
+            await self.builder.render_async(prompt), sampling
+        )
+        while True:
+            try:
+                ticket = await self.admission.acquire(
+                    self.admission.estimate_tokens(
+                        prompt, sampling.max_tokens, built.num_tokens
+                    ),
+                    priority=PRIORITY_BATCH,
+                    timeout=None,
+                    tenant=tenant
+                )
+            except AdmissionRejected as e:
+                if e.retry_after is None:
+                    raise
+                await asyncio.sleep(e.retry_after)
+                continue
+            try:
+                engine = await self.engine_manager.get()
+                break
+            except EngineUnavailable as e:
+                # Give the slot and the tokens back while the engine loads
+                ticket.refund()
+                await asyncio.sleep(e.retry_after)
+            except BaseException:
+                ticket.refund()
+                raise
+        try:
+            completion = await vLLMService.complete(
+                engine, built.engine_prompt,
+                sampling=sampling,
+                priority=ticket.priority
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.engine_manager.report_error(e)
+            raise
+        finally:
+            ticket.release()
+        self.engine_manager.report_success()
+        return completion
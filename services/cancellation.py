@@ -0,0 +1,26 @@
+from dataclasses import asdict, dataclass
+
+
+###############################################################################
+#
+#             Counters for requests aborted before they finished
+#
+###############################################################################
+@dataclass
+class AbortStats:
+    aborted_requests: int = 0
+    # Tokens already decoded when the client went away
+    tokens_generated: int = 0
+    # max_tokens minus tokens generated: the decode budget handed back
+    tokens_saved: int = 0
+
+    def record(self, generated: int, max_tokens: int) -> None:
+        self.aborted_requests += 1
+        self.tokens_generated += generated
+        self.tokens_saved += max(max_tokens - generated, 0)
+
+    def snapshot(self) -> dict[str, int]:
+        return asdict(self)
+
+
+abort_stats = AbortStats()
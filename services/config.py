@@ -0,0 +1,210 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Literal, Mapping
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+
+###############################################################################
+#
+#               Engine configuration: typed settings and profiles
+#
+# Resolution, lowest to highest precedence:
+#   1. EngineSettings defaults (the values this service was tuned with)
+#   2. the profile named by ENGINE_PROFILE (built-in, or from the file)
+#   3. top-level keys of ENGINE_CONFIG_FILE (JSON; .yaml/.yml files need
+#      PyYAML, which is not a dependency of this service)
+#   4. legacy env vars (VLLM_EAGER, VLLM_SCHEDULING_POLICY, MAX_MODEL_LEN)
+#   5. ENGINE_<FIELD> env vars, e.g. ENGINE_MAX_NUM_BATCHED_TOKENS=8192
+# so an A/B run only needs a different env, not a code edit. The
+# resolved settings and where each value came from are served on /config.
+#
+###############################################################################
+DEFAULT_MODEL_PATH = "/models_dir/language_model/GRPO-Vi-Qwen2-7B-RAG-W4A16"
+
+
+class EngineSettings(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    model: str = DEFAULT_MODEL_PATH
+    # Defaults to `model`
+    tokenizer: str | None = None
+    max_model_len: int = Field(4096, gt=0)
+    gpu_memory_utilization: float = Field(0.85, gt=0, le=1)
+    max_num_batched_tokens: int = Field(4096, gt=0)
+    # None = vLLM's default
+    max_num_seqs: int | None = Field(None, gt=0)
+    enable_prefix_caching: bool = True
+    # None = vLLM's default (on in the V1 engine)
+    enable_chunked_prefill: bool | None = None
+    kv_cache_dtype: Literal["auto", "fp8", "fp8_e4m3", "fp8_e5m2"] = "auto"
+    swap_space: float = Field(4, ge=0)
+    enforce_eager: bool = False
+    # torch.compile level when not eager; 2 rather than 3 for stability
+    compilation_level: int = Field(2, ge=0, le=3)
+    max_seq_len_to_capture: int = Field(4096, gt=0)
+    scheduling_policy: Literal["fcfs", "priority"] = "fcfs"
+    trust_remote_code: bool = True
+
+
+PROFILES: dict[str, dict[str, Any]] = {
+    "default": {},
+    # Small prefill chunks interleave with decode: lower ITL, fewer seqs
+    "latency": {
+        "max_num_batched_tokens": 2048,
+        "max_num_seqs": 64,
+        "enable_chunked_prefill": True,
+    },
+    # Bigger batches and an fp8 KV cache to fit more sequences
+    "throughput": {
+        "max_num_batched_tokens": 8192,
+        "max_num_seqs": 256,
+        "gpu_memory_utilization": 0.92,
+        "enable_chunked_prefill": True,
+        "kv_cache_dtype": "fp8",
+    },
+    # No compilation or CUDA graph capture: ready in the least time
+    "fast-boot": {
+        "enforce_eager": True,
+        "compilation_level": 0,
+    },
+}
+
+# Read before ENGINE_* so the old switches keep working
+_LEGACY_ENV: dict[str, str] = {
+    "VLLM_EAGER": "enforce_eager",
+    "VLLM_SCHEDULING_POLICY": "scheduling_policy",
+    "MAX_MODEL_LEN": "max_model_len",
+}
+
+
+def _read_file(path: str) -> dict[str, Any]:
+    """JSON, or YAML when PyYAML happens to be installed"""
+    if not path.endswith((".json", ".yaml", ".yml")):
+        raise ValueError(f"{path}: expected a .json config file")
+    text = Path(path).read_text(encoding="utf-8")
+    if path.endswith(".json"):
+        data = json.loads(text)
+    else:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(
+                f"{path}: only JSON config files are supported (YAML "
+                f"needs PyYAML, which is not installed); convert it to "
+                f".json"
+            ) from None
+        data = yaml.safe_load(text) or {}
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected an object of settings")
+    return data
+
+
+class EngineConfig:
+    """Resolved EngineSettings, the profile used and each value's source"""
+
+    def __init__(
+        self,
+        settings: EngineSettings,
+        profile: str,
+        sources: dict[str, str],
+        profiles: list[str]
+    ) -> None:
+        self.settings = settings
+        self.profile = profile
+        self.sources = sources
+        self.profiles = profiles
+
+    @classmethod
+    def from_env(
+        cls,
+        environ: Mapping[str, str] | None = None
+    ) -> "EngineConfig":
+        """Raises ValueError for an unknown profile or invalid values"""
+        env = os.environ if environ is None else environ
+        profiles = dict(PROFILES)
+        file_values: dict[str, Any] = {}
+        path = env.get("ENGINE_CONFIG_FILE")
+        if path:
+            data = _read_file(path)
+            # {"profiles": {...}, <overrides>}
+            profiles.update(data.pop("profiles", None) or {})
+            file_values = data
+        profile = env.get("ENGINE_PROFILE", "default")
+        if profile not in profiles:
+            raise ValueError(
+                f"Unknown ENGINE_PROFILE {profile!r}; "
+                f"expected one of {sorted(profiles)}"
+            )
+
+        values: dict[str, Any] = {}
+        sources: dict[str, str] = {}
+
+        def layer(items: Mapping[str, Any], source: str) -> None:
+            for key, value in items.items():
+                values[key] = value
+                sources[key] = source
+
+        layer(profiles[profile], f"profile:{profile}")
+        layer(file_values, f"file:{path}")
+        layer({
+            field: env[name] for name, field in _LEGACY_ENV.items()
+            if name in env
+        }, "env:legacy")
+        layer({
+            field: env[f"ENGINE_{field.upper()}"]
+            for field in EngineSettings.model_fields
+            if f"ENGINE_{field.upper()}" in env
+        }, "env")
+        try:
+            settings = EngineSettings.model_validate(values)
+        except ValidationError as e:
+            raise ValueError(f"Invalid engine config: {e}") from None
+        return cls(settings, profile, sources, sorted(profiles))
+
+    def engine_args(
+        self,
+        compile_cache_dir: str | None = None,
+        speculative_config: dict[str, Any] | None = None
+    ) -> dict[str, Any]:
+        """
+        Keyword arguments for AsyncEngineArgs. The compilation config is
+        left as a plain dict here (and in /config); the caller turns it into
+        a CompilationConfig.
+        """
+        s = self.settings
+        args: dict[str, Any] = {
+            "model": s.model,
+            "tokenizer": s.tokenizer or s.model,
+            "trust_remote_code": s.trust_remote_code,
+            "max_model_len": s.max_model_len,
+            "gpu_memory_utilization": s.gpu_memory_utilization,
+            "max_num_batched_tokens": s.max_num_batched_tokens,
+            "enable_prefix_caching": s.enable_prefix_caching,
+            "kv_cache_dtype": s.kv_cache_dtype,
+            "swap_space": s.swap_space,
+            "enforce_eager": s.enforce_eager,
+            "scheduling_policy": s.scheduling_policy,
+            "max_seq_len_to_capture": s.max_seq_len_to_capture,
+        }
+        if s.max_num_seqs is not None:
+            args["max_num_seqs"] = s.max_num_seqs
+        if s.enable_chunked_prefill is not None:
+            args["enable_chunked_prefill"] = s.enable_chunked_prefill
+        if not s.enforce_eager:
+            args["compilation_config"] = {
+                "level": s.compilation_level,
+                "cache_dir": compile_cache_dir,
+            }
+        if speculative_config is not None:
+            args["speculative_config"] = speculative_config
+        return args
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "profile": self.profile,
+            "profiles": self.profiles,
+            "settings": self.settings.model_dump(),
+            "sources": self.sources,
+        }
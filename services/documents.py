@@ -0,0 +1,88 @@
+import hashlib
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+
+###############################################################################
+#
+#                   Document text extraction and chunking
+#
+# Runs in the ingestion process pool, so nothing heavy is imported at
+# module level: PyMuPDF is loaded by the worker that opens a PDF.
+#
+###############################################################################
+SUPPORTED_SUFFIXES = (".pdf", ".txt", ".md")
+
+# Preferred cut points, best first
+_BREAKS = ("\n\n", "\n", ". ", " ")
+_BLANK_LINES = re.compile(r"\n\s*\n\s*")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+
+
+@dataclass
+class Chunk:
+    # 1-based page; text files are one page
+    page: int
+    # Position within the document
+    index: int
+    text: str
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def extract_pages(data: bytes, name: str) -> list[str]:
+    if name.lower().endswith(".pdf"):
+        import fitz
+
+        with fitz.open(stream=data, filetype="pdf") as document:
+            return [page.get_text("text") for page in document]
+    return [data.decode("utf-8", errors="replace")]
+
+
+def split_text(text: str, size: int, overlap: int) -> list[str]:
+    """
+    Pieces of at most `size` chars, cut at a paragraph, line, sentence or
+    word break in the second half of the window when there is one; each
+    piece starts `overlap` chars before the previous one ended.
+    """
+    text = _BLANK_LINES.sub("\n\n", _SPACES.sub(" ", text)).strip()
+    pieces: list[str] = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            window = text[start:end]
+            for separator in _BREAKS:
+                cut = window.rfind(separator)
+                if cut > size // 2:
+                    end = start + cut + len(separator)
+                    break
+        piece = text[start:end].strip()
+        if piece:
+            pieces.append(piece)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return pieces
+
+
+def chunk_document(
+    source: bytes | str,
+    name: str,
+    size: int,
+    overlap: int
+) -> tuple[int, list[Chunk]]:
+    """
+    Page count and chunks of one document. `source` is its bytes, or the
+    path of a local file so the bytes need not cross the process boundary.
+    """
+    data = Path(source).read_bytes() if isinstance(source, str) else source
+    pages = extract_pages(data, name)
+    chunks: list[Chunk] = []
+    for page, text in enumerate(pages, 1):
+        for piece in split_text(text, size, overlap):
+            chunks.append(Chunk(page=page, index=len(chunks), text=piece))
+    return len(pages), chunks
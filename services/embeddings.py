@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import os
+import re
+import unicodedata
+from typing import Protocol
+
+import numpy as np
+
+
+###############################################################################
+#
+#                      Text embedders (L2-normalized output)
+#
+###############################################################################
+class Embedder(Protocol):
+    dim: int
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """Return a (len(texts), dim) float32 array of unit vectors"""
+        ...
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """
+    Character n-gram feature hashing; no model weights needed.
+
+    Catches near-duplicates (typos, word order, missing diacritics are
+    partly covered by the folded n-grams) but not true paraphrases; use
+    TransformersEmbedder for those.
+    """
+
+    _TOKEN = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, dim: int = 512, ngram: int = 3) -> None:
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text: str) -> list[str]:
+        folded = unicodedata.normalize("NFC", text).casefold()
+        words = self._TOKEN.findall(folded)
+        # Diacritic-free copy so "tai lieu" and "tài liệu" share features
+        ascii_words = [
+            unicodedata.normalize("NFKD", w).encode("ascii", "ignore")
+            .decode("ascii") for w in words
+        ]
+        features = words + [f"a:{w}" for w in ascii_words if w]
+        for word in ascii_words:
+            padded = f"#{word}#"
+            features.extend(
+                padded[i:i + self.ngram]
+                for i in range(max(len(padded) - self.ngram + 1, 1))
+            )
+        return features
+
+    def _embed_sync(self, texts: list[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(
+                    feature.encode("utf-8"), digest_size=8
+                ).digest()
+                h = int.from_bytes(digest, "little")
+                out[row, h % self.dim] += 1.0 if h >> 63 else -1.0
+        return _normalize_rows(out)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        return self._embed_sync(texts)
+
+
+class TransformersEmbedder:
+    """Mean-pooled sentence embeddings from a local HF encoder model"""
+
+    def __init__(
+        self,
+        model_path: str,
+        device: str = "cpu",
+        max_length: int = 512
+    ) -> None:
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModel.from_pretrained(model_path).to(device).eval()
+        self.device = device
+        self.max_length = max_length
+        self.dim = int(self.model.config.hidden_size)
+
+    def _embed_sync(self, texts: list[str]) -> np.ndarray:
+        torch = self._torch
+        batch = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt"
+        ).to(self.device)
+        with torch.inference_mode():
+            hidden = self.model(**batch).last_hidden_state
+        mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return _normalize_rows(pooled.float().cpu().numpy())
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._embed_sync, texts)
+
+
+def build_embedder() -> Embedder:
+    """EMBEDDING_MODEL_PATH selects a HF model, otherwise feature hashing"""
+    model_path = os.getenv("EMBEDDING_MODEL_PATH")
+    if model_path:
+        print(f"🧭 Loading embedding model from {model_path}")
+        return TransformersEmbedder(
+            model_path,
+            device=os.getenv("EMBEDDING_DEVICE", "cpu")
+        )
+    return HashingEmbedder(dim=int(os.getenv("EMBEDDING_DIM", "512")))
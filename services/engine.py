@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import os
+import random
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Protocol
+
+
+###############################################################################
+#
+#                   Engine protocol used by the serving path
+#
+###############################################################################
+class LLMEngine(Protocol):
+    """The part of the AsyncLLMEngine surface the API layer depends on"""
+
+    def generate(
+        self,
+        prompt: Any,
+        sampling_params: Any,
+        request_id: str,
+        **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        ...
+
+    async def abort(self, request_id: str) -> None:
+        ...
+
+
+class EngineFailure(RuntimeError):
+    """The engine failed, as opposed to the one request it was running"""
+
+
+def get_engine_backend() -> str:
+    """Engine backend selected via ENGINE_BACKEND (vllm | synthetic | ipc)"""
+    return os.getenv("ENGINE_BACKEND", "vllm").strip().lower()
+
+
+###############################################################################
+#
+#               Synthetic engine (CPU only, for load testing)
+#
+###############################################################################
+class SyntheticEngineError(EngineFailure):
+    """Failure injected by the synthetic engine"""
+
+
+@dataclass
+class SyntheticEngineConfig:
+    ttft_ms: float = 50.0
+    itl_ms: float = 20.0
+    output_tokens: int = 128
+    failure_rate: float = 0.0
+    init_s: float = 0.0
+    max_num_seqs: int = 256
+    seed: int = 0
+    # Simulated prefix cache: KV block size and capacity in blocks (0 = off)
+    block_size: int = 16
+    prefix_cache_blocks: int = 65536
+    # Simulated speculative decoding: tokens proposed per step (0 = off),
+    # chance each is accepted, and extra step time for verification
+    spec_tokens: int = 0
+    spec_accept: float = 0.7
+    spec_overhead: float = 0.15
+
+    @classmethod
+    def from_env(cls) -> "SyntheticEngineConfig":
+        return cls(
+            ttft_ms=float(os.getenv("SYNTHETIC_TTFT_MS", cls.ttft_ms)),
+            itl_ms=float(os.getenv("SYNTHETIC_ITL_MS", cls.itl_ms)),
+            output_tokens=int(
+                os.getenv("SYNTHETIC_OUTPUT_TOKENS", cls.output_tokens)
+            ),
+            failure_rate=float(
+                os.getenv("SYNTHETIC_FAILURE_RATE", cls.failure_rate)
+            ),
+            init_s=float(os.getenv("SYNTHETIC_INIT_S", cls.init_s)),
+            max_num_seqs=int(
+                os.getenv("SYNTHETIC_MAX_NUM_SEQS", cls.max_num_seqs)
+            ),
+            seed=int(os.getenv("SYNTHETIC_SEED", cls.seed)),
+            block_size=int(
+                os.getenv("SYNTHETIC_BLOCK_SIZE", cls.block_size)
+            ),
+            prefix_cache_blocks=int(
+                os.getenv(
+                    "SYNTHETIC_PREFIX_CACHE_BLOCKS", cls.prefix_cache_blocks
+                )
+            ),
+            spec_accept=float(
+                os.getenv("SYNTHETIC_SPEC_ACCEPT", cls.spec_accept)
+            ),
+            spec_overhead=float(
+                os.getenv("SYNTHETIC_SPEC_OVERHEAD", cls.spec_overhead)
+            ),
+        )
+
+
+@dataclass
+class SyntheticCompletionOutput:
+    """Mirrors the fields of vllm.outputs.CompletionOutput we read"""
+    index: int
+    text: str
+    token_ids: list[int]
+    finish_reason: str | None = None
+    stop_reason: int | str | None = None
+
+
+@dataclass
+class SyntheticRequestOutput:
+    """Mirrors the fields of vllm.outputs.RequestOutput we read"""
+    request_id: str
+    prompt: str | None
+    prompt_token_ids: list[int]
+    outputs: list[SyntheticCompletionOutput]
+    finished: bool
+    num_cached_tokens: int = 0
+
+
+# Mix of Vietnamese and ASCII words so the SSE escaping path sees both
+_VOCAB: tuple[str, ...] = (
+    "Xin", " chào", ",", " tôi", " là", " trợ", " lý", " ảo", ".",
+    " Câu", " hỏi", " của", " bạn", " rất", " hay", " và", " có",
+    " thể", " được", " trả", " lời", " như", " sau", ":", "\n",
+    " the", " answer", " is", " \"quoted\"", " 42", " tài", " liệu",
+)
+
+
+@dataclass
+class _SyntheticRequest:
+    aborted: bool = False
+    running: bool = False
+
+
+@dataclass
+class SyntheticEngine:
+    """
+    Deterministic fake engine with configurable latency and failures.
+
+    The same prompt always produces the same token stream, so benchmark
+    runs are comparable across releases.
+    """
+    config: SyntheticEngineConfig = field(
+        default_factory=SyntheticEngineConfig
+    )
+    _requests: dict[str, _SyntheticRequest] = field(default_factory=dict)
+    _slots: asyncio.Semaphore = field(init=False)
+    # Chained block hashes, LRU ordered, like vLLM's prefix cache
+    _blocks: OrderedDict[int, None] = field(default_factory=OrderedDict)
+    _spec_counters: dict[str, int] = field(default_factory=lambda: {
+        "drafts": 0, "draft_tokens": 0, "accepted_tokens": 0,
+    })
+    _spec_rng: random.Random = field(init=False)
+
+    def __post_init__(self) -> None:
+        self._slots = asyncio.Semaphore(self.config.max_num_seqs)
+        # Separate from the per-prompt rngs so outputs stay identical
+        # with speculation on, as they are for greedy vLLM
+        self._spec_rng = random.Random(self.config.seed)
+
+    @classmethod
+    async def from_config(
+        cls,
+        config: SyntheticEngineConfig
+    ) -> "SyntheticEngine":
+        if config.init_s > 0:
+            await asyncio.sleep(config.init_s)
+        return cls(config=config)
+
+    @property
+    def num_running(self) -> int:
+        return sum(1 for r in self._requests.values() if r.running)
+
+    @property
+    def num_waiting(self) -> int:
+        return sum(1 for r in self._requests.values() if not r.running)
+
+    def get_stats(self) -> dict[str, float]:
+        """Same keys services.metrics reads from vLLM's gauges"""
+        running = self.num_running
+        return {
+            "kv_cache_usage": running / self.config.max_num_seqs,
+            "num_requests_running": running,
+            "num_requests_waiting": self.num_waiting,
+        }
+
+    def get_spec_decode_stats(self) -> dict[str, float]:
+        """Same keys services.speculative reads from vLLM's counters"""
+        if not self.config.spec_tokens:
+            return {}
+        return {k: float(v) for k, v in self._spec_counters.items()}
+
+    def _draft_step(self) -> int:
+        """Tokens one verified step emits: accepted proposals plus one"""
+        k = self.config.spec_tokens
+        accepted = 0
+        while accepted < k and \
+                self._spec_rng.random() < self.config.spec_accept:
+            accepted += 1
+        self._spec_counters["drafts"] += 1
+        self._spec_counters["draft_tokens"] += k
+        self._spec_counters["accepted_tokens"] += accepted
+        return accepted + 1
+
+    def _cached_tokens(self, token_ids: list[int]) -> int:
+        """Count full blocks already seen with the same prefix, then add"""
+        size = self.config.block_size
+        if not self.config.prefix_cache_blocks:
+            return 0
+        cached = 0
+        missed = False
+        parent = 0
+        for start in range(0, len(token_ids) - size + 1, size):
+            parent = hash((parent, tuple(token_ids[start:start + size])))
+            if not missed and parent in self._blocks:
+                cached += size
+                self._blocks.move_to_end(parent)
+            else:
+                missed = True
+                self._blocks[parent] = None
+        while len(self._blocks) > self.config.prefix_cache_blocks:
+            self._blocks.popitem(last=False)
+        return cached
+
+    def _rng(self, prompt_text: str) -> random.Random:
+        digest = hashlib.blake2b(
+            prompt_text.encode("utf-8"), digest_size=8
+        ).digest()
+        seed = int.from_bytes(digest, "little") ^ self.config.seed
+        return random.Random(seed)
+
+    @staticmethod
+    def _prompt_view(prompt: Any) -> tuple[str, list[int]]:
+        if isinstance(prompt, dict):
+            if "prompt_token_ids" in prompt:
+                ids = list(prompt["prompt_token_ids"])
+                return " ".join(map(str, ids)), ids
+            prompt = prompt.get("prompt", "")
+        text = str(prompt)
+        # One stable pseudo token per word
+        ids = [
+            int.from_bytes(
+                hashlib.blake2b(w.encode("utf-8"), digest_size=4).digest(),
+                "little"
+            ) % 151_000
+            for w in text.split()
+        ]
+        return text, ids
+
+    async def generate(
+        self,
+        prompt: Any,
+        sampling_params: Any,
+        request_id: str,
+        **kwargs: Any
+    ) -> AsyncIterator[SyntheticRequestOutput]:
+        cfg = self.config
+        text, prompt_token_ids = self._prompt_view(prompt)
+        rng = self._rng(text)
+        max_tokens = getattr(sampling_params, "max_tokens", None) \
+            or cfg.output_tokens
+        num_tokens = max(1, min(max_tokens, cfg.output_tokens))
+        kind = getattr(
+            getattr(sampling_params, "output_kind", None), "name", "CUMULATIVE"
+        )
+        stop = tuple(getattr(sampling_params, "stop", None) or ())
+        fail_at = (
+            rng.randrange(num_tokens)
+            if rng.random() < cfg.failure_rate else -1
+        )
+
+        num_cached_tokens = self._cached_tokens(prompt_token_ids)
+        # Choice 0 keeps the single-choice stream; others get their own seed
+        rngs = [rng] + [
+            self._rng(f"{text}\x00{j}")
+            for j in range(1, getattr(sampling_params, "n", 1) or 1)
+        ]
+        produced: list[list[str]] = [[] for _ in rngs]
+        finish_reasons: list[str | None] = [None] * len(rngs)
+        delta = kind == "DELTA"
+        # Tokens left in the current speculative step; they arrive together
+        step_left = 0
+        state = _SyntheticRequest()
+        self._requests[request_id] = state
+        try:
+            async with self._slots:
+                state.running = True
+                await asyncio.sleep(cfg.ttft_ms / 1000)
+                for i in range(num_tokens):
+                    if state.aborted:
+                        return
+                    if i == fail_at:
+                        raise SyntheticEngineError(
+                            f"Injected failure for request {request_id}"
+                        )
+                    if i and cfg.spec_tokens:
+                        if not step_left:
+                            await asyncio.sleep(
+                                cfg.itl_ms * (1 + cfg.spec_overhead) / 1000
+                            )
+                            step_left = self._draft_step()
+                        step_left -= 1
+                    elif i:
+                        await asyncio.sleep(cfg.itl_ms / 1000)
+                    outputs: list[SyntheticCompletionOutput] = []
+                    for j, choice_rng in enumerate(rngs):
+                        if finish_reasons[j] is not None:
+                            continue
+                        piece = _VOCAB[choice_rng.randrange(len(_VOCAB))]
+                        produced[j].append(piece)
+                        if stop and any(
+                            s in "".join(produced[j]) for s in stop
+                        ):
+                            finish_reasons[j] = "stop"
+                        elif i == num_tokens - 1:
+                            finish_reasons[j] = "length"
+                        outputs.append(SyntheticCompletionOutput(
+                            index=j,
+                            text=piece if delta else "".join(produced[j]),
+                            token_ids=(
+                                [i] if delta else list(range(i + 1))
+                            ),
+                            finish_reason=finish_reasons[j],
+                        ))
+                    finished = all(r is not None for r in finish_reasons)
+                    if kind == "FINAL_ONLY":
+                        if not finished:
+                            continue
+                        outputs = [
+                            SyntheticCompletionOutput(
+                                index=j,
+                                text="".join(pieces),
+                                token_ids=list(range(len(pieces))),
+                                finish_reason=finish_reasons[j],
+                            )
+                            for j, pieces in enumerate(produced)
+                        ]
+                    yield SyntheticRequestOutput(
+                        request_id=request_id,
+                        prompt=text,
+                        prompt_token_ids=prompt_token_ids,
+                        outputs=outputs,
+                        finished=finished,
+                        num_cached_tokens=num_cached_tokens,
+                    )
+                    if finished:
+                        return
+        finally:
+            self._requests.pop(request_id, None)
+
+    async def abort(self, request_id: str) -> None:
+        state = self._requests.get(request_id)
+        if state is not None:
+            state.aborted = True
+
+    def shutdown(self) -> None:
+        for state in self._requests.values():
+            state.aborted = True
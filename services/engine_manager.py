@@ -0,0 +1,277 @@
+import asyncio
+import gc
+import inspect
+import math
+import os
+import sys
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from enum import Enum
+from typing import AsyncGenerator, Awaitable, Callable
+
+from services.engine import EngineFailure, LLMEngine
+
+
+###############################################################################
+#
+#             Engine lifecycle: single-flight (re)initialization
+#
+###############################################################################
+class EngineState(str, Enum):
+    COLD = "cold"
+    LOADING = "loading"
+    READY = "ready"
+    # Serving, but recent requests failed; restarts past the threshold
+    DEGRADED = "degraded"
+    # Last load failed; the next request retries after the backoff
+    FAILED = "failed"
+
+
+# Raised by vLLM once its engine loop has died; matched by name so this
+# module imports without vLLM
+_DEAD_ENGINE_ERRORS = frozenset({"AsyncEngineDeadError", "EngineDeadError"})
+
+
+def engine_dead(engine: object, error: BaseException) -> bool:
+    """The engine cannot serve anything until it is rebuilt"""
+    return bool(getattr(engine, "errored", False)) or any(
+        cls.__name__ in _DEAD_ENGINE_ERRORS for cls in type(error).__mro__
+    )
+
+
+def engine_failure(engine: object, error: BaseException) -> bool:
+    """
+    Whether `error` is the engine's fault. A bad prompt or parameters
+    (vLLM raises ValueError/TypeError) fail only their own request and
+    say nothing about the engine's health. An engine that judges its own
+    errors (a router keeps replica health per replica) says so through
+    is_engine_failure().
+    """
+    judge = getattr(engine, "is_engine_failure", None)
+    if judge is not None:
+        return judge(error)
+    return engine_dead(engine, error) or isinstance(
+        error, (EngineFailure, ConnectionError, EOFError)
+    )
+
+
+class EngineUnavailable(RuntimeError):
+    """No engine within the caller's wait budget"""
+
+    def __init__(self, state: EngineState, retry_after: int) -> None:
+        super().__init__(f"engine {state.value}")
+        self.state = state
+        self.retry_after = retry_after
+
+
+@dataclass
+class EngineManagerConfig:
+    wait_timeout_s: float = 30.0
+    retry_backoff_s: float = 10.0
+    max_consecutive_errors: int = 5
+
+    @classmethod
+    def from_env(cls) -> "EngineManagerConfig":
+        return cls(
+            wait_timeout_s=float(
+                os.getenv("ENGINE_WAIT_TIMEOUT_S", cls.wait_timeout_s)
+            ),
+            retry_backoff_s=float(
+                os.getenv("ENGINE_RETRY_BACKOFF_S", cls.retry_backoff_s)
+            ),
+            max_consecutive_errors=int(
+                os.getenv(
+                    "ENGINE_MAX_CONSECUTIVE_ERRORS",
+                    cls.max_consecutive_errors
+                )
+            ),
+        )
+
+
+class EngineManager:
+    """
+    Owns the one engine of this process.
+
+    Loading runs in a single background task guarded by one lock, so a
+    burst of requests during a cold start or after a failure shares one
+    load instead of building several engines. Callers wait at most
+    `wait_timeout_s`; a failed engine is shut down before its replacement
+    is built. Only engine failures (engine_failure()) count toward a
+    restart, and a merely failing engine is restarted once the streams
+    still running on it have finished.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Awaitable[LLMEngine]],
+        config: EngineManagerConfig | None = None
+    ) -> None:
+        self.factory = factory
+        self.config = config or EngineManagerConfig()
+        self.state = EngineState.COLD
+        self.engine: LLMEngine | None = None
+        self.last_error: str | None = None
+        self.loads = 0
+        self.load_seconds: float | None = None
+        self.consecutive_errors = 0
+        # Response streams running through track()
+        self.active_streams = 0
+        self._lock = asyncio.Lock()
+        self._load_task: asyncio.Task[LLMEngine] | None = None
+        self._failed_at = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.state in (EngineState.READY, EngineState.DEGRADED)
+
+    def start(self) -> asyncio.Task[LLMEngine]:
+        """Begin loading in the background if nothing is loaded or loading"""
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.create_task(self._load())
+            # Failures are recorded in state; don't warn about them twice
+            self._load_task.add_done_callback(
+                lambda t: t.cancelled() or t.exception()
+            )
+        return self._load_task
+
+    async def get(self, timeout: float | None = None) -> LLMEngine:
+        """Return the engine, waiting up to `timeout` for a load"""
+        if self.ready and self.engine is not None:
+            return self.engine
+        if self.state is EngineState.FAILED:
+            remaining = self._failed_at + self.config.retry_backoff_s \
+                - time.monotonic()
+            if remaining > 0:
+                raise EngineUnavailable(self.state, math.ceil(remaining))
+        task = self.start()
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(task),
+                self.config.wait_timeout_s if timeout is None else timeout
+            )
+        except asyncio.TimeoutError:
+            raise EngineUnavailable(
+                self.state, math.ceil(self.config.wait_timeout_s)
+            ) from None
+        except Exception:
+            raise EngineUnavailable(
+                self.state, math.ceil(self.config.retry_backoff_s)
+            ) from None
+
+    async def _load(self) -> LLMEngine:
+        async with self._lock:
+            if self.ready and self.engine is not None:
+                return self.engine
+            if self.engine is not None:
+                await self._teardown()
+            self.state = EngineState.LOADING
+            started = time.monotonic()
+            print("⚙️ (Re)initializing vLLM engine...")
+            try:
+                engine = await self.factory()
+            except Exception as e:
+                self.state = EngineState.FAILED
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._failed_at = time.monotonic()
+                print(f"❌ [Init Error] Failed to start vLLM engine: {e}")
+                raise
+            self.engine = engine
+            self.loads += 1
+            self.load_seconds = time.monotonic() - started
+            self.consecutive_errors = 0
+            self.last_error = None
+            self.state = EngineState.READY
+            print(f"⏱️ Engine loaded in {self.load_seconds:.1f}s")
+            return engine
+
+    async def _teardown(self) -> None:
+        engine, self.engine = self.engine, None
+        print("🧹 Shutting down previous engine...")
+        shutdown = getattr(engine, "shutdown", None) \
+            or getattr(engine, "shutdown_background_loop", None)
+        try:
+            if shutdown is not None:
+                result = shutdown()
+                if inspect.isawaitable(result):
+                    await result
+        except Exception as e:
+            print(f"⚠️ Engine shutdown raised: {e}")
+        del engine
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def report_success(self) -> None:
+        if self.state is EngineState.DEGRADED:
+            self.state = EngineState.READY
+        self.consecutive_errors = 0
+
+    def report_error(self, error: BaseException) -> None:
+        """Count a failed generation; restart a dead or failing engine"""
+        if not self.ready or not engine_failure(self.engine, error):
+            return
+        self.consecutive_errors += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        if engine_dead(self.engine, error) or \
+                (self._failing() and not self.active_streams):
+            self._restart()
+        else:
+            # A failing engine may still be finishing healthy streams
+            self.state = EngineState.DEGRADED
+
+    def _failing(self) -> bool:
+        return self.consecutive_errors >= self.config.max_consecutive_errors
+
+    def _restart(self) -> None:
+        print(f"💥 Engine unhealthy ({self.last_error}), restarting...")
+        self.state = EngineState.FAILED
+        self._failed_at = 0.0
+        self.start()
+
+    async def track(
+        self,
+        stream: AsyncGenerator[bytes, None]
+    ) -> AsyncGenerator[bytes, None]:
+        """Feed the outcome of a response stream into the health state"""
+        self.active_streams += 1
+        error: Exception | None = None
+        completed = False
+        try:
+            async with aclosing(stream):
+                async for chunk in stream:
+                    yield chunk
+            completed = True
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.active_streams -= 1
+            if error is not None:
+                self.report_error(error)
+            elif completed:
+                self.report_success()
+            if self.state is EngineState.DEGRADED and self._failing() \
+                    and not self.active_streams:
+                # The restart report_error held back for live streams
+                self._restart()
+
+    async def shutdown(self) -> None:
+        if self._load_task is not None and not self._load_task.done():
+            self._load_task.cancel()
+        async with self._lock:
+            if self.engine is not None:
+                await self._teardown()
+            self.state = EngineState.COLD
+
+    def snapshot(self) -> dict[str, object]:
+        return {
+            "state": self.state.value,
+            "ready": self.ready,
+            "loads": self.loads,
+            "load_seconds": self.load_seconds,
+            "consecutive_errors": self.consecutive_errors,
+            "active_streams": self.active_streams,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,643 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator
+from uuid import NAMESPACE_URL, uuid5
+
+import numpy as np
+
+from services.documents import (
+    SUPPORTED_SUFFIXES,
+    Chunk,
+    chunk_document,
+    content_hash,
+)
+from services.embeddings import Embedder, build_embedder
+from services.retrieval import QdrantStore, RetrievalConfig
+
+
+###############################################################################
+#
+#          Document ingestion: PDF -> chunks -> embeddings -> Qdrant
+#
+# Documents are listed from a local directory or a MinIO/S3 prefix. A
+# document whose size+mtime (or ETag), else content hash, matches what is
+# stored on its first chunk is skipped, so re-indexing only pays for what
+# changed. Text extraction and chunking run in a process pool; chunks are
+# embedded `embed_batch` at a time and upserted `upsert_batch` at a time.
+# At most `max_pending` documents are between listing and the upsert
+# queue, and the queue itself is bounded, so memory does not grow with
+# the corpus.
+#
+# Points are keyed by (document, chunk index) and carry the LangChain
+# payload layout the retriever reads ({"page_content", "metadata"}). A
+# document's first chunk is written last and its stale chunks are deleted
+# after it, so an interrupted run leaves the document to be redone rather
+# than marked as indexed. A document that was only touched (new stamp, same
+# content) gets its stamp updated, so the next run skips it unread. With
+# `delete_missing`, a completed run also drops the points of documents no
+# longer in the source, within the part of the index the run covered.
+#
+###############################################################################
+class IngestError(ValueError):
+    pass
+
+
+@dataclass
+class IngestConfig:
+    # Directory, or s3://bucket/prefix on MINIO_ENDPOINT
+    source: str = "/data/documents"
+    # Extraction processes (0 = one per CPU)
+    workers: int = 0
+    chunk_chars: int = 1000
+    chunk_overlap: int = 150
+    embed_batch: int = 64
+    upsert_batch: int = 256
+    # Documents in flight before the upsert queue (0 = 2 per worker)
+    max_pending: int = 0
+    max_document_bytes: int = 256 * 1024 * 1024
+    # Drop indexed documents that are gone from the source
+    delete_missing: bool = False
+    minio_endpoint: str = "localhost:9000"
+    minio_access_key: str | None = None
+    minio_secret_key: str | None = None
+    minio_secure: bool = False
+
+    @classmethod
+    def from_env(cls) -> "IngestConfig":
+        return cls(
+            source=os.getenv("INGEST_SOURCE", cls.source),
+            workers=int(os.getenv("INGEST_WORKERS", cls.workers)),
+            chunk_chars=int(os.getenv("INGEST_CHUNK_CHARS", cls.chunk_chars)),
+            chunk_overlap=int(
+                os.getenv("INGEST_CHUNK_OVERLAP", cls.chunk_overlap)
+            ),
+            embed_batch=int(os.getenv("INGEST_EMBED_BATCH", cls.embed_batch)),
+            upsert_batch=int(
+                os.getenv("INGEST_UPSERT_BATCH", cls.upsert_batch)
+            ),
+            max_pending=int(os.getenv("INGEST_MAX_PENDING", cls.max_pending)),
+            max_document_bytes=int(
+                os.getenv("INGEST_MAX_DOCUMENT_BYTES", cls.max_document_bytes)
+            ),
+            delete_missing=os.getenv("INGEST_DELETE_MISSING", "0") == "1",
+            minio_endpoint=os.getenv("MINIO_ENDPOINT", cls.minio_endpoint),
+            minio_access_key=os.getenv("MINIO_ACCESS_KEY"),
+            minio_secret_key=os.getenv("MINIO_SECRET_KEY"),
+            minio_secure=os.getenv("MINIO_SECURE", "0") == "1",
+        )
+
+    @property
+    def num_workers(self) -> int:
+        return self.workers or os.cpu_count() or 1
+
+
+@dataclass
+class IngestStats:
+    source: str
+    status: str = "running"
+    error: str | None = None
+    documents: int = 0
+    skipped: int = 0
+    indexed: int = 0
+    failed: int = 0
+    # Documents gone from the source, dropped from the index
+    deleted: int = 0
+    pages: int = 0
+    chunks: int = 0
+    bytes: int = 0
+    started_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    _started: float = field(default_factory=time.monotonic, repr=False)
+    _seconds: float | None = field(default=None, repr=False)
+
+    @property
+    def seconds(self) -> float:
+        if self._seconds is not None:
+            return self._seconds
+        return time.monotonic() - self._started
+
+    def finish(self, status: str, error: str | None = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self._seconds = time.monotonic() - self._started
+
+    def snapshot(self) -> dict[str, Any]:
+        data = {
+            k: v for k, v in asdict(self).items() if not k.startswith("_")
+        }
+        seconds = self.seconds
+        data.update(
+            seconds=round(seconds, 3),
+            pages_per_s=self.pages / seconds if seconds else 0.0,
+            chunks_per_s=self.chunks / seconds if seconds else 0.0,
+        )
+        return data
+
+
+###############################################################################
+#
+#                                Sources
+#
+###############################################################################
+@dataclass
+class SourceItem:
+    # Identity in the index: path under the root, or s3://bucket/object
+    key: str
+    size: int
+    # Cheap change marker checked before reading: size+mtime, or ETag
+    stamp: str
+    # Local file path, or object name
+    location: str
+    local: bool = True
+
+
+def _supported(name: str) -> bool:
+    return name.lower().endswith(SUPPORTED_SUFFIXES)
+
+
+class LocalSource:
+    def __init__(self, path: str, key_root: str | None = None) -> None:
+        """
+        Keys are relative to `key_root` when `path` is inside it, so a run
+        over a subdirectory names documents like a run over the whole tree
+        """
+        self.path = Path(path).resolve()
+        if not self.path.is_dir():
+            raise IngestError(f"not a directory: {path}")
+        root = Path(key_root).resolve() if key_root else self.path
+        self.root = root if self.path.is_relative_to(root) else self.path
+        self._scope = (
+            "" if self.path == self.root
+            else str(self.path.relative_to(self.root)) + os.sep
+        )
+
+    def covers(self, key: str) -> bool:
+        """Whether a full listing of this source would include `key`"""
+        return not key.startswith("s3://") and key.startswith(self._scope)
+
+    async def items(self) -> AsyncIterator[SourceItem]:
+        walker = os.walk(self.path)
+        # One directory per thread hop, so huge trees are never listed whole
+        while (entry := await asyncio.to_thread(next, walker, None)):
+            dirpath, _, filenames = entry
+            for name in sorted(filenames):
+                if not _supported(name):
+                    continue
+                path = Path(dirpath) / name
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                yield SourceItem(
+                    key=str(path.relative_to(self.root)),
+                    size=stat.st_size,
+                    stamp=f"{stat.st_size}:{stat.st_mtime_ns}",
+                    location=str(path),
+                )
+
+    async def read(self, item: SourceItem) -> bytes:
+        return await asyncio.to_thread(Path(item.location).read_bytes)
+
+    async def close(self) -> None:
+        pass
+
+
+class S3Source:
+    """A bucket prefix on MinIO or any S3-compatible store"""
+
+    def __init__(self, uri: str, config: IngestConfig) -> None:
+        from miniopy_async import Minio
+
+        self.bucket, _, self.prefix = uri.removeprefix("s3://").partition("/")
+        self.client = Minio(
+            config.minio_endpoint,
+            access_key=config.minio_access_key,
+            secret_key=config.minio_secret_key,
+            secure=config.minio_secure,
+        )
+        self._session: Any = None
+
+    def covers(self, key: str) -> bool:
+        """Whether a full listing of this source would include `key`"""
+        return key.startswith(f"s3://{self.bucket}/{self.prefix}")
+
+    async def items(self) -> AsyncIterator[SourceItem]:
+        async for obj in self.client.list_objects(
+            self.bucket, prefix=self.prefix, recursive=True
+        ):
+            if obj.is_dir or not _supported(obj.object_name):
+                continue
+            yield SourceItem(
+                key=f"s3://{self.bucket}/{obj.object_name}",
+                size=obj.size or 0,
+                stamp=(obj.etag or "").strip('"'),
+                location=obj.object_name,
+                local=False,
+            )
+
+    async def read(self, item: SourceItem) -> bytes:
+        import aiohttp
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        response = await self.client.get_object(
+            self.bucket, item.location, session=self._session
+        )
+        try:
+            return await response.read()
+        finally:
+            response.release()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+def open_source(uri: str, config: IngestConfig) -> LocalSource | S3Source:
+    if uri.startswith("s3://"):
+        return S3Source(uri, config)
+    return LocalSource(
+        uri, None if config.source.startswith("s3://") else config.source
+    )
+
+
+###############################################################################
+#
+#                                Pipeline
+#
+###############################################################################
+def point_id(key: str, index: int) -> str:
+    return str(uuid5(NAMESPACE_URL, f"{key}#{index}"))
+
+
+@dataclass
+class _Point:
+    chunk: Chunk
+    metadata: dict[str, Any]
+    # The document's first chunk; written last, then stale chunks go
+    marker: bool = False
+
+
+class Ingestor:
+    def __init__(
+        self,
+        store: QdrantStore,
+        embedder: Embedder,
+        config: IngestConfig | None = None
+    ) -> None:
+        self.store = store
+        self.embedder = embedder
+        self.config = config or IngestConfig()
+
+    async def run(
+        self,
+        source: str | None = None,
+        force: bool = False,
+        stats: IngestStats | None = None
+    ) -> IngestStats:
+        """Index `source` (default: the configured one); `force` redoes all"""
+        uri = source or self.config.source
+        stats = stats or IngestStats(source=uri)
+        print(f"📚 [Ingest] indexing {uri} "
+              f"({self.config.num_workers} workers)")
+        try:
+            await self._run(uri, force, stats)
+        except asyncio.CancelledError:
+            stats.finish("cancelled")
+            raise
+        except Exception as e:
+            stats.finish("failed", f"{type(e).__name__}: {e}")
+            print(f"❌ [Ingest] {uri} failed: {stats.error}")
+            raise
+        stats.finish("completed")
+        print(f"✅ [Ingest] {stats.indexed} indexed, {stats.skipped} "
+              f"unchanged, {stats.failed} failed, {stats.deleted} deleted: "
+              f"{stats.pages} pages, "
+              f"{stats.chunks} chunks in {stats.seconds:.1f}s "
+              f"({stats.pages / stats.seconds:.1f} pages/s)")
+        return stats
+
+    async def _run(self, uri: str, force: bool, stats: IngestStats) -> None:
+        cfg = self.config
+        docs = open_source(uri, cfg)
+        await self.store.ensure_collection(self.embedder.dim)
+        queue: asyncio.Queue[_Point | None] = asyncio.Queue(
+            maxsize=cfg.upsert_batch * 2
+        )
+        pending = asyncio.Semaphore(cfg.max_pending or 2 * cfg.num_workers)
+        tasks: set[asyncio.Task[None]] = set()
+        listed: set[str] = set()
+        pool = ProcessPoolExecutor(
+            cfg.num_workers,
+            # Not fork: this process may hold CUDA, threads and a live loop
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+        async def produce() -> None:
+            async for item in docs.items():
+                listed.add(item.key)
+                await pending.acquire()
+                task = asyncio.create_task(
+                    self._prepare(docs, item, pool, queue, stats, force)
+                )
+                task.add_done_callback(lambda _: pending.release())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+            await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        writer = asyncio.create_task(self._write(queue, stats))
+        try:
+            # Either side failing stops the other (a full queue or an
+            # empty one would otherwise wait forever)
+            done, _ = await asyncio.wait(
+                (producer, writer), return_when=asyncio.FIRST_EXCEPTION
+            )
+            for task in done:
+                task.result()
+            if cfg.delete_missing:
+                await self._delete_missing(docs, listed, stats)
+        except BaseException:
+            running = (*tasks, producer, writer)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            raise
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            await docs.close()
+
+    async def _delete_missing(
+        self,
+        docs: LocalSource | S3Source,
+        listed: set[str],
+        stats: IngestStats
+    ) -> None:
+        """Drop documents this source covers but no longer lists"""
+        missing = sorted(
+            key for key in await self.store.sources()
+            if docs.covers(key) and key not in listed
+        )
+        step = self.config.upsert_batch
+        for i in range(0, len(missing), step):
+            await self.store.delete_sources(missing[i:i + step])
+        stats.deleted += len(missing)
+        for key in missing:
+            print(f"🗑️ [Ingest] {key} is gone from the source, dropped")
+
+    async def _prepare(
+        self,
+        docs: LocalSource | S3Source,
+        item: SourceItem,
+        pool: ProcessPoolExecutor,
+        queue: asyncio.Queue[_Point | None],
+        stats: IngestStats,
+        force: bool
+    ) -> None:
+        """Skip, or extract and chunk one document onto the upsert queue"""
+        cfg = self.config
+        stats.documents += 1
+        try:
+            if item.size > cfg.max_document_bytes:
+                raise IngestError(
+                    f"{item.size} bytes > INGEST_MAX_DOCUMENT_BYTES"
+                )
+            marker = point_id(item.key, 0)
+            stored = {} if force else (
+                await self.store.retrieve([marker])
+            ).get(marker, {}).get("metadata", {})
+            if stored and stored.get("stamp") == item.stamp:
+                stats.skipped += 1
+                return
+            data = await docs.read(item)
+            doc_hash = await asyncio.to_thread(content_hash, data)
+            if stored.get("doc_hash") == doc_hash:
+                # Touched but unchanged: next time the stamp is enough
+                await self.store.update_metadata(
+                    [marker], {"stamp": item.stamp}
+                )
+                stats.skipped += 1
+                return
+            pages, chunks = await asyncio.get_running_loop().run_in_executor(
+                pool, chunk_document,
+                # A local file is re-read by the worker, not pickled over
+                item.location if item.local else data,
+                item.key, cfg.chunk_chars, cfg.chunk_overlap
+            )
+            del data
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats.failed += 1
+            print(f"⚠️ [Ingest] {item.key}: {type(e).__name__}: {e}")
+            return
+        stats.pages += pages
+        stats.bytes += item.size
+        metadata = {
+            "source": item.key, "doc_hash": doc_hash, "stamp": item.stamp,
+        }
+        if not chunks:
+            # Nothing to search (e.g. a scanned PDF without a text layer)
+            await self.store.delete_stale(item.key, doc_hash)
+            stats.indexed += 1
+            return
+        for chunk in chunks[1:]:
+            await queue.put(_Point(chunk, metadata))
+        await queue.put(_Point(chunks[0], metadata, marker=True))
+
+    async def _write(
+        self,
+        queue: asyncio.Queue[_Point | None],
+        stats: IngestStats
+    ) -> None:
+        batch: list[_Point] = []
+        while True:
+            point = await queue.get()
+            if point is not None:
+                batch.append(point)
+            if batch and (
+                point is None or len(batch) >= self.config.upsert_batch
+            ):
+                await self._flush(batch, stats)
+                batch = []
+            if point is None:
+                return
+
+    async def _flush(self, batch: list[_Point], stats: IngestStats) -> None:
+        step = self.config.embed_batch
+        texts = [p.chunk.text for p in batch]
+        vectors = [
+            await self.embedder.embed(texts[i:i + step])
+            for i in range(0, len(texts), step)
+        ]
+        await self.store.upsert(
+            [point_id(p.metadata["source"], p.chunk.index) for p in batch],
+            np.concatenate(vectors),
+            [
+                {
+                    self.store.text_key: p.chunk.text,
+                    "metadata": {
+                        **p.metadata,
+                        "page": p.chunk.page,
+                        "chunk": p.chunk.index,
+                    },
+                }
+                for p in batch
+            ],
+        )
+        stats.chunks += len(batch)
+        for point in batch:
+            if point.marker:
+                await self.store.delete_stale(
+                    point.metadata["source"], point.metadata["doc_hash"]
+                )
+                stats.indexed += 1
+
+
+###############################################################################
+#
+#                     Background runs for the HTTP API
+#
+###############################################################################
+class IngestionManager:
+    """One ingestion run at a time; keeps the stats of the last one"""
+
+    def __init__(
+        self,
+        config: IngestConfig,
+        store: QdrantStore | None = None
+    ) -> None:
+        self.config = config
+        # Shared with the retriever: local-mode Qdrant allows one client
+        self._store = store
+        self._own_store = store is None
+        self._ingestor: Ingestor | None = None
+        self._task: asyncio.Task[IngestStats] | None = None
+        self.last: IngestStats | None = None
+
+    @classmethod
+    def from_env(
+        cls,
+        store: QdrantStore | None = None
+    ) -> "IngestionManager | None":
+        """None unless INGEST_ENABLED=1"""
+        if os.getenv("INGEST_ENABLED", "0") != "1":
+            return None
+        return cls(IngestConfig.from_env(), store)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _source(self, prefix: str | None) -> str:
+        """The configured source, narrowed to `prefix` inside it"""
+        root = self.config.source
+        if not prefix:
+            return root
+        if root.startswith("s3://"):
+            return f"{root.rstrip('/')}/{prefix.lstrip('/')}"
+        base = Path(root).resolve()
+        path = (base / prefix).resolve()
+        if not path.is_relative_to(base):
+            raise IngestError(f"prefix must stay under {root}")
+        return str(path)
+
+    def start(
+        self,
+        prefix: str | None = None,
+        force: bool = False
+    ) -> IngestStats:
+        if self.running:
+            raise IngestError("an ingestion run is already in progress")
+        source = self._source(prefix)
+        if self._ingestor is None:
+            if self._store is None:
+                self._store = _store_from_env()
+            self._ingestor = Ingestor(
+                self._store, build_embedder(), self.config
+            )
+        stats = IngestStats(source=source)
+        self.last = stats
+        self._task = asyncio.create_task(
+            self._ingestor.run(stats.source, force, stats)
+        )
+        # Failures are recorded in stats; don't warn about them twice
+        self._task.add_done_callback(
+            lambda t: t.cancelled() or t.exception()
+        )
+        return stats
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "source": self.config.source,
+            "running": self.running,
+            "last": self.last.snapshot() if self.last else None,
+        }
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._own_store and self._store is not None:
+            await self._store.close()
+
+
+def _store_from_env() -> QdrantStore:
+    """The collection the retriever searches (QDRANT_*, RAG_*)"""
+    config = RetrievalConfig.from_env()
+    return QdrantStore(
+        config.qdrant_location,
+        config.collection,
+        text_key=config.text_key,
+        api_key=config.qdrant_api_key,
+        max_concurrency=config.max_concurrency
+    )
+
+
+async def _main(args: argparse.Namespace) -> dict[str, Any]:
+    config = IngestConfig.from_env()
+    if args.workers:
+        config.workers = args.workers
+    if args.delete_missing:
+        config.delete_missing = True
+    store = _store_from_env()
+    try:
+        stats = await Ingestor(store, build_embedder(), config).run(
+            args.source, args.force
+        )
+    finally:
+        await store.close()
+    return stats.snapshot()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m services.ingestion",
+        description="Index PDFs (and .txt/.md) into the RAG collection"
+    )
+    parser.add_argument(
+        "source", nargs="?", default=None,
+        help="directory or s3://bucket/prefix (default: INGEST_SOURCE)"
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="re-index documents even if unchanged"
+    )
+    parser.add_argument(
+        "--delete-missing", action="store_true",
+        help="drop indexed documents that are gone from the source "
+             "(default: INGEST_DELETE_MISSING)"
+    )
+    parser.add_argument("--workers", type=int, default=0)
+    print(json.dumps(
+        asyncio.run(_main(parser.parse_args())), indent=2, ensure_ascii=False
+    ))
@@ -0,0 +1,504 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator
+
+from services.engine_manager import (
+    EngineManager,
+    EngineManagerConfig,
+    EngineUnavailable,
+)
+from services.metrics import read_engine_stats
+from services.router import (
+    _SAMPLING_FIELDS,
+    RemoteCompletionOutput,
+    RemoteRequestOutput,
+    build_engine_factory,
+)
+from services.sampling import (
+    RequestOutputKind,
+    SamplingSpec,
+    sampling_factory,
+)
+from services.speculative import read_spec_decode_counters
+
+
+###############################################################################
+#
+#          One engine process shared by several API worker processes
+#
+# The engine owner (`python -m services.ipc`) holds the GPU, the KV cache
+# and the scheduler; API workers (gunicorn -w N, ENGINE_BACKEND=ipc) do
+# HTTP, SSE framing, retrieval and prompt building on their own cores and
+# reach it through IPCEngine over a unix socket. A frame is a 4-byte
+# length and a JSON list of messages; everything queued for a worker in
+# one loop iteration shares a frame, so a decode step costs one write per
+# worker, not one per stream.
+#
+#   worker -> owner  {"t": "gen", "id", "prompt", "sp", "kind", "pri"}
+#                    {"t": "abort", "id"}
+#   owner -> worker  {"t": "out", "id", "o": [[index, text, n_tokens,
+#                     finish_reason], ...], "f": finished, "p", "c"}
+#                    {"t": "err", "id", "e"}
+#                    {"t": "state", "ready", "state", "stats", "spec"}
+#
+###############################################################################
+_HEADER_BYTES = 4
+
+
+class IPCError(RuntimeError):
+    """The engine process failed a request or went away"""
+
+
+@dataclass
+class IPCConfig:
+    socket_path: str = "/tmp/chatbot-engine.sock"
+    # How long a worker waits for the engine process to be ready
+    connect_timeout_s: float = 1800.0
+    # Engine state and load pushed to every worker this often
+    stats_interval_s: float = 0.5
+    # Unsent bytes for one worker before its streams wait for it to read
+    max_buffer_bytes: int = 4 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "IPCConfig":
+        return cls(
+            socket_path=os.getenv("ENGINE_IPC_SOCKET", cls.socket_path),
+            connect_timeout_s=float(
+                os.getenv(
+                    "ENGINE_IPC_CONNECT_TIMEOUT_S", cls.connect_timeout_s
+                )
+            ),
+            stats_interval_s=float(
+                os.getenv("ENGINE_IPC_STATS_INTERVAL_S", cls.stats_interval_s)
+            ),
+            max_buffer_bytes=int(
+                os.getenv("ENGINE_IPC_MAX_BUFFER_BYTES", cls.max_buffer_bytes)
+            ),
+        )
+
+
+async def read_frame(reader: asyncio.StreamReader) -> list[dict[str, Any]]:
+    header = await reader.readexactly(_HEADER_BYTES)
+    return json.loads(
+        await reader.readexactly(int.from_bytes(header, "big"))
+    )
+
+
+class _Channel:
+    """Coalesces messages into one frame per loop iteration"""
+
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        max_buffer_bytes: int = IPCConfig.max_buffer_bytes
+    ) -> None:
+        self.writer = writer
+        self.max_buffer_bytes = max_buffer_bytes
+        self.frames = 0
+        self.messages = 0
+        self._pending: list[dict[str, Any]] = []
+
+    def send(self, message: dict[str, Any]) -> None:
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._pending.append(message)
+
+    def _flush(self) -> None:
+        pending, self._pending = self._pending, []
+        if self.writer.is_closing():
+            return
+        payload = json.dumps(
+            pending, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+        self.writer.write(
+            len(payload).to_bytes(_HEADER_BYTES, "big") + payload
+        )
+        self.frames += 1
+        self.messages += len(pending)
+
+    async def drain(self) -> None:
+        """Wait only when the peer has fallen behind"""
+        transport = self.writer.transport
+        if transport.get_write_buffer_size() > self.max_buffer_bytes:
+            await self.writer.drain()
+
+    async def close(self) -> None:
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+###############################################################################
+#
+#                   Worker side: the engine behind a socket
+#
+###############################################################################
+def _sampling_fields(sampling_params: Any) -> dict[str, Any]:
+    return {
+        name: getattr(sampling_params, name)
+        for name in _SAMPLING_FIELDS
+        if getattr(sampling_params, name, None) is not None
+    }
+
+
+class IPCEngine:
+    """
+    LLMEngine backed by the engine process. Outputs are RemoteRequestOutput
+    with placeholder token IDs; only their counts cross the socket.
+    """
+
+    def __init__(
+        self,
+        config: IPCConfig,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+    ) -> None:
+        self.config = config
+        self._reader = reader
+        self._channel = _Channel(writer)
+        self._streams: dict[str, asyncio.Queue[dict[str, Any]]] = {}
+        self._state: dict[str, Any] = {}
+        self._ready = asyncio.Event()
+        self.closed: str | None = None
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def connect(cls, config: IPCConfig | None = None) -> "IPCEngine":
+        """Wait for the socket, then for the engine process to be ready"""
+        config = config or IPCConfig()
+        deadline = time.monotonic() + config.connect_timeout_s
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    config.socket_path
+                )
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise IPCError(
+                        f"no engine process at {config.socket_path}"
+                    ) from None
+                await asyncio.sleep(0.5)
+        engine = cls(config, reader, writer)
+        try:
+            await asyncio.wait_for(
+                engine._ready.wait(), max(0.0, deadline - time.monotonic())
+            )
+        except asyncio.TimeoutError:
+            await engine.shutdown()
+            raise IPCError(
+                f"engine process not ready after {config.connect_timeout_s}s"
+            ) from None
+        if engine.closed is not None:
+            raise IPCError(engine.closed)
+        return engine
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                for message in await read_frame(self._reader):
+                    if message["t"] == "state":
+                        self._state = message
+                        if message["ready"]:
+                            self._ready.set()
+                        continue
+                    queue = self._streams.get(message["id"])
+                    if queue is not None:
+                        queue.put_nowait(message)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.closed = f"engine process connection lost: {e}"
+        except asyncio.CancelledError:
+            self.closed = "engine connection closed"
+            raise
+        finally:
+            print(f"⚠️ [IPC] {self.closed}")
+            for queue in self._streams.values():
+                queue.put_nowait({"e": self.closed})
+            # Wake a connect() still waiting for the first ready state
+            self._ready.set()
+
+    @property
+    def errored(self) -> bool:
+        """Lost the engine process; EngineManager reconnects on this"""
+        return self.closed is not None
+
+    async def generate(
+        self,
+        prompt: Any,
+        sampling_params: Any,
+        request_id: str,
+        priority: int = 0
+    ) -> AsyncGenerator[RemoteRequestOutput, None]:
+        if self.closed is not None:
+            raise IPCError(self.closed)
+        prompt_ids: list[int] = (
+            prompt["prompt_token_ids"] if isinstance(prompt, dict) else []
+        )
+        queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self._streams[request_id] = queue
+        self._channel.send({
+            "t": "gen",
+            "id": request_id,
+            "prompt": prompt,
+            "sp": _sampling_fields(sampling_params),
+            "kind": getattr(
+                getattr(sampling_params, "output_kind", None),
+                "name", "CUMULATIVE"
+            ),
+            "pri": priority,
+        })
+        finished = False
+        try:
+            while not finished:
+                message = await queue.get()
+                if "e" in message:
+                    raise IPCError(message["e"])
+                if "p" in message and not prompt_ids:
+                    prompt_ids = [0] * message["p"]
+                finished = message["f"]
+                yield RemoteRequestOutput(
+                    request_id=request_id,
+                    prompt_token_ids=prompt_ids,
+                    outputs=[
+                        RemoteCompletionOutput(
+                            index=index,
+                            text=text,
+                            token_ids=[0] * n_tokens,
+                            finish_reason=finish_reason,
+                        )
+                        for index, text, n_tokens, finish_reason
+                        in message["o"]
+                    ],
+                    finished=finished,
+                    num_cached_tokens=message.get("c", 0),
+                )
+        finally:
+            self._streams.pop(request_id, None)
+            if not finished and self.closed is None:
+                self._channel.send({"t": "abort", "id": request_id})
+
+    async def abort(self, request_id: str) -> None:
+        # A stream closed before finishing has already sent its abort
+        if request_id in self._streams and self.closed is None:
+            self._channel.send({"t": "abort", "id": request_id})
+
+    def get_stats(self) -> dict[str, float]:
+        return self._state.get("stats", {})
+
+    def get_spec_decode_stats(self) -> dict[str, float]:
+        return self._state.get("spec", {})
+
+    async def shutdown(self) -> None:
+        self._read_task.cancel()
+        await asyncio.gather(self._read_task, return_exceptions=True)
+        await self._channel.close()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "socket": self.config.socket_path,
+            "connected": self.closed is None,
+            "engine": self._state.get("state"),
+            "streams": len(self._streams),
+        }
+
+
+###############################################################################
+#
+#                   Owner side: serve one engine to workers
+#
+###############################################################################
+class EngineServer:
+    """Runs requests from every connected worker on one engine"""
+
+    def __init__(self, manager: EngineManager, config: IPCConfig) -> None:
+        self.manager = manager
+        self.config = config
+        self.requests = 0
+        self._channels: set[_Channel] = set()
+        self._server: asyncio.AbstractServer | None = None
+        self._stats_task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        path = self.config.socket_path
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._serve, path)
+        os.chmod(path, 0o660)
+        self.manager.start()
+        self._stats_task = asyncio.create_task(self._push_state())
+        print(f"🔌 [IPC] engine process listening on {path}")
+
+    async def close(self) -> None:
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+        if self._server is not None:
+            self._server.close()
+        for channel in list(self._channels):
+            await channel.close()
+        if os.path.exists(self.config.socket_path):
+            os.unlink(self.config.socket_path)
+        await self.manager.shutdown()
+
+    def _state(self) -> dict[str, Any]:
+        engine = self.manager.engine if self.manager.ready else None
+        return {
+            "t": "state",
+            "ready": self.manager.ready,
+            "state": self.manager.state.value,
+            "stats": read_engine_stats(engine),
+            "spec": read_spec_decode_counters(engine),
+        }
+
+    async def _push_state(self) -> None:
+        while True:
+            state = self._state()
+            for channel in self._channels:
+                channel.send(state)
+            await asyncio.sleep(self.config.stats_interval_s)
+
+    async def _serve(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter
+    ) -> None:
+        channel = _Channel(writer, self.config.max_buffer_bytes)
+        self._channels.add(channel)
+        channel.send(self._state())
+        tasks: dict[str, asyncio.Task[None]] = {}
+        print(f"🔗 [IPC] worker connected ({len(self._channels)} total)")
+        try:
+            while True:
+                for message in await read_frame(reader):
+                    request_id = message["id"]
+                    if message["t"] == "gen":
+                        task = asyncio.create_task(
+                            self._generate(channel, message)
+                        )
+                        tasks[request_id] = task
+                        task.add_done_callback(
+                            lambda _, rid=request_id: tasks.pop(rid, None)
+                        )
+                    elif message["t"] == "abort":
+                        task = tasks.get(request_id)
+                        if task is not None:
+                            task.cancel()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._channels.discard(channel)
+            # A worker that went away cannot read its streams any more
+            for task in list(tasks.values()):
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            await channel.close()
+            print(f"🔗 [IPC] worker disconnected ({len(self._channels)} left)")
+
+    async def _generate(
+        self,
+        channel: _Channel,
+        message: dict[str, Any]
+    ) -> None:
+        request_id = message["id"]
+        self.requests += 1
+        try:
+            engine = await self.manager.get()
+        except EngineUnavailable as e:
+            channel.send({"t": "err", "id": request_id, "e": str(e)})
+            return
+        fields = message["sp"]
+        spec = SamplingSpec(**{
+            **fields, "stop": tuple(fields.get("stop") or ())
+        })
+        generator = engine.generate(
+            prompt=message["prompt"],
+            sampling_params=sampling_factory.params(
+                spec, RequestOutputKind[message["kind"]]
+            ),
+            request_id=request_id,
+            **({"priority": message["pri"]} if message["pri"] else {})
+        )
+        finished = False
+        first = True
+        try:
+            async for output in generator:
+                finished = output.finished
+                reply: dict[str, Any] = {
+                    "t": "out",
+                    "id": request_id,
+                    "o": [
+                        [c.index, c.text, len(c.token_ids), c.finish_reason]
+                        for c in output.outputs
+                    ],
+                    "f": finished,
+                }
+                if first:
+                    first = False
+                    reply["p"] = len(output.prompt_token_ids or ())
+                    reply["c"] = getattr(output, "num_cached_tokens", 0) or 0
+                channel.send(reply)
+                if finished:
+                    break
+                await channel.drain()
+            if not finished:
+                raise IPCError("engine stream ended before finishing")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.manager.report_error(e)
+            channel.send({
+                "t": "err", "id": request_id,
+                "e": f"{type(e).__name__}: {e}",
+            })
+            return
+        finally:
+            if not finished:
+                await asyncio.shield(_abort(engine, generator, request_id))
+        self.manager.report_success()
+
+
+async def _abort(
+    engine: Any,
+    generator: AsyncGenerator[Any, None],
+    request_id: str
+) -> None:
+    await generator.aclose()
+    await engine.abort(request_id)
+
+
+async def serve_engine() -> None:
+    """Run the engine process until SIGTERM/SIGINT"""
+    from services.engine import get_engine_backend
+    from services.vllm_service import vLLMService
+
+    if get_engine_backend() == "ipc":
+        raise ValueError(
+            "The engine process needs a real backend, not ENGINE_BACKEND=ipc"
+        )
+    # With ROUTER_REPLICAS set the shared engine is itself a router
+    server = EngineServer(
+        EngineManager(
+            build_engine_factory(vLLMService.init_resource),
+            EngineManagerConfig.from_env()
+        ),
+        IPCConfig.from_env()
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await server.start()
+    try:
+        await stop.wait()
+    finally:
+        print("🛑 [IPC] engine process shutting down...")
+        await server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve_engine())
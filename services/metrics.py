@@ -0,0 +1,406 @@
+from bisect import bisect_left
+from typing import Any, Callable, Iterable
+
+
+###############################################################################
+#
+#          Minimal Prometheus-compatible metrics (text format 0.0.4)
+#
+# Everything runs on the event loop thread, so observations are plain
+# attribute updates: no locks, and histograms use a fixed bucket array.
+#
+###############################################################################
+PREFIX = "chatbot_"
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.value = 0.0
+        self._children: dict[tuple[str, ...], _CounterChild] = {}
+
+    def labels(self, *values: str) -> _CounterChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _CounterChild()
+        return child
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        if self.labelnames:
+            for values, child in self._children.items():
+                yield (
+                    f"{self.name}_total"
+                    f"{_labels(self.labelnames, values)} {_fmt(child.value)}"
+                )
+        else:
+            yield f"{self.name}_total {_fmt(self.value)}"
+
+
+class Gauge:
+    """Either set directly or computed by `callback` at scrape time"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float | None] | None = None
+    ) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.callback = callback
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def render(self) -> Iterable[str]:
+        value = self.callback() if self.callback else self.value
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_fmt(value)}"
+
+
+class Histogram:
+    __slots__ = (
+        "name", "documentation", "bounds", "counts", "sum", "count"
+    )
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple[float, ...]
+    ) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.bounds = tuple(sorted(buckets))
+        # One slot per bound plus +Inf; cumulative sums built at scrape time
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        cumulative = 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += n
+            yield f'{self.name}_bucket{{le="{_fmt(bound)}"}} {cumulative}'
+        yield f"{self.name}_sum {_fmt(self.sum)}"
+        yield f"{self.name}_count {self.count}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: list[Counter | Gauge | Histogram] = []
+        self._collectors: list[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]) -> None:
+        """Extra exposition lines produced at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {type(e).__name__}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 120.0,
+)
+_ITL_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075, 0.1, 0.25,
+    0.5, 1.0,
+)
+_TOKEN_BUCKETS = (
+    1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096,
+)
+_BYTE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576,
+)
+
+
+###############################################################################
+#
+#                        Serving-path metrics
+#
+###############################################################################
+REQUEST_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "request_queue_seconds",
+    "Time spent waiting for admission",
+    _LATENCY_BUCKETS
+))
+TTFT_SECONDS = REGISTRY.register(Histogram(
+    "time_to_first_token_seconds",
+    "Engine submit to first generated text",
+    _LATENCY_BUCKETS
+))
+INTER_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    "inter_token_latency_seconds",
+    "Gap between consecutive engine outputs",
+    _ITL_BUCKETS
+))
+GENERATION_SECONDS = REGISTRY.register(Histogram(
+    "generation_seconds",
+    "Engine submit to final output",
+    _LATENCY_BUCKETS
+))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "prompt_tokens",
+    "Prompt length in tokens",
+    _TOKEN_BUCKETS
+))
+OUTPUT_TOKENS = REGISTRY.register(Histogram(
+    "output_tokens",
+    "Generated tokens per request",
+    _TOKEN_BUCKETS
+))
+PREFIX_CACHE_HIT_RATIO = REGISTRY.register(Histogram(
+    "prefix_cache_hit_ratio",
+    "Share of each prompt served from vLLM's prefix cache",
+    (0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 1.0)
+))
+SSE_BYTES = REGISTRY.register(Histogram(
+    "sse_response_bytes",
+    "SSE bytes written per response",
+    _BYTE_BUCKETS
+))
+SSE_BYTES_TOTAL = REGISTRY.register(Counter(
+    "sse_bytes",
+    "SSE bytes written"
+))
+STREAMS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "streams_in_flight",
+    "SSE responses currently streaming"
+))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "admission_rejected",
+    "Requests turned away by admission control",
+    ("reason",)
+))
+
+
+###############################################################################
+#
+#                     Retrieval (RAG) stage metrics
+#
+###############################################################################
+RAG_EMBED_SECONDS = REGISTRY.register(Histogram(
+    "rag_embed_seconds",
+    "Question embedding, including time spent waiting for a batch",
+    _LATENCY_BUCKETS
+))
+RAG_EMBED_BATCH_SIZE = REGISTRY.register(Histogram(
+    "rag_embed_batch_size",
+    "Texts per embedding model call",
+    _TOKEN_BUCKETS
+))
+RAG_SEARCH_SECONDS = REGISTRY.register(Histogram(
+    "rag_search_seconds",
+    "Vector store query",
+    _LATENCY_BUCKETS
+))
+RAG_RERANK_SECONDS = REGISTRY.register(Histogram(
+    "rag_rerank_seconds",
+    "Reranking of the fetched candidates",
+    _LATENCY_BUCKETS
+))
+RAG_TOKENIZE_SECONDS = REGISTRY.register(Histogram(
+    "rag_tokenize_seconds",
+    "Token counting of question and candidates",
+    _LATENCY_BUCKETS
+))
+RAG_RETRIEVAL_SECONDS = REGISTRY.register(Histogram(
+    "rag_retrieval_seconds",
+    "Question in to assembled prompt out",
+    _LATENCY_BUCKETS
+))
+RAG_CONTEXT_TOKENS = REGISTRY.register(Histogram(
+    "rag_context_tokens",
+    "Document tokens placed in the prompt",
+    _TOKEN_BUCKETS
+))
+
+
+###############################################################################
+#
+#                          API process health
+#
+###############################################################################
+EVENT_LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds",
+    "How late the loop-lag sampler woke up",
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+))
+TOKENIZE_SECONDS = REGISTRY.register(Histogram(
+    "tokenize_seconds",
+    "One prompt's tokenization on the tokenizer pool",
+    _ITL_BUCKETS
+))
+TOKENIZE_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "tokenize_queue_seconds",
+    "Time a tokenization job waited for a tokenizer thread",
+    _ITL_BUCKETS
+))
+
+
+###############################################################################
+#
+#                      Scrape-time collectors
+#
+###############################################################################
+def stats_collector(
+    name: str,
+    snapshot: Callable[[], dict[str, Any]]
+) -> Callable[[], Iterable[str]]:
+    """Expose the numeric fields of a snapshot() dict as untyped samples"""
+    def collect() -> Iterable[str]:
+        for key, value in snapshot().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = f"{PREFIX}{name}_{key}"
+                yield f"# TYPE {metric} untyped"
+                yield f"{metric} {_fmt(value)}"
+    return collect
+
+
+def labeled_collector(
+    name: str,
+    label: str,
+    snapshots: Callable[[], dict[str, dict[str, Any]]]
+) -> Callable[[], Iterable[str]]:
+    """Like stats_collector, for one snapshot per `label` value"""
+    def collect() -> Iterable[str]:
+        samples: dict[str, list[str]] = {}
+        for value, snapshot in snapshots().items():
+            labels = _labels((label,), (value,))
+            for key, number in snapshot.items():
+                if isinstance(number, (int, float)) and \
+                        not isinstance(number, bool):
+                    samples.setdefault(f"{PREFIX}{name}_{key}", []).append(
+                        f"{PREFIX}{name}_{key}{labels} {_fmt(number)}"
+                    )
+        for metric, lines in samples.items():
+            yield f"# TYPE {metric} untyped"
+            yield from lines
+    return collect
+
+
+# vLLM's own Prometheus gauges, summed over their label sets
+_VLLM_ENGINE_GAUGES: dict[str, str] = {
+    "vllm:gpu_cache_usage_perc": "kv_cache_usage",
+    "vllm:kv_cache_usage_perc": "kv_cache_usage",
+    "vllm:num_requests_running": "num_requests_running",
+    "vllm:num_requests_waiting": "num_requests_waiting",
+}
+
+
+def read_engine_stats(engine: Any) -> dict[str, float]:
+    """KV-cache usage and running/waiting counts for `engine`"""
+    if engine is None:
+        return {}
+    get_stats = getattr(engine, "get_stats", None)
+    if get_stats is not None:
+        return get_stats()
+    try:
+        from prometheus_client import REGISTRY as PROMETHEUS_REGISTRY
+    except ImportError:
+        return {}
+    stats: dict[str, float] = {}
+    for family in PROMETHEUS_REGISTRY.collect():
+        key = _VLLM_ENGINE_GAUGES.get(family.name)
+        if key is not None:
+            stats[key] = sum(sample.value for sample in family.samples)
+    return stats
+
+
+def engine_collector(
+    get_engine: Callable[[], Any]
+) -> Callable[[], Iterable[str]]:
+    def collect() -> Iterable[str]:
+        for key, value in read_engine_stats(get_engine()).items():
+            metric = f"{PREFIX}engine_{key}"
+            yield f"# TYPE {metric} gauge"
+            yield f"{metric} {_fmt(value)}"
+    return collect
+
+
+def vllm_collector() -> Iterable[str]:
+    """Everything vLLM registered with prometheus_client, verbatim"""
+    try:
+        from prometheus_client import REGISTRY as PROMETHEUS_REGISTRY
+        from prometheus_client import generate_latest
+    except ImportError:
+        return []
+    return generate_latest(PROMETHEUS_REGISTRY).decode("utf-8").splitlines()
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
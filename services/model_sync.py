@@ -0,0 +1,469 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+
+###############################################################################
+#
+#             Model directory sync: content-addressed and resumable
+#
+# The manifest lists every file with its size and the sha256 of each
+# `chunk_bytes` chunk. sync() hashes the source chunk by chunk on a thread
+# pool (hashlib and file I/O release the GIL) and writes only the chunks
+# whose hash differs from what the destination holds, so a changed shard
+# costs its changed chunks and an unchanged tree costs a read. Finished
+# chunks are appended to a journal in the destination, so an interrupted
+# sync resumes where it stopped. The manifest is marked incomplete for the
+# whole sync and complete only after the copy is verified, so the server
+# refuses a half-synced directory at startup (verify_model_dir).
+#
+###############################################################################
+MANIFEST_NAME = ".model_manifest.json"
+JOURNAL_NAME = ".model_sync.journal"
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+_OWN_FILES = (MANIFEST_NAME, JOURNAL_NAME, MANIFEST_NAME + ".tmp")
+
+
+class ModelSyncError(RuntimeError):
+    pass
+
+
+@dataclass
+class FileEntry:
+    path: str
+    size: int
+    chunks: list[str]
+    # Source mtime: lets the next sync skip hashing an untouched file
+    mtime_ns: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "path": self.path,
+            "size": self.size,
+            "chunks": self.chunks,
+            "mtime_ns": self.mtime_ns,
+        }
+
+
+@dataclass
+class SyncStats:
+    files: int = 0
+    files_unchanged: int = 0
+    files_deleted: int = 0
+    chunks: int = 0
+    chunks_written: int = 0
+    chunks_resumed: int = 0
+    bytes_total: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0
+    verified: str = "none"
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False
+    )
+
+    def add(self, **counts: int) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def snapshot(self) -> dict[str, Any]:
+        data = {k: v for k, v in vars(self).items() if not k.startswith("_")}
+        data["read_mb_per_s"] = (
+            self.bytes_read / self.seconds / 1e6 if self.seconds else 0.0
+        )
+        return data
+
+
+def _iter_files(root: Path) -> Iterator[Path]:
+    for path in sorted(root.rglob("*")):
+        if path.is_file() and path.name not in _OWN_FILES:
+            yield path
+
+
+def _chunk_count(size: int, chunk_bytes: int) -> int:
+    return max(1, -(-size // chunk_bytes))
+
+
+def _read_chunk(path: Path, index: int, chunk_bytes: int) -> bytes:
+    with path.open("rb") as f:
+        f.seek(index * chunk_bytes)
+        return f.read(chunk_bytes)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_manifest(root: str | Path) -> dict[str, Any] | None:
+    try:
+        return json.loads((Path(root) / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(
+    root: Path,
+    entries: dict[str, FileEntry],
+    chunk_bytes: int,
+    complete: bool
+) -> None:
+    manifest = {
+        "complete": complete,
+        "chunk_bytes": chunk_bytes,
+        "files": [entries[p].as_dict() for p in sorted(entries)],
+        "written_at": time.time(),
+    }
+    tmp = root / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, root / MANIFEST_NAME)
+
+
+class _Journal:
+    """Append-only record of chunks known to be in place at the destination"""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # (file, size, mtime_ns, chunk) -> sha256
+        self.done: dict[tuple[str, int, int, int], str] = {}
+        if path.exists():
+            for line in path.read_text().splitlines():
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    # Torn last line from the interruption
+                    continue
+                self.done[(r["f"], r["s"], r["m"], r["c"])] = r["h"]
+        self._file = path.open("a")
+        self._lock = threading.Lock()
+
+    def record(self, entry: FileEntry, index: int, digest: str) -> None:
+        line = json.dumps({
+            "f": entry.path, "s": entry.size, "m": entry.mtime_ns,
+            "c": index, "h": digest,
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def remove(self) -> None:
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def _previous_entries(
+    manifest: dict[str, Any] | None,
+    chunk_bytes: int
+) -> dict[str, FileEntry]:
+    """Entries of a previous complete sync with the same chunking"""
+    if not manifest or not manifest.get("complete") \
+            or manifest.get("chunk_bytes") != chunk_bytes:
+        return {}
+    return {
+        f["path"]: FileEntry(f["path"], f["size"], f["chunks"], f["mtime_ns"])
+        for f in manifest.get("files", [])
+    }
+
+
+def sync(
+    src: str | Path,
+    dst: str | Path,
+    workers: int = 8,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    delete: bool = False,
+    verify: str = "full",
+    checkpoint: Callable[[], None] | None = None,
+    checkpoint_bytes: int = 4 * 1024 ** 3
+) -> SyncStats:
+    """
+    Make `dst` a verified copy of `src`.
+
+    `checkpoint` (e.g. a Modal volume commit) is called every
+    `checkpoint_bytes` written, so progress survives a killed container.
+    `verify` is "full" (rehash the destination), "size" or "none".
+    """
+    src_root, dst_root = Path(src), Path(dst)
+    if not src_root.is_dir():
+        raise ModelSyncError(f"source is not a directory: {src}")
+    dst_root.mkdir(parents=True, exist_ok=True)
+    started = time.monotonic()
+    stats = SyncStats()
+    previous = _previous_entries(load_manifest(dst_root), chunk_bytes)
+    # From here until verification the directory is not servable
+    _write_manifest(dst_root, previous, chunk_bytes, complete=False)
+    journal = _Journal(dst_root / JOURNAL_NAME)
+
+    entries: dict[str, FileEntry] = {}
+    jobs: list[tuple[FileEntry, Path, Path, int, bool]] = []
+    for path in _iter_files(src_root):
+        rel = path.relative_to(src_root).as_posix()
+        st = path.stat()
+        n = _chunk_count(st.st_size, chunk_bytes)
+        entry = FileEntry(rel, st.st_size, [""] * n, st.st_mtime_ns)
+        entries[rel] = entry
+        target = dst_root / rel
+        stats.add(files=1, chunks=n, bytes_total=st.st_size)
+        old = previous.get(rel)
+        if (
+            old is not None
+            and (old.size, old.mtime_ns) == (entry.size, entry.mtime_ns)
+            and target.is_file() and target.stat().st_size == entry.size
+        ):
+            entry.chunks = old.chunks
+            stats.add(files_unchanged=1)
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fresh = not target.exists()
+        with target.open("ab") as f:
+            f.truncate(entry.size)
+        jobs.extend((entry, path, target, i, fresh) for i in range(n))
+
+    written_since = [0]
+    lock = threading.Lock()
+
+    def copy_chunk(
+        entry: FileEntry,
+        source: Path,
+        target: Path,
+        index: int,
+        fresh: bool
+    ) -> int:
+        key = (entry.path, entry.size, entry.mtime_ns, index)
+        if key in journal.done:
+            entry.chunks[index] = journal.done[key]
+            stats.add(chunks_resumed=1)
+            return 0
+        data = _read_chunk(source, index, chunk_bytes)
+        digest = _sha256(data)
+        entry.chunks[index] = digest
+        stats.add(bytes_read=len(data))
+        if fresh or _sha256(
+            _read_chunk(target, index, chunk_bytes)
+        ) != digest:
+            with target.open("r+b") as f:
+                f.seek(index * chunk_bytes)
+                f.write(data)
+            stats.add(chunks_written=1, bytes_written=len(data))
+            written = len(data)
+        else:
+            written = 0
+        journal.record(entry, index, digest)
+        return written
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for written in pool.map(lambda job: copy_chunk(*job), jobs):
+            if checkpoint is None or not written:
+                continue
+            with lock:
+                written_since[0] += written
+                due = written_since[0] >= checkpoint_bytes
+                if due:
+                    written_since[0] = 0
+            if due:
+                checkpoint()
+
+    if delete:
+        for path in _iter_files(dst_root):
+            if path.relative_to(dst_root).as_posix() not in entries:
+                path.unlink()
+                stats.add(files_deleted=1)
+
+    problems = verify_entries(dst_root, entries, chunk_bytes, verify, workers)
+    if problems:
+        journal.close()
+        raise ModelSyncError(
+            f"{len(problems)} files failed verification, e.g. {problems[0]}"
+        )
+    stats.verified = verify
+    _write_manifest(dst_root, entries, chunk_bytes, complete=True)
+    journal.remove()
+    stats.seconds = time.monotonic() - started
+    return stats
+
+
+def verify_entries(
+    root: Path,
+    entries: dict[str, FileEntry],
+    chunk_bytes: int,
+    mode: str = "size",
+    workers: int = 8
+) -> list[str]:
+    """Files under `root` that do not match `entries` ("size" or "full")"""
+    if mode == "none":
+        return []
+    problems: list[str] = []
+    for entry in entries.values():
+        path = root / entry.path
+        if not path.is_file():
+            problems.append(f"{entry.path}: missing")
+        elif path.stat().st_size != entry.size:
+            problems.append(f"{entry.path}: size differs")
+    if mode != "full" or problems:
+        return problems
+
+    def check(job: tuple[FileEntry, int]) -> str | None:
+        entry, index = job
+        data = _read_chunk(root / entry.path, index, chunk_bytes)
+        if _sha256(data) != entry.chunks[index]:
+            return f"{entry.path}: chunk {index} differs"
+        return None
+
+    jobs = [
+        (entry, index) for entry in entries.values()
+        for index in range(len(entry.chunks))
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        problems.extend(p for p in pool.map(check, jobs) if p)
+    return problems
+
+
+def find_manifest(path: str | Path) -> Path | None:
+    """The sync root at or above `path` (the model may be a subdirectory)"""
+    current = Path(path).resolve()
+    for directory in (current, *current.parents):
+        if (directory / MANIFEST_NAME).is_file():
+            return directory
+    return None
+
+
+def verify_model_dir(
+    model_path: str,
+    mode: str = "size",
+    required: bool = False,
+    workers: int = 8
+) -> dict[str, Any]:
+    """
+    Check the files under `model_path` against the sync manifest before
+    the engine loads them. Raises ModelSyncError on a partial or corrupt
+    sync; a directory that was never synced only fails when `required`.
+    "full" rehashes every chunk, which also warms the page cache for the
+    weight load that follows.
+    """
+    root = find_manifest(model_path)
+    if root is None:
+        if required:
+            raise ModelSyncError(f"no {MANIFEST_NAME} at or above {model_path}")
+        return {"manifest": None, "mode": mode, "files": 0}
+    manifest = load_manifest(root) or {}
+    if not manifest.get("complete"):
+        raise ModelSyncError(f"model sync into {root} did not complete")
+    prefix = Path(model_path).resolve().relative_to(root.resolve()).as_posix()
+    entries = {
+        f["path"]: FileEntry(f["path"], f["size"], f["chunks"], f["mtime_ns"])
+        for f in manifest.get("files", [])
+        if prefix == "." or f["path"].startswith(prefix + "/")
+    }
+    problems = verify_entries(
+        root, entries, manifest["chunk_bytes"], mode, workers
+    )
+    if problems:
+        raise ModelSyncError(
+            f"{len(problems)} model files failed verification, "
+            f"e.g. {problems[0]}"
+        )
+    return {"manifest": str(root / MANIFEST_NAME), "mode": mode,
+            "files": len(entries)}
+
+
+def manifest_digest(model_path: str) -> str | None:
+    """Hash of the synced model's chunk hashes, None if not synced"""
+    root = find_manifest(model_path)
+    manifest = load_manifest(root) if root else None
+    if not manifest or not manifest.get("complete"):
+        return None
+    prefix = Path(model_path).resolve().relative_to(root.resolve()).as_posix()
+    digest = hashlib.sha256()
+    for f in manifest.get("files", []):
+        if prefix == "." or f["path"].startswith(prefix + "/"):
+            digest.update(f["path"].encode())
+            digest.update("".join(f["chunks"]).encode())
+    return digest.hexdigest()[:16]
+
+
+@dataclass
+class ModelVerifyConfig:
+    # "size", "full" or "off"
+    mode: str = "size"
+    # Refuse to load a model directory that was never synced
+    required: bool = False
+    workers: int = 8
+
+    @classmethod
+    def from_env(cls) -> "ModelVerifyConfig":
+        mode = os.getenv("MODEL_VERIFY", "size").lower()
+        if mode not in ("size", "full", "off"):
+            raise ValueError(f"MODEL_VERIFY must be size, full or off: {mode!r}")
+        return cls(
+            mode=mode,
+            required=os.getenv("MODEL_MANIFEST_REQUIRED", "0") == "1",
+            workers=int(os.getenv("MODEL_VERIFY_WORKERS", "8")),
+        )
+
+    def check(self, model_path: str) -> dict[str, Any] | None:
+        if self.mode == "off":
+            return None
+        result = verify_model_dir(
+            model_path, self.mode, self.required, self.workers
+        )
+        if result["manifest"] is None:
+            print(f"⚠️ No sync manifest for {model_path}, skipping verification")
+        return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m services.model_sync",
+        description="Sync a model directory, or verify a synced one"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    sync_cmd = commands.add_parser("sync")
+    sync_cmd.add_argument("src")
+    sync_cmd.add_argument("dst")
+    sync_cmd.add_argument("--workers", type=int, default=8)
+    sync_cmd.add_argument(
+        "--chunk-mb", type=int, default=DEFAULT_CHUNK_BYTES // 2 ** 20
+    )
+    sync_cmd.add_argument(
+        "--delete", action="store_true",
+        help="remove destination files that are not in the source"
+    )
+    sync_cmd.add_argument(
+        "--verify", choices=("full", "size", "none"), default="full"
+    )
+    verify_cmd = commands.add_parser("verify")
+    verify_cmd.add_argument("path")
+    verify_cmd.add_argument("--full", action="store_true")
+    verify_cmd.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "sync":
+            result = sync(
+                args.src, args.dst, workers=args.workers,
+                chunk_bytes=args.chunk_mb * 2 ** 20, delete=args.delete,
+                verify=args.verify
+            ).snapshot()
+        else:
+            result = verify_model_dir(
+                args.path, "full" if args.full else "size", required=True,
+                workers=args.workers
+            )
+    except ModelSyncError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import asyncio
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any
+
+from services import metrics
+
+
+###############################################################################
+#
+#                 Event-loop lag sampler and on-demand profiling
+#
+# The sampler sleeps `interval_s` and measures how late it woke up: that
+# delay is what every coroutine on the loop waited behind something that
+# did not yield (JSON encoding, tokenization, a sync call). The profiler
+# runs cProfile on the loop thread for a bounded number of seconds;
+# work handed to worker threads (asyncio.to_thread) is not in it.
+#
+###############################################################################
+@dataclass
+class LoopLagConfig:
+    interval_s: float = 0.1
+    # Lag above this is logged
+    warn_s: float = 0.25
+    # Samples kept for the percentiles in snapshot()
+    window: int = 600
+
+    @classmethod
+    def from_env(cls) -> "LoopLagConfig | None":
+        if os.getenv("LOOP_LAG_ENABLED", "1") != "1":
+            return None
+        return cls(
+            interval_s=float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")) / 1000,
+            warn_s=float(os.getenv("LOOP_LAG_WARN_MS", "250")) / 1000,
+            window=int(os.getenv("LOOP_LAG_WINDOW", "600")),
+        )
+
+
+class LoopLagMonitor:
+    def __init__(self, config: LoopLagConfig) -> None:
+        self.config = config
+        self.samples = 0
+        self.warnings = 0
+        self.last_s = 0.0
+        self.max_s = 0.0
+        self._recent: deque[float] = deque(maxlen=config.window)
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    def from_env(cls) -> "LoopLagMonitor | None":
+        config = LoopLagConfig.from_env()
+        return cls(config) if config is not None else None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        interval = self.config.interval_s
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.record(max(time.perf_counter() - started - interval, 0.0))
+
+    def record(self, lag: float) -> None:
+        self.samples += 1
+        self.last_s = lag
+        self.max_s = max(self.max_s, lag)
+        self._recent.append(lag)
+        metrics.EVENT_LOOP_LAG_SECONDS.observe(lag)
+        if lag >= self.config.warn_s:
+            self.warnings += 1
+            print(f"🐢 Event loop blocked for {lag * 1000:.0f} ms")
+
+    def snapshot(self) -> dict[str, Any]:
+        recent = sorted(self._recent)
+
+        def pct(q: float) -> float:
+            return recent[min(int(q * len(recent)), len(recent) - 1)] \
+                if recent else 0.0
+
+        return {
+            "samples": self.samples,
+            "warnings": self.warnings,
+            "last_s": self.last_s,
+            "max_s": self.max_s,
+            "p50_s": pct(0.50),
+            "p99_s": pct(0.99),
+        }
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+@dataclass
+class ProfilingConfig:
+    max_seconds: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "ProfilingConfig | None":
+        if os.getenv("PROFILE_ENABLED", "0") != "1":
+            return None
+        return cls(
+            max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "60")),
+        )
+
+
+class CPUProfiler:
+    """cProfile of the API process's event-loop thread, one at a time"""
+
+    SORT_KEYS = ("cumulative", "tottime", "calls")
+
+    def __init__(self, config: ProfilingConfig) -> None:
+        self.config = config
+        self.captures = 0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CPUProfiler | None":
+        config = ProfilingConfig.from_env()
+        return cls(config) if config is not None else None
+
+    async def capture(self, seconds: float) -> pstats.Stats:
+        """Profile everything the loop runs for `seconds`"""
+        if self._lock.locked():
+            raise ProfilerBusy("a profile is already being captured")
+        seconds = min(max(seconds, 0.1), self.config.max_seconds)
+        async with self._lock:
+            print(f"🔬 Profiling the event loop for {seconds:.1f}s")
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            self.captures += 1
+            return pstats.Stats(profiler)
+
+    @staticmethod
+    def render(stats: pstats.Stats, sort: str, limit: int) -> str:
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    @staticmethod
+    def dump(stats: pstats.Stats) -> bytes:
+        """The .prof format pstats, snakeviz and friends load"""
+        return marshal.dumps(stats.stats)
@@ -0,0 +1,327 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Protocol
+
+from services.tokenizer import TokenizerConfig, TokenizerService
+
+
+###############################################################################
+#
+#             Prefix-cache-friendly chat prompts (system + docs + question)
+#
+# vLLM's prefix cache reuses KV blocks whose tokens, and every token before
+# them, match a previous request exactly. So everything shared goes first
+# and never changes byte for byte: the system prompt, then the documents
+# in a fixed order, then the question. Each shared segment is padded to a
+# whole number of KV blocks so its last tokens do not share a block with
+# whatever follows.
+#
+###############################################################################
+# Byte-stable: no dates, request data or whitespace that editors may strip
+SYSTEM_PROMPT = (
+    "Bạn là trợ lý AI trả lời bằng tiếng Việt. Khi có tài liệu tham khảo, "
+    "chỉ dựa vào các tài liệu đó để trả lời và trích dẫn số thứ tự tài liệu "
+    "như [1]. Nếu tài liệu không chứa thông tin cần thiết, hãy nói rằng bạn "
+    "không biết."
+)
+DOCUMENT_TEMPLATE = "Tài liệu [{index}]:\n{text}\n\n"
+QUESTION_TEMPLATE = "Câu hỏi: {question}"
+# Qwen2's ChatML layout, used when the tokenizer is not available
+CHATML_HEAD = "<|im_start|>system\n{system}<|im_end|>\n<|im_start|>user\n"
+CHATML_FOOT = "<|im_end|>\n<|im_start|>assistant\n"
+CHATML_TURN = "<|im_start|>{role}\n{content}<|im_end|>\n"
+# Closes an assistant turn and opens the next user turn
+CHATML_SEP = "<|im_end|>\n<|im_start|>user\n"
+_SENTINEL = "\x00USER_CONTENT\x00"
+_ANSWER_SENTINEL = "\x00ANSWER_CONTENT\x00"
+_NEXT_SENTINEL = "\x00NEXT_CONTENT\x00"
+
+
+class PromptDocument(Protocol):
+    id: str
+    text: str
+
+
+class ConversationTurn(Protocol):
+    question: str
+    answer: str
+    # What the engine generated, when known; re-tokenizing the text can
+    # split it differently and lose the cached blocks
+    answer_ids: list[int] | None
+
+
+@dataclass
+class BuiltPrompt:
+    text: str
+    # Set when the prompt was tokenized segment by segment
+    token_ids: list[int] | None
+    # System prompt and documents, padded; the part other requests can share
+    shared_prefix_tokens: int
+
+    @property
+    def engine_prompt(self) -> str | dict[str, list[int]]:
+        """What to pass as `prompt` to engine.generate"""
+        if self.token_ids is not None:
+            return {"prompt_token_ids": self.token_ids}
+        return self.text
+
+    @property
+    def num_tokens(self) -> int | None:
+        return len(self.token_ids) if self.token_ids is not None else None
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(model_path: str) -> Any | None:
+    """The served model's HF tokenizer, or None if it can't be loaded"""
+    if not Path(model_path).is_dir():
+        return None
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return None
+    return AutoTokenizer.from_pretrained(model_path)
+
+
+class PromptBuilder:
+    """
+    Renders (question, documents) through the model's chat template.
+
+    Documents are ordered by id rather than retrieval score, so the same
+    set of documents always produces the same prefix. With a tokenizer
+    the prompt is tokenized per segment (segment IDs are cached by the
+    TokenizerService) and handed to the engine as token IDs, which is
+    what makes block padding exact.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any | None = None,
+        block_size: int = 16,
+        align: bool = True,
+        tokens: TokenizerService | None = None
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.block_size = block_size
+        self.align = align and tokenizer is not None
+        # render() runs on its thread pool
+        self.tokens = tokens or TokenizerService(tokenizer)
+        if tokenizer is not None and getattr(
+            tokenizer, "chat_template", None
+        ):
+            template = tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": _SENTINEL},
+                ],
+                tokenize=False,
+                add_generation_prompt=True
+            )
+            self.head, self.foot = template.split(_SENTINEL)
+            self.turn_sep = self._template_separator(tokenizer)
+        else:
+            self.head = CHATML_HEAD.format(system=SYSTEM_PROMPT)
+            self.foot = CHATML_FOOT
+            self.turn_sep = CHATML_SEP
+        self._filler: list[int] = []
+        # Trailing stop tokens of a generated answer; turn_sep closes it
+        self._stop_ids: set[int] = set()
+        if tokenizer is not None:
+            self._filler = tokenizer.encode("\n", add_special_tokens=False)
+            self._stop_ids = {
+                i for i in (
+                    tokenizer.eos_token_id,
+                    tokenizer.convert_tokens_to_ids("<|im_end|>"),
+                )
+                if isinstance(i, int)
+            }
+
+    @staticmethod
+    def _template_separator(tokenizer: Any) -> str:
+        """What the chat template puts between an answer and the next turn"""
+        template = tokenizer.apply_chat_template(
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": _SENTINEL},
+                {"role": "assistant", "content": _ANSWER_SENTINEL},
+                {"role": "user", "content": _NEXT_SENTINEL},
+            ],
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        return template.split(_ANSWER_SENTINEL)[1].split(_NEXT_SENTINEL)[0]
+
+    @classmethod
+    def from_env(cls, model_path: str) -> "PromptBuilder":
+        tokenizer = load_tokenizer(model_path)
+        return cls(
+            tokenizer,
+            block_size=int(os.getenv("PROMPT_BLOCK_SIZE", "16")),
+            align=os.getenv("PROMPT_BLOCK_ALIGN", "1") == "1",
+            tokens=TokenizerService(tokenizer, TokenizerConfig.from_env()),
+        )
+
+    @staticmethod
+    def order(documents: list[PromptDocument]) -> list[PromptDocument]:
+        """Deterministic order: by id, ties broken by content"""
+        return sorted(documents, key=lambda d: (str(d.id), d.text))
+
+    def _encode(self, text: str) -> list[int]:
+        return self.tokens.encode(text)
+
+    def _padding(self, length: int) -> int:
+        if not self.align or len(self._filler) != 1:
+            return 0
+        return -length % self.block_size
+
+    def segment_overhead(self) -> int:
+        """Upper bound on padding added to one shared segment"""
+        return self.block_size - 1 if self.align else 0
+
+    def render(
+        self,
+        question: str,
+        documents: list[PromptDocument] | None = None
+    ) -> BuiltPrompt:
+        shared = [self.head] + [
+            DOCUMENT_TEMPLATE.format(index=i, text=d.text)
+            for i, d in enumerate(self.order(documents or []), start=1)
+        ]
+        tail = QUESTION_TEMPLATE.format(question=question) + self.foot
+        if self.tokenizer is None:
+            text = "".join(shared) + tail
+            return BuiltPrompt(text, None, 0)
+        ids: list[int] = []
+        parts: list[str] = []
+        for segment in shared:
+            segment_ids = self._encode(segment)
+            pad = self._padding(len(segment_ids))
+            ids.extend(segment_ids)
+            ids.extend(self._filler * pad)
+            parts.append(segment + "\n" * pad)
+        shared_prefix_tokens = len(ids)
+        ids.extend(self.tokens.encode(tail, cache=False))
+        parts.append(tail)
+        return BuiltPrompt("".join(parts), ids, shared_prefix_tokens)
+
+    async def render_async(
+        self,
+        question: str,
+        documents: list[PromptDocument] | None = None
+    ) -> BuiltPrompt:
+        """render() on the tokenizer pool when it has to tokenize"""
+        return await self.tokens.run(self.render, question, documents)
+
+    def render_conversation(
+        self,
+        turns: list[ConversationTurn],
+        question: str
+    ) -> BuiltPrompt:
+        """
+        Earlier turns and then `question`, laid out append-only: every
+        prompt is the previous prompt, its answer and the new question, so
+        the prefix cache already holds all of it but the new question.
+        Unlike render(), the question goes in verbatim.
+        """
+        pieces: list[str] = []
+        for turn in turns:
+            pieces += [turn.question, self.foot, turn.answer, self.turn_sep]
+        tail = question + self.foot
+        if self.tokenizer is None:
+            return BuiltPrompt(self.head + "".join(pieces) + tail, None, 0)
+        head_ids = self._encode(self.head)
+        pad = self._padding(len(head_ids))
+        ids = head_ids + self._filler * pad
+        parts = [self.head + "\n" * pad]
+        shared_prefix_tokens = len(ids)
+        for turn in turns:
+            ids.extend(self._encode(turn.question))
+            ids.extend(self._encode(self.foot))
+            ids.extend(
+                turn.answer_ids if turn.answer_ids is not None
+                else self._encode(turn.answer)
+            )
+            ids.extend(self._encode(self.turn_sep))
+        parts.extend(pieces)
+        ids.extend(self._encode(question))
+        ids.extend(self._encode(self.foot))
+        parts.append(tail)
+        return BuiltPrompt("".join(parts), ids, shared_prefix_tokens)
+
+    def answer_ids(self, token_ids: list[int]) -> list[int]:
+        """Generated IDs without the stop token turn_sep re-adds"""
+        end = len(token_ids)
+        while end and token_ids[end - 1] in self._stop_ids:
+            end -= 1
+        return token_ids[:end]
+
+    def count_tokens(self, text: str) -> int | None:
+        """Exact count with the tokenizer (segment-cached), else None"""
+        if self.tokenizer is None:
+            return None
+        return len(self._encode(text))
+
+    def render_messages(self, messages: list[dict[str, str]]) -> BuiltPrompt:
+        """
+        Client-supplied chat turns (OpenAI style) through the chat
+        template as-is: no system prompt injected, no block padding.
+        """
+        if self.tokenizer is not None and getattr(
+            self.tokenizer, "chat_template", None
+        ):
+            text = self.tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+        else:
+            text = "".join(
+                CHATML_TURN.format(role=m["role"], content=m["content"])
+                for m in messages
+            ) + "<|im_start|>assistant\n"
+        if self.tokenizer is None:
+            return BuiltPrompt(text, None, 0)
+        return BuiltPrompt(text, self.tokens.encode(text, cache=False), 0)
+
+    async def render_messages_async(
+        self,
+        messages: list[dict[str, str]]
+    ) -> BuiltPrompt:
+        return await self.tokens.run(self.render_messages, messages)
+
+
+@lru_cache(maxsize=1)
+def get_prompt_builder(model_path: str) -> PromptBuilder:
+    return PromptBuilder.from_env(model_path)
+
+
+###############################################################################
+#
+#                     Prefix-cache hit accounting
+#
+###############################################################################
+@dataclass
+class PrefixCacheStats:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    def record(self, prompt_tokens: int, cached_tokens: int) -> float:
+        """Count one request; return its own hit rate"""
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        return cached_tokens / prompt_tokens if prompt_tokens else 0.0
+
+    def snapshot(self) -> dict[str, int | float]:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "hit_rate": (
+                self.cached_tokens / self.prompt_tokens
+                if self.prompt_tokens else 0.0
+            ),
+        }
+
+
+prefix_cache_stats = PrefixCacheStats()
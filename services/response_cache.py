@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import aclosing, closing
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncGenerator, Callable, Mapping, Protocol
+
+
+###############################################################################
+#
+#                     Keys: normalized prompt + sampling
+#
+###############################################################################
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """NFC, case-folded, whitespace-collapsed form used for cache keys"""
+    text = unicodedata.normalize("NFC", prompt)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def cache_key(prompt: str, sampling: Mapping[str, Any]) -> str:
+    payload = json.dumps(sampling, sort_keys=True, default=str)
+    return hashlib.sha256(
+        f"{normalize_prompt(prompt)}\x00{payload}".encode("utf-8")
+    ).hexdigest()
+
+
+###############################################################################
+#
+#                     Optional second-level backends
+#
+###############################################################################
+class CacheBackend(Protocol):
+    async def get(self, key: str) -> list[str] | None:
+        ...
+
+    async def set(self, key: str, deltas: list[str], ttl_s: float) -> None:
+        ...
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk backend; point several workers at one file to share entries.
+
+    Queries run in a worker thread so the event loop never blocks on disk.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, deltas TEXT, expires_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5.0)
+
+    def _get(self, key: str) -> list[str] | None:
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT deltas, expires_at FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _set(self, key: str, deltas: list[str], ttl_s: float) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                (key, json.dumps(deltas), time.time() + ttl_s)
+            )
+            conn.execute(
+                "DELETE FROM responses WHERE expires_at < ?", (time.time(),)
+            )
+
+    async def get(self, key: str) -> list[str] | None:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, deltas: list[str], ttl_s: float) -> None:
+        await asyncio.to_thread(self._set, key, deltas, ttl_s)
+
+
+###############################################################################
+#
+#                    In-memory LRU/TTL cache with single-flight
+#
+###############################################################################
+@dataclass
+class ResponseCacheConfig:
+    enabled: bool = True
+    max_bytes: int = 64 * 1024 * 1024
+    max_entry_bytes: int = 256 * 1024
+    ttl_s: float = 3600.0
+    # "" (memory only) or "sqlite:///path/to/cache.db"
+    backend: str = ""
+
+    @classmethod
+    def from_env(cls) -> "ResponseCacheConfig":
+        return cls(
+            enabled=os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1",
+            max_bytes=int(
+                os.getenv("RESPONSE_CACHE_MAX_BYTES", cls.max_bytes)
+            ),
+            max_entry_bytes=int(
+                os.getenv(
+                    "RESPONSE_CACHE_MAX_ENTRY_BYTES", cls.max_entry_bytes
+                )
+            ),
+            ttl_s=float(os.getenv("RESPONSE_CACHE_TTL_S", cls.ttl_s)),
+            backend=os.getenv("RESPONSE_CACHE_BACKEND", cls.backend),
+        )
+
+
+@dataclass
+class _Entry:
+    deltas: list[str]
+    size: int
+    expires_at: float
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    backend_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    def snapshot(self) -> dict[str, int | float]:
+        lookups = self.hits + self.backend_hits + self.misses + self.coalesced
+        served = self.hits + self.backend_hits + self.coalesced
+        return {
+            **asdict(self),
+            "hit_rate": served / lookups if lookups else 0.0,
+        }
+
+
+class _Flight:
+    """One in-progress generation shared by every identical request"""
+
+    def __init__(self) -> None:
+        self.deltas: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.task: asyncio.Task[None] | None = None
+        self._waiter: asyncio.Future[None] | None = None
+
+    def publish(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    async def wait(self) -> None:
+        if self._waiter is None:
+            self._waiter = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self._waiter)
+
+
+class ResponseCache:
+    """
+    Memory-bounded LRU with TTL over completed answers.
+
+    Concurrent misses on the same key share one generation: the producer
+    runs in its own task and every request (the first included) replays
+    its deltas, so one client disconnecting does not break the others.
+    The generation is aborted once no subscriber is left.
+    """
+
+    def __init__(
+        self,
+        config: ResponseCacheConfig | None = None,
+        backend: CacheBackend | None = None
+    ) -> None:
+        self.config = config or ResponseCacheConfig()
+        self.backend = backend
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._flights: dict[str, _Flight] = {}
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache | None":
+        """Build the cache from RESPONSE_CACHE_*; None when disabled"""
+        config = ResponseCacheConfig.from_env()
+        if not config.enabled:
+            return None
+        backend: CacheBackend | None = None
+        if config.backend.startswith("sqlite:///"):
+            backend = SQLiteCacheBackend(config.backend[len("sqlite:///"):])
+        elif config.backend:
+            raise ValueError(
+                f"Unknown RESPONSE_CACHE_BACKEND: {config.backend!r}"
+            )
+        return cls(config, backend)
+
+    def take(self, key: str) -> list[str] | None:
+        """
+        The deltas cached in memory for `key`, counted as a hit; None if
+        the engine is needed. Callers replay them without going through
+        stream(), so an entry expiring in between cannot turn the hit
+        into a generation that skipped admission.
+        """
+        deltas = self._get(key)
+        if deltas is not None:
+            self.stats.hits += 1
+        return deltas
+
+    def _get(self, key: str) -> list[str] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.deltas
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self.stats.bytes -= entry.size
+        self.stats.entries -= 1
+
+    def _put(self, key: str, deltas: list[str]) -> None:
+        size = sum(len(d) for d in deltas)
+        if size > self.config.max_entry_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = _Entry(
+            deltas=deltas,
+            size=size,
+            expires_at=time.monotonic() + self.config.ttl_s
+        )
+        self.stats.bytes += size
+        self.stats.entries += 1
+        while self.stats.bytes > self.config.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    async def stream(
+        self,
+        key: str,
+        produce: Callable[[], AsyncGenerator[str, None]]
+    ) -> AsyncGenerator[str, None]:
+        """Yield cached deltas for `key`, generating them at most once"""
+        deltas = self._get(key)
+        if deltas is not None:
+            self.stats.hits += 1
+            for delta in deltas:
+                yield delta
+            return
+
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats.coalesced += 1
+        else:
+            if self.backend is not None:
+                deltas = await self.backend.get(key)
+                if deltas is not None:
+                    self.stats.backend_hits += 1
+                    self._put(key, deltas)
+                    for delta in deltas:
+                        yield delta
+                    return
+                # Another request may have started while we hit the backend
+                flight = self._flights.get(key)
+            if flight is None:
+                self.stats.misses += 1
+                flight = self._flights[key] = _Flight()
+                flight.task = asyncio.create_task(
+                    self._run(key, flight, produce)
+                )
+            else:
+                self.stats.coalesced += 1
+
+        flight.subscribers += 1
+        try:
+            i = 0
+            while True:
+                while i < len(flight.deltas):
+                    yield flight.deltas[i]
+                    i += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.done:
+                # Nobody is listening any more: abort the generation
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _run(
+        self,
+        key: str,
+        flight: _Flight,
+        produce: Callable[[], AsyncGenerator[str, None]]
+    ) -> None:
+        completed = False
+        try:
+            deltas = produce()
+            async with aclosing(deltas):
+                async for delta in deltas:
+                    flight.deltas.append(delta)
+                    flight.publish()
+            completed = True
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.publish()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if completed:
+            self._put(key, flight.deltas)
+            if self.backend is not None:
+                try:
+                    await self.backend.set(
+                        key, flight.deltas, self.config.ttl_s
+                    )
+                except Exception as e:
+                    print(f"⚠️ [Cache] backend write failed: {e}")
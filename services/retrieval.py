@@ -0,0 +1,676 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Any, Protocol
+
+import numpy as np
+
+from services import metrics
+from services.embeddings import Embedder, build_embedder
+from services.prompting import BuiltPrompt, PromptBuilder
+from services.tokenizer import TokenizerService
+
+
+###############################################################################
+#
+#                     Embedding with cross-request batching
+#
+###############################################################################
+class BatchingEmbedder:
+    """
+    Embedder wrapper that caches vectors and batches concurrent calls.
+
+    Texts requested within `max_wait_ms` of each other (up to `max_batch`)
+    go to the wrapped model in one call, so a burst of questions costs one
+    forward pass instead of one per request.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        max_batch: int = 32,
+        max_wait_ms: float = 5.0,
+        cache_size: int = 4096
+    ) -> None:
+        self.embedder = embedder
+        self.dim = embedder.dim
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._pending: dict[str, asyncio.Future[np.ndarray]] = {}
+        self._flusher: asyncio.Task[None] | None = None
+        self._batches: set[asyncio.Task[None]] = set()
+
+    def _remember(self, text: str, vector: np.ndarray) -> None:
+        self._cache[text] = vector
+        self._cache.move_to_end(text)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        futures: list[asyncio.Future[np.ndarray]] = []
+        loop = asyncio.get_running_loop()
+        for text in texts:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self.hits += 1
+                self._cache.move_to_end(text)
+                future = loop.create_future()
+                future.set_result(vector)
+            else:
+                self.misses += 1
+                future = self._pending.get(text)
+                if future is None:
+                    future = self._pending[text] = loop.create_future()
+            futures.append(future)
+        if self._pending and (self._flusher is None or self._flusher.done()):
+            self._flusher = asyncio.create_task(self._flush_soon())
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        vectors = await asyncio.gather(*(asyncio.shield(f) for f in futures))
+        return np.stack(vectors)
+
+    async def _flush_soon(self) -> None:
+        await asyncio.sleep(self.max_wait_ms / 1000)
+        self._flush()
+
+    def _flush(self) -> None:
+        while self._pending:
+            texts = list(self._pending)[:self.max_batch]
+            batch = {text: self._pending.pop(text) for text in texts}
+            task = asyncio.create_task(self._run(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run(self, batch: dict[str, asyncio.Future[np.ndarray]]) -> None:
+        texts = list(batch)
+        metrics.RAG_EMBED_BATCH_SIZE.observe(len(texts))
+        try:
+            vectors = await self.embedder.embed(texts)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, vector in zip(texts, vectors):
+            self._remember(text, vector.copy())
+            if not batch[text].done():
+                batch[text].set_result(vector)
+
+    def snapshot(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._cache),
+        }
+
+
+###############################################################################
+#
+#                          Token counting
+#
+###############################################################################
+class TokenCounter(Protocol):
+    async def count(self, texts: list[str]) -> list[int]:
+        ...
+
+    async def truncate(self, text: str, max_tokens: int) -> str:
+        ...
+
+
+class ApproxTokenCounter:
+    """Characters / `chars_per_token`, the same estimate admission uses"""
+
+    def __init__(self, chars_per_token: float = 3.0) -> None:
+        self.chars_per_token = chars_per_token
+
+    async def count(self, texts: list[str]) -> list[int]:
+        return [math.ceil(len(t) / self.chars_per_token) for t in texts]
+
+    async def truncate(self, text: str, max_tokens: int) -> str:
+        return text[:int(max_tokens * self.chars_per_token)]
+
+
+class HFTokenCounter:
+    """Exact counts with the served model's tokenizer, on its pool"""
+
+    def __init__(self, tokens: TokenizerService) -> None:
+        self.tokens = tokens
+        self.tokenizer = tokens.tokenizer
+
+    def _count(self, texts: list[str]) -> list[int]:
+        encoded = self.tokenizer(texts, add_special_tokens=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    async def count(self, texts: list[str]) -> list[int]:
+        return await self.tokens.run(self._count, texts)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        ids = self.tokens.encode(text, cache=False)
+        return self.tokens.decode(ids[:max_tokens])
+
+    async def truncate(self, text: str, max_tokens: int) -> str:
+        return await self.tokens.run(self._truncate, text, max_tokens)
+
+
+def build_token_counter(tokens: TokenizerService) -> TokenCounter:
+    if tokens.available:
+        return HFTokenCounter(tokens)
+    return ApproxTokenCounter(
+        float(os.getenv("ADMISSION_CHARS_PER_TOKEN", "3.0"))
+    )
+
+
+###############################################################################
+#
+#                          Vector store and reranker
+#
+###############################################################################
+@dataclass
+class Document:
+    id: str
+    text: str
+    score: float
+    metadata: dict[str, Any] = field(default_factory=dict)
+
+    def to_event(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "score": round(self.score, 4),
+            "text": self.text,
+            "metadata": self.metadata,
+        }
+
+
+class QdrantStore:
+    """
+    Shared AsyncQdrantClient for the process.
+
+    `location` is a server URL, ":memory:" or a local path; the last two
+    run Qdrant in-process, which is what tests use. Concurrent queries are
+    capped so a burst cannot open an unbounded number of connections.
+    """
+
+    def __init__(
+        self,
+        location: str,
+        collection: str,
+        text_key: str = "page_content",
+        api_key: str | None = None,
+        max_concurrency: int = 16
+    ) -> None:
+        from qdrant_client import AsyncQdrantClient, models
+
+        self._models = models
+        self.collection = collection
+        self.text_key = text_key
+        if location == ":memory:":
+            self.client = AsyncQdrantClient(location=":memory:")
+        elif location.startswith(("http://", "https://")):
+            self.client = AsyncQdrantClient(url=location, api_key=api_key)
+        else:
+            self.client = AsyncQdrantClient(path=location)
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def ensure_collection(self, dim: int) -> None:
+        if not await self.client.collection_exists(self.collection):
+            await self.client.create_collection(
+                collection_name=self.collection,
+                vectors_config=self._models.VectorParams(
+                    size=dim, distance=self._models.Distance.COSINE
+                ),
+            )
+
+    async def upsert(
+        self,
+        ids: list[str | int],
+        vectors: np.ndarray,
+        payloads: list[dict[str, Any]]
+    ) -> None:
+        await self.client.upsert(
+            collection_name=self.collection,
+            points=[
+                self._models.PointStruct(
+                    id=point_id, vector=vector.tolist(), payload=payload
+                )
+                for point_id, vector, payload in zip(ids, vectors, payloads)
+            ],
+        )
+
+    async def retrieve(
+        self,
+        ids: list[str | int]
+    ) -> dict[str, dict[str, Any]]:
+        """Payloads of the points that exist among `ids`"""
+        async with self._slots:
+            points = await self.client.retrieve(
+                collection_name=self.collection,
+                ids=ids,
+                with_payload=True,
+                with_vectors=False,
+            )
+        return {str(point.id): dict(point.payload or {}) for point in points}
+
+    async def delete_stale(self, source: str, doc_hash: str) -> None:
+        """Drop points of `source` left from a version other than `doc_hash`"""
+        models = self._models
+        await self.client.delete(
+            collection_name=self.collection,
+            points_selector=models.FilterSelector(filter=models.Filter(
+                must=[models.FieldCondition(
+                    key="metadata.source",
+                    match=models.MatchValue(value=source),
+                )],
+                must_not=[models.FieldCondition(
+                    key="metadata.doc_hash",
+                    match=models.MatchValue(value=doc_hash),
+                )],
+            )),
+        )
+
+    async def update_metadata(
+        self,
+        ids: list[str | int],
+        values: dict[str, Any]
+    ) -> None:
+        """Set `values` inside the `metadata` payload of `ids`"""
+        await self.client.set_payload(
+            collection_name=self.collection,
+            payload=values,
+            points=ids,
+            key="metadata",
+        )
+
+    async def sources(self, page: int = 1024) -> set[str]:
+        """Every metadata.source in the collection"""
+        found: set[str] = set()
+        offset = None
+        while True:
+            points, offset = await self.client.scroll(
+                collection_name=self.collection,
+                limit=page,
+                offset=offset,
+                with_payload=["metadata.source"],
+                with_vectors=False,
+            )
+            for point in points:
+                metadata = (point.payload or {}).get("metadata") or {}
+                if "source" in metadata:
+                    found.add(metadata["source"])
+            if offset is None:
+                return found
+
+    async def delete_sources(self, sources: list[str]) -> None:
+        """Drop every point of `sources`"""
+        models = self._models
+        await self.client.delete(
+            collection_name=self.collection,
+            points_selector=models.FilterSelector(filter=models.Filter(
+                must=[models.FieldCondition(
+                    key="metadata.source",
+                    match=models.MatchAny(any=sources),
+                )],
+            )),
+        )
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        limit: int,
+        score_threshold: float | None = None
+    ) -> list[Document]:
+        async with self._slots:
+            response = await self.client.query_points(
+                collection_name=self.collection,
+                query=vector.tolist(),
+                limit=limit,
+                with_payload=True,
+                score_threshold=score_threshold,
+            )
+        documents: list[Document] = []
+        for point in response.points:
+            payload = dict(point.payload or {})
+            text = payload.pop(self.text_key, "")
+            metadata = payload.pop("metadata", None) or payload
+            documents.append(Document(
+                id=str(point.id),
+                text=text,
+                score=float(point.score),
+                metadata=metadata,
+            ))
+        return documents
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+class Reranker(Protocol):
+    async def rerank(self, query: str, texts: list[str]) -> list[float]:
+        """One relevance score per text, higher is better"""
+        ...
+
+
+class CrossEncoderReranker:
+    """Local HF cross-encoder (sequence classification with one logit)"""
+
+    def __init__(self, model_path: str, device: str = "cpu") -> None:
+        import torch
+        from transformers import (
+            AutoModelForSequenceClassification,
+            AutoTokenizer,
+        )
+
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModelForSequenceClassification.from_pretrained(
+            model_path
+        ).to(device).eval()
+        self.device = device
+
+    def _rerank_sync(self, query: str, texts: list[str]) -> list[float]:
+        batch = self.tokenizer(
+            [query] * len(texts),
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=512,
+            return_tensors="pt"
+        ).to(self.device)
+        with self._torch.inference_mode():
+            logits = self.model(**batch).logits
+        return logits.view(len(texts), -1)[:, 0].float().cpu().tolist()
+
+    async def rerank(self, query: str, texts: list[str]) -> list[float]:
+        if not texts:
+            return []
+        return await asyncio.to_thread(self._rerank_sync, query, texts)
+
+
+###############################################################################
+#
+#                     Token-budgeted prompt assembly
+#
+###############################################################################
+# Label and separator around each document block
+DOCUMENT_OVERHEAD_TOKENS = 8
+# Don't bother squeezing in a truncated document shorter than this
+MIN_DOCUMENT_TOKENS = 64
+
+
+@dataclass
+class RetrievalResult:
+    prompt: BuiltPrompt
+    documents: list[Document]
+    prompt_tokens: int
+    context_tokens: int
+    timings_ms: dict[str, float]
+
+
+class PromptAssembler:
+    """
+    Picks ranked documents that fit max_model_len - max_tokens.
+
+    Selection follows retrieval rank; rendering (and document order in
+    the prompt) is left to the PromptBuilder.
+    """
+
+    def __init__(
+        self,
+        counter: TokenCounter,
+        builder: PromptBuilder,
+        max_model_len: int = 4096,
+        max_tokens: int = 1024
+    ) -> None:
+        self.counter = counter
+        self.builder = builder
+        self.max_model_len = max_model_len
+        self.max_tokens = max_tokens
+        self._template_tokens: int | None = None
+
+    async def template_tokens(self) -> int:
+        """Chat template, system prompt and padding of its segment"""
+        if self._template_tokens is None:
+            (tokens,) = await self.counter.count([
+                self.builder.render("").text
+            ])
+            self._template_tokens = tokens + self.builder.segment_overhead()
+        return self._template_tokens
+
+    async def select(
+        self,
+        question_tokens: int,
+        template_tokens: int,
+        documents: list[Document],
+        document_tokens: list[int]
+    ) -> tuple[list[Document], int]:
+        """Return (documents to use, context tokens), truncating the last"""
+        budget = self.max_model_len - self.max_tokens \
+            - template_tokens - question_tokens
+        overhead = DOCUMENT_OVERHEAD_TOKENS + self.builder.segment_overhead()
+        used: list[Document] = []
+        context_tokens = 0
+        for document, tokens in zip(documents, document_tokens):
+            remaining = budget - context_tokens - overhead
+            if tokens > remaining:
+                if remaining < MIN_DOCUMENT_TOKENS:
+                    break
+                document = replace(
+                    document,
+                    text=await self.counter.truncate(
+                        document.text, remaining
+                    )
+                )
+                tokens = remaining
+            used.append(document)
+            context_tokens += tokens + overhead
+        return used, context_tokens
+
+
+###############################################################################
+#
+#                           Retrieval pipeline
+#
+###############################################################################
+@dataclass
+class RetrievalConfig:
+    enabled: bool = False
+    # Server URL, ":memory:" or a local path
+    qdrant_location: str = ":memory:"
+    qdrant_api_key: str | None = None
+    collection: str = "documents"
+    text_key: str = "page_content"
+    top_k: int = 6
+    # Candidates fetched for the reranker to choose top_k from
+    fetch_k: int = 24
+    score_threshold: float | None = None
+    reranker_model: str = ""
+    max_model_len: int = 4096
+    embed_batch: int = 32
+    embed_wait_ms: float = 5.0
+    embed_cache_size: int = 4096
+    max_concurrency: int = 16
+
+    @classmethod
+    def from_env(
+        cls,
+        max_model_len: int | None = None
+    ) -> "RetrievalConfig":
+        """`max_model_len` is the engine's (EngineSettings)"""
+        threshold = os.getenv("RAG_SCORE_THRESHOLD")
+        return cls(
+            enabled=os.getenv("RAG_ENABLED", "0") == "1",
+            qdrant_location=os.getenv(
+                "QDRANT_URL", os.getenv("QDRANT_LOCATION", cls.qdrant_location)
+            ),
+            qdrant_api_key=os.getenv("QDRANT_API_KEY"),
+            collection=os.getenv("RAG_COLLECTION", cls.collection),
+            text_key=os.getenv("RAG_TEXT_KEY", cls.text_key),
+            top_k=int(os.getenv("RAG_TOP_K", cls.top_k)),
+            fetch_k=int(os.getenv("RAG_FETCH_K", cls.fetch_k)),
+            score_threshold=float(threshold) if threshold else None,
+            reranker_model=os.getenv("RAG_RERANKER_MODEL", ""),
+            max_model_len=max_model_len or cls.max_model_len,
+            embed_batch=int(os.getenv("RAG_EMBED_BATCH", cls.embed_batch)),
+            embed_wait_ms=float(
+                os.getenv("RAG_EMBED_WAIT_MS", cls.embed_wait_ms)
+            ),
+            embed_cache_size=int(
+                os.getenv("RAG_EMBED_CACHE_SIZE", cls.embed_cache_size)
+            ),
+            max_concurrency=int(
+                os.getenv("RAG_QDRANT_MAX_CONCURRENCY", cls.max_concurrency)
+            ),
+        )
+
+
+class Retriever:
+    """
+    Question -> embed -> search -> (rerank) -> budgeted prompt.
+
+    Counting the question's tokens runs alongside embedding and search,
+    and counting the candidates' tokens alongside reranking, so the
+    tokenizer never sits on the critical path by itself.
+    """
+
+    def __init__(
+        self,
+        embedder: BatchingEmbedder,
+        store: QdrantStore,
+        assembler: PromptAssembler,
+        config: RetrievalConfig | None = None,
+        reranker: Reranker | None = None
+    ) -> None:
+        self.embedder = embedder
+        self.store = store
+        self.assembler = assembler
+        self.config = config or RetrievalConfig()
+        self.reranker = reranker
+
+    @classmethod
+    def from_env(
+        cls,
+        max_tokens: int,
+        builder: PromptBuilder,
+        max_model_len: int
+    ) -> "Retriever | None":
+        """Build from RAG_* / QDRANT_*; None unless RAG_ENABLED=1"""
+        config = RetrievalConfig.from_env(max_model_len)
+        if not config.enabled:
+            return None
+        embedder = BatchingEmbedder(
+            build_embedder(),
+            max_batch=config.embed_batch,
+            max_wait_ms=config.embed_wait_ms,
+            cache_size=config.embed_cache_size
+        )
+        store = QdrantStore(
+            config.qdrant_location,
+            config.collection,
+            text_key=config.text_key,
+            api_key=config.qdrant_api_key,
+            max_concurrency=config.max_concurrency
+        )
+        reranker: Reranker | None = None
+        if config.reranker_model:
+            print(f"🧭 Loading reranker from {config.reranker_model}")
+            reranker = CrossEncoderReranker(
+                config.reranker_model,
+                device=os.getenv("EMBEDDING_DEVICE", "cpu")
+            )
+        assembler = PromptAssembler(
+            build_token_counter(builder.tokens),
+            builder,
+            max_model_len=config.max_model_len,
+            max_tokens=max_tokens
+        )
+        return cls(embedder, store, assembler, config, reranker)
+
+    async def _embed_and_search(self, question: str) -> list[Document]:
+        started = time.perf_counter()
+        vector = (await self.embedder.embed([question]))[0]
+        embedded = time.perf_counter()
+        metrics.RAG_EMBED_SECONDS.observe(embedded - started)
+        limit = self.config.fetch_k if self.reranker else self.config.top_k
+        documents = await self.store.search(
+            vector, limit, self.config.score_threshold
+        )
+        metrics.RAG_SEARCH_SECONDS.observe(time.perf_counter() - embedded)
+        return documents
+
+    async def _rerank(
+        self,
+        question: str,
+        documents: list[Document]
+    ) -> list[Document]:
+        if self.reranker is None:
+            return documents
+        started = time.perf_counter()
+        scores = await self.reranker.rerank(
+            question, [d.text for d in documents]
+        )
+        metrics.RAG_RERANK_SECONDS.observe(time.perf_counter() - started)
+        ranked = sorted(
+            zip(scores, range(len(documents))), reverse=True
+        )[:self.config.top_k]
+        return [documents[i] for _, i in ranked]
+
+    async def _count(self, texts: list[str]) -> list[int]:
+        started = time.perf_counter()
+        counts = await self.assembler.counter.count(texts)
+        metrics.RAG_TOKENIZE_SECONDS.observe(time.perf_counter() - started)
+        return counts
+
+    async def retrieve(self, question: str) -> RetrievalResult:
+        started = time.perf_counter()
+        question_count = asyncio.create_task(self._count([question]))
+        try:
+            documents = await self._embed_and_search(question)
+            searched = time.perf_counter()
+            candidate_counts = asyncio.create_task(
+                self._count([d.text for d in documents])
+            )
+            try:
+                ranked = await self._rerank(question, documents)
+                counts = dict(zip(
+                    (id(d) for d in documents), await candidate_counts
+                ))
+            finally:
+                candidate_counts.cancel()
+            ranked_at = time.perf_counter()
+            (question_tokens,) = await question_count
+        finally:
+            question_count.cancel()
+        template_tokens = await self.assembler.template_tokens()
+        used, context_tokens = await self.assembler.select(
+            question_tokens,
+            template_tokens,
+            ranked,
+            [counts[id(d)] for d in ranked]
+        )
+        prompt = await self.assembler.builder.render_async(question, used)
+        prompt_tokens = prompt.num_tokens \
+            or template_tokens + question_tokens + context_tokens
+        finished = time.perf_counter()
+        metrics.RAG_RETRIEVAL_SECONDS.observe(finished - started)
+        metrics.RAG_CONTEXT_TOKENS.observe(context_tokens)
+        return RetrievalResult(
+            prompt=prompt,
+            documents=used,
+            prompt_tokens=prompt_tokens,
+            context_tokens=context_tokens,
+            timings_ms={
+                "search": (searched - started) * 1000,
+                "rerank_and_count": (ranked_at - searched) * 1000,
+                "assemble": (finished - ranked_at) * 1000,
+                "total": (finished - started) * 1000,
+            }
+        )
+
+    async def close(self) -> None:
+        await self.store.close()
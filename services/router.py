@@ -0,0 +1,772 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, AsyncGenerator, Awaitable, Callable
+
+from services.admission import PRIORITY_BATCH
+from services.engine import EngineFailure, LLMEngine
+from services.engine_manager import (
+    EngineManager,
+    EngineManagerConfig,
+    EngineUnavailable,
+    engine_failure,
+)
+from services.metrics import read_engine_stats
+
+
+###############################################################################
+#
+#              Router over several engine replicas (local or HTTP)
+#
+# EngineRouter implements the LLMEngine protocol, so the rest of the app
+# treats N replicas as one engine. Each request goes to the replica its
+# prompt prefix hashes to (rendezvous hashing, so prefix-cache hits land on
+# the replica that already holds those KV blocks) unless that replica is
+# busier than the least-loaded one by more than `affinity_slack`. Load is
+# in-flight requests plus weighted queue depth and KV-cache usage, polled
+# every `poll_interval_s`. Replicas that fail `eject_after` times in a row
+# are ejected for `eject_s`, then readmitted once a health poll succeeds;
+# draining ones finish what they have but get nothing new. Only replica
+# faults count toward ejection, never a request the replica refused, and
+# the app's own EngineManager sees nothing but NoReplicaAvailable: one
+# sick replica is ejected, not the whole router rebuilt.
+#
+###############################################################################
+class ReplicaState(str, Enum):
+    HEALTHY = "healthy"
+    DRAINING = "draining"
+    EJECTED = "ejected"
+
+
+class ReplicaError(RuntimeError):
+    """A replica answered with an error or could not be reached"""
+
+    def __init__(self, message: str, status: int | None = None) -> None:
+        super().__init__(message)
+        # HTTP status of the replica's answer, if it sent one
+        self.status = status
+
+
+class NoReplicaAvailable(EngineFailure):
+    pass
+
+
+@dataclass
+class RouterConfig:
+    # "local" entries share this process; "http(s)://..." are remote
+    replicas: list[str]
+    # CUDA_VISIBLE_DEVICES for each local replica, in order (empty = unset)
+    local_devices: list[str] = field(default_factory=list)
+    poll_interval_s: float = 1.0
+    poll_timeout_s: float = 2.0
+    eject_after: int = 3
+    eject_s: float = 15.0
+    ready_timeout_s: float = 1800.0
+    # Prompt prefix hashed for affinity: token IDs, or 4x as many chars
+    affinity_tokens: int = 256
+    # Extra load the preferred replica may carry before we go elsewhere
+    affinity_slack: float = 4.0
+    queue_weight: float = 2.0
+    kv_weight: float = 8.0
+
+    @classmethod
+    def from_env(cls) -> "RouterConfig | None":
+        """
+        Build from ROUTER_*; None unless ROUTER_REPLICAS is set, e.g.
+        "local:2" or "http://10.0.0.5:8000,http://10.0.0.6:8000".
+        """
+        spec = os.getenv("ROUTER_REPLICAS", "").strip()
+        if not spec:
+            return None
+        replicas: list[str] = []
+        for entry in (e.strip() for e in spec.split(",") if e.strip()):
+            if entry.startswith("local"):
+                _, _, count = entry.partition(":")
+                replicas.extend(["local"] * int(count or 1))
+            else:
+                replicas.append(entry.rstrip("/"))
+        devices = os.getenv("ROUTER_LOCAL_DEVICES", "")
+        return cls(
+            replicas=replicas,
+            local_devices=[d.strip() for d in devices.split(",") if d.strip()],
+            poll_interval_s=float(
+                os.getenv("ROUTER_POLL_INTERVAL_S", cls.poll_interval_s)
+            ),
+            poll_timeout_s=float(
+                os.getenv("ROUTER_POLL_TIMEOUT_S", cls.poll_timeout_s)
+            ),
+            eject_after=int(os.getenv("ROUTER_EJECT_AFTER", cls.eject_after)),
+            eject_s=float(os.getenv("ROUTER_EJECT_S", cls.eject_s)),
+            ready_timeout_s=float(
+                os.getenv("ROUTER_READY_TIMEOUT_S", cls.ready_timeout_s)
+            ),
+            affinity_tokens=int(
+                os.getenv("ROUTER_AFFINITY_TOKENS", cls.affinity_tokens)
+            ),
+            affinity_slack=float(
+                os.getenv("ROUTER_AFFINITY_SLACK", cls.affinity_slack)
+            ),
+            queue_weight=float(
+                os.getenv("ROUTER_QUEUE_WEIGHT", cls.queue_weight)
+            ),
+            kv_weight=float(os.getenv("ROUTER_KV_WEIGHT", cls.kv_weight)),
+        )
+
+
+###############################################################################
+#
+#                               Replicas
+#
+###############################################################################
+class Replica:
+    """Routing state shared by local and remote replicas"""
+
+    kind = "replica"
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = ReplicaState.HEALTHY
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.last_error: str | None = None
+        self.stats: dict[str, float] = {}
+
+    @property
+    def available(self) -> bool:
+        """Able to serve right now (engine loaded, server up)"""
+        return True
+
+    @property
+    def routable(self) -> bool:
+        return self.state is ReplicaState.HEALTHY and self.available
+
+    def load(self, config: RouterConfig) -> float:
+        stats = self.stats
+        running = max(
+            float(self.inflight), stats.get("num_requests_running", 0.0)
+        )
+        return running \
+            + config.queue_weight * stats.get("num_requests_waiting", 0.0) \
+            + config.kv_weight * stats.get("kv_cache_usage", 0.0)
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+
+    def is_failure(self, error: BaseException) -> bool:
+        """The replica's fault, rather than the request's"""
+        return engine_failure(None, error)
+
+    def record_failure(
+        self,
+        error: BaseException,
+        config: RouterConfig
+    ) -> None:
+        if not self.is_failure(error):
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        if self.state is ReplicaState.HEALTHY and \
+                self.consecutive_failures >= config.eject_after:
+            self.state = ReplicaState.EJECTED
+            self.ejected_until = time.monotonic() + config.eject_s
+            print(f"🚫 [Router] ejected {self.name} for "
+                  f"{config.eject_s:.0f}s ({self.last_error})")
+
+    async def start(self) -> None:
+        pass
+
+    async def poll(self) -> dict[str, float]:
+        """Load signals; raises if the replica is unhealthy"""
+        raise NotImplementedError
+
+    def generate(
+        self,
+        prompt: Any,
+        sampling_params: Any,
+        request_id: str,
+        **kwargs: Any
+    ) -> AsyncGenerator[Any, None]:
+        raise NotImplementedError
+
+    async def abort(self, request_id: str) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "state": self.state.value,
+            "available": self.available,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            **self.stats,
+        }
+
+
+_DEVICE_LOCK = asyncio.Lock()
+
+
+def _on_device(
+    factory: Callable[[], Awaitable[LLMEngine]],
+    device: str | None
+) -> Callable[[], Awaitable[LLMEngine]]:
+    """
+    Build with CUDA_VISIBLE_DEVICES=device. vLLM's engine core is a child
+    process, which picks up the variable when it is spawned.
+    """
+    if not device:
+        return factory
+
+    async def build() -> LLMEngine:
+        async with _DEVICE_LOCK:
+            previous = os.environ.get("CUDA_VISIBLE_DEVICES")
+            os.environ["CUDA_VISIBLE_DEVICES"] = device
+            try:
+                return await factory()
+            finally:
+                if previous is None:
+                    os.environ.pop("CUDA_VISIBLE_DEVICES", None)
+                else:
+                    os.environ["CUDA_VISIBLE_DEVICES"] = previous
+    return build
+
+
+class LocalReplica(Replica):
+    """An in-process engine with its own EngineManager (load, restart)"""
+
+    kind = "local"
+
+    def __init__(self, name: str, manager: EngineManager) -> None:
+        super().__init__(name)
+        self.manager = manager
+
+    @property
+    def available(self) -> bool:
+        return self.manager.ready
+
+    def is_failure(self, error: BaseException) -> bool:
+        return isinstance(error, EngineUnavailable) or \
+            engine_failure(self.manager.engine, error)
+
+    async def start(self) -> None:
+        self.manager.start()
+
+    async def poll(self) -> dict[str, float]:
+        if not self.manager.ready:
+            # Kicks off a reload once the manager's backoff has passed
+            try:
+                await self.manager.get(timeout=0)
+            except EngineUnavailable:
+                pass
+            return {}
+        return read_engine_stats(self.manager.engine)
+
+    async def generate(
+        self,
+        prompt: Any,
+        sampling_params: Any,
+        request_id: str,
+        **kwargs: Any
+    ) -> AsyncGenerator[Any, None]:
+        engine = await self.manager.get()
+        finished = False
+        try:
+            async with aclosing(engine.generate(
+                prompt=prompt,
+                sampling_params=sampling_params,
+                request_id=request_id,
+                **kwargs
+            )) as outputs:
+                async for output in outputs:
+                    finished = output.finished
+                    yield output
+        except Exception as e:
+            self.manager.report_error(e)
+            raise
+        finally:
+            if not finished:
+                await asyncio.shield(engine.abort(request_id))
+        self.manager.report_success()
+
+    async def close(self) -> None:
+        await self.manager.shutdown()
+
+    def snapshot(self) -> dict[str, Any]:
+        return {**super().snapshot(), "engine": self.manager.state.value}
+
+
+@dataclass
+class RemoteCompletionOutput:
+    """Mirrors the fields of vllm.outputs.CompletionOutput we read"""
+    index: int
+    text: str
+    token_ids: list[int]
+    finish_reason: str | None = None
+
+
+@dataclass
+class RemoteRequestOutput:
+    """Mirrors the fields of vllm.outputs.RequestOutput we read"""
+    request_id: str
+    prompt_token_ids: list[int]
+    outputs: list[RemoteCompletionOutput]
+    finished: bool
+    num_cached_tokens: int = 0
+
+
+_SAMPLING_FIELDS = (
+    "n", "max_tokens", "temperature", "top_p", "top_k",
+    "repetition_penalty", "presence_penalty", "frequency_penalty", "seed",
+    "stop",
+)
+
+
+class HTTPReplica(Replica):
+    """
+    Another instance of this app, reached through its /v1/completions
+    stream. Prompts travel as token IDs when we have them, so the remote
+    side skips tokenization and sees the exact prefix we hashed.
+    """
+
+    kind = "http"
+
+    def __init__(
+        self,
+        base_url: str,
+        poll_timeout_s: float = 2.0
+    ) -> None:
+        super().__init__(base_url.split("://", 1)[-1])
+        self.base_url = base_url
+        self.poll_timeout_s = poll_timeout_s
+        self._session: Any = None
+        self._responses: dict[str, Any] = {}
+        self._up = False
+
+    @property
+    def available(self) -> bool:
+        return self._up
+
+    def is_failure(self, error: BaseException) -> bool:
+        import aiohttp
+        if isinstance(error, ReplicaError):
+            # A 4xx is the request's fault (bad prompt, over-long, shed)
+            return error.status is None or not 400 <= error.status < 500
+        return isinstance(
+            error, (aiohttp.ClientError, asyncio.TimeoutError)
+        ) or super().is_failure(error)
+
+    async def start(self) -> None:
+        import aiohttp
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10)
+        )
+
+    async def poll(self) -> dict[str, float]:
+        import aiohttp
+        try:
+            async with self._session.get(
+                f"{self.base_url}/health",
+                timeout=aiohttp.ClientTimeout(total=self.poll_timeout_s)
+            ) as response:
+                data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self._up = False
+            raise ReplicaError(f"health check failed: {e}") from None
+        self._up = response.status == 200 and bool(data.get("ready"))
+        if not self._up:
+            raise ReplicaError(f"not ready: {data.get('status')}")
+        return {
+            k: float(v) for k, v in data.get("load", {}).items()
+            if isinstance(v, (int, float))
+        }
+
+    async def generate(
+        self,
+        prompt: Any,
+        sampling_params: Any,
+        request_id: str,
+        priority: int = 0
+    ) -> AsyncGenerator[RemoteRequestOutput, None]:
+        prompt_ids: list[int] = (
+            prompt["prompt_token_ids"] if isinstance(prompt, dict) else []
+        )
+        body: dict[str, Any] = {
+            "prompt": prompt_ids or prompt,
+            "stream": True,
+            # The usage chunk carries the remote prompt length
+            "stream_options": {"include_usage": True},
+            **{
+                name: getattr(sampling_params, name)
+                for name in _SAMPLING_FIELDS
+                if getattr(sampling_params, name, None) is not None
+            },
+        }
+        kind = getattr(
+            getattr(sampling_params, "output_kind", None), "name", "CUMULATIVE"
+        )
+        n = body.get("n", 1)
+        texts: dict[int, list[str]] = {i: [] for i in range(n)}
+        tokens = dict.fromkeys(range(n), 0)
+        finish_reasons: dict[int, str | None] = dict.fromkeys(range(n))
+        final: RemoteRequestOutput | None = None
+        async with self._session.post(
+            f"{self.base_url}/v1/completions",
+            json=body,
+            # Queued behind the replica's own interactive traffic
+            headers=(
+                {"X-Priority": "batch"} if priority >= PRIORITY_BATCH else None
+            )
+        ) as response:
+            if response.status != 200:
+                raise ReplicaError(
+                    f"HTTP {response.status}: {(await response.text())[:200]}",
+                    response.status
+                )
+            self._responses[request_id] = response
+            try:
+                async for line in response.content:
+                    if not line.startswith(b"data: "):
+                        continue
+                    payload = line[6:].strip()
+                    if payload == b"[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    if "error" in chunk:
+                        raise ReplicaError(chunk["error"].get("message"))
+                    if chunk.get("usage") and final is not None:
+                        if not prompt_ids:
+                            final.prompt_token_ids = [0] * chunk["usage"].get(
+                                "prompt_tokens", 0
+                            )
+                        break
+                    outputs = []
+                    for choice in chunk["choices"]:
+                        i = choice["index"]
+                        text = choice.get("text") or ""
+                        texts[i].append(text)
+                        # The stream has no token IDs; a chunk is ~a token
+                        tokens[i] += 1 if text else 0
+                        finish_reasons[i] = choice.get("finish_reason")
+                        outputs.append(RemoteCompletionOutput(
+                            index=i,
+                            text=(
+                                text if kind == "DELTA"
+                                else "".join(texts[i])
+                            ),
+                            token_ids=[0] * (
+                                (1 if text else 0) if kind == "DELTA"
+                                else tokens[i]
+                            ),
+                            finish_reason=finish_reasons[i],
+                        ))
+                    finished = all(
+                        r is not None for r in finish_reasons.values()
+                    )
+                    if kind == "FINAL_ONLY":
+                        if not finished:
+                            continue
+                        outputs = [
+                            RemoteCompletionOutput(
+                                index=i,
+                                text="".join(texts[i]),
+                                token_ids=[0] * tokens[i],
+                                finish_reason=finish_reasons[i],
+                            )
+                            for i in range(n)
+                        ]
+                    output = RemoteRequestOutput(
+                        request_id=request_id,
+                        prompt_token_ids=prompt_ids,
+                        outputs=outputs,
+                        finished=finished,
+                    )
+                    if finished:
+                        # Held back until the usage chunk fills in the
+                        # prompt length
+                        final = output
+                    else:
+                        yield output
+            finally:
+                self._responses.pop(request_id, None)
+        if final is None:
+            raise ReplicaError("stream ended before finishing")
+        yield final
+
+    async def abort(self, request_id: str) -> None:
+        """Dropping the connection makes the remote side abort"""
+        response = self._responses.pop(request_id, None)
+        if response is not None:
+            response.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+###############################################################################
+#
+#                                 Router
+#
+###############################################################################
+def _weight(key: bytes, name: str) -> int:
+    digest = hashlib.blake2b(key + name.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+@dataclass
+class RouterStats:
+    routed: int = 0
+    affinity_hits: int = 0
+    affinity_overflows: int = 0
+    failovers: int = 0
+    unavailable: int = 0
+
+
+class EngineRouter:
+    """LLMEngine facade dispatching each request to one replica"""
+
+    def __init__(
+        self,
+        replicas: list[Replica],
+        config: RouterConfig
+    ) -> None:
+        self.replicas = replicas
+        self.config = config
+        self.stats = RouterStats()
+        self._routes: dict[str, Replica] = {}
+        self._poll_task: asyncio.Task[None] | None = None
+
+    @classmethod
+    async def create(
+        cls,
+        config: RouterConfig,
+        local_factory: Callable[[], Awaitable[LLMEngine]]
+    ) -> "EngineRouter":
+        """Start every replica; return once at least one can serve"""
+        replicas: list[Replica] = []
+        local = 0
+        for entry in config.replicas:
+            if entry == "local":
+                device = (
+                    config.local_devices[local]
+                    if local < len(config.local_devices) else None
+                )
+                replicas.append(LocalReplica(
+                    f"local-{local}",
+                    EngineManager(
+                        _on_device(local_factory, device),
+                        EngineManagerConfig.from_env()
+                    )
+                ))
+                local += 1
+            else:
+                replicas.append(HTTPReplica(entry, config.poll_timeout_s))
+        router = cls(replicas, config)
+        for replica in replicas:
+            await replica.start()
+        try:
+            await router._wait_ready()
+        except BaseException:
+            await router.shutdown()
+            raise
+        router._poll_task = asyncio.create_task(router._poll_loop())
+        print(f"🧭 [Router] {len(replicas)} replicas: "
+              f"{', '.join(r.name for r in replicas)}")
+        return router
+
+    async def _wait_ready(self) -> None:
+        deadline = time.monotonic() + self.config.ready_timeout_s
+        while True:
+            await self._poll_all()
+            if any(r.routable for r in self.replicas):
+                return
+            if time.monotonic() > deadline:
+                raise NoReplicaAvailable("no replica became ready")
+            await asyncio.sleep(min(self.config.poll_interval_s, 0.5))
+
+    async def _poll_one(self, replica: Replica) -> None:
+        try:
+            replica.stats = await asyncio.wait_for(
+                replica.poll(), self.config.poll_timeout_s
+            )
+        except Exception as e:
+            replica.stats = {}
+            replica.record_failure(e, self.config)
+            return
+        replica.record_success()
+        if replica.state is ReplicaState.EJECTED and \
+                time.monotonic() >= replica.ejected_until:
+            replica.state = ReplicaState.HEALTHY
+            print(f"✅ [Router] readmitted {replica.name}")
+
+    async def _poll_all(self) -> None:
+        await asyncio.gather(*(self._poll_one(r) for r in self.replicas))
+
+    async def _poll_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.poll_interval_s)
+            await self._poll_all()
+
+    def _affinity_key(self, prompt: Any) -> bytes:
+        n = self.config.affinity_tokens
+        if isinstance(prompt, dict) and "prompt_token_ids" in prompt:
+            ids = prompt["prompt_token_ids"][:n]
+            return b"".join(i.to_bytes(4, "little") for i in ids)
+        return str(prompt)[:4 * n].encode("utf-8")
+
+    def pick(self, key: bytes, exclude: set[str]) -> Replica:
+        """Rendezvous-preferred replica unless it is clearly busier"""
+        candidates = [
+            r for r in self.replicas
+            if r.routable and r.name not in exclude
+        ]
+        if not candidates:
+            self.stats.unavailable += 1
+            raise NoReplicaAvailable("no healthy replica")
+        cfg = self.config
+        least = min(candidates, key=lambda r: r.load(cfg))
+        preferred = max(candidates, key=lambda r: _weight(key, r.name))
+        if preferred.load(cfg) <= least.load(cfg) + cfg.affinity_slack:
+            self.stats.affinity_hits += 1
+            return preferred
+        self.stats.affinity_overflows += 1
+        return least
+
+    async def generate(
+        self,
+        prompt: Any,
+        sampling_params: Any,
+        request_id: str,
+        **kwargs: Any
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Stream from the chosen replica. A replica that fails before its
+        first output is skipped and the next choice tried; a request the
+        replica rejected is not retried elsewhere.
+        """
+        key = self._affinity_key(prompt)
+        tried: set[str] = set()
+        while True:
+            replica = self.pick(key, tried)
+            tried.add(replica.name)
+            self.stats.routed += 1
+            replica.requests += 1
+            replica.inflight += 1
+            self._routes[request_id] = replica
+            started = False
+            try:
+                async with aclosing(replica.generate(
+                    prompt, sampling_params, request_id, **kwargs
+                )) as outputs:
+                    async for output in outputs:
+                        started = True
+                        yield output
+                replica.record_success()
+                return
+            except Exception as e:
+                replica.record_failure(e, self.config)
+                if started or not replica.is_failure(e) or not any(
+                    r.routable and r.name not in tried for r in self.replicas
+                ):
+                    raise
+                self.stats.failovers += 1
+                print(f"↪️ [Router] {replica.name} failed before output "
+                      f"({type(e).__name__}), trying another replica")
+            finally:
+                replica.inflight -= 1
+                if self._routes.get(request_id) is replica:
+                    del self._routes[request_id]
+
+    def is_engine_failure(self, error: BaseException) -> bool:
+        """
+        What the app's EngineManager may count against the router: replica
+        faults are already handled by ejection, so only running out of
+        replicas altogether.
+        """
+        return isinstance(error, NoReplicaAvailable)
+
+    async def abort(self, request_id: str) -> None:
+        replica = self._routes.pop(request_id, None)
+        if replica is not None:
+            await replica.abort(request_id)
+
+    def get_stats(self) -> dict[str, float]:
+        """Summed replica stats, for the engine_* gauges"""
+        totals: dict[str, float] = {
+            "replicas_routable": float(
+                sum(r.routable for r in self.replicas)
+            ),
+        }
+        for replica in self.replicas:
+            for key in ("num_requests_running", "num_requests_waiting"):
+                totals[key] = totals.get(key, 0.0) + replica.stats.get(key, 0)
+        usage = [
+            r.stats["kv_cache_usage"] for r in self.replicas
+            if "kv_cache_usage" in r.stats
+        ]
+        if usage:
+            totals["kv_cache_usage"] = sum(usage) / len(usage)
+        return totals
+
+    def find(self, name: str) -> Replica | None:
+        return next((r for r in self.replicas if r.name == name), None)
+
+    def drain(self, name: str) -> Replica | None:
+        """Stop sending new requests to `name`; in-flight ones finish"""
+        replica = self.find(name)
+        if replica is not None:
+            replica.state = ReplicaState.DRAINING
+            print(f"🚰 [Router] draining {name} "
+                  f"({replica.inflight} in flight)")
+        return replica
+
+    def resume(self, name: str) -> Replica | None:
+        replica = self.find(name)
+        if replica is not None:
+            replica.state = ReplicaState.HEALTHY
+            replica.consecutive_failures = 0
+        return replica
+
+    async def shutdown(self) -> None:
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        await asyncio.gather(
+            *(r.close() for r in self.replicas), return_exceptions=True
+        )
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "routed": self.stats.routed,
+            "affinity_hits": self.stats.affinity_hits,
+            "affinity_overflows": self.stats.affinity_overflows,
+            "failovers": self.stats.failovers,
+            "unavailable": self.stats.unavailable,
+            "replicas": {r.name: r.snapshot() for r in self.replicas},
+        }
+
+
+def build_engine_factory(
+    local_factory: Callable[[], Awaitable[LLMEngine]]
+) -> Callable[[], Awaitable[LLMEngine]]:
+    """`local_factory` itself, or a router over ROUTER_REPLICAS"""
+    config = RouterConfig.from_env()
+    if config is None:
+        return local_factory
+
+    async def build() -> LLMEngine:
+        return await EngineRouter.create(config, local_factory)
+    return build
@@ -0,0 +1,236 @@
+import json
+import os
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, replace
+from enum import Enum
+from typing import Any
+
+try:
+    from vllm import SamplingParams
+    from vllm.sampling_params import RequestOutputKind
+except ImportError:
+    # ENGINE_BACKEND=synthetic runs without vLLM: stand-ins with the fields
+    # the synthetic engine, the IPC client and HTTP replicas read
+    class RequestOutputKind(Enum):  # type: ignore[no-redef]
+        CUMULATIVE = 0
+        DELTA = 1
+        FINAL_ONLY = 2
+
+    @dataclass
+    class SamplingParams:  # type: ignore[no-redef]
+        n: int = 1
+        max_tokens: int | None = 16
+        temperature: float = 1.0
+        top_p: float = 1.0
+        top_k: int = 0
+        repetition_penalty: float = 1.0
+        presence_penalty: float = 0.0
+        frequency_penalty: float = 0.0
+        seed: int | None = None
+        stop: list[str] | None = None
+        ignore_eos: bool = False
+        output_kind: RequestOutputKind = RequestOutputKind.CUMULATIVE
+
+
+###############################################################################
+#
+#              Sampling presets, per-request overrides and caps
+#
+# Requests name a preset and override individual fields; the server clamps
+# max_tokens, bounds the stop list and appends its own stop strings. The
+# result is a frozen SamplingSpec, which doubles as the key for both the
+# response cache and the SamplingParams cache: most traffic uses a handful
+# of distinct settings, so the engine gets the same few objects over and
+# over instead of a fresh one (and its validation) per request.
+#
+###############################################################################
+@dataclass(frozen=True)
+class SamplingSpec:
+    max_tokens: int
+    temperature: float
+    top_p: float
+    top_k: int
+    repetition_penalty: float
+    presence_penalty: float = 0.0
+    frequency_penalty: float = 0.0
+    seed: int | None = None
+    stop: tuple[str, ...] = ()
+    # Choices per request (OpenAI `n`)
+    n: int = 1
+
+    def as_dict(self) -> dict[str, Any]:
+        """Plain fields, used in cache keys and /health"""
+        data = asdict(self)
+        data["stop"] = list(self.stop)
+        return data
+
+
+PRESETS: dict[str, SamplingSpec] = {
+    "default": SamplingSpec(
+        max_tokens=1024,
+        temperature=0.5,
+        top_p=0.85,
+        top_k=25,
+        repetition_penalty=1.1,
+    ),
+    # Short factual answers: the cheapest way to raise throughput
+    "concise": SamplingSpec(
+        max_tokens=256,
+        temperature=0.3,
+        top_p=0.85,
+        top_k=25,
+        repetition_penalty=1.1,
+    ),
+    # Greedy; repeatable answers for evaluation and batch jobs
+    "precise": SamplingSpec(
+        max_tokens=512,
+        temperature=0.0,
+        top_p=1.0,
+        top_k=-1,
+        repetition_penalty=1.05,
+    ),
+    "creative": SamplingSpec(
+        max_tokens=1024,
+        temperature=0.8,
+        top_p=0.95,
+        top_k=50,
+        repetition_penalty=1.1,
+    ),
+}
+
+
+@dataclass
+class SamplingConfig:
+    preset: str = "default"
+    # Hard ceiling on max_tokens, whatever the request or preset says
+    max_tokens_cap: int = 1024
+    max_stop: int = 8
+    max_stop_chars: int = 64
+    max_n: int = 8
+    # Always appended to the request's stop list
+    stop: tuple[str, ...] = ()
+    cache_size: int = 256
+
+    @classmethod
+    def from_env(cls) -> "SamplingConfig":
+        return cls(
+            preset=os.getenv("SAMPLING_PRESET", cls.preset),
+            max_tokens_cap=int(
+                os.getenv("SAMPLING_MAX_TOKENS_CAP", cls.max_tokens_cap)
+            ),
+            max_stop=int(os.getenv("SAMPLING_MAX_STOP", cls.max_stop)),
+            max_stop_chars=int(
+                os.getenv("SAMPLING_MAX_STOP_CHARS", cls.max_stop_chars)
+            ),
+            max_n=int(os.getenv("SAMPLING_MAX_N", cls.max_n)),
+            # JSON list, e.g. SAMPLING_STOP='["\\n\\nCâu hỏi:"]'
+            stop=tuple(json.loads(os.getenv("SAMPLING_STOP", "[]"))),
+            cache_size=int(
+                os.getenv("SAMPLING_CACHE_SIZE", cls.cache_size)
+            ),
+        )
+
+
+@dataclass
+class _ParamsCacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class SamplingFactory:
+    """Resolves presets + overrides and hands out shared SamplingParams"""
+
+    def __init__(self, config: SamplingConfig | None = None) -> None:
+        self.config = config or SamplingConfig()
+        if self.config.preset not in PRESETS:
+            raise ValueError(
+                f"Unknown SAMPLING_PRESET: {self.config.preset!r}"
+            )
+        self._params: OrderedDict[
+            tuple[SamplingSpec, RequestOutputKind], SamplingParams
+        ] = OrderedDict()
+        self.stats = _ParamsCacheStats()
+        self.default = self.resolve()
+
+    def resolve(
+        self,
+        preset: str | None = None,
+        **overrides: Any
+    ) -> SamplingSpec:
+        """
+        Apply `overrides` (None values ignored) on top of `preset`, then the
+        server caps. Raises ValueError for an unknown preset, or a stop
+        list or `n` over the limits.
+        """
+        cfg = self.config
+        base = PRESETS.get(preset or cfg.preset)
+        if base is None:
+            raise ValueError(
+                f"Unknown sampling preset {preset!r}; "
+                f"expected one of {sorted(PRESETS)}"
+            )
+        fields = {k: v for k, v in overrides.items() if v is not None}
+        stop = fields.pop("stop", ())
+        if isinstance(stop, str):
+            stop = (stop,)
+        if len(stop) > cfg.max_stop:
+            raise ValueError(f"At most {cfg.max_stop} stop sequences")
+        if any(not s or len(s) > cfg.max_stop_chars for s in stop):
+            raise ValueError(
+                f"Stop sequences must be 1-{cfg.max_stop_chars} characters"
+            )
+        if not 1 <= fields.get("n", 1) <= cfg.max_n:
+            raise ValueError(f"n must be between 1 and {cfg.max_n}")
+        spec = replace(base, **fields)
+        return replace(
+            spec,
+            max_tokens=max(1, min(spec.max_tokens, cfg.max_tokens_cap)),
+            # Deduplicated, order kept, so equal lists give equal specs
+            stop=tuple(dict.fromkeys((*stop, *cfg.stop)))
+        )
+
+    def params(
+        self,
+        spec: SamplingSpec,
+        output_kind: RequestOutputKind = RequestOutputKind.DELTA
+    ) -> SamplingParams:
+        """
+        Shared SamplingParams for `spec`. The engine clones what it keeps,
+        so one object can be passed to any number of requests.
+        """
+        key = (spec, output_kind)
+        params = self._params.get(key)
+        if params is not None:
+            self.stats.hits += 1
+            self._params.move_to_end(key)
+            return params
+        self.stats.misses += 1
+        params = SamplingParams(
+            n=spec.n,
+            max_tokens=spec.max_tokens,
+            temperature=spec.temperature,
+            top_p=spec.top_p,
+            top_k=spec.top_k,
+            repetition_penalty=spec.repetition_penalty,
+            presence_penalty=spec.presence_penalty,
+            frequency_penalty=spec.frequency_penalty,
+            seed=spec.seed,
+            stop=list(spec.stop) or None,
+            output_kind=output_kind
+        )
+        self._params[key] = params
+        while len(self._params) > self.config.cache_size:
+            self._params.popitem(last=False)
+        return params
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "preset": self.config.preset,
+            "max_tokens_cap": self.config.max_tokens_cap,
+            "cached_params": len(self._params),
+            "params_hits": self.stats.hits,
+            "params_misses": self.stats.misses,
+        }
+
+
+sampling_factory = SamplingFactory(SamplingConfig.from_env())
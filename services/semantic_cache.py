@@ -0,0 +1,321 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Callable, Protocol
+
+import numpy as np
+
+from services.embeddings import Embedder, build_embedder
+
+
+###############################################################################
+#
+#                       Nearest-neighbour vector indexes
+#
+###############################################################################
+class VectorIndex(Protocol):
+    async def search(self, vector: np.ndarray) -> tuple[int, float] | None:
+        """Best (id, cosine similarity) or None when the index is empty"""
+        ...
+
+    async def add(self, entry_id: int, vector: np.ndarray) -> None:
+        ...
+
+    async def remove(self, entry_id: int) -> None:
+        ...
+
+
+class NumpyIndex:
+    """Brute-force inner product over a preallocated float32 matrix"""
+
+    def __init__(self, dim: int, capacity: int) -> None:
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._ids = np.full(capacity, -1, dtype=np.int64)
+        self._slots: dict[int, int] = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+    async def search(self, vector: np.ndarray) -> tuple[int, float] | None:
+        if not self._slots:
+            return None
+        scores = self._matrix @ vector
+        scores[self._ids < 0] = -np.inf
+        slot = int(np.argmax(scores))
+        return int(self._ids[slot]), float(scores[slot])
+
+    async def add(self, entry_id: int, vector: np.ndarray) -> None:
+        slot = self._free.pop()
+        self._matrix[slot] = vector
+        self._ids[slot] = entry_id
+        self._slots[entry_id] = slot
+
+    async def remove(self, entry_id: int) -> None:
+        slot = self._slots.pop(entry_id, None)
+        if slot is not None:
+            self._ids[slot] = -1
+            self._matrix[slot] = 0.0
+            self._free.append(slot)
+
+
+class QdrantIndex:
+    """Qdrant local mode (":memory:" or an on-disk path), no server needed"""
+
+    def __init__(
+        self,
+        dim: int,
+        location: str = ":memory:",
+        collection: str = "semantic_cache"
+    ) -> None:
+        from qdrant_client import QdrantClient, models
+
+        self._models = models
+        self.collection = collection
+        if location == ":memory:":
+            self.client = QdrantClient(location=":memory:")
+        else:
+            self.client = QdrantClient(path=location)
+        if self.client.collection_exists(collection):
+            self.client.delete_collection(collection)
+        self.client.create_collection(
+            collection_name=collection,
+            vectors_config=models.VectorParams(
+                size=dim, distance=models.Distance.COSINE
+            ),
+        )
+
+    def _search(self, vector: np.ndarray) -> tuple[int, float] | None:
+        hits = self.client.query_points(
+            collection_name=self.collection,
+            query=vector.tolist(),
+            limit=1,
+        ).points
+        if not hits:
+            return None
+        return int(hits[0].id), float(hits[0].score)
+
+    async def search(self, vector: np.ndarray) -> tuple[int, float] | None:
+        return await asyncio.to_thread(self._search, vector)
+
+    async def add(self, entry_id: int, vector: np.ndarray) -> None:
+        await asyncio.to_thread(
+            self.client.upsert,
+            collection_name=self.collection,
+            points=[self._models.PointStruct(
+                id=entry_id, vector=vector.tolist()
+            )],
+        )
+
+    async def remove(self, entry_id: int) -> None:
+        await asyncio.to_thread(
+            self.client.delete,
+            collection_name=self.collection,
+            points_selector=self._models.PointIdsList(points=[entry_id]),
+        )
+
+
+###############################################################################
+#
+#                       Semantic cache over answers
+#
+###############################################################################
+@dataclass
+class SemanticCacheConfig:
+    enabled: bool = False
+    threshold: float = 0.92
+    ttl_s: float = 3600.0
+    max_entries: int = 10_000
+    # "numpy" or "qdrant"
+    index: str = "numpy"
+    qdrant_location: str = ":memory:"
+
+    @classmethod
+    def from_env(cls) -> "SemanticCacheConfig":
+        return cls(
+            enabled=os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1",
+            threshold=float(
+                os.getenv("SEMANTIC_CACHE_THRESHOLD", cls.threshold)
+            ),
+            ttl_s=float(os.getenv("SEMANTIC_CACHE_TTL_S", cls.ttl_s)),
+            max_entries=int(
+                os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", cls.max_entries)
+            ),
+            index=os.getenv("SEMANTIC_CACHE_INDEX", cls.index),
+            qdrant_location=os.getenv(
+                "SEMANTIC_CACHE_QDRANT_LOCATION", cls.qdrant_location
+            ),
+        )
+
+
+@dataclass
+class _SemanticEntry:
+    question: str
+    deltas: list[str]
+    expires_at: float
+
+
+@dataclass
+class _Latency:
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+        }
+
+
+@dataclass
+class SemanticCacheStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+    hit_latency: _Latency = field(default_factory=_Latency)
+    miss_latency: _Latency = field(default_factory=_Latency)
+
+    def snapshot(self) -> dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "hit_latency": self.hit_latency.snapshot(),
+            "miss_latency": self.miss_latency.snapshot(),
+        }
+
+
+class SemanticCache:
+    """
+    Returns a stored answer when a question's embedding is close enough.
+
+    Lookup cost (embed + nearest neighbour) is recorded separately for
+    hits and misses so it can be compared with decode time.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        index: VectorIndex,
+        config: SemanticCacheConfig | None = None
+    ) -> None:
+        self.embedder = embedder
+        self.index = index
+        self.config = config or SemanticCacheConfig()
+        self.stats = SemanticCacheStats()
+        self._entries: OrderedDict[int, _SemanticEntry] = OrderedDict()
+        # (expires_at, id) in insertion order, which with one TTL is also
+        # expiry order; _entries is reordered by hits
+        self._expiry: deque[tuple[float, int]] = deque()
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def from_env(cls) -> "SemanticCache | None":
+        """Build from SEMANTIC_CACHE_*; None unless explicitly enabled"""
+        config = SemanticCacheConfig.from_env()
+        if not config.enabled:
+            return None
+        embedder = build_embedder()
+        index: VectorIndex
+        if config.index == "qdrant":
+            index = QdrantIndex(embedder.dim, config.qdrant_location)
+        elif config.index == "numpy":
+            index = NumpyIndex(embedder.dim, config.max_entries)
+        else:
+            raise ValueError(
+                f"Unknown SEMANTIC_CACHE_INDEX: {config.index!r}"
+            )
+        return cls(embedder, index, config)
+
+    async def lookup(
+        self,
+        question: str
+    ) -> tuple[list[str] | None, np.ndarray]:
+        """Return (cached deltas or None, question embedding)"""
+        started = time.perf_counter()
+        vector = (await self.embedder.embed([question]))[0]
+        # An expired entry left in the index could outrank a live one
+        await self._sweep()
+        match = await self.index.search(vector)
+        deltas: list[str] | None = None
+        if match is not None and match[1] >= self.config.threshold:
+            entry = self._entries.get(match[0])
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self.stats.expired += 1
+                await self._evict(match[0])
+            elif entry is not None:
+                self._entries.move_to_end(match[0])
+                deltas = entry.deltas
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if deltas is not None:
+            self.stats.hits += 1
+            self.stats.hit_latency.observe(elapsed_ms)
+        else:
+            self.stats.misses += 1
+            self.stats.miss_latency.observe(elapsed_ms)
+        return deltas, vector
+
+    async def store(
+        self,
+        question: str,
+        vector: np.ndarray,
+        deltas: list[str]
+    ) -> None:
+        await self._sweep()
+        while len(self._entries) >= self.config.max_entries:
+            oldest = next(iter(self._entries))
+            await self._evict(oldest)
+            self.stats.evictions += 1
+        entry_id = next(self._ids)
+        expires_at = time.monotonic() + self.config.ttl_s
+        self._entries[entry_id] = _SemanticEntry(
+            question=question,
+            deltas=deltas,
+            expires_at=expires_at
+        )
+        self._expiry.append((expires_at, entry_id))
+        await self.index.add(entry_id, vector)
+
+    async def _sweep(self) -> None:
+        """Drop expired entries from the index, oldest first"""
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, entry_id = self._expiry.popleft()
+            if entry_id in self._entries:
+                self.stats.expired += 1
+                await self._evict(entry_id)
+
+    async def _evict(self, entry_id: int) -> None:
+        self._entries.pop(entry_id, None)
+        await self.index.remove(entry_id)
+
+    async def stream(
+        self,
+        question: str,
+        produce: Callable[[], AsyncGenerator[str, None]]
+    ) -> AsyncGenerator[str, None]:
+        """Replay a similar cached answer or generate and remember it"""
+        deltas, vector = await self.lookup(question)
+        if deltas is not None:
+            for delta in deltas:
+                yield delta
+            return
+        generated: list[str] = []
+        stream = produce()
+        async with aclosing(stream):
+            async for delta in stream:
+                generated.append(delta)
+                yield delta
+        await self.store(question, vector, generated)
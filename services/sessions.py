@@ -0,0 +1,490 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Protocol
+from uuid import uuid4
+
+from services.admission import api_workers
+from services.prompting import BuiltPrompt, PromptBuilder
+
+
+###############################################################################
+#
+#                  Server-side chat sessions with a token budget
+#
+# A session keeps its turns so clients send only the new question. The
+# prompt is laid out append-only (PromptBuilder.render_conversation):
+# turn N's prompt starts with turn N-1's prompt and answer, so vLLM's
+# prefix cache serves all of it and only the new question is prefilled.
+# When history outgrows the budget (max_model_len minus the answer's
+# max_tokens) the oldest turns leave the prompt. They are dropped down to
+# `truncate_to` of the budget rather than just under it: truncating
+# changes the prefix and costs one full prefill, so it should happen once
+# every several turns, not on every turn once the budget is reached.
+#
+###############################################################################
+class SessionError(ValueError):
+    pass
+
+
+@dataclass
+class SessionConfig:
+    enabled: bool = True
+    # Sessions held in memory; least recently used ones go first
+    max_sessions: int = 1024
+    ttl_s: float = 3600.0
+    # Turns kept per session (also the history GET returns)
+    max_turns: int = 200
+    max_model_len: int = 4096
+    # Tokens kept free besides max_tokens, for estimate error
+    margin_tokens: int = 64
+    # After truncating, history fills at most this share of the budget
+    truncate_to: float = 0.5
+    # Token estimate without a tokenizer, corrected per session from the
+    # engine's exact prompt counts
+    chars_per_token: float = 3.0
+    # "" (memory only) or "sqlite:///path/to/sessions.db"
+    backend: str = ""
+
+    @classmethod
+    def from_env(cls, max_model_len: int) -> "SessionConfig":
+        return cls(
+            enabled=os.getenv("SESSIONS_ENABLED", "1") == "1",
+            max_sessions=int(
+                os.getenv("SESSION_MAX_SESSIONS", cls.max_sessions)
+            ),
+            ttl_s=float(os.getenv("SESSION_TTL_S", cls.ttl_s)),
+            max_turns=int(os.getenv("SESSION_MAX_TURNS", cls.max_turns)),
+            max_model_len=max_model_len,
+            margin_tokens=int(
+                os.getenv("SESSION_MARGIN_TOKENS", cls.margin_tokens)
+            ),
+            truncate_to=float(
+                os.getenv("SESSION_TRUNCATE_TO", cls.truncate_to)
+            ),
+            chars_per_token=float(
+                os.getenv("SESSION_CHARS_PER_TOKEN", cls.chars_per_token)
+            ),
+            backend=os.getenv("SESSION_BACKEND", ""),
+        )
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str
+    answer_ids: list[int] | None
+    # Tokens this turn adds to the prompt (question, answer, template)
+    tokens: int
+    # Per-turn report: prompt_tokens, cached_tokens, ...
+    report: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Session:
+    id: str
+    tenant: str
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    turns: list[Turn] = field(default_factory=list)
+    # Index of the oldest turn still in the prompt
+    window: int = 0
+    # Bumped on every committed turn; stale copies are reloaded
+    version: int = 0
+    # Engine prompt tokens over our estimate, for budgets without a
+    # tokenizer
+    token_scale: float = 1.0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    truncations: int = 0
+    lock: asyncio.Lock = field(
+        default_factory=asyncio.Lock, repr=False, compare=False
+    )
+
+    def to_dict(self) -> dict[str, Any]:
+        data = {
+            f.name: getattr(self, f.name) for f in fields(self)
+            if f.name != "lock"
+        }
+        data["turns"] = [asdict(t) for t in self.turns]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Session":
+        turns = [Turn(**t) for t in data.pop("turns", [])]
+        return cls(**data, turns=turns)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "turns": [
+                {"question": t.question, "answer": t.answer, **t.report}
+                for t in self.turns
+            ],
+            "window_start": self.window,
+            "prompt_tokens": self.prompt_tokens,
+            "prefill_tokens_saved": self.cached_tokens,
+            "prefill_saved_ratio": (
+                self.cached_tokens / self.prompt_tokens
+                if self.prompt_tokens else 0.0
+            ),
+            "truncations": self.truncations,
+        }
+
+
+@dataclass
+class SessionPrompt:
+    prompt: BuiltPrompt
+    # Index of the oldest turn in the prompt; the session's window once
+    # the turn is committed
+    window: int
+    # Turns dropped from the front of the prompt for this turn
+    truncated_turns: int
+    # Tokens of the new question and its template
+    question_tokens: int
+    estimated_tokens: int
+
+
+###############################################################################
+#
+#                         Optional persistent backend
+#
+###############################################################################
+class SessionBackend(Protocol):
+    async def load(self, session_id: str) -> dict[str, Any] | None:
+        ...
+
+    async def version(self, session_id: str) -> int | None:
+        ...
+
+    async def save(self, data: dict[str, Any], ttl_s: float) -> None:
+        ...
+
+    async def delete(self, session_id: str) -> None:
+        ...
+
+
+class SQLiteSessionBackend:
+    """
+    Sessions on disk, so they outlive restarts and memory eviction and
+    several API workers can serve the same session.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, version INTEGER, data TEXT, "
+                "expires_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5.0)
+
+    def _load(self, session_id: str) -> dict[str, Any] | None:
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT data, expires_at FROM sessions WHERE id = ?",
+                (session_id,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _version(self, session_id: str) -> int | None:
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def _save(self, data: dict[str, Any], ttl_s: float) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                (data["id"], data["version"], json.dumps(data),
+                 time.time() + ttl_s)
+            )
+            conn.execute(
+                "DELETE FROM sessions WHERE expires_at < ?", (time.time(),)
+            )
+
+    def _delete(self, session_id: str) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def load(self, session_id: str) -> dict[str, Any] | None:
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def version(self, session_id: str) -> int | None:
+        return await asyncio.to_thread(self._version, session_id)
+
+    async def save(self, data: dict[str, Any], ttl_s: float) -> None:
+        await asyncio.to_thread(self._save, data, ttl_s)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.to_thread(self._delete, session_id)
+
+
+###############################################################################
+#
+#                       Bounded in-memory session store
+#
+###############################################################################
+@dataclass
+class SessionStats:
+    sessions: int = 0
+    created: int = 0
+    evicted: int = 0
+    expired: int = 0
+    turns: int = 0
+    truncations: int = 0
+    prompt_tokens: int = 0
+    # Prompt tokens the engine served from its prefix cache
+    prefill_tokens_saved: int = 0
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            **asdict(self),
+            "prefill_saved_ratio": (
+                self.prefill_tokens_saved / self.prompt_tokens
+                if self.prompt_tokens else 0.0
+            ),
+        }
+
+
+class SessionStore:
+    def __init__(
+        self,
+        config: SessionConfig,
+        builder: PromptBuilder,
+        backend: SessionBackend | None = None
+    ) -> None:
+        self.config = config
+        self.builder = builder
+        self.backend = backend
+        self.stats = SessionStats()
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+
+    @classmethod
+    def from_env(
+        cls,
+        builder: PromptBuilder,
+        max_model_len: int
+    ) -> "SessionStore | None":
+        """Build from SESSION_*; None when SESSIONS_ENABLED=0"""
+        config = SessionConfig.from_env(max_model_len)
+        if not config.enabled:
+            return None
+        backend: SessionBackend | None = None
+        if config.backend.startswith("sqlite:///"):
+            backend = SQLiteSessionBackend(config.backend[len("sqlite:///"):])
+        elif config.backend:
+            raise ValueError(f"Unknown SESSION_BACKEND: {config.backend!r}")
+        return cls(config, builder, backend)
+
+    def _remember(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        while len(self._sessions) > self.config.max_sessions:
+            # Least recently used first, skipping sessions mid-turn
+            victim = next(
+                (s for s in self._sessions.values() if not s.lock.locked()),
+                None
+            )
+            if victim is None:
+                break
+            del self._sessions[victim.id]
+            self.stats.evicted += 1
+        self.stats.sessions = len(self._sessions)
+
+    def _expired(self, session: Session) -> bool:
+        return time.time() - session.updated_at > self.config.ttl_s
+
+    async def create(self, tenant: str) -> Session:
+        session = Session(id=uuid4().hex, tenant=tenant)
+        self.stats.created += 1
+        self._remember(session)
+        if self.backend is not None:
+            await self.backend.save(session.to_dict(), self.config.ttl_s)
+        return session
+
+    async def get(self, session_id: str, tenant: str) -> Session | None:
+        """The tenant's session, or None if unknown, expired or not theirs"""
+        session = self._sessions.get(session_id)
+        if session is not None and self.backend is not None \
+                and api_workers() > 1 and not session.lock.locked():
+            # Another worker may have served a turn since
+            if await self.backend.version(session_id) != session.version:
+                session = None
+        if session is None and self.backend is not None:
+            data = await self.backend.load(session_id)
+            if data is not None:
+                session = Session.from_dict(data)
+        if session is None:
+            return None
+        if self._expired(session):
+            self._sessions.pop(session_id, None)
+            self.stats.expired += 1
+            self.stats.sessions = len(self._sessions)
+            return None
+        if session.tenant != tenant:
+            return None
+        self._remember(session)
+        return session
+
+    async def delete(self, session_id: str, tenant: str) -> bool:
+        session = await self.get(session_id, tenant)
+        if session is None:
+            return False
+        self._sessions.pop(session_id, None)
+        self.stats.sessions = len(self._sessions)
+        if self.backend is not None:
+            await self.backend.delete(session_id)
+        return True
+
+    def _estimate(self, session: Session, text: str) -> int:
+        exact = self.builder.count_tokens(text)
+        if exact is not None:
+            return exact
+        return int(
+            len(text) / self.config.chars_per_token * session.token_scale
+        ) + 1
+
+    def _turn_tokens(
+        self,
+        session: Session,
+        question: str,
+        answer_tokens: int
+    ) -> int:
+        """Prompt tokens a finished turn adds; the answer count is exact"""
+        return self._estimate(
+            session, question + self.builder.foot + self.builder.turn_sep
+        ) + answer_tokens
+
+    def estimate_cost(
+        self,
+        session: Session,
+        question: str,
+        max_tokens: int
+    ) -> int:
+        """Prompt plus answer tokens of the next turn, for admission"""
+        history = sum(t.tokens for t in session.turns[session.window:])
+        return history + self._estimate(session, question) + max_tokens
+
+    def prepare(
+        self,
+        session: Session,
+        question: str,
+        max_tokens: int
+    ) -> SessionPrompt:
+        """
+        The next turn's prompt within the token budget; may tokenize, so
+        call it off the event loop when the builder has a tokenizer. The
+        session is left as it is: commit() applies the new window, so a
+        turn that fails or is abandoned truncates nothing.
+        """
+        budget = self.config.max_model_len - max_tokens \
+            - self.config.margin_tokens
+        fixed = self._estimate(
+            session, self.builder.head
+        ) + self.builder.segment_overhead()
+        question_tokens = self._estimate(
+            session, question + self.builder.foot
+        )
+        if fixed + question_tokens > budget:
+            raise SessionError(
+                f"question needs about {question_tokens} tokens, the budget "
+                f"left by max_tokens={max_tokens} is {budget - fixed}"
+            )
+        window = session.window
+        history = sum(t.tokens for t in session.turns[window:])
+        truncated = 0
+        if fixed + history + question_tokens > budget:
+            target = budget * self.config.truncate_to
+            while window < len(session.turns) and (
+                fixed + history + question_tokens > target
+            ):
+                history -= session.turns[window].tokens
+                window += 1
+                truncated += 1
+        prompt = self.builder.render_conversation(
+            session.turns[window:], question
+        )
+        return SessionPrompt(
+            prompt=prompt,
+            window=window,
+            truncated_turns=truncated,
+            question_tokens=question_tokens,
+            estimated_tokens=fixed + history + question_tokens,
+        )
+
+    async def commit(
+        self,
+        session: Session,
+        question: str,
+        prepared: SessionPrompt,
+        answer: str,
+        answer_ids: list[int],
+        prompt_tokens: int,
+        cached_tokens: int,
+        finish_reason: str | None
+    ) -> dict[str, Any]:
+        """Append a finished turn and return its report"""
+        if prepared.prompt.token_ids is None and prepared.estimated_tokens:
+            # Learn this conversation's chars per token from the engine
+            session.token_scale = min(max(
+                session.token_scale * prompt_tokens
+                / prepared.estimated_tokens, 0.25
+            ), 4.0)
+        report = {
+            "turn": len(session.turns) + 1,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            # Prompt tokens that had to be prefilled this turn
+            "prefill_tokens": prompt_tokens - cached_tokens,
+            "output_tokens": len(answer_ids),
+            "truncated_turns": prepared.truncated_turns,
+            "finish_reason": finish_reason,
+        }
+        if self.builder.tokenizer is not None:
+            answer_ids = self.builder.answer_ids(answer_ids)
+            kept_ids: list[int] | None = answer_ids
+        else:
+            # Without the tokenizer the prompt is text; the engine's IDs
+            # only give the answer's length
+            kept_ids = None
+        session.window = prepared.window
+        session.turns.append(Turn(
+            question, answer, kept_ids,
+            self._turn_tokens(session, question, len(answer_ids)), report
+        ))
+        overflow = len(session.turns) - self.config.max_turns
+        if overflow > 0:
+            del session.turns[:overflow]
+            session.window = max(session.window - overflow, 0)
+        session.version += 1
+        session.updated_at = time.time()
+        session.prompt_tokens += prompt_tokens
+        session.cached_tokens += cached_tokens
+        session.truncations += bool(prepared.truncated_turns)
+        self.stats.turns += 1
+        self.stats.prompt_tokens += prompt_tokens
+        self.stats.prefill_tokens_saved += cached_tokens
+        self.stats.truncations += bool(prepared.truncated_turns)
+        if self.backend is not None:
+            await self.backend.save(session.to_dict(), self.config.ttl_s)
+        return {
+            **report,
+            "session_id": session.id,
+            "prefill_tokens_saved": session.cached_tokens,
+            "session_prompt_tokens": session.prompt_tokens,
+        }
@@ -0,0 +1,133 @@
+import os
+from dataclasses import dataclass
+from typing import Any
+
+
+###############################################################################
+#
+#                Speculative decoding: configuration and stats
+#
+# A proposer guesses the next k tokens and the target model verifies them
+# in one forward pass, so each decode step can emit up to k + 1 tokens.
+# "ngram" (prompt lookup) needs no extra weights and suits RAG, where
+# answers copy spans from the retrieved context; "draft" runs a small
+# model sharing the target's tokenizer, e.g. Qwen2-0.5B for Qwen2-7B.
+#
+###############################################################################
+SPECULATIVE_METHODS = ("ngram", "draft")
+
+
+@dataclass
+class SpeculativeConfig:
+    method: str
+    num_speculative_tokens: int = 4
+    draft_model: str | None = None
+    draft_tensor_parallel_size: int = 1
+    # n-gram window matched against the prompt (ngram only)
+    prompt_lookup_max: int = 4
+    prompt_lookup_min: int = 2
+
+    @classmethod
+    def from_env(cls) -> "SpeculativeConfig | None":
+        """None unless SPECULATIVE_METHOD is ngram or draft"""
+        method = os.getenv("SPECULATIVE_METHOD", "").strip().lower()
+        if method in ("", "off", "none", "0"):
+            return None
+        if method not in SPECULATIVE_METHODS:
+            raise ValueError(
+                f"Unknown SPECULATIVE_METHOD {method!r}; "
+                f"expected one of {SPECULATIVE_METHODS} or off"
+            )
+        draft_model = os.getenv("SPECULATIVE_DRAFT_MODEL") or None
+        if method == "draft" and draft_model is None:
+            raise ValueError(
+                "SPECULATIVE_METHOD=draft needs SPECULATIVE_DRAFT_MODEL"
+            )
+        return cls(
+            method=method,
+            num_speculative_tokens=int(
+                os.getenv("SPECULATIVE_NUM_TOKENS", cls.num_speculative_tokens)
+            ),
+            draft_model=draft_model,
+            draft_tensor_parallel_size=int(
+                os.getenv(
+                    "SPECULATIVE_DRAFT_TP", cls.draft_tensor_parallel_size
+                )
+            ),
+            prompt_lookup_max=int(
+                os.getenv("SPECULATIVE_NGRAM_MAX", cls.prompt_lookup_max)
+            ),
+            prompt_lookup_min=int(
+                os.getenv("SPECULATIVE_NGRAM_MIN", cls.prompt_lookup_min)
+            ),
+        )
+
+    def engine_config(self) -> dict[str, Any]:
+        """AsyncEngineArgs(speculative_config=...)"""
+        if self.method == "ngram":
+            return {
+                "method": "ngram",
+                "num_speculative_tokens": self.num_speculative_tokens,
+                "prompt_lookup_max": self.prompt_lookup_max,
+                "prompt_lookup_min": self.prompt_lookup_min,
+            }
+        return {
+            "model": self.draft_model,
+            "num_speculative_tokens": self.num_speculative_tokens,
+            "draft_tensor_parallel_size": self.draft_tensor_parallel_size,
+        }
+
+
+# vLLM's spec-decode counters, summed over their label sets
+_VLLM_SPEC_COUNTERS: dict[str, str] = {
+    "vllm:spec_decode_num_drafts": "drafts",
+    "vllm:spec_decode_num_draft_tokens": "draft_tokens",
+    "vllm:spec_decode_num_accepted_tokens": "accepted_tokens",
+}
+
+
+def read_spec_decode_counters(engine: Any) -> dict[str, float]:
+    """Cumulative drafts, draft tokens and accepted tokens for `engine`"""
+    if engine is None:
+        return {}
+    get_stats = getattr(engine, "get_spec_decode_stats", None)
+    if get_stats is not None:
+        return get_stats()
+    try:
+        from prometheus_client import REGISTRY as PROMETHEUS_REGISTRY
+    except ImportError:
+        return {}
+    counters: dict[str, float] = {}
+    for family in PROMETHEUS_REGISTRY.collect():
+        key = _VLLM_SPEC_COUNTERS.get(family.name)
+        if key is not None:
+            counters[key] = sum(
+                sample.value for sample in family.samples
+                if sample.name.endswith("_total")
+            )
+    return counters
+
+
+def spec_decode_snapshot(
+    config: SpeculativeConfig | None,
+    engine: Any
+) -> dict[str, Any]:
+    """
+    Acceptance rate (accepted / proposed tokens) and mean tokens emitted
+    per decode step, the upper bound on decode speedup; wall-clock
+    speedup is what `python -m bench --compare-speculative` measures.
+    """
+    if config is None:
+        return {"enabled": False}
+    counters = read_spec_decode_counters(engine)
+    drafts = counters.get("drafts", 0.0)
+    draft_tokens = counters.get("draft_tokens", 0.0)
+    accepted = counters.get("accepted_tokens", 0.0)
+    return {
+        "enabled": True,
+        "method": config.method,
+        "num_speculative_tokens": config.num_speculative_tokens,
+        **counters,
+        "acceptance_rate": accepted / draft_tokens if draft_tokens else 0.0,
+        "tokens_per_step": 1 + accepted / drafts if drafts else 0.0,
+    }
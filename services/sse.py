@@ -0,0 +1,119 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+from json.encoder import encode_basestring_ascii
+from typing import Any
+
+
+###############################################################################
+#
+#                 Pre-encoded SSE frames for the answer stream
+#
+###############################################################################
+# Byte-identical to json.dumps({"type": "answer_part", "data": text}) framing
+ANSWER_PART_PREFIX: bytes = b'data: {"type": "answer_part", "data": '
+FRAME_SUFFIX: bytes = b"}\n\n"
+DONE_FRAME: bytes = b'data: {"type": "done"}'
+
+
+def encode_answer_part(text: str) -> bytes:
+    """Escape only the delta text into the pre-built answer_part frame"""
+    return b"".join((
+        ANSWER_PART_PREFIX,
+        encode_basestring_ascii(text).encode("ascii"),
+        FRAME_SUFFIX,
+    ))
+
+
+def encode_event(kind: str, data: Any) -> bytes:
+    """A `{"type": kind, "data": data}` frame, framed like answer_part"""
+    payload = json.dumps({"type": kind, "data": data})
+    return b"data: " + payload.encode("ascii") + b"\n\n"
+
+
+def encode_context(documents: list[dict[str, Any]]) -> bytes:
+    """The `context` event sent ahead of the answer when RAG is enabled"""
+    return encode_event("context", documents)
+
+
+def encode_data(payload: dict[str, Any]) -> bytes:
+    """A plain `data: <json>` frame (OpenAI-style chunks)"""
+    return b"data: " + json.dumps(
+        payload, separators=(",", ":")
+    ).encode("ascii") + b"\n\n"
+
+
+OPENAI_DONE_FRAME: bytes = b"data: [DONE]\n\n"
+
+
+@dataclass(frozen=True)
+class CoalescePolicy:
+    """
+    When to merge consecutive deltas into one answer_part frame.
+
+    `max_bytes` flushes once the pending text reaches that many characters
+    (a cheap proxy for bytes) and `flush_interval_ms` flushes on the first
+    delta arriving after the oldest pending one is that old. Zero for both
+    disables coalescing.
+    """
+    max_bytes: int = 0
+    flush_interval_ms: float = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.flush_interval_ms > 0
+
+    @classmethod
+    def from_env(cls) -> "CoalescePolicy":
+        return cls(
+            max_bytes=int(os.getenv("SSE_COALESCE_BYTES", "0")),
+            flush_interval_ms=float(os.getenv("SSE_FLUSH_INTERVAL_MS", "0")),
+        )
+
+
+NO_COALESCING = CoalescePolicy()
+
+
+class SSEFrameWriter:
+    """
+    Turns text deltas into answer_part frames without keeping history.
+
+    Only the deltas waiting for the next flush are held; they are dropped
+    as soon as their frame is emitted.
+    """
+    __slots__ = ("_max_bytes", "_interval", "_pending", "_size", "_since")
+
+    def __init__(self, policy: CoalescePolicy = NO_COALESCING) -> None:
+        self._max_bytes = policy.max_bytes
+        self._interval = policy.flush_interval_ms / 1000
+        self._pending: list[str] = []
+        self._size = 0
+        self._since = 0.0
+
+    def feed(self, text: str) -> bytes | None:
+        """Accept one delta; return a frame when the policy says to flush"""
+        if not (self._max_bytes or self._interval):
+            return encode_answer_part(text)
+        if not self._pending:
+            self._since = time.monotonic()
+        self._pending.append(text)
+        self._size += len(text)
+        if self._max_bytes and self._size >= self._max_bytes:
+            return self.flush()
+        if self._interval and time.monotonic() - self._since >= self._interval:
+            return self.flush()
+        return None
+
+    def flush(self) -> bytes | None:
+        if not self._pending:
+            return None
+        frame = encode_answer_part("".join(self._pending))
+        self._pending.clear()
+        self._size = 0
+        return frame
+
+    def done(self) -> bytes:
+        """Flush whatever is pending and close the stream"""
+        tail = self.flush()
+        return tail + DONE_FRAME if tail else DONE_FRAME
@@ -0,0 +1,430 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import shutil
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Iterator
+from uuid import uuid4
+
+from services.engine import LLMEngine
+from services.model_sync import manifest_digest
+from services.sampling import SamplingParams
+
+
+###############################################################################
+#
+#                  Phase-by-phase startup timing report
+#
+###############################################################################
+def _process_started_at() -> float | None:
+    """Wall-clock creation time of this process, if psutil can tell"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().create_time()
+
+
+@dataclass
+class StartupPhase:
+    name: str
+    # Offset from the start of the current boot
+    started_s: float
+    seconds: float | None = None
+    detail: dict[str, Any] = field(default_factory=dict)
+
+
+class StartupReport:
+    """
+    Timings of the most recent engine boot.
+
+    A boot is reset by every (re)initialization; `process_to_ready_s`
+    includes interpreter start and imports, so it is the number to compare
+    across releases.
+    """
+
+    def __init__(self) -> None:
+        self.process_started_at = _process_started_at()
+        self.boots = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.boots += 1
+        self.boot_started_at = time.time()
+        self._origin = time.perf_counter()
+        self.phases: list[StartupPhase] = []
+        self.ready_at: float | None = None
+        self.compile_caches: dict[str, dict[str, Any]] = {}
+
+    @contextmanager
+    def phase(self, name: str, **detail: Any) -> Iterator[StartupPhase]:
+        entry = StartupPhase(
+            name=name,
+            started_s=time.perf_counter() - self._origin,
+            detail=detail
+        )
+        self.phases.append(entry)
+        try:
+            yield entry
+        finally:
+            entry.seconds = time.perf_counter() - self._origin \
+                - entry.started_s
+            print(f"⏱️ [Startup] {name}: {entry.seconds:.2f}s")
+
+    def mark_ready(self) -> None:
+        self.ready_at = time.time()
+
+    @property
+    def boot_seconds(self) -> float | None:
+        if self.ready_at is None:
+            return None
+        return self.ready_at - self.boot_started_at
+
+    def snapshot(self) -> dict[str, Any]:
+        process_to_ready = (
+            self.ready_at - self.process_started_at
+            if self.ready_at is not None and self.process_started_at
+            else None
+        )
+        return {
+            "boots": self.boots,
+            "ready": self.ready_at is not None,
+            "boot_seconds": self.boot_seconds,
+            "process_to_ready_s": process_to_ready,
+            "compile_caches": self.compile_caches,
+            "phases": [asdict(p) for p in self.phases],
+        }
+
+
+startup_report = StartupReport()
+
+
+###############################################################################
+#
+#          Compile caches keyed by model + vLLM version + GPU arch
+#
+###############################################################################
+# Env var -> default base directory; each gets a keyed subdirectory
+COMPILE_CACHE_DIRS: dict[str, str] = {
+    "TORCHINDUCTOR_CACHE_DIR": "/cache/torch",
+    "TRITON_CACHE_DIR": "/cache/triton",
+    "VLLM_TORCH_COMPILE_DIR": "/cache/vllm_compile",
+}
+MANIFEST_NAME = "manifest.json"
+# Written when a keyed dir is created, before any manifest; only dirs
+# carrying one of the two are ever pruned
+KEY_MARKER_NAME = ".compile_cache_key.json"
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "none"
+
+
+def gpu_arch() -> str:
+    """e.g. "sm_86"; read via NVML so CUDA is not initialized here"""
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+            major, minor = pynvml.nvmlDeviceGetCudaComputeCapability(handle)
+        finally:
+            pynvml.nvmlShutdown()
+    except Exception:
+        return "cpu"
+    return f"sm_{major}{minor}"
+
+
+def model_fingerprint(model_path: str) -> str:
+    """
+    Hash of the synced files' chunk hashes when the model came through
+    model_sync, else of config.json plus the names and sizes of the weight
+    files
+    """
+    synced = manifest_digest(model_path)
+    if synced is not None:
+        return synced
+    root = Path(model_path)
+    digest = hashlib.sha256(model_path.encode("utf-8"))
+    if root.is_dir():
+        for path in sorted(root.iterdir()):
+            if path.is_file():
+                digest.update(f"{path.name}:{path.stat().st_size}".encode())
+        config = root / "config.json"
+        if config.is_file():
+            digest.update(config.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+@dataclass
+class CompileCacheKey:
+    model: str
+    vllm_version: str
+    torch_version: str
+    gpu_arch: str
+
+    @classmethod
+    def detect(cls, model_path: str) -> "CompileCacheKey":
+        return cls(
+            model=model_fingerprint(model_path),
+            vllm_version=_package_version("vllm"),
+            torch_version=_package_version("torch"),
+            gpu_arch=gpu_arch(),
+        )
+
+    @property
+    def slug(self) -> str:
+        raw = json.dumps(asdict(self), sort_keys=True).encode("utf-8")
+        return f"{self.gpu_arch}-{hashlib.sha256(raw).hexdigest()[:12]}"
+
+
+def _dir_stats(path: Path) -> tuple[int, int]:
+    files = 0
+    size = 0
+    for entry in path.rglob("*"):
+        if entry.is_file() and entry.name not in (
+            MANIFEST_NAME, KEY_MARKER_NAME
+        ):
+            files += 1
+            size += entry.stat().st_size
+    return files, size
+
+
+@dataclass
+class CompileCache:
+    """One keyed cache directory and the manifest that vouches for it"""
+    env_var: str
+    path: Path
+    key: CompileCacheKey
+    # "warm", "cold" or "invalid" (wiped at startup)
+    status: str = "cold"
+    files: int = 0
+    bytes: int = 0
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.path / MANIFEST_NAME
+
+    def mark(self) -> None:
+        """Create the directory and record its key as this module's"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        marker = self.path / KEY_MARKER_NAME
+        if not marker.is_file():
+            marker.write_text(json.dumps(asdict(self.key), indent=2))
+
+    def validate(self) -> None:
+        """
+        Trust the directory only if a previous boot completed with the same
+        key and every file it recorded is still there. Anything else (a boot
+        killed mid-compile, a partial volume sync) is wiped, since a
+        truncated cache entry fails later and far less clearly.
+        """
+        if not self.path.exists():
+            self.status = "cold"
+            return
+        try:
+            manifest = json.loads(self.manifest_path.read_text())
+        except (OSError, ValueError):
+            manifest = None
+        files, size = _dir_stats(self.path)
+        if manifest is None and files == 0:
+            self.status = "cold"
+            return
+        if (
+            manifest is not None
+            and manifest.get("key") == asdict(self.key)
+            and files >= manifest.get("files", 0)
+        ):
+            self.status = "warm"
+            self.files, self.bytes = files, size
+            return
+        print(f"🧹 [Startup] Invalid compile cache, wiping {self.path}")
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.status = "invalid"
+
+    def commit(self) -> None:
+        """Write the manifest once the engine has booted successfully"""
+        self.files, self.bytes = _dir_stats(self.path)
+        manifest = {
+            "key": asdict(self.key),
+            "files": self.files,
+            "bytes": self.bytes,
+            "written_at": time.time(),
+        }
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp, self.manifest_path)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "path": str(self.path),
+            "status": self.status,
+            "files": self.files,
+            "bytes": self.bytes,
+        }
+
+
+def _is_keyed_dir(path: Path) -> bool:
+    """Created by prepare_compile_caches: its marker or a keyed manifest"""
+    if (path / KEY_MARKER_NAME).is_file():
+        return True
+    try:
+        manifest = json.loads((path / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return False
+    key = manifest.get("key") if isinstance(manifest, dict) else None
+    return isinstance(key, dict) \
+        and key.keys() == {f.name for f in fields(CompileCacheKey)}
+
+
+def _prune_siblings(base: Path, keep: Path, max_keys: int) -> None:
+    """
+    Drop the least recently used keyed dirs beyond `max_keys`. Anything
+    else under `base` (another tool's cache, a bind mount) is left alone.
+    """
+    siblings = sorted(
+        (
+            p for p in base.iterdir()
+            if p.is_dir() and p != keep and _is_keyed_dir(p)
+        ),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True
+    )
+    for stale in siblings[max(max_keys - 1, 0):]:
+        print(f"🧹 [Startup] Removing stale compile cache {stale}")
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def prepare_compile_caches(
+    model_path: str,
+    max_keys: int | None = None
+) -> list[CompileCache]:
+    """
+    Point the torch/triton/vLLM cache env vars at keyed subdirectories
+    and validate them. Must run before the engine is constructed.
+    """
+    if max_keys is None:
+        max_keys = int(os.getenv("COMPILE_CACHE_MAX_KEYS", "2"))
+    key = CompileCacheKey.detect(model_path)
+    caches: list[CompileCache] = []
+    for env_var, default in COMPILE_CACHE_DIRS.items():
+        base = Path(
+            os.getenv(f"{env_var}_BASE") or os.getenv(env_var) or default
+        )
+        cache = CompileCache(env_var, base / key.slug, key)
+        cache.validate()
+        cache.mark()
+        _prune_siblings(base, cache.path, max_keys)
+        # Remember the base so a re-init does not nest keys
+        os.environ[f"{env_var}_BASE"] = str(base)
+        os.environ[env_var] = str(cache.path)
+        caches.append(cache)
+    return caches
+
+
+###############################################################################
+#
+#                  Warmup over real batch sizes and prompt lengths
+#
+###############################################################################
+def _int_list(value: str) -> tuple[int, ...]:
+    return tuple(int(v) for v in value.split(",") if v.strip())
+
+
+@dataclass
+class WarmupProfile:
+    batch_sizes: tuple[int, ...] = (1, 8, 32)
+    prompt_tokens: tuple[int, ...] = (128, 1024, 3072)
+    max_tokens: int = 8
+    # Prompts are clipped so prompt + output fits the model
+    max_model_len: int = 4096
+
+    @classmethod
+    def from_env(cls, max_model_len: int) -> "WarmupProfile":
+        """
+        WARMUP_PROFILE=minimal (the default) is the old single 1-token
+        request; WARMUP_PROFILE=full runs the batch size x prompt length
+        grid, which lengthens every boot
+        """
+        if os.getenv("WARMUP_PROFILE", "minimal") != "full":
+            return cls(
+                batch_sizes=(1,), prompt_tokens=(8,), max_tokens=1,
+                max_model_len=max_model_len
+            )
+        return cls(
+            batch_sizes=_int_list(
+                os.getenv("WARMUP_BATCH_SIZES", "1,8,32")
+            ),
+            prompt_tokens=_int_list(
+                os.getenv("WARMUP_PROMPT_TOKENS", "128,1024,3072")
+            ),
+            max_tokens=int(os.getenv("WARMUP_MAX_TOKENS", cls.max_tokens)),
+            max_model_len=max_model_len,
+        )
+
+
+def _warmup_prompt(num_tokens: int, seed: int) -> dict[str, list[int]]:
+    """
+    Random token IDs of an exact length, different per request so the
+    prefix cache cannot turn the prefill being warmed up into a lookup.
+    """
+    rng = random.Random(seed)
+    return {
+        "prompt_token_ids": [
+            rng.randrange(1000, 30000) for _ in range(num_tokens)
+        ]
+    }
+
+
+async def _drain(
+    engine: LLMEngine,
+    prompt: dict[str, list[int]],
+    sampling_params: Any
+) -> None:
+    async for _ in engine.generate(
+        prompt=prompt,
+        sampling_params=sampling_params,
+        request_id=f"warmup-{uuid4()}"
+    ):
+        continue
+
+
+async def run_warmup(
+    engine: LLMEngine,
+    profile: WarmupProfile,
+    report: StartupReport = startup_report
+) -> None:
+    """Run every (prompt length, batch size) pair of `profile` once"""
+    sampling_params = SamplingParams(
+        max_tokens=profile.max_tokens,
+        temperature=0.0,
+        ignore_eos=True
+    )
+    limit = profile.max_model_len - profile.max_tokens
+    seed = 0
+    for prompt_tokens in profile.prompt_tokens:
+        prompt_tokens = min(prompt_tokens, limit)
+        for batch_size in profile.batch_sizes:
+            with report.phase(
+                f"warmup b={batch_size} p={prompt_tokens}",
+                batch_size=batch_size,
+                prompt_tokens=prompt_tokens
+            ):
+                prompts = [
+                    _warmup_prompt(prompt_tokens, seed + i)
+                    for i in range(batch_size)
+                ]
+                seed += batch_size
+                await asyncio.gather(*(
+                    _drain(engine, prompt, sampling_params)
+                    for prompt in prompts
+                ))
@@ -0,0 +1,164 @@
+import json
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Any, Mapping
+
+from services.admission import (
+    DEFAULT_TENANT,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    worker_share,
+)
+
+
+###############################################################################
+#
+#                 Tenants: who is asking, and at what priority
+#
+# A tenant comes from the API key (Authorization: Bearer, or X-API-Key)
+# when it is listed in TENANT_API_KEYS, else "default". Behind a gateway
+# that authenticates callers and sets X-Tenant-ID, TENANT_TRUST_HEADER=1
+# takes that header too; it never names a tenant that has an API key,
+# and an unauthenticated client must not be able to reach the server
+# directly with it on. Its weight sets its share of the
+# admission queue, its token rate caps what it may spend per second, and
+# its priority class is the best one its requests may ask for:
+# X-Priority can only lower it.
+#
+###############################################################################
+PRIORITY_CLASSES: dict[str, int] = {
+    "interactive": PRIORITY_INTERACTIVE,
+    "batch": PRIORITY_BATCH,
+}
+
+_TENANT_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.:-]{0,63}$")
+
+
+@dataclass(frozen=True)
+class Tenant:
+    name: str = DEFAULT_TENANT
+    # Share of the admission queue relative to other tenants
+    weight: float = 1.0
+    priority: int = PRIORITY_INTERACTIVE
+    # Estimated tokens per second (0 = unlimited) and bucket size
+    token_rate: float = 0.0
+    token_burst: float = 0.0
+
+
+def _priority(value: Any) -> int:
+    if isinstance(value, int):
+        return value
+    if value not in PRIORITY_CLASSES:
+        raise ValueError(
+            f"Unknown priority class {value!r}; "
+            f"expected one of {sorted(PRIORITY_CLASSES)}"
+        )
+    return PRIORITY_CLASSES[value]
+
+
+@dataclass
+class TenantConfig:
+    header: str = "x-tenant-id"
+    priority_header: str = "x-priority"
+    # Take X-Tenant-ID as given; only behind a gateway that sets it
+    trust_header: bool = False
+    # API key -> tenant name
+    api_keys: dict[str, str] = field(default_factory=dict)
+    # Per-tenant overrides, e.g. {"bulk": {"weight": 0.5, "priority":
+    # "batch", "token_rate": 2000}}
+    tenants: dict[str, Tenant] = field(default_factory=dict)
+    default_weight: float = 1.0
+    default_token_rate: float = 0.0
+    # 0 = ten seconds' worth of token_rate
+    default_token_burst: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "TenantConfig":
+        """Token rates are server-wide, split across API_WORKERS"""
+        default_rate = worker_share(float(
+            os.getenv("TENANT_TOKEN_RATE", cls.default_token_rate)
+        ))
+        default_burst = worker_share(float(
+            os.getenv("TENANT_TOKEN_BURST", cls.default_token_burst)
+        ))
+        default = Tenant(
+            weight=float(os.getenv("TENANT_WEIGHT", cls.default_weight)),
+            token_rate=default_rate,
+            token_burst=default_burst or default_rate * 10
+        )
+        tenants: dict[str, Tenant] = {}
+        for name, spec in json.loads(os.getenv("TENANTS", "{}")).items():
+            rate = worker_share(float(spec.get("token_rate", 0))) \
+                if "token_rate" in spec else default.token_rate
+            tenants[name] = replace(
+                default,
+                name=name,
+                weight=float(spec.get("weight", default.weight)),
+                priority=_priority(spec.get("priority", "interactive")),
+                token_rate=rate,
+                token_burst=worker_share(float(spec.get("token_burst", 0)))
+                or rate * 10
+            )
+        return cls(
+            header=os.getenv("TENANT_HEADER", cls.header).lower(),
+            priority_header=os.getenv(
+                "TENANT_PRIORITY_HEADER", cls.priority_header
+            ).lower(),
+            trust_header=os.getenv("TENANT_TRUST_HEADER", "0") == "1",
+            api_keys=json.loads(os.getenv("TENANT_API_KEYS", "{}")),
+            tenants=tenants,
+            default_weight=default.weight,
+            default_token_rate=default.token_rate,
+            default_token_burst=default.token_burst
+        )
+
+
+class TenantRegistry:
+    """Maps request headers to a Tenant with its effective priority"""
+
+    def __init__(self, config: TenantConfig | None = None) -> None:
+        self.config = config or TenantConfig()
+        # Only reachable with their key, never by the header
+        self._keyed = set(self.config.api_keys.values())
+        self._default = Tenant(
+            weight=self.config.default_weight,
+            token_rate=self.config.default_token_rate,
+            token_burst=self.config.default_token_burst
+        )
+
+    def get(self, name: str) -> Tenant:
+        tenant = self.config.tenants.get(name)
+        if tenant is not None:
+            return tenant
+        return replace(self._default, name=name)
+
+    def resolve(self, headers: Mapping[str, str]) -> Tenant:
+        """Tenant for a request; unknown X-Priority classes are ignored"""
+        cfg = self.config
+        name = None
+        key = headers.get("x-api-key") or ""
+        authorization = headers.get("authorization") or ""
+        if authorization.lower().startswith("bearer "):
+            key = authorization[7:].strip()
+        if key:
+            name = cfg.api_keys.get(key)
+        if name is None and cfg.trust_header:
+            claimed = headers.get(cfg.header) or ""
+            if _TENANT_ID.match(claimed) and claimed not in self._keyed:
+                name = claimed
+        tenant = self.get(name or DEFAULT_TENANT)
+        requested = PRIORITY_CLASSES.get(
+            (headers.get(cfg.priority_header) or "").strip().lower()
+        )
+        if requested is not None and requested > tenant.priority:
+            tenant = replace(tenant, priority=requested)
+        return tenant
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "configured": sorted(self.config.tenants),
+            "api_keys": len(self.config.api_keys),
+            "trust_header": self.config.trust_header,
+            "default_token_rate": self.config.default_token_rate,
+        }
@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, TypeVar
+
+from services import metrics
+
+T = TypeVar("T")
+
+
+###############################################################################
+#
+#               Off-loop tokenization with cached segment IDs
+#
+# HF fast tokenizers run in Rust and release the GIL while encoding, so a
+# small pool of our own tokenizes prompts in parallel without blocking
+# the event loop, and without queuing behind the default executor that
+# asyncio.to_thread shares with file, sqlite and embedding work. Segments
+# that recur across requests (system prompt, template pieces, documents,
+# earlier session turns) are cached by content hash. The resulting exact
+# count is what admission charges and what fit() checks against
+# max_model_len, so an over-long prompt is refused or cut before it waits
+# in any queue rather than failing inside the engine.
+#
+###############################################################################
+OVERLENGTH_MODES = ("reject", "truncate")
+
+
+class PromptTooLong(ValueError):
+    def __init__(
+        self,
+        prompt_tokens: int,
+        max_tokens: int,
+        max_model_len: int
+    ) -> None:
+        super().__init__(
+            f"Prompt is {prompt_tokens} tokens; with max_tokens="
+            f"{max_tokens} it does not fit the model's context of "
+            f"{max_model_len} tokens"
+        )
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.max_model_len = max_model_len
+
+
+@dataclass
+class TokenizerConfig:
+    threads: int = 4
+    # Segment ID lists kept
+    cache_size: int = 4096
+    # What fit() does with a prompt that does not fit: "reject" or
+    # "truncate" (lower max_tokens, then cut the middle of the prompt)
+    overlength: str = "reject"
+    # Answer budget "truncate" keeps before it cuts the prompt itself
+    min_output_tokens: int = 64
+
+    @classmethod
+    def from_env(cls) -> "TokenizerConfig":
+        overlength = os.getenv("TOKENIZER_OVERLENGTH", cls.overlength)
+        if overlength not in OVERLENGTH_MODES:
+            raise ValueError(
+                f"TOKENIZER_OVERLENGTH must be one of {OVERLENGTH_MODES}, "
+                f"got {overlength!r}"
+            )
+        return cls(
+            threads=int(os.getenv("TOKENIZER_THREADS", cls.threads)),
+            cache_size=int(os.getenv("TOKENIZER_CACHE_SIZE", cls.cache_size)),
+            overlength=overlength,
+            min_output_tokens=int(os.getenv(
+                "TOKENIZER_MIN_OUTPUT_TOKENS", cls.min_output_tokens
+            )),
+        )
+
+
+@dataclass
+class TokenizerStats:
+    # Texts actually run through the tokenizer, and their tokens
+    encodes: int = 0
+    tokens: int = 0
+    encode_seconds: float = 0.0
+    cache_hits: int = 0
+    # Jobs submitted to the pool and their time waiting for a thread
+    jobs: int = 0
+    queue_seconds: float = 0.0
+    rejected: int = 0
+    # Prompts cut by fit(), and answers whose max_tokens it lowered
+    truncated: int = 0
+    clamped: int = 0
+
+    def snapshot(self) -> dict[str, int | float]:
+        lookups = self.encodes + self.cache_hits
+        return {
+            "encodes": self.encodes,
+            "tokens": self.tokens,
+            "encode_seconds": self.encode_seconds,
+            "cache_hits": self.cache_hits,
+            "cache_hit_rate": self.cache_hits / lookups if lookups else 0.0,
+            "jobs": self.jobs,
+            "queue_seconds": self.queue_seconds,
+            "rejected": self.rejected,
+            "truncated": self.truncated,
+            "clamped": self.clamped,
+        }
+
+
+class TokenizerService:
+    """
+    The served model's tokenizer behind a dedicated thread pool.
+
+    Without a tokenizer (synthetic engine, model not on disk) run() calls
+    inline and encode() is unavailable; callers fall back to estimates.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any | None,
+        config: TokenizerConfig | None = None
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.config = config or TokenizerConfig()
+        self.stats = TokenizerStats()
+        self._segments: OrderedDict[bytes, list[int]] = OrderedDict()
+        # encode() runs on the pool threads
+        self._lock = threading.Lock()
+        self._pool: ThreadPoolExecutor | None = None
+
+    @property
+    def available(self) -> bool:
+        return self.tokenizer is not None
+
+    def encode(self, text: str, cache: bool = True) -> list[int]:
+        """
+        Token IDs of `text`, without special tokens. Segments shared by
+        many requests should be cached; one-off text (a question, a
+        client's messages) should not push them out.
+        """
+        key = b""
+        if cache:
+            key = hashlib.blake2b(
+                text.encode("utf-8"), digest_size=16
+            ).digest()
+            with self._lock:
+                ids = self._segments.get(key)
+                if ids is not None:
+                    self._segments.move_to_end(key)
+                    self.stats.cache_hits += 1
+                    return ids
+        started = time.perf_counter()
+        # No truncation/padding arguments: those mutate the Rust
+        # tokenizer's state and fail ("Already borrowed") across threads
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stats.encodes += 1
+            self.stats.tokens += len(ids)
+            self.stats.encode_seconds += elapsed
+            if cache:
+                self._segments[key] = ids
+                while len(self._segments) > self.config.cache_size:
+                    self._segments.popitem(last=False)
+        return ids
+
+    def decode(self, token_ids: list[int]) -> str:
+        return self.tokenizer.decode(token_ids)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """fn(*args) on the tokenizer pool; inline without a tokenizer"""
+        if self.tokenizer is None:
+            return fn(*args)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                self.config.threads, thread_name_prefix="tokenizer"
+            )
+        submitted = time.perf_counter()
+
+        def timed() -> tuple[float, float, T]:
+            started = time.perf_counter()
+            result = fn(*args)
+            return started, time.perf_counter(), result
+
+        started, finished, result = await asyncio.get_running_loop() \
+            .run_in_executor(self._pool, timed)
+        # Recorded here, on the loop, where the metrics are not shared
+        self.stats.jobs += 1
+        self.stats.queue_seconds += started - submitted
+        metrics.TOKENIZE_QUEUE_SECONDS.observe(started - submitted)
+        metrics.TOKENIZE_SECONDS.observe(finished - started)
+        return result
+
+    async def encode_async(
+        self,
+        text: str,
+        cache: bool = False
+    ) -> list[int] | None:
+        """encode() on the pool, or None without a tokenizer"""
+        if self.tokenizer is None:
+            return None
+        return await self.run(self.encode, text, cache)
+
+    def fit(
+        self,
+        token_ids: list[int],
+        max_tokens: int,
+        max_model_len: int,
+        keep_head: int = 0,
+        overlength: str | None = None
+    ) -> tuple[list[int], int]:
+        """
+        (token_ids, max_tokens) within max_model_len.
+
+        A prompt that does not fit raises PromptTooLong, or in "truncate"
+        mode first gets a smaller max_tokens (down to min_output_tokens)
+        and then loses tokens from its middle: the first `keep_head`
+        (the shared, cached prefix) and the end (the question and the
+        generation prompt) are kept.
+        """
+        length = len(token_ids)
+        if length + max_tokens <= max_model_len:
+            return token_ids, max_tokens
+        if (overlength or self.config.overlength) != "truncate":
+            self.stats.rejected += 1
+            raise PromptTooLong(length, max_tokens, max_model_len)
+        output = min(max_tokens, max(
+            max_model_len - length, self.config.min_output_tokens
+        ))
+        keep = max_model_len - output
+        if keep <= 0:
+            self.stats.rejected += 1
+            raise PromptTooLong(length, max_tokens, max_model_len)
+        if output < max_tokens:
+            self.stats.clamped += 1
+        if length > keep:
+            head = min(keep_head, keep // 2)
+            token_ids = token_ids[:head] + token_ids[length - keep + head:]
+            self.stats.truncated += 1
+        return token_ids, output
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,476 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Iterator
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+###############################################################################
+#
+#               Per-request span timelines, exported as OTLP-JSON
+#
+# The middleware opens one trace per HTTP request and keeps it in a
+# context variable. Code on the request path adds child spans and events
+# to it with start_span()/span(); without a current trace (tracing off,
+# request not sampled, batch work) they get a shared no-op span, so the
+# instrumented code costs a context-variable read. Finished traces are
+# batched and written as OTLP/HTTP JSON (ExportTraceServiceRequest)
+# lines to a file the collector's otlpjsonfile receiver can tail, and/or
+# POSTed to an OTLP/HTTP endpoint.
+#
+###############################################################################
+_KIND_INTERNAL = 1
+_KIND_SERVER = 2
+_STATUS_UNSET = 0
+_STATUS_ERROR = 2
+
+
+@dataclass
+class TracingConfig:
+    sample_rate: float = 1.0
+    # Event on the engine span every N generated tokens (0 = none)
+    token_every: int = 16
+    # OTLP-JSON lines appended here ("" = no file)
+    export_path: str = "/tmp/chatbot-traces.jsonl"
+    # e.g. http://collector:4318/v1/traces ("" = no POST)
+    otlp_endpoint: str = ""
+    flush_interval_s: float = 1.0
+    batch_size: int = 256
+    # Finished traces waiting for export; past this they are dropped
+    max_queue: int = 4096
+    # Finished traces kept for GET /admin/traces
+    keep_recent: int = 100
+    service_name: str = "chatbot-api"
+    exclude_paths: tuple[str, ...] = (
+        "/metrics", "/health", "/ready", "/live", "/ping", "/admin"
+    )
+
+    @classmethod
+    def from_env(cls) -> "TracingConfig | None":
+        if os.getenv("TRACING_ENABLED", "0") != "1":
+            return None
+        exclude = os.getenv("TRACE_EXCLUDE_PATHS")
+        return cls(
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1.0")),
+            token_every=int(os.getenv("TRACE_TOKEN_EVERY", "16")),
+            export_path=os.getenv("TRACE_EXPORT_PATH", cls.export_path),
+            otlp_endpoint=os.getenv("TRACE_OTLP_ENDPOINT", ""),
+            flush_interval_s=float(
+                os.getenv("TRACE_FLUSH_INTERVAL_S", "1.0")
+            ),
+            batch_size=int(os.getenv("TRACE_BATCH_SIZE", "256")),
+            max_queue=int(os.getenv("TRACE_MAX_QUEUE", "4096")),
+            keep_recent=int(os.getenv("TRACE_KEEP_RECENT", "100")),
+            service_name=os.getenv("OTEL_SERVICE_NAME", cls.service_name),
+            exclude_paths=(
+                tuple(p.strip() for p in exclude.split(",") if p.strip())
+                if exclude is not None else cls.exclude_paths
+            ),
+        )
+
+
+def _attribute(key: str, value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        # OTLP-JSON carries 64-bit integers as strings
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+def _attributes(values: dict[str, Any]) -> list[dict[str, Any]]:
+    return [_attribute(k, v) for k, v in values.items() if v is not None]
+
+
+class Span:
+    __slots__ = (
+        "name", "span_id", "parent_id", "kind", "start_ns", "end_ns",
+        "attributes", "events", "error", "token_every",
+    )
+    recording = True
+
+    def __init__(
+        self,
+        name: str,
+        parent_id: str | None,
+        attributes: dict[str, Any],
+        kind: int = _KIND_INTERNAL,
+        token_every: int = 0
+    ) -> None:
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.attributes = attributes
+        self.events: list[tuple[str, int, dict[str, Any]]] = []
+        self.error: str | None = None
+        self.token_every = token_every
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def event(self, name: str, **attributes: Any) -> None:
+        self.events.append((name, time.time_ns(), attributes))
+
+    def end(self, error: BaseException | None = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+    def to_otlp(self, trace_id: str) -> dict[str, Any]:
+        span: dict[str, Any] = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": _attributes(self.attributes),
+            "events": [
+                {
+                    "timeUnixNano": str(at),
+                    "name": name,
+                    "attributes": _attributes(attributes),
+                }
+                for name, at, attributes in self.events
+            ],
+            "status": (
+                {"code": _STATUS_ERROR, "message": self.error}
+                if self.error else {"code": _STATUS_UNSET}
+            ),
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stands in for a span when the request is not traced"""
+    __slots__ = ()
+    recording = False
+    token_every = 0
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def event(self, name: str, **attributes: Any) -> None:
+        pass
+
+    def end(self, error: BaseException | None = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class RequestTrace:
+    """One request's root span and its children, all parented to the root"""
+
+    def __init__(
+        self,
+        name: str,
+        attributes: dict[str, Any],
+        token_every: int,
+        traceparent: str | None = None
+    ) -> None:
+        parent = _parse_traceparent(traceparent)
+        self.trace_id = parent[0] if parent else os.urandom(16).hex()
+        self.token_every = token_every
+        self.root = Span(
+            name, parent[1] if parent else None, attributes, _KIND_SERVER
+        )
+        self.spans: list[Span] = [self.root]
+
+    def start_span(self, name: str, **attributes: Any) -> Span:
+        span = Span(name, self.root.span_id, attributes,
+                    token_every=self.token_every)
+        self.spans.append(span)
+        return span
+
+    def to_otlp(self) -> list[dict[str, Any]]:
+        return [span.to_otlp(self.trace_id) for span in self.spans]
+
+
+def _parse_traceparent(value: str | None) -> tuple[str, str] | None:
+    """(trace id, parent span id) from a W3C traceparent header"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+_current: ContextVar[RequestTrace | None] = ContextVar(
+    "request_trace", default=None
+)
+
+
+def current_trace() -> RequestTrace | None:
+    return _current.get()
+
+
+def start_span(name: str, **attributes: Any) -> Span | _NoopSpan:
+    """A child of the current request's root span; the caller ends it"""
+    trace = _current.get()
+    if trace is None:
+        return NOOP_SPAN
+    return trace.start_span(name, **attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | _NoopSpan]:
+    current = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        current.end()
+
+
+def event(name: str, **attributes: Any) -> None:
+    """An event on the current request's root span"""
+    trace = _current.get()
+    if trace is not None:
+        trace.root.event(name, **attributes)
+
+
+@dataclass
+class TracingStats:
+    traces: int = 0
+    sampled_out: int = 0
+    spans: int = 0
+    exported: int = 0
+    dropped: int = 0
+    export_errors: int = 0
+    # Time spent encoding and writing batches
+    export_seconds: float = 0.0
+    pending: int = 0
+
+    def snapshot(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class Tracer:
+    config: TracingConfig
+    stats: TracingStats = field(default_factory=TracingStats)
+
+    def __post_init__(self) -> None:
+        self._pending: list[RequestTrace] = []
+        self.recent: deque[RequestTrace] = deque(
+            maxlen=self.config.keep_recent
+        )
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._session = None
+        self._resource = {"attributes": _attributes({
+            "service.name": self.config.service_name,
+            "process.pid": os.getpid(),
+        })}
+
+    @classmethod
+    def from_env(cls) -> "Tracer | None":
+        config = TracingConfig.from_env()
+        return cls(config) if config is not None else None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+            print(f"🔭 Tracing {self.config.sample_rate:.0%} of requests "
+                  f"-> {self.config.export_path or self.config.otlp_endpoint}")
+
+    def begin(
+        self,
+        name: str,
+        attributes: dict[str, Any],
+        traceparent: str | None = None
+    ) -> RequestTrace | None:
+        if self.config.sample_rate < 1.0 \
+                and random.random() >= self.config.sample_rate:
+            self.stats.sampled_out += 1
+            return None
+        self.stats.traces += 1
+        return RequestTrace(
+            name, attributes, self.config.token_every, traceparent
+        )
+
+    def finish(self, trace: RequestTrace) -> None:
+        self.recent.append(trace)
+        self.stats.spans += len(trace.spans)
+        if len(self._pending) >= self.config.max_queue:
+            self.stats.dropped += 1
+            return
+        self._pending.append(trace)
+        self.stats.pending = len(self._pending)
+        if len(self._pending) >= self.config.batch_size:
+            self._wakeup.set()
+
+    def export_request(self, traces: list[RequestTrace]) -> dict[str, Any]:
+        """One OTLP/HTTP JSON ExportTraceServiceRequest"""
+        return {"resourceSpans": [{
+            "resource": self._resource,
+            "scopeSpans": [{
+                "scope": {"name": "chatbot.tracing"},
+                "spans": [s for t in traces for s in t.to_otlp()],
+            }],
+        }]}
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self.config.flush_interval_s
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        while self._pending:
+            batch = self._pending[:self.config.batch_size]
+            del self._pending[:len(batch)]
+            self.stats.pending = len(self._pending)
+            started = time.perf_counter()
+            try:
+                await self._export(batch)
+                self.stats.exported += len(batch)
+            except Exception as e:
+                self.stats.export_errors += 1
+                print(f"⚠️ [Tracing] export of {len(batch)} traces "
+                      f"failed: {e}")
+            self.stats.export_seconds += time.perf_counter() - started
+
+    async def _export(self, batch: list[RequestTrace]) -> None:
+        payload = json.dumps(
+            self.export_request(batch), separators=(",", ":")
+        )
+        if self.config.export_path:
+            await asyncio.to_thread(self._append, payload)
+        if self.config.otlp_endpoint:
+            import aiohttp
+
+            if self._session is None:
+                self._session = aiohttp.ClientSession(
+                    timeout=aiohttp.ClientTimeout(total=10)
+                )
+            async with self._session.post(
+                self.config.otlp_endpoint,
+                data=payload,
+                headers={"Content-Type": "application/json"},
+            ) as response:
+                response.raise_for_status()
+
+    def _append(self, payload: str) -> None:
+        # One O_APPEND write per batch keeps lines from API workers whole
+        fd = os.open(
+            self.config.export_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            0o644
+        )
+        try:
+            os.write(fd, (payload + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class TracingMiddleware:
+    """
+    Opens the request's root span and times the response writes.
+
+    `send` on a streamed body waits while the client's socket buffer is
+    full, so the time spent in it (`response.send_blocked_s`) is what a
+    slow reader cost this request.
+    """
+
+    def __init__(self, app: ASGIApp, tracer: Tracer) -> None:
+        self.app = app
+        self.tracer = tracer
+        self.exclude = tracer.config.exclude_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path.startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or ())
+        traceparent = headers.get(b"traceparent")
+        trace = self.tracer.begin(
+            f"{scope['method']} {path}",
+            {"http.method": scope["method"], "http.target": path},
+            traceparent.decode("latin-1") if traceparent else None
+        )
+        if trace is None:
+            await self.app(scope, receive, send)
+            return
+        root = trace.root
+        sent_bytes = 0
+        blocked = 0.0
+
+        async def traced_send(message: Message) -> None:
+            nonlocal sent_bytes, blocked
+            if message["type"] == "http.response.start":
+                root.set(**{"http.status_code": message["status"]})
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"x-trace-id", trace.trace_id.encode("ascii")),
+                ]
+                await send(message)
+                root.event("response_start")
+                return
+            started = time.perf_counter()
+            await send(message)
+            blocked += time.perf_counter() - started
+            if message["type"] != "http.response.body":
+                return
+            if not sent_bytes:
+                root.event("first_byte")
+            sent_bytes += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                root.event("last_byte_flushed")
+
+        token = _current.set(trace)
+        error: BaseException | None = None
+        try:
+            await self.app(scope, receive, traced_send)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            root.set(**{
+                "response.bytes": sent_bytes,
+                "response.send_blocked_s": round(blocked, 6),
+            })
+            root.end(error)
+            self.tracer.finish(trace)
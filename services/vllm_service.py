@@ -6,7 +6,7 @@
 # from vllm.engine.arg_utils import AsyncEngineArgs
 # from vllm.engine.async_llm_engine import AsyncLLMEngine
 # from vllm.sampling_params import RequestOutputKind
-# from vllm.outputs import CompletionOutput
+# from vllm.outputs import CompletionOutput, RequestOutput
 # from vllm.config.compilation import CompilationConfig
 
 
@@ -115,107 +115,636 @@
 #                 }
 #                 yield f"data: {json.dumps(stream_end)}"
 #                 return
+import asyncio
 import os
-import json
+import time
+from contextlib import aclosing
+from dataclasses import asdict, dataclass, replace
 from uuid import uuid4
+from typing import TYPE_CHECKING, Any
 from typing_extensions import AsyncGenerator
-from vllm import SamplingParams
-from vllm.engine.arg_utils import AsyncEngineArgs
-from vllm.engine.async_llm_engine import AsyncLLMEngine
-from vllm.sampling_params import RequestOutputKind
-from vllm.outputs import CompletionOutput
-from vllm.config.compilation import CompilationConfig
+from services.engine import (
+    LLMEngine,
+    SyntheticEngine,
+    SyntheticEngineConfig,
+    get_engine_backend,
+)
+from services import metrics, tracing
+from services.config import EngineConfig
+from services.ipc import IPCConfig, IPCEngine
+from services.cancellation import abort_stats
+from services.prompting import (
+    BuiltPrompt,
+    get_prompt_builder,
+    prefix_cache_stats,
+)
+from services.response_cache import ResponseCache, cache_key
+from services.retrieval import Retriever
+from services.sampling import (
+    RequestOutputKind,
+    SamplingSpec,
+    sampling_factory,
+)
+from services.semantic_cache import SemanticCache
+from services.model_sync import ModelVerifyConfig
+from services.speculative import SpeculativeConfig
+from services.sessions import Session, SessionError, SessionStore
+from services.sse import (
+    CoalescePolicy,
+    SSEFrameWriter,
+    encode_context,
+    encode_event,
+)
+from services.startup import (
+    CompileCache,
+    WarmupProfile,
+    prepare_compile_caches,
+    run_warmup,
+    startup_report,
+)
+
+if TYPE_CHECKING:
+    from vllm.engine.async_llm_engine import AsyncLLMEngine
+    from vllm.outputs import CompletionOutput, RequestOutput
+
+ENGINE_CONFIG = EngineConfig.from_env()
+MODEL_PATH = ENGINE_CONFIG.settings.model
+MAX_MODEL_LEN = ENGINE_CONFIG.settings.max_model_len
+DEFAULT_COALESCE = CoalescePolicy.from_env()
+DEFAULT_SAMPLING: SamplingSpec = sampling_factory.default
+DEFAULT_MAX_TOKENS = DEFAULT_SAMPLING.max_tokens
+# "priority" lets vLLM's scheduler run interactive requests ahead of batch
+# work already in the engine; with the default "fcfs" it rejects priorities
+SCHEDULING_POLICY = ENGINE_CONFIG.settings.scheduling_policy
+SPECULATIVE_CONFIG = SpeculativeConfig.from_env()
+
+
+def engine_priority(priority: int) -> dict[str, int]:
+    """Extra generate() kwargs carrying the admission priority"""
+    if priority and SCHEDULING_POLICY == "priority":
+        return {"priority": priority}
+    return {}
+
+
+@dataclass
+class Completion:
+    """One finished, non-streamed generation"""
+    text: str
+    prompt_tokens: int
+    output_tokens: int
+    finish_reason: str | None
+
+
+@dataclass
+class PreparedPrompt:
+    """A request's final prompt, known before it is admitted"""
+    built: BuiltPrompt
+    sampling: SamplingSpec
+    # Response cache key: the requested sampling, and the documents when
+    # there are any, so a caller can peek before preparing without them
+    key: str
+    # Payload of the `context` event; None without a retriever
+    documents: list[dict] | None = None
+    # Sent as the client wrote it, without the chat template
+    raw: bool = False
+
 
 class vLLMService:
     @staticmethod
-    async def init_resource() -> AsyncLLMEngine:
-        """Initialize vLLM engine with proper cache directories"""
+    async def init_resource() -> LLMEngine:
+        """Initialize the engine selected by ENGINE_BACKEND and warm it up"""
+        startup_report.reset()
+        backend = get_engine_backend()
+        if backend == "synthetic":
+            print("🧪 Using synthetic engine (ENGINE_BACKEND=synthetic)")
+            config = SyntheticEngineConfig.from_env()
+            if SPECULATIVE_CONFIG is not None:
+                config.spec_tokens = SPECULATIVE_CONFIG.num_speculative_tokens
+            with startup_report.phase("engine_build", backend=backend):
+                engine = await SyntheticEngine.from_config(config)
+            caches: list[CompileCache] = []
+        elif backend == "vllm":
+            # A half-synced or corrupt volume fails here, not mid-load
+            verify = ModelVerifyConfig.from_env()
+            with startup_report.phase("model_verify", mode=verify.mode):
+                verify.check(MODEL_PATH)
+            with startup_report.phase("compile_cache"):
+                caches = prepare_compile_caches(MODEL_PATH)
+            startup_report.compile_caches = {
+                c.env_var: c.snapshot() for c in caches
+            }
+            with startup_report.phase("engine_build", backend=backend):
+                engine = vLLMService._build_vllm_engine()
+        elif backend == "ipc":
+            # The engine process built and warmed the engine already
+            print("🔌 Connecting to the engine process (ENGINE_BACKEND=ipc)")
+            with startup_report.phase("engine_connect", backend=backend):
+                engine = await IPCEngine.connect(IPCConfig.from_env())
+            startup_report.mark_ready()
+            print("✅ Engine process connected!")
+            return engine
+        else:
+            raise ValueError(f"Unknown ENGINE_BACKEND: {backend!r}")
+
+        # Warmup
+        print("🔥 Warming up vLLM engine...")
+        profile = WarmupProfile.from_env(MAX_MODEL_LEN)
+        with startup_report.phase("warmup", **asdict(profile)):
+            await run_warmup(engine, profile)
+
+        # Only a boot that got this far vouches for the compile caches
+        for cache in caches:
+            cache.commit()
+            startup_report.compile_caches[cache.env_var] = cache.snapshot()
+        startup_report.mark_ready()
+        print("✅ vLLM engine ready!")
+        return engine
+
+    @staticmethod
+    def _build_vllm_engine() -> "AsyncLLMEngine":
+        """Initialize vLLM engine from ENGINE_CONFIG (services.config)"""
+        # Imported here so the other backends run without vLLM installed
+        from vllm.config.compilation import CompilationConfig
+        from vllm.engine.arg_utils import AsyncEngineArgs
+        from vllm.engine.async_llm_engine import AsyncLLMEngine
         
         # ✅ Lấy cache directory từ environment (được set trong deploy_model.py)
         cache_dir = os.getenv("VLLM_TORCH_COMPILE_DIR", "/cache/vllm_compile")
-        use_eager = os.getenv("VLLM_EAGER", "0") == "1"
         
         print(f"📁 vLLM compile cache directory: {cache_dir}")
+        print(f"⚙️ Engine profile: {ENGINE_CONFIG.profile}")
         
-        if not use_eager:
-            comp_cfg = CompilationConfig(
-                level=2,  # Giảm từ 3 xuống 2 để ổn định
-                cache_dir=cache_dir  # ✅ Dùng path đã mount volume
-            )
-            args = AsyncEngineArgs(
-                model="/models_dir/language_model/GRPO-Vi-Qwen2-7B-RAG-W4A16",
-                tokenizer="/models_dir/language_model/GRPO-Vi-Qwen2-7B-RAG-W4A16",
-                trust_remote_code=True,
-                max_model_len=4096,
-                gpu_memory_utilization=0.85,
-                max_num_batched_tokens=4096,
-                enable_prefix_caching=True,
-                swap_space=4,
-                enforce_eager=use_eager,
-                compilation_config=comp_cfg,
-                max_seq_len_to_capture=4096
-            )
-        else:
-            args = AsyncEngineArgs(
-                model="/models_dir/language_model/GRPO-Vi-Qwen2-7B-RAG-W4A16",
-                tokenizer="/models_dir/language_model/GRPO-Vi-Qwen2-7B-RAG-W4A16",
-                trust_remote_code=True,
-                max_model_len=4096,
-                gpu_memory_utilization=0.85,
-                max_num_batched_tokens=4096,
-                enable_prefix_caching=True,
-                swap_space=4,
-                enforce_eager=use_eager,
-                max_seq_len_to_capture=4096
+        if SPECULATIVE_CONFIG is not None:
+            print(f"🎯 Speculative decoding: {SPECULATIVE_CONFIG.method}, "
+                  f"k={SPECULATIVE_CONFIG.num_speculative_tokens}")
+        kwargs = ENGINE_CONFIG.engine_args(
+            cache_dir,
+            SPECULATIVE_CONFIG.engine_config() if SPECULATIVE_CONFIG else None
+        )
+        if "compilation_config" in kwargs:
+            kwargs["compilation_config"] = CompilationConfig(
+                **kwargs["compilation_config"]
             )
+        args = AsyncEngineArgs(**kwargs)
         
-        engine = AsyncLLMEngine.from_engine_args(args)
-        
-        # Warmup
-        print("🔥 Warming up vLLM engine...")
-        async for _ in engine.generate(
-            prompt="Hello, how are you?",
-            sampling_params=SamplingParams(max_tokens=1, temperature=0.0),
-            request_id=str(uuid4())
-        ):
-            continue
-        
-        print("✅ vLLM engine ready!")
-        return engine
+        return AsyncLLMEngine.from_engine_args(args)
 
     @staticmethod
-    async def generate_answer(
-        llm_engine: AsyncLLMEngine,
-        prompt: str
+    async def stream_outputs(
+        llm_engine: LLMEngine,
+        prompt: str | dict[str, list[int]],
+        request_id: str | None = None,
+        sampling: SamplingSpec | None = None,
+        priority: int = 0
+    ) -> AsyncGenerator["RequestOutput", None]:
+        """
+        Yield the engine's DELTA outputs (all `n` choices) until it finishes.
+
+        If the consumer stops early (client disconnect, cancellation) the
+        engine request is aborted so its decode slot and KV blocks are freed.
+        """
+        request_id = request_id or str(uuid4())
+        sampling_params = sampling_factory.params(
+            sampling or DEFAULT_SAMPLING, RequestOutputKind.DELTA
+        )
+        answer_generator = llm_engine.generate(
+            prompt=prompt,
+            sampling_params=sampling_params,
+            request_id=request_id,
+            **engine_priority(priority)
+        )
+        finished = False
+        error: Exception | None = None
+        num_generated = 0
+        observe_itl = metrics.INTER_TOKEN_SECONDS.observe
+        span = tracing.start_span("engine.generate", request_id=request_id)
+        # Every `token_every` tokens the span gets a progress event
+        next_mark = span.token_every or float("inf")
+        submitted = last_output = time.perf_counter()
+        try:
+            async for request_output in answer_generator:
+                now = time.perf_counter()
+                if num_generated:
+                    observe_itl(now - last_output)
+                else:
+                    metrics.TTFT_SECONDS.observe(now - submitted)
+                    prompt_tokens = len(request_output.prompt_token_ids or ())
+                    cached_tokens = getattr(
+                        request_output, "num_cached_tokens", 0
+                    ) or 0
+                    metrics.PROMPT_TOKENS.observe(prompt_tokens)
+                    metrics.PREFIX_CACHE_HIT_RATIO.observe(
+                        prefix_cache_stats.record(prompt_tokens, cached_tokens)
+                    )
+                    span.event(
+                        "first_output",
+                        prompt_tokens=prompt_tokens,
+                        cached_tokens=cached_tokens
+                    )
+                last_output = now
+                for completion_output in request_output.outputs:
+                    num_generated += len(completion_output.token_ids)
+                if num_generated >= next_mark:
+                    span.event("tokens", generated=num_generated)
+                    next_mark = num_generated + span.token_every
+                if request_output.finished:
+                    finished = True
+                    metrics.GENERATION_SECONDS.observe(now - submitted)
+                    metrics.OUTPUT_TOKENS.observe(num_generated)
+                    span.set(
+                        output_tokens=num_generated,
+                        finish_reason=request_output.outputs[0].finish_reason
+                    )
+                    span.end()
+                yield request_output
+                if finished:
+                    return
+            raise RuntimeError(
+                f"Engine stream for {request_id} ended before finishing"
+            )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if not finished:
+                # Ended here only: a finished stream ended it above
+                span.set(output_tokens=num_generated)
+                if error is None:
+                    span.set(aborted=True)
+                    abort_stats.record(
+                        num_generated,
+                        sampling_params.max_tokens * sampling_params.n
+                    )
+                span.end(error)
+                # Shielded so a cancelled caller cannot skip the abort
+                await asyncio.shield(vLLMService._abort(
+                    llm_engine,
+                    answer_generator,
+                    request_id
+                ))
+
+    @staticmethod
+    async def stream_deltas(
+        llm_engine: LLMEngine,
+        prompt: str | dict[str, list[int]],
+        request_id: str | None = None,
+        sampling: SamplingSpec | None = None,
+        priority: int = 0
     ) -> AsyncGenerator[str, None]:
-        """Generate streaming response"""
-        num_tokens: int = 0
-        tokens: list[str] = [""]
+        """Yield non-empty text deltas of the first choice"""
+        outputs = vLLMService.stream_outputs(
+            llm_engine, prompt, request_id, sampling, priority
+        )
+        async with aclosing(outputs):
+            async for request_output in outputs:
+                completion_output: CompletionOutput = request_output.outputs[0]
+                if completion_output.text:
+                    yield completion_output.text
+
+    @staticmethod
+    async def _abort(
+        llm_engine: LLMEngine,
+        answer_generator: AsyncGenerator,
+        request_id: str
+    ) -> None:
+        await answer_generator.aclose()
+        await llm_engine.abort(request_id)
+
+    @staticmethod
+    async def complete(
+        llm_engine: LLMEngine,
+        prompt: str | dict[str, list[int]],
+        request_id: str | None = None,
+        sampling: SamplingSpec | None = None,
+        priority: int = 0
+    ) -> Completion:
+        """
+        Run one request to completion and return only the final output.
+
+        FINAL_ONLY skips per-token detokenized deltas, which is what offline
+        work wants; cancellation still aborts the engine request.
+        """
+        request_id = request_id or str(uuid4())
+        sampling_params = sampling_factory.params(
+            sampling or DEFAULT_SAMPLING, RequestOutputKind.FINAL_ONLY
+        )
         answer_generator = llm_engine.generate(
             prompt=prompt,
-            sampling_params=SamplingParams(
-                max_tokens=1024,
-                temperature=0.5,
-                top_p=0.85,
-                top_k=25,
-                repetition_penalty=1.1,
-                output_kind=RequestOutputKind.DELTA
-            ),
-            request_id=str(uuid4())
+            sampling_params=sampling_params,
+            request_id=request_id,
+            **engine_priority(priority)
+        )
+        submitted = time.perf_counter()
+        finished = False
+        error: Exception | None = None
+        span = tracing.start_span("engine.complete", request_id=request_id)
+        try:
+            async for request_output in answer_generator:
+                if not request_output.finished:
+                    continue
+                finished = True
+                output: CompletionOutput = request_output.outputs[0]
+                prompt_tokens = len(request_output.prompt_token_ids or ())
+                span.set(
+                    prompt_tokens=prompt_tokens,
+                    output_tokens=len(output.token_ids),
+                    finish_reason=output.finish_reason
+                )
+                metrics.GENERATION_SECONDS.observe(
+                    time.perf_counter() - submitted
+                )
+                metrics.PROMPT_TOKENS.observe(prompt_tokens)
+                metrics.OUTPUT_TOKENS.observe(len(output.token_ids))
+                metrics.PREFIX_CACHE_HIT_RATIO.observe(
+                    prefix_cache_stats.record(
+                        prompt_tokens,
+                        getattr(request_output, "num_cached_tokens", 0) or 0
+                    )
+                )
+                return Completion(
+                    text=output.text,
+                    prompt_tokens=prompt_tokens,
+                    output_tokens=len(output.token_ids),
+                    finish_reason=output.finish_reason
+                )
+            raise RuntimeError(
+                f"Engine stream for {request_id} ended before finishing"
+            )
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if not finished and error is None:
+                span.set(aborted=True)
+            span.end(error)
+            if not finished:
+                await asyncio.shield(vLLMService._abort(
+                    llm_engine,
+                    answer_generator,
+                    request_id
+                ))
+
+    @staticmethod
+    def cache_key(
+        prompt: str,
+        sampling: SamplingSpec | None = None,
+        raw: bool = False
+    ) -> str:
+        spec = (sampling or DEFAULT_SAMPLING).as_dict()
+        return cache_key(prompt, {**spec, "raw": True} if raw else spec)
+
+    @staticmethod
+    def fit_prompt(
+        built: BuiltPrompt,
+        sampling: SamplingSpec,
+        overlength: str | None = None
+    ) -> tuple[BuiltPrompt, SamplingSpec]:
+        """
+        `built` and `sampling` within max_model_len, per
+        TOKENIZER_OVERLENGTH unless `overlength` overrides it; raises
+        PromptTooLong. Prompts without token IDs are left to the
+        engine's own length check.
+        """
+        if built.token_ids is None:
+            return built, sampling
+        tokens = get_prompt_builder(MODEL_PATH).tokens
+        ids, max_tokens = tokens.fit(
+            built.token_ids, sampling.max_tokens, MAX_MODEL_LEN,
+            keep_head=built.shared_prefix_tokens,
+            overlength=overlength
+        )
+        if ids is not built.token_ids:
+            built = BuiltPrompt(
+                tokens.decode(ids) if tokens.available else built.text,
+                ids,
+                min(built.shared_prefix_tokens, len(ids) // 2)
+            )
+        if max_tokens != sampling.max_tokens:
+            sampling = replace(sampling, max_tokens=max_tokens)
+        return built, sampling
+
+    @staticmethod
+    async def prepare_prompt(
+        prompt: str,
+        sampling: SamplingSpec | None = None,
+        retriever: Retriever | None = None,
+        raw: bool = False
+    ) -> PreparedPrompt:
+        """
+        The final prompt, before admission: documents retrieved, rendered
+        on the tokenizer pool and fitted to max_model_len, so admission
+        charges its exact length and an over-long prompt never waits in a
+        queue. Raises PromptTooLong.
+
+        Without retrieved documents, a `raw` prompt is only tokenized: no
+        system prompt, chat template or block padding is added.
+        """
+        sampling = sampling or DEFAULT_SAMPLING
+        if retriever is not None:
+            try:
+                with tracing.span("rag.retrieve"):
+                    retrieval = await retriever.retrieve(prompt)
+            except Exception as e:
+                # Answer without context rather than fail the request
+                print(f"⚠️ [RAG] retrieval failed, answering without "
+                      f"context: {e}")
+            else:
+                # Documents were picked to fit the default max_tokens; a
+                # larger one gives way rather than failing the request
+                built, fitted = vLLMService.fit_prompt(
+                    retrieval.prompt, sampling,
+                    overlength="truncate" if retrieval.documents else None
+                )
+                return PreparedPrompt(
+                    built, fitted,
+                    vLLMService.cache_key(retrieval.prompt.text, sampling),
+                    [d.to_event() for d in retrieval.documents]
+                )
+        builder = get_prompt_builder(MODEL_PATH)
+        with tracing.span("prompt.render"):
+            if raw:
+                built = BuiltPrompt(
+                    prompt, await builder.tokens.encode_async(prompt), 0
+                )
+            else:
+                built = await builder.render_async(prompt)
+        built, fitted = vLLMService.fit_prompt(built, sampling)
+        return PreparedPrompt(
+            built, fitted,
+            vLLMService.cache_key(prompt, sampling, raw),
+            [] if retriever is not None else None,
+            raw
         )
-        async for request_output in answer_generator:
-            completion_output: CompletionOutput = request_output.outputs[0]
-            generated_text: str = completion_output.text
-            if generated_text:
-                tokens.append(generated_text)
-                num_tokens += 1
-                text = tokens[(-1 * (num_tokens > 1))]
-                answer_part = {
-                    "type": "answer_part",
-                    "data": text
-                }
-                yield f"data: {json.dumps(answer_part)}\n\n"
-            if request_output.finished:
-                stream_end = {"type": "done"}
-                yield f"data: {json.dumps(stream_end)}"
-                return
+
+    @staticmethod
+    async def generate_answer(
+        llm_engine: LLMEngine | None,
+        prompt: str,
+        coalesce: CoalescePolicy | None = None,
+        cache: ResponseCache | None = None,
+        semantic_cache: SemanticCache | None = None,
+        sampling: SamplingSpec | None = None,
+        priority: int = 0,
+        prepared: PreparedPrompt | None = None,
+        cached: list[str] | None = None
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Generate streaming response as pre-encoded SSE frames.
+
+        `cached` holds deltas the caller already took from the response
+        cache (ResponseCache.take); they are replayed as they are and
+        `llm_engine` may be None. `prepared` comes from prepare_prompt();
+        when it retrieved documents they are sent as a `context` event
+        first. With a retriever the caller prepares first and looks up
+        `prepared.key`: the documents are part of the key. Unless it is raw,
+        the engine gets a chat-templated prompt built for prefix-cache
+        reuse (services.prompting). With `cache`, identical requests are
+        replayed from the response cache or joined onto the generation
+        already in progress. On a miss there, `semantic_cache` may serve
+        the answer to a similar question; it only holds default-sampling
+        answers and is keyed on the question alone, so it is skipped for
+        other sampling, for raw prompts and whenever a retriever ran (the
+        answer depends on documents that change with every ingestion).
+        """
+        writer = SSEFrameWriter(coalesce or DEFAULT_COALESCE)
+        written = 0
+        if prepared is not None:
+            sampling = prepared.sampling
+            key = prepared.key
+        else:
+            sampling = sampling or DEFAULT_SAMPLING
+            key = vLLMService.cache_key(prompt, sampling)
+        if sampling != DEFAULT_SAMPLING or prepared is not None and (
+            prepared.documents is not None or prepared.raw
+        ):
+            semantic_cache = None
+        metrics.STREAMS_IN_FLIGHT.inc()
+        try:
+            if prepared is not None and prepared.documents is not None:
+                frame = encode_context(prepared.documents)
+                written += len(frame)
+                yield frame
+
+            async def generate() -> AsyncGenerator[str, None]:
+                # Prepared here only on a cache miss: it may tokenize
+                ready = prepared \
+                    or await vLLMService.prepare_prompt(prompt, sampling)
+                stream = vLLMService.stream_deltas(
+                    llm_engine, ready.built.engine_prompt,
+                    sampling=ready.sampling,
+                    priority=priority
+                )
+                async with aclosing(stream):
+                    async for delta in stream:
+                        yield delta
+
+            def produce() -> AsyncGenerator[str, None]:
+                if semantic_cache is not None:
+                    return semantic_cache.stream(prompt, generate)
+                return generate()
+
+            async def replay(deltas: list[str]) -> AsyncGenerator[str, None]:
+                for delta in deltas:
+                    yield delta
+
+            if cached is not None:
+                deltas = replay(cached)
+            elif cache is not None:
+                deltas = cache.stream(key, produce)
+            else:
+                deltas = produce()
+            async with aclosing(deltas):
+                async for text in deltas:
+                    frame = writer.feed(text)
+                    if frame is not None:
+                        written += len(frame)
+                        yield frame
+            frame = writer.done()
+            written += len(frame)
+            yield frame
+        finally:
+            metrics.STREAMS_IN_FLIGHT.dec()
+            metrics.SSE_BYTES.observe(written)
+            metrics.SSE_BYTES_TOTAL.inc(written)
+
+    @staticmethod
+    async def session_answer(
+        llm_engine: LLMEngine,
+        store: SessionStore,
+        session: Session,
+        question: str,
+        coalesce: CoalescePolicy | None = None,
+        sampling: SamplingSpec | None = None,
+        priority: int = 0
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        One chat turn as SSE frames: the answer, then a `session` event
+        with the turn's token report (prefill saved by the prefix cache).
+
+        Turns of one session run one at a time; the turn is only added to
+        the history once the answer finished, so a client that went away
+        mid-answer can ask again.
+        """
+        writer = SSEFrameWriter(coalesce or DEFAULT_COALESCE)
+        sampling = sampling or DEFAULT_SAMPLING
+        written = 0
+        metrics.STREAMS_IN_FLIGHT.inc()
+        try:
+            async with session.lock:
+                try:
+                    with tracing.span("session.prepare"):
+                        prepared = await store.builder.tokens.run(
+                            store.prepare, session, question,
+                            sampling.max_tokens
+                        )
+                except SessionError as e:
+                    frame = encode_event("error", str(e)) + writer.done()
+                    written += len(frame)
+                    yield frame
+                    return
+                parts: list[str] = []
+                answer_ids: list[int] = []
+                prompt_tokens = cached_tokens = 0
+                finish_reason: str | None = None
+                outputs = vLLMService.stream_outputs(
+                    llm_engine, prepared.prompt.engine_prompt,
+                    sampling=sampling,
+                    priority=priority
+                )
+                async with aclosing(outputs):
+                    async for request_output in outputs:
+                        if not prompt_tokens:
+                            prompt_tokens = len(
+                                request_output.prompt_token_ids or ()
+                            )
+                            cached_tokens = getattr(
+                                request_output, "num_cached_tokens", 0
+                            ) or 0
+                        completion_output = request_output.outputs[0]
+                        answer_ids.extend(completion_output.token_ids)
+                        finish_reason = completion_output.finish_reason
+                        if not completion_output.text:
+                            continue
+                        parts.append(completion_output.text)
+                        frame = writer.feed(completion_output.text)
+                        if frame is not None:
+                            written += len(frame)
+                            yield frame
+                tail = writer.flush()
+                if tail is not None:
+                    written += len(tail)
+                    yield tail
+                report = await store.commit(
+                    session, question, prepared, "".join(parts), answer_ids,
+                    prompt_tokens, cached_tokens, finish_reason
+                )
+            frame = encode_event("session", report)
+            written += len(frame)
+            yield frame
+            frame = writer.done()
+            written += len(frame)
+            yield frame
+        finally:
+            metrics.STREAMS_IN_FLIGHT.dec()
+            metrics.SSE_BYTES.observe(written)
+            metrics.SSE_BYTES_TOTAL.inc(written)
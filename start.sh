@@ -4,14 +4,40 @@ set -euo pipefail
 # Ensure cache dirs exist on the Runpod network volume
 mkdir -p "${TORCHINDUCTOR_CACHE_DIR}" "${TRITON_CACHE_DIR}"
 
-# Toggle your strategy with env:
-#  - FAST BOOT (default): VLLM_EAGER=1 (skip CUDA graph capture; fastest startup)
-#  - COMPILE & REUSE:     VLLM_EAGER=0 (your app should set CompilationConfig(cache_dir=/runpod-volume/vllm-compile-cache))
-: "${VLLM_EAGER:=0}"
-export VLLM_EAGER
+# Toggle your strategy with env (engine profiles in services/config.py; see /config):
+#  - FAST BOOT:       ENGINE_PROFILE=fast-boot or VLLM_EAGER=1 (skip CUDA graph capture; fastest startup)
+#  - COMPILE & REUSE: ENGINE_PROFILE=default (caches are keyed by model+vLLM+GPU arch under the dirs above; see /startup)
+#  - TUNING:          ENGINE_PROFILE=latency|throughput, ENGINE_CONFIG_FILE=..., ENGINE_<FIELD>=...
+: "${ENGINE_PROFILE:=default}"
+export ENGINE_PROFILE
 
 API_PORT="${PORT:-8080}"
 HEALTH_PORT="${PORT_HEALTH:-8081}"
+API_WORKERS="${API_WORKERS:-1}"
+export API_WORKERS
+
+# Multi-process mode (API_WORKERS>1): one engine process owns the GPU and
+# API_WORKERS gunicorn workers share it over a unix socket (services/ipc.py).
+# Admission and tenant limits are server-wide and split across the workers.
+if [ "$#" -eq 0 ] && [ "${API_WORKERS}" -gt 1 ]; then
+  export ENGINE_IPC_SOCKET="${ENGINE_IPC_SOCKET:-/tmp/chatbot-engine.sock}"
+  echo "Starting engine process on ${ENGINE_IPC_SOCKET}"
+  uv run python -m services.ipc &
+  ENGINE_PID=$!
+  echo "Starting Gunicorn (${API_WORKERS} workers) with API:${API_PORT} HEALTH:${HEALTH_PORT}"
+  ENGINE_BACKEND=ipc uv run gunicorn -w "${API_WORKERS}" \
+    -k uvicorn_worker.UvicornWorker \
+    -b 0.0.0.0:"${API_PORT}" -b 0.0.0.0:"${HEALTH_PORT}" \
+    main:app &
+  API_PID=$!
+  trap 'kill -TERM "${API_PID}" "${ENGINE_PID}" 2>/dev/null' TERM INT
+  # Whichever exits first takes the other down, so the container restarts
+  status=0
+  wait -n "${API_PID}" "${ENGINE_PID}" || status=$?
+  kill -TERM "${API_PID}" "${ENGINE_PID}" 2>/dev/null || true
+  wait || true
+  exit "${status}"
+fi
 
 echo "Starting Gunicorn with API:${API_PORT} HEALTH:${HEALTH_PORT}"
 
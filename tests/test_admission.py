@@ -0,0 +1,142 @@
+import asyncio
+from typing import AsyncGenerator
+
+import pytest
+
+from api.v1.routes import admission_error_response
+from services.admission import (
+    PRIORITY_BATCH,
+    AdmissionConfig,
+    AdmissionController,
+    AdmissionRejected,
+    admitted_stream,
+)
+from services.engine import SyntheticEngine, SyntheticEngineConfig
+
+
+async def _queued(
+    controller: AdmissionController,
+    *args,
+    **kwargs
+) -> asyncio.Task:
+    """An acquire() that has reached the wait queue"""
+    depth = controller.queue_depth
+    task = asyncio.create_task(controller.acquire(*args, **kwargs))
+    while controller.queue_depth == depth:
+        await asyncio.sleep(0)
+    return task
+
+
+async def _answer(
+    engine: SyntheticEngine,
+    request_id: str
+) -> AsyncGenerator[bytes, None]:
+    async for output in engine.generate("hello", None, request_id):
+        yield output.outputs[0].text.encode()
+
+
+def test_full_queue_sheds_with_429_and_retry_after():
+    controller = AdmissionController(AdmissionConfig(
+        max_inflight=1, max_queue=1
+    ))
+
+    async def scenario() -> None:
+        running = await controller.acquire(10)
+        waiting = await _queued(controller, 10)
+        with pytest.raises(AdmissionRejected) as raised:
+            await controller.acquire(10)
+        assert raised.value.reason == "queue full"
+        assert controller.rejected == 1
+
+        response = admission_error_response(raised.value)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) \
+            == raised.value.retry_after >= 1
+
+        # The queued request gets the slot the first one frees
+        running.release()
+        ticket = await waiting
+        assert controller.inflight == 1
+        ticket.release()
+        assert controller.snapshot()["inflight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_rejects_and_leaves_the_queue():
+    controller = AdmissionController(AdmissionConfig(
+        max_inflight=1, queue_timeout_s=0.05
+    ))
+
+    async def scenario() -> None:
+        running = await controller.acquire(10)
+        with pytest.raises(AdmissionRejected, match="queue timeout"):
+            await controller.acquire(10)
+        assert controller.timed_out == 1
+        assert controller.queue_depth == 0
+        running.release()
+        assert controller.inflight == 0
+
+    asyncio.run(scenario())
+
+
+def test_interactive_requests_are_admitted_before_queued_batch_work():
+    controller = AdmissionController(AdmissionConfig(max_inflight=1))
+
+    async def scenario() -> None:
+        running = await controller.acquire(10)
+        batch = await _queued(controller, 10, priority=PRIORITY_BATCH)
+        interactive = await _queued(controller, 10)
+        running.release()
+        first = await interactive
+        assert not batch.done()
+        first.release()
+        (await batch).release()
+
+    asyncio.run(scenario())
+
+
+def test_token_budget_limits_concurrent_work():
+    controller = AdmissionController(AdmissionConfig(
+        max_inflight=8, token_budget=100
+    ))
+
+    async def scenario() -> None:
+        big = await controller.acquire(80)
+        small = await controller.acquire(20)
+        waiting = await _queued(controller, 30)
+        small.release()
+        # 80 + 30 is still over budget
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        big.release()
+        (await waiting).release()
+        assert controller.inflight_tokens == 0
+
+    asyncio.run(scenario())
+
+
+def test_ticket_is_held_for_the_whole_stream():
+    controller = AdmissionController(AdmissionConfig(max_inflight=1))
+    engine = SyntheticEngine(SyntheticEngineConfig(
+        ttft_ms=0, itl_ms=1, output_tokens=4
+    ))
+
+    async def scenario() -> None:
+        ticket = await controller.acquire(10)
+        parts = []
+        async for part in admitted_stream(ticket, _answer(engine, "r-0")):
+            assert controller.inflight == 1
+            parts.append(part)
+        assert len(parts) == 4
+        assert controller.inflight == 0
+
+        # A client that goes away mid-stream frees the slot as well
+        ticket = await controller.acquire(10)
+        stream = admitted_stream(ticket, _answer(engine, "r-1"))
+        await anext(stream)
+        await stream.aclose()
+        assert ticket.released
+        assert controller.inflight == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any
+
+from services.admission import AdmissionController
+from services.batch import (
+    JOB_FILE,
+    BatchConfig,
+    BatchJob,
+    BatchManager,
+    BatchStatus,
+)
+from services.engine import SyntheticEngine, SyntheticEngineConfig
+from services.engine_manager import EngineManager
+from services.prompting import PromptBuilder
+
+PROMPTS = 12
+
+
+class CountingEngine(SyntheticEngine):
+    """Counts the prompts it was asked to answer"""
+
+    calls = 0
+
+    async def generate(self, prompt: Any, sampling_params: Any,
+                       request_id: str, **kwargs: Any):
+        self.calls += 1
+        async for output in super().generate(
+            prompt, sampling_params, request_id, **kwargs
+        ):
+            yield output
+
+
+def _manager(root: Path, engine: SyntheticEngine) -> BatchManager:
+    async def factory() -> SyntheticEngine:
+        return engine
+
+    return BatchManager(
+        EngineManager(factory),
+        AdmissionController(),
+        PromptBuilder(),
+        BatchConfig(root=str(root / "jobs"), input_dir=str(root))
+    )
+
+
+def _engine() -> CountingEngine:
+    return CountingEngine(SyntheticEngineConfig(
+        ttft_ms=1, itl_ms=1, output_tokens=20
+    ))
+
+
+def _records(manager: BatchManager, job_id: str) -> list[dict]:
+    text = manager.output_path(job_id).read_text(encoding="utf-8")
+    return [json.loads(line) for line in text.splitlines()]
+
+
+async def _until(predicate, timeout: float = 10.0) -> None:
+    async def poll() -> None:
+        while not predicate():
+            await asyncio.sleep(0.005)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_job_resumes_after_a_crash_without_redoing_lines(tmp_path: Path):
+    (tmp_path / "prompts.jsonl").write_text("".join(
+        json.dumps({"id": f"q{i}", "prompt": f"question {i}"}) + "\n"
+        for i in range(PROMPTS)
+    ))
+
+    async def scenario() -> None:
+        first = _manager(tmp_path, _engine())
+        first.start()
+        job = await first.submit_path("prompts.jsonl", concurrency=2)
+        await _until(lambda: job.done >= 3)
+        # Stopped mid-job, with the last line torn as if killed mid-write
+        await first.shutdown()
+        answered = {r["index"] for r in _records(first, job.id)}
+        assert 3 <= len(answered) < PROMPTS
+        with first.output_path(job.id).open("a") as out:
+            out.write('{"index": 11, "outp')
+        saved = BatchJob.load(first.root / job.id / JOB_FILE)
+        assert saved.status is BatchStatus.RUNNING
+
+        engine = _engine()
+        second = _manager(tmp_path, engine)
+        second.start()
+        resumed = second.get(job.id)
+        await _until(lambda: resumed.status is BatchStatus.COMPLETED)
+
+        records = _records(second, job.id)
+        assert sorted(r["index"] for r in records) == list(range(PROMPTS))
+        assert all("error" not in r for r in records)
+        assert {r["id"] for r in records} == {f"q{i}" for i in range(PROMPTS)}
+        # Only the lines that had no answer were generated again
+        assert engine.calls == PROMPTS - len(answered)
+        assert (resumed.completed, resumed.failed) == (PROMPTS, 0)
+        assert resumed.resumes == 1
+        assert resumed.output_tokens == sum(
+            r["output_tokens"] for r in records
+        )
+        on_disk = BatchJob.load(second.root / job.id / JOB_FILE)
+        assert on_disk.status is BatchStatus.COMPLETED
+        await second.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_bad_lines_fail_alone(tmp_path: Path):
+    (tmp_path / "prompts.jsonl").write_text(
+        '"a bare string prompt"\n'
+        '{"id": 7}\n'
+        '[1, 2]\n'
+        '{"prompt": "fine"}\n'
+    )
+
+    async def scenario() -> None:
+        manager = _manager(tmp_path, _engine())
+        manager.start()
+        job = await manager.submit_path("prompts.jsonl")
+        await _until(lambda: job.status is BatchStatus.COMPLETED)
+        records = sorted(_records(manager, job.id), key=lambda r: r["index"])
+        assert ["error" in r for r in records] == [False, True, True, False]
+        assert (job.completed, job.failed, job.total) == (2, 2, 4)
+        await manager.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,213 @@
+import asyncio
+from typing import Any, AsyncGenerator
+
+import pytest
+
+from services.engine import (
+    SyntheticEngine,
+    SyntheticEngineConfig,
+    SyntheticEngineError,
+)
+from services.engine_manager import (
+    EngineManager,
+    EngineManagerConfig,
+    EngineState,
+    EngineUnavailable,
+)
+
+
+class ClosingEngine(SyntheticEngine):
+    """Records whether the manager shut it down"""
+
+    closed = False
+
+    def shutdown(self) -> None:
+        self.closed = True
+
+
+class Factory:
+    """Builds synthetic engines; `fail` makes the next builds raise"""
+
+    def __init__(self, init_s: float = 0.0, **settings: Any) -> None:
+        self.init_s = init_s
+        self.settings = {"ttft_ms": 0, "itl_ms": 0, "output_tokens": 4,
+                         **settings}
+        self.fail = False
+        self.calls = 0
+        self.built: list[ClosingEngine] = []
+
+    async def __call__(self) -> ClosingEngine:
+        self.calls += 1
+        await asyncio.sleep(self.init_s)
+        if self.fail:
+            raise RuntimeError("CUDA out of memory")
+        engine = ClosingEngine(SyntheticEngineConfig(**self.settings))
+        self.built.append(engine)
+        return engine
+
+
+async def _answer(
+    engine: SyntheticEngine,
+    request_id: str
+) -> AsyncGenerator[bytes, None]:
+    async for output in engine.generate("hello", None, request_id):
+        yield output.outputs[0].text.encode()
+
+
+async def _serve(manager: EngineManager, request_id: str) -> None:
+    engine = await manager.get()
+    async for _ in manager.track(_answer(engine, request_id)):
+        pass
+
+
+def test_cold_start_burst_shares_one_load():
+    factory = Factory(init_s=0.05)
+    manager = EngineManager(factory)
+
+    async def scenario() -> None:
+        assert manager.state is EngineState.COLD
+        waiting = [asyncio.create_task(manager.get()) for _ in range(8)]
+        await asyncio.sleep(0.01)
+        assert manager.state is EngineState.LOADING
+        engines = await asyncio.gather(*waiting)
+        assert factory.calls == 1
+        assert all(engine is engines[0] for engine in engines)
+        assert manager.state is EngineState.READY
+        assert manager.snapshot()["loads"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiting_longer_than_the_load_allows_is_rejected():
+    manager = EngineManager(Factory(init_s=0.2))
+
+    async def scenario() -> None:
+        with pytest.raises(EngineUnavailable) as raised:
+            await manager.get(timeout=0.01)
+        assert raised.value.state is EngineState.LOADING
+        # The load carries on for the next caller
+        assert await manager.get()
+        assert manager.loads == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_load_backs_off_then_retries():
+    factory = Factory()
+    factory.fail = True
+    manager = EngineManager(
+        factory, EngineManagerConfig(retry_backoff_s=0.05)
+    )
+
+    async def scenario() -> None:
+        with pytest.raises(EngineUnavailable):
+            await manager.get()
+        assert manager.state is EngineState.FAILED
+        assert "CUDA out of memory" in manager.last_error
+        # Within the backoff no new load is attempted
+        with pytest.raises(EngineUnavailable) as raised:
+            await manager.get()
+        assert raised.value.retry_after == 1
+        assert factory.calls == 1
+
+        factory.fail = False
+        await asyncio.sleep(0.06)
+        assert await manager.get() is factory.built[0]
+        assert manager.state is EngineState.READY
+        assert manager.last_error is None
+
+    asyncio.run(scenario())
+
+
+def test_request_errors_do_not_count_against_the_engine():
+    manager = EngineManager(Factory())
+
+    async def rejected() -> AsyncGenerator[bytes, None]:
+        raise ValueError("prompt too long")
+        yield b""
+
+    async def scenario() -> None:
+        await manager.get()
+        for _ in range(10):
+            with pytest.raises(ValueError):
+                async for _ in manager.track(rejected()):
+                    pass
+        assert manager.state is EngineState.READY
+        assert manager.consecutive_errors == 0
+
+    asyncio.run(scenario())
+
+
+def test_failing_engine_degrades_recovers_and_restarts():
+    factory = Factory(failure_rate=1.0, output_tokens=1)
+    manager = EngineManager(
+        factory, EngineManagerConfig(max_consecutive_errors=3)
+    )
+
+    async def scenario() -> None:
+        await manager.get()
+        with pytest.raises(SyntheticEngineError):
+            await _serve(manager, "r-0")
+        assert manager.state is EngineState.DEGRADED
+        assert manager.ready
+
+        # A success in between resets the count
+        factory.built[0].config.failure_rate = 0.0
+        await _serve(manager, "r-1")
+        assert manager.state is EngineState.READY
+        assert manager.consecutive_errors == 0
+
+        factory.built[0].config.failure_rate = 1.0
+        for i in range(3):
+            with pytest.raises(SyntheticEngineError):
+                await _serve(manager, f"r-{i + 2}")
+        # The third failure in a row rebuilds the engine
+        assert manager.state in (EngineState.FAILED, EngineState.LOADING)
+        factory.settings["failure_rate"] = 0.0
+        replacement = await manager.get()
+        assert replacement is factory.built[1]
+        assert factory.built[0].closed
+        assert manager.loads == 2
+        await _serve(manager, "r-5")
+        assert manager.state is EngineState.READY
+
+    asyncio.run(scenario())
+
+
+def test_restart_waits_for_streams_still_running():
+    factory = Factory()
+    manager = EngineManager(
+        factory, EngineManagerConfig(max_consecutive_errors=1)
+    )
+    finish = asyncio.Event()
+
+    async def failing(wait: bool) -> AsyncGenerator[bytes, None]:
+        yield b"part"
+        if wait:
+            await finish.wait()
+        raise SyntheticEngineError("injected")
+
+    async def drain(stream: AsyncGenerator[bytes, None]) -> None:
+        async for _ in manager.track(stream):
+            pass
+
+    async def scenario() -> None:
+        engine = await manager.get()
+        running = asyncio.create_task(drain(failing(wait=True)))
+        await asyncio.sleep(0)
+        with pytest.raises(SyntheticEngineError):
+            await drain(failing(wait=False))
+        # Past the threshold, but a stream is still being served
+        assert manager.state is EngineState.DEGRADED
+        assert manager.active_streams == 1
+        assert not engine.closed
+
+        finish.set()
+        with pytest.raises(SyntheticEngineError):
+            await running
+        assert manager.state in (EngineState.FAILED, EngineState.LOADING)
+        assert await manager.get() is factory.built[1]
+        assert engine.closed
+        assert manager.loads == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,150 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("qdrant_client")
+
+from services.embeddings import HashingEmbedder  # noqa: E402
+from services.ingestion import IngestConfig, Ingestor  # noqa: E402
+from services.retrieval import QdrantStore  # noqa: E402
+
+PARAGRAPH = (
+    "Refunds are issued to the original payment method within five "
+    "business days of the returned item reaching our warehouse.\n\n"
+)
+
+
+def _ingestor(source: Path) -> Ingestor:
+    return Ingestor(
+        QdrantStore(":memory:", "documents"),
+        HashingEmbedder(dim=64),
+        IngestConfig(
+            source=str(source), workers=1, chunk_chars=200, chunk_overlap=20
+        )
+    )
+
+
+async def _points(store: QdrantStore, source: str) -> list[dict]:
+    models = store._models
+    points, _ = await store.client.scroll(
+        collection_name=store.collection,
+        scroll_filter=models.Filter(must=[models.FieldCondition(
+            key="metadata.source", match=models.MatchValue(value=source),
+        )]),
+        limit=1000,
+        with_payload=True,
+    )
+    return [point.payload["metadata"] for point in points]
+
+
+def test_unchanged_documents_are_skipped(tmp_path: Path):
+    (tmp_path / "refunds.txt").write_text(PARAGRAPH * 6)
+    (tmp_path / "hours.md").write_text("Open 9 to 5, Monday to Friday.")
+    ingestor = _ingestor(tmp_path)
+
+    async def scenario() -> None:
+        try:
+            first = await ingestor.run()
+            assert (first.indexed, first.skipped, first.failed) == (2, 0, 0)
+            assert first.chunks > 2
+            second = await ingestor.run()
+            assert (second.indexed, second.skipped) == (0, 2)
+            assert second.chunks == 0
+        finally:
+            await ingestor.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_touched_but_identical_document_is_not_reindexed(tmp_path: Path):
+    path = tmp_path / "refunds.txt"
+    path.write_text(PARAGRAPH * 3)
+    ingestor = _ingestor(tmp_path)
+
+    async def scenario() -> None:
+        try:
+            await ingestor.run()
+            stat = path.stat()
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            again = await ingestor.run()
+            assert (again.indexed, again.skipped) == (0, 1)
+            assert again.chunks == 0
+        finally:
+            await ingestor.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_changed_document_replaces_its_chunks(tmp_path: Path):
+    path = tmp_path / "refunds.txt"
+    path.write_text(PARAGRAPH * 6)
+    ingestor = _ingestor(tmp_path)
+
+    async def scenario() -> None:
+        try:
+            await ingestor.run()
+            before = await _points(ingestor.store, "refunds.txt")
+            assert len(before) > 1
+            path.write_text("Refunds are no longer offered.")
+            changed = await ingestor.run()
+            assert (changed.indexed, changed.skipped) == (1, 0)
+            after = await _points(ingestor.store, "refunds.txt")
+            # The shorter version's one chunk, none left from the old one
+            assert len(after) == 1
+            assert after[0]["doc_hash"] != before[0]["doc_hash"]
+        finally:
+            await ingestor.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_touched_document_gets_its_stamp_updated(tmp_path: Path):
+    path = tmp_path / "refunds.txt"
+    path.write_text(PARAGRAPH)
+    ingestor = _ingestor(tmp_path)
+
+    async def scenario() -> None:
+        try:
+            await ingestor.run()
+            stat = path.stat()
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            await ingestor.run()
+            stamp = f"{path.stat().st_size}:{path.stat().st_mtime_ns}"
+            stored = await _points(ingestor.store, "refunds.txt")
+            assert [p["stamp"] for p in stored if p["chunk"] == 0] == [stamp]
+        finally:
+            await ingestor.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_missing_documents_are_deleted_only_when_asked(tmp_path: Path):
+    (tmp_path / "keep.txt").write_text(PARAGRAPH)
+    (tmp_path / "gone.txt").write_text(PARAGRAPH * 2)
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "elsewhere.txt").write_text(PARAGRAPH)
+    ingestor = _ingestor(tmp_path)
+
+    async def scenario() -> None:
+        try:
+            await ingestor.run()
+            (tmp_path / "gone.txt").unlink()
+            kept = await ingestor.run()
+            assert kept.deleted == 0
+            assert await _points(ingestor.store, "gone.txt")
+
+            ingestor.config.delete_missing = True
+            (tmp_path / "other" / "elsewhere.txt").unlink()
+            # A run over a subdirectory only prunes inside it
+            narrow = await ingestor.run(str(tmp_path / "other"))
+            assert narrow.deleted == 1
+            assert await _points(ingestor.store, "gone.txt")
+            full = await ingestor.run()
+            assert (full.deleted, full.skipped) == (1, 1)
+            assert await ingestor.store.sources() == {"keep.txt"}
+        finally:
+            await ingestor.store.close()
+
+    asyncio.run(scenario())
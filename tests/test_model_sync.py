@@ -0,0 +1,111 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from services.model_sync import (
+    JOURNAL_NAME,
+    ModelSyncError,
+    load_manifest,
+    sync,
+    verify_model_dir,
+)
+
+CHUNK = 1024
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _model(root: Path) -> dict[str, bytes]:
+    files = {
+        "config.json": b'{"architectures": ["Qwen2ForCausalLM"]}',
+        "model-00001.safetensors": bytes(range(256)) * 20,
+        "sub/tokenizer.json": b"x" * (3 * CHUNK + 7),
+    }
+    for name, data in files.items():
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(data)
+    return files
+
+
+def _interrupt() -> None:
+    raise Interrupted
+
+
+def _same_tree(src: Path, dst: Path, files: dict[str, bytes]) -> None:
+    for name, data in files.items():
+        assert (dst / name).read_bytes() == data == (src / name).read_bytes()
+
+
+def test_interrupted_sync_resumes_from_the_journal(tmp_path: Path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    files = _model(src)
+    # The checkpoint after the first written chunk stands in for a kill
+    with pytest.raises(Interrupted):
+        sync(src, dst, workers=1, chunk_bytes=CHUNK,
+             checkpoint=_interrupt, checkpoint_bytes=1)
+    assert load_manifest(dst)["complete"] is False
+    with pytest.raises(ModelSyncError, match="did not complete"):
+        verify_model_dir(str(dst))
+
+    # Copies already running may finish after the interrupt; keep the
+    # first record, which is always there, and tear the next one
+    journal = dst / JOURNAL_NAME
+    first = journal.read_text().splitlines()[0]
+    journal.write_text(first + '\n{"f": "sub/tok')
+
+    stats = sync(src, dst, workers=2, chunk_bytes=CHUNK)
+    assert stats.chunks_resumed == 1
+    assert stats.bytes_read == stats.bytes_total - json.loads(first)["s"]
+    assert stats.verified == "full"
+    assert not journal.exists()
+    assert load_manifest(dst)["complete"] is True
+    assert verify_model_dir(str(dst), "full")["files"] == len(files)
+    _same_tree(src, dst, files)
+
+
+def test_unchanged_tree_writes_nothing(tmp_path: Path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    files = _model(src)
+    sync(src, dst, chunk_bytes=CHUNK)
+    again = sync(src, dst, chunk_bytes=CHUNK)
+    assert again.files_unchanged == len(files)
+    assert again.bytes_read == again.bytes_written == 0
+
+
+def test_corrupted_chunk_is_detected(tmp_path: Path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    _model(src)
+    sync(src, dst, chunk_bytes=CHUNK)
+    target = dst / "sub" / "tokenizer.json"
+    with target.open("r+b") as f:
+        f.seek(CHUNK + 5)
+        f.write(b"!")
+
+    # Same size, so only rehashing the chunks notices
+    verify_model_dir(str(dst), "size")
+    with pytest.raises(ModelSyncError, match="chunk 1 differs"):
+        verify_model_dir(str(dst), "full")
+
+
+def test_sync_refuses_a_journaled_chunk_that_is_corrupt(tmp_path: Path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    _model(src)
+    with pytest.raises(Interrupted):
+        sync(src, dst, workers=1, chunk_bytes=CHUNK,
+             checkpoint=_interrupt, checkpoint_bytes=1)
+    # A chunk the journal calls done, damaged after it was recorded
+    record = json.loads((dst / JOURNAL_NAME).read_text().splitlines()[-1])
+    with (dst / record["f"]).open("r+b") as f:
+        f.seek(record["c"] * CHUNK)
+        f.write(b"!")
+
+    with pytest.raises(ModelSyncError, match="failed verification"):
+        sync(src, dst, chunk_bytes=CHUNK)
+    assert load_manifest(dst)["complete"] is False
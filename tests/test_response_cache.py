@@ -0,0 +1,104 @@
+import asyncio
+import time
+from typing import AsyncGenerator
+
+from services.engine import SyntheticEngine, SyntheticEngineConfig
+from services.response_cache import ResponseCache, ResponseCacheConfig
+
+
+class CountingProducer:
+    """Streams one synthetic answer per call and counts the calls"""
+
+    def __init__(self, output_tokens: int = 8, itl_ms: float = 1) -> None:
+        self.engine = SyntheticEngine(SyntheticEngineConfig(
+            ttft_ms=0, itl_ms=itl_ms, output_tokens=output_tokens
+        ))
+        self.calls = 0
+        self.finished = 0
+        self.cancelled = 0
+
+    async def __call__(self) -> AsyncGenerator[str, None]:
+        self.calls += 1
+        try:
+            async for output in self.engine.generate(
+                "hello", None, f"r-{self.calls}"
+            ):
+                yield output.outputs[0].text
+            self.finished += 1
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+
+async def _collect(stream: AsyncGenerator[str, None]) -> list[str]:
+    return [delta async for delta in stream]
+
+
+def test_concurrent_misses_share_one_generation():
+    cache = ResponseCache()
+    produce = CountingProducer()
+
+    async def scenario() -> None:
+        answers = await asyncio.gather(*(
+            _collect(cache.stream("key", produce)) for _ in range(5)
+        ))
+        assert produce.calls == 1
+        assert all(answer == answers[0] for answer in answers)
+        assert len(answers[0]) == 8
+        assert (cache.stats.misses, cache.stats.coalesced) == (1, 4)
+
+        # Completed: replayed from memory, the engine is not asked again
+        assert await _collect(cache.stream("key", produce)) == answers[0]
+        assert cache.take("key") == answers[0]
+        assert produce.calls == 1
+        assert cache.stats.hits == 2
+
+    asyncio.run(scenario())
+
+
+def test_one_subscriber_leaving_does_not_break_the_others():
+    cache = ResponseCache()
+    produce = CountingProducer(output_tokens=20)
+
+    async def scenario() -> None:
+        leaving = cache.stream("key", produce)
+        staying = asyncio.create_task(_collect(cache.stream("key", produce)))
+        await anext(leaving)
+        await leaving.aclose()
+        answer = await staying
+        assert len(answer) == 20
+        assert (produce.calls, produce.finished) == (1, 1)
+        assert cache.take("key") == answer
+
+    asyncio.run(scenario())
+
+
+def test_generation_is_aborted_once_every_subscriber_left():
+    cache = ResponseCache()
+    produce = CountingProducer(output_tokens=1000)
+
+    async def scenario() -> None:
+        streams = [cache.stream("key", produce) for _ in range(3)]
+        for stream in streams:
+            await anext(stream)
+        for stream in streams:
+            await stream.aclose()
+        await asyncio.sleep(0.01)
+        assert produce.cancelled == 1
+        assert cache.take("key") is None
+        assert not cache._flights
+
+    asyncio.run(scenario())
+
+
+def test_expired_entries_are_not_taken():
+    cache = ResponseCache(ResponseCacheConfig(ttl_s=0.01))
+    produce = CountingProducer(output_tokens=2)
+
+    async def scenario() -> None:
+        await _collect(cache.stream("key", produce))
+        time.sleep(0.02)
+        assert cache.take("key") is None
+        assert cache.stats.entries == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("qdrant_client")
+
+from services.embeddings import HashingEmbedder  # noqa: E402
+from services.prompting import PromptBuilder  # noqa: E402
+from services.retrieval import (  # noqa: E402
+    DOCUMENT_OVERHEAD_TOKENS,
+    ApproxTokenCounter,
+    BatchingEmbedder,
+    Document,
+    HFTokenCounter,
+    PromptAssembler,
+    QdrantStore,
+    Retriever,
+)
+from services.tokenizer import TokenizerService  # noqa: E402
+
+# Cut to one length so the budget arithmetic does not depend on rank
+SIZE = 300
+DOCUMENTS = {
+    source: (sentence * 8)[:SIZE] for source, sentence in {
+        "refunds.txt": "Refunds are issued to the original payment "
+                       "method within five business days. ",
+        "hours.txt": "The support center opens at nine and closes at "
+                     "five, Monday to Friday. ",
+        "shipping.txt": "Orders ship from the central warehouse by "
+                        "courier and arrive within a week. ",
+    }.items()
+}
+QUESTION = "How are refunds issued to the payment method?"
+
+
+class WordTokenizer:
+    """One token per word; records the threads that encode"""
+
+    def __init__(self) -> None:
+        self.threads: set[str] = set()
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        self.threads.add(threading.current_thread().name)
+        return [len(word) for word in text.split()]
+
+    def decode(self, token_ids: list[int]) -> str:
+        return " ".join("x" * i for i in token_ids)
+
+    def __call__(self, texts: list[str], add_special_tokens: bool = False):
+        return {"input_ids": [self.encode(t) for t in texts]}
+
+
+async def _retriever(max_model_len: int) -> Retriever:
+    """One point per document in an in-memory collection; 1 char = 1 token"""
+    embedder = BatchingEmbedder(HashingEmbedder(dim=64), max_wait_ms=0)
+    store = QdrantStore(":memory:", "documents")
+    await store.ensure_collection(embedder.dim)
+    texts = list(DOCUMENTS.values())
+    await store.upsert(
+        list(range(len(texts))),
+        await embedder.embed(texts),
+        [
+            {"page_content": text, "metadata": {"source": source}}
+            for source, text in DOCUMENTS.items()
+        ]
+    )
+    assembler = PromptAssembler(
+        ApproxTokenCounter(chars_per_token=1.0),
+        PromptBuilder(),
+        max_model_len=max_model_len,
+        max_tokens=16
+    )
+    return Retriever(embedder, store, assembler)
+
+
+def test_closest_document_comes_first_and_all_fit():
+    async def scenario() -> None:
+        retriever = await _retriever(max_model_len=4096)
+        try:
+            result = await retriever.retrieve(QUESTION)
+            assert [d.metadata["source"] for d in result.documents][0] \
+                == "refunds.txt"
+            assert sorted(d.text for d in result.documents) \
+                == sorted(DOCUMENTS.values())
+            assert result.context_tokens == sum(
+                len(text) + DOCUMENT_OVERHEAD_TOKENS
+                for text in DOCUMENTS.values()
+            )
+            assert QUESTION in result.prompt.text
+        finally:
+            await retriever.close()
+
+    asyncio.run(scenario())
+
+
+def test_last_document_is_truncated_to_the_budget():
+    async def scenario() -> None:
+        probe = await _retriever(max_model_len=4096)
+        template_tokens = await probe.assembler.template_tokens()
+        await probe.close()
+        # Room for two documents and 100 tokens of the third
+        budget = 2 * (SIZE + DOCUMENT_OVERHEAD_TOKENS) \
+            + 100 + DOCUMENT_OVERHEAD_TOKENS
+        retriever = await _retriever(
+            16 + template_tokens + len(QUESTION) + budget
+        )
+        try:
+            result = await retriever.retrieve(QUESTION)
+            assert [len(d.text) for d in result.documents] \
+                == [SIZE, SIZE, 100]
+            assert result.context_tokens == budget
+        finally:
+            await retriever.close()
+
+    asyncio.run(scenario())
+
+
+def test_truncating_with_the_tokenizer_runs_on_its_pool():
+    tokenizer = WordTokenizer()
+    counter = HFTokenCounter(TokenizerService(tokenizer))
+    assembler = PromptAssembler(
+        counter, PromptBuilder(), max_model_len=200, max_tokens=16
+    )
+    document = Document("d1", "word " * 300, 1.0)
+
+    async def scenario() -> None:
+        used, context_tokens = await assembler.select(
+            question_tokens=10,
+            template_tokens=20,
+            documents=[document],
+            document_tokens=[300]
+        )
+        remaining = 200 - 16 - 20 - 10 - DOCUMENT_OVERHEAD_TOKENS
+        assert len(used[0].text.split()) == remaining
+        assert context_tokens == remaining + DOCUMENT_OVERHEAD_TOKENS
+
+    asyncio.run(scenario())
+    assert tokenizer.threads
+    assert all(name.startswith("tokenizer") for name in tokenizer.threads)
@@ -0,0 +1,178 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+from services.engine import (
+    SyntheticEngine,
+    SyntheticEngineConfig,
+    SyntheticEngineError,
+)
+from services.engine_manager import EngineManager, engine_failure
+from services.router import (
+    EngineRouter,
+    LocalReplica,
+    NoReplicaAvailable,
+    ReplicaState,
+    RouterConfig,
+)
+
+
+class RejectingEngine(SyntheticEngine):
+    """Refuses every prompt, as vLLM does an invalid request"""
+
+    async def generate(self, prompt: Any, sampling_params: Any,
+                       request_id: str, **kwargs: Any):
+        raise ValueError("prompt rejected")
+        yield
+
+
+def _synthetic(**overrides: Any) -> SyntheticEngine:
+    settings: dict[str, Any] = {"ttft_ms": 0, "itl_ms": 0, "output_tokens": 4}
+    return SyntheticEngine(SyntheticEngineConfig(**{**settings, **overrides}))
+
+
+async def _router(
+    engines: list[SyntheticEngine],
+    **overrides: Any
+) -> EngineRouter:
+    """Local replicas over `engines`, without the background poll loop"""
+    config = RouterConfig(
+        replicas=["local"] * len(engines), poll_interval_s=60, **overrides
+    )
+    replicas = []
+    for i, engine in enumerate(engines):
+        async def factory(engine: SyntheticEngine = engine) -> SyntheticEngine:
+            return engine
+        replicas.append(LocalReplica(f"local-{i}", EngineManager(factory)))
+    router = EngineRouter(replicas, config)
+    for replica in replicas:
+        await replica.start()
+    await router._wait_ready()
+    return router
+
+
+async def _complete(router: EngineRouter, prompt: str, request_id: str) -> str:
+    text = ""
+    async for output in router.generate(prompt, None, request_id):
+        text = output.outputs[0].text
+    return text
+
+
+def _served_by(router: EngineRouter, before: dict[str, int]) -> list[str]:
+    return [r.name for r in router.replicas if r.requests != before[r.name]]
+
+
+def test_dispatch_streams_from_one_replica():
+    async def scenario() -> None:
+        router = await _router([_synthetic() for _ in range(3)])
+        try:
+            text = await _complete(router, "hello there", "r-0")
+            assert text == await _complete(router, "hello there", "r-1")
+            assert text
+            assert router.stats.routed == 2
+            assert sum(r.inflight for r in router.replicas) == 0
+            assert router._routes == {}
+        finally:
+            await router.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_same_prefix_goes_to_the_same_replica():
+    async def scenario() -> None:
+        router = await _router([_synthetic() for _ in range(3)])
+        try:
+            used = set()
+            for i in range(12):
+                prompt = f"shared system prompt {i}"
+                served = []
+                for attempt in range(3):
+                    before = {r.name: r.requests for r in router.replicas}
+                    await _complete(router, prompt, f"r-{i}-{attempt}")
+                    served += _served_by(router, before)
+                assert len(set(served)) == 1
+                used.update(served)
+            # Rendezvous hashing spreads distinct prefixes out
+            assert len(used) > 1
+            assert router.stats.affinity_hits == 36
+        finally:
+            await router.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_busy_preferred_replica_overflows_to_least_loaded():
+    async def scenario() -> None:
+        router = await _router([_synthetic() for _ in range(2)])
+        try:
+            key = router._affinity_key("some prompt")
+            preferred = router.pick(key, set())
+            preferred.stats = {"num_requests_waiting": 10.0}
+            chosen = router.pick(key, set())
+            assert chosen is not preferred
+            assert router.stats.affinity_overflows == 1
+        finally:
+            await router.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_failing_replica_is_ejected_and_requests_fail_over():
+    async def scenario() -> None:
+        # One token and certain failure: it fails before any output
+        broken = _synthetic(failure_rate=1.0, output_tokens=1)
+        router = await _router([broken, _synthetic()], eject_after=2)
+        failing, healthy = router.replicas
+        try:
+            # Prompts whose affinity points at the broken replica
+            prompts = [
+                prompt for prompt in (f"prompt {i}" for i in range(64))
+                if router.pick(router._affinity_key(prompt), set()) is failing
+            ][:4]
+            for i, prompt in enumerate(prompts):
+                assert await _complete(router, prompt, f"r-{i}")
+            assert failing.state is ReplicaState.EJECTED
+            assert failing.consecutive_failures == 2
+            assert healthy.state is ReplicaState.HEALTHY
+            assert router.stats.failovers == 2
+            # The replica's own manager keeps its engine; no restart
+            assert failing.manager.loads == 1
+        finally:
+            await router.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_request_errors_neither_eject_nor_fail_over():
+    async def scenario() -> None:
+        router = await _router([RejectingEngine()], eject_after=2)
+        replica = router.replicas[0]
+        try:
+            for i in range(4):
+                with pytest.raises(ValueError):
+                    await _complete(router, "bad", f"r-{i}")
+            assert replica.state is ReplicaState.HEALTHY
+            assert replica.failures == 0
+            assert router.stats.failovers == 0
+        finally:
+            await router.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_app_manager_only_counts_running_out_of_replicas():
+    async def scenario() -> None:
+        router = await _router([_synthetic()])
+        try:
+            assert not engine_failure(router, SyntheticEngineError("x"))
+            assert not engine_failure(router, ValueError("x"))
+            router.drain("local-0")
+            with pytest.raises(NoReplicaAvailable) as raised:
+                await _complete(router, "anything", "r-0")
+            assert engine_failure(router, raised.value)
+            assert router.stats.unavailable == 1
+        finally:
+            await router.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import numpy as np
+
+from services.semantic_cache import (
+    NumpyIndex,
+    SemanticCache,
+    SemanticCacheConfig,
+)
+
+
+class FixedEmbedder:
+    """Unit vectors picked per text, so similarities are exact"""
+
+    dim = 2
+
+    def __init__(self, vectors: dict[str, tuple[float, float]]) -> None:
+        self.vectors = vectors
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        rows = np.array([self.vectors[t] for t in texts], dtype=np.float32)
+        return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def _cache(ttl_s: float) -> SemanticCache:
+    embedder = FixedEmbedder({
+        "old": (1.0, 0.0),
+        "new": (1.0, 0.1),
+        "query": (1.0, 0.01),
+    })
+    return SemanticCache(
+        embedder,
+        NumpyIndex(embedder.dim, capacity=8),
+        SemanticCacheConfig(threshold=0.9, ttl_s=ttl_s)
+    )
+
+
+def test_expired_best_match_does_not_hide_a_live_one():
+    cache = _cache(ttl_s=0.05)
+
+    async def scenario() -> None:
+        vectors = await cache.embedder.embed(["old", "new"])
+        await cache.store("old", vectors[0], ["stale"])
+        time.sleep(0.03)
+        await cache.store("new", vectors[1], ["fresh"])
+        time.sleep(0.03)
+        # "old" is the closer match but has expired
+        deltas, _ = await cache.lookup("query")
+        assert deltas == ["fresh"]
+        assert (cache.stats.hits, cache.stats.expired) == (1, 1)
+        assert len(cache._entries) == 1
+
+    asyncio.run(scenario())
+
+
+def test_expired_entries_are_swept_on_insert():
+    cache = _cache(ttl_s=0.01)
+
+    async def scenario() -> None:
+        vectors = await cache.embedder.embed(["old", "new"])
+        await cache.store("old", vectors[0], ["stale"])
+        time.sleep(0.02)
+        await cache.store("new", vectors[1], ["fresh"])
+        assert list(cache._entries) == [2]
+        assert cache.stats.expired == 1
+
+    asyncio.run(scenario())
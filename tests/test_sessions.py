@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from services.prompting import PromptBuilder
+from services.sessions import (
+    Session,
+    SessionConfig,
+    SessionError,
+    SessionStore,
+    Turn,
+)
+
+
+def _store(max_model_len: int = 400) -> SessionStore:
+    return SessionStore(
+        SessionConfig(max_model_len=max_model_len, margin_tokens=0),
+        PromptBuilder()
+    )
+
+
+def _session(turns: int, tokens: int = 60) -> Session:
+    return Session("s", "tenant", turns=[
+        Turn(f"question {i}", f"answer {i}", None, tokens)
+        for i in range(turns)
+    ])
+
+
+def test_long_history_is_truncated_from_the_oldest_turn():
+    store = _store()
+    session = _session(5)
+
+    prepared = store.prepare(session, "next?", 64)
+    assert prepared.truncated_turns > 0
+    assert prepared.window == prepared.truncated_turns
+    # Truncating leaves room for more turns than just this one
+    assert prepared.estimated_tokens <= (400 - 64) * store.config.truncate_to
+    text = prepared.prompt.text
+    assert "question 0" not in text
+    assert "question 4" in text
+    assert text.endswith("next?" + store.builder.foot)
+
+    # History that fits is sent whole
+    short = _session(2)
+    assert store.prepare(short, "next?", 64).truncated_turns == 0
+
+
+def test_window_moves_only_when_the_turn_is_committed():
+    store = _store()
+    session = _session(5)
+
+    async def scenario() -> None:
+        prepared = store.prepare(session, "next?", 64)
+        # A turn that failed or was abandoned truncates nothing
+        assert session.window == 0
+        assert store.prepare(session, "next?", 64).window == prepared.window
+
+        report = await store.commit(
+            session, "next?", prepared, "ok", [1, 2], 100, 0, "stop"
+        )
+        assert session.window == prepared.window
+        assert len(session.turns) == 6
+        assert report["truncated_turns"] == prepared.truncated_turns
+        assert session.truncations == 1
+        # The next turn builds on the committed window
+        assert store.prepare(session, "again?", 64).window >= session.window
+
+    asyncio.run(scenario())
+
+
+def test_question_that_cannot_fit_is_rejected():
+    store = _store(max_model_len=100)
+    with pytest.raises(SessionError):
+        store.prepare(_session(0), "x" * 1000, 64)
+
+
+def test_sessions_belong_to_their_tenant():
+    store = _store()
+
+    async def scenario() -> None:
+        session = await store.create("tenant-a")
+        assert await store.get(session.id, "tenant-a") is session
+        assert await store.get(session.id, "tenant-b") is None
+        assert not await store.delete(session.id, "tenant-b")
+        assert await store.delete(session.id, "tenant-a")
+        assert await store.get(session.id, "tenant-a") is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from api.v1.routes import admission_error_response
+from services.admission import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AdmissionConfig,
+    AdmissionController,
+    AdmissionRejected,
+    AdmissionTicket,
+)
+from services.tenants import Tenant, TenantConfig, TenantRegistry
+
+
+async def _admission_order(
+    controller: AdmissionController,
+    requests: list[Tenant],
+    admissions: int
+) -> list[str]:
+    """
+    Queue `requests` behind a held slot (max_inflight=1), then free the
+    slot `admissions` times; names in the order they were admitted
+    """
+    order: list[str] = []
+    tickets: list[AdmissionTicket] = [await controller.acquire(10)]
+
+    async def request(tenant: Tenant) -> None:
+        tickets.append(await controller.acquire(10, tenant=tenant))
+        order.append(tenant.name)
+
+    tasks = []
+    for tenant in requests:
+        tasks.append(asyncio.create_task(request(tenant)))
+        await asyncio.sleep(0)
+    assert controller.queue_depth == len(requests)
+    for _ in range(admissions):
+        admitted = len(order)
+        tickets[-1].release()
+        while len(order) == admitted:
+            await asyncio.sleep(0)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return order
+
+
+def test_new_tenant_is_not_stuck_behind_a_backlog():
+    controller = AdmissionController(AdmissionConfig(max_inflight=1))
+    heavy, light = Tenant("heavy"), Tenant("light")
+
+    async def scenario() -> None:
+        order = await _admission_order(
+            controller, [heavy] * 6 + [light] * 2, admissions=4
+        )
+        assert order.count("light") == 2
+
+    asyncio.run(scenario())
+
+
+def test_backlogged_tenants_share_in_proportion_to_weight():
+    controller = AdmissionController(AdmissionConfig(max_inflight=1))
+    double, single = Tenant("double", weight=2.0), Tenant("single")
+
+    async def scenario() -> None:
+        order = await _admission_order(
+            controller, [double] * 6 + [single] * 6, admissions=9
+        )
+        assert (order.count("double"), order.count("single")) == (6, 3)
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_limits_a_tenant_and_refunds_unused_tokens():
+    controller = AdmissionController()
+    tenant = Tenant("metered", token_rate=100.0, token_burst=200.0)
+    other = Tenant("other", token_rate=100.0, token_burst=200.0)
+
+    async def scenario() -> None:
+        # A new tenant starts with a full bucket
+        first = await controller.acquire(150, tenant=tenant)
+        with pytest.raises(AdmissionRejected) as limited:
+            await controller.acquire(100, tenant=tenant)
+        assert limited.value.reason == "tenant token rate exceeded"
+        assert limited.value.retry_after == 1
+        response = admission_error_response(limited.value)
+        assert response.status_code == 429
+        # Other tenants have their own bucket
+        (await controller.acquire(150, tenant=other)).release()
+
+        # Never fits the bucket: 413, retrying is futile
+        with pytest.raises(AdmissionRejected) as oversized:
+            await controller.acquire(300, tenant=tenant)
+        assert oversized.value.retry_after is None
+        assert admission_error_response(oversized.value).status_code == 413
+
+        # A request that never ran (engine down) gets its tokens back
+        first.refund()
+        (await controller.acquire(150, tenant=tenant)).release()
+        stats = controller.tenant_snapshots()["metered"]
+        assert stats["rate_limited"] == 1
+        assert stats["inflight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_tenant_priority_class_caps_what_requests_ask_for():
+    registry = TenantRegistry(TenantConfig(
+        api_keys={"secret": "bulk"},
+        tenants={"bulk": Tenant("bulk", priority=PRIORITY_BATCH)}
+    ))
+    controller = AdmissionController()
+
+    async def scenario() -> None:
+        bulk = registry.resolve({"authorization": "Bearer secret"})
+        assert bulk.name == "bulk"
+        ticket = await controller.acquire(
+            10, priority=PRIORITY_INTERACTIVE, tenant=bulk
+        )
+        assert ticket.priority == PRIORITY_BATCH
+        ticket.release()
+
+        lowered = registry.resolve({"x-priority": "batch"})
+        assert (lowered.name, lowered.priority) == ("default", PRIORITY_BATCH)
+        # X-Priority can only lower the class
+        raised = registry.resolve({
+            "x-api-key": "secret", "x-priority": "interactive"
+        })
+        assert raised.priority == PRIORITY_BATCH
+
+    asyncio.run(scenario())
+
+
+def test_tenant_header_is_only_trusted_when_configured():
+    headers = {"x-tenant-id": "bulk"}
+    assert TenantRegistry().resolve(headers).name == "default"
+    trusting = TenantRegistry(TenantConfig(trust_header=True))
+    assert trusting.resolve(headers).name == "bulk"
+    # A keyed tenant cannot be claimed through the header
+    keyed = TenantRegistry(TenantConfig(
+        trust_header=True, api_keys={"secret": "bulk"}
+    ))
+    assert keyed.resolve(headers).name == "default"
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import pytest
+
+from services.tokenizer import PromptTooLong, TokenizerConfig, TokenizerService
+
+
+class WordTokenizer:
+    """One token per word; counts the encodes and their threads"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.threads: set[str] = set()
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> list[int]:
+        self.calls += 1
+        self.threads.add(threading.current_thread().name)
+        return [len(word) for word in text.split()]
+
+
+def test_prompt_that_fits_is_left_alone():
+    service = TokenizerService(None)
+    ids = list(range(100))
+    assert service.fit(ids, 50, 200) == (ids, 50)
+    assert service.stats.rejected == 0
+
+
+def test_overlong_prompt_is_rejected_by_default():
+    service = TokenizerService(None)
+    with pytest.raises(PromptTooLong) as raised:
+        service.fit(list(range(180)), 50, 200)
+    assert (raised.value.prompt_tokens, raised.value.max_tokens) == (180, 50)
+    assert service.stats.rejected == 1
+
+
+def test_truncate_lowers_max_tokens_before_cutting_the_prompt():
+    service = TokenizerService(None, TokenizerConfig(
+        overlength="truncate", min_output_tokens=16
+    ))
+    ids = list(range(180))
+    # Room is left for 20 answer tokens: only max_tokens shrinks
+    assert service.fit(ids, 50, 200) == (ids, 20)
+    assert (service.stats.clamped, service.stats.truncated) == (1, 0)
+
+
+def test_truncate_keeps_the_head_and_the_end_of_the_prompt():
+    service = TokenizerService(None, TokenizerConfig(min_output_tokens=16))
+    ids = list(range(300))
+    fitted, max_tokens = service.fit(
+        ids, 50, 200, keep_head=10, overlength="truncate"
+    )
+    assert max_tokens == 16
+    assert len(fitted) + max_tokens == 200
+    assert fitted[:10] == ids[:10]
+    assert fitted[10:] == ids[-(len(fitted) - 10):]
+    assert service.stats.truncated == 1
+
+    # A context smaller than the answer floor cannot be fitted at all
+    with pytest.raises(PromptTooLong):
+        service.fit(ids, 50, 10, overlength="truncate")
+
+
+def test_segments_are_cached_and_encoded_on_the_pool():
+    tokenizer = WordTokenizer()
+    service = TokenizerService(tokenizer)
+
+    async def scenario() -> None:
+        first = await service.run(service.encode, "a shared system prompt")
+        again = await service.run(service.encode, "a shared system prompt")
+        assert first == again == [1, 6, 6, 6]
+        assert tokenizer.calls == 1
+        assert service.stats.cache_hits == 1
+        # One-off text is not cached
+        await service.encode_async("a question")
+        await service.encode_async("a question")
+        assert tokenizer.calls == 3
+        assert tokenizer.threads and all(
+            name.startswith("tokenizer") for name in tokenizer.threads
+        )
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        service.shutdown()